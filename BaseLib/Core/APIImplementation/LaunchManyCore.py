@@ -14,6 +14,9 @@ from BaseLib.__init__ import LIBRARYNAME
 from BaseLib.Core.BitTornado.RawServer import RawServer
 from BaseLib.Core.BitTornado.ServerPortHandler import MultiHandler
 from BaseLib.Core.BitTornado.BT1.track import Tracker
+from BaseLib.Core.BitTornado.BT1.HashChecker import HashCheckPool
+from BaseLib.Core.BitTornado.BT1.PieceCache import PieceCache
+from BaseLib.Core.BitTornado.RateLimiter import UploadScheduler
 from BaseLib.Core.BitTornado.HTTPHandler import HTTPHandler,DummyHTTPHandler
 from BaseLib.Core.simpledefs import *
 from BaseLib.Core.exceptions import *
@@ -61,6 +64,15 @@ class TriblerLaunchMany(Thread):
         # Following two attributes set/get by network thread ONLY
         self.hashcheck_queue = []
         self.sdownloadtohashcheck = None
+        # Worker threads that hash check the data on disk of all downloads,
+        # the number of threads caps the number of concurrent verifications
+        if config.get('hashcheck_threads', 0) > 0:
+            HashCheckPool.getInstance(config['hashcheck_threads'])
+        # Pieces read by the downloads are cached, so popular pieces are read
+        # from disk once
+        if config.get('piece_cache_size', 0) > 0:
+            PieceCache.getInstance(config['piece_cache_size'] * 1048576,
+                                   config.get('piece_cache_readahead', 0))
         
         # Following 2 attributes set/get by UPnPThread
         self.upnp_thread = None
@@ -74,6 +86,13 @@ class TriblerLaunchMany(Thread):
                                    failfunc = self.rawserver_fatalerrorfunc,
                                    errorfunc = self.rawserver_nonfatalerrorfunc)
         self.rawserver.add_task(self.rawserver_keepalive,1)
+        # The downloads share the upload rate of the session
+        if config.get('total_max_upload_rate', 0) > 0 or config.get('upload_local_prefixes'):
+            UploadScheduler.getInstance(self.rawserver.add_task,
+                                        config.get('total_max_upload_rate', 0),
+                                        config.get('upload_local_prefixes', []),
+                                        config.get('upload_local_weight', 1),
+                                        config.get('upload_remote_weight', 1))
 
         self.listen_port = self.rawserver.find_and_bind(0, 
                     config['minport'], config['maxport'], config['bind'], 
@@ -430,6 +449,8 @@ class TriblerLaunchMany(Thread):
         Called by network thread """
         if DEBUG:
             print >>sys.stderr,"tlm: hashcheck_done, success",success
+            if HashCheckPool.hasInstance():
+                print >>sys.stderr,"tlm: hashcheck_done, %.1f MB/s" % HashCheckPool.getInstance().get_rate()
         if success:
             self.sdownloadtohashcheck.hashcheck_done()
         if self.hashcheck_queue:
@@ -596,6 +617,9 @@ class TriblerLaunchMany(Thread):
                 db.commit()
             
             mainlineDHT.deinit()
+            HashCheckPool.delInstance()
+            PieceCache.delInstance()
+            UploadScheduler.delInstance()
             
             ts = enumerate()
             print >>sys.stderr,"tlm: Number of threads still running",len(ts)
@@ -38,6 +38,7 @@ class Choker:
         
         # _smoothit
         self.biasedUnchoking = BiasedUnchoking.getInstance()
+        self._rerank_pending = False        # rechoke scheduled for final rankings
         self._is_supporter_server = False   # for supporter
         self._supportee_list = []           # for supporter
         # TODO: unify usage of IDs via the StaticConfig
@@ -307,12 +308,23 @@ class Choker:
         
         # ask SIS-Server for its ranking, that will be used only for optimistic unchokes)
         #optimisticUnchoke = None
-        sisResult = self.biasedUnchoking.selectConnections(askSis)
+        sisResult = self.biasedUnchoking.selectConnections(askSis, callback = self._ranking_arrived)
         if self.logger.isEnabledFor(logging.INFO):
             self.logger.info("Original "+str([x.get_ip() for x in connections]))
             self.logger.info("SIS sorted "+str([x.get_ip() for x in sisResult]))
         assert len(sisResult) == len(connections), "sent %d but received %d " % (len(connections), len(sisResult))
         return sisResult
+
+    def _ranking_arrived(self):
+        ''' Called from the ranking thread once provisional rankings were resolved. '''
+        if not self._rerank_pending:
+            self._rerank_pending = True
+            self.schedule(self._rechoke_ranked)
+
+    def _rechoke_ranked(self):
+        self._rerank_pending = False
+        if not self.paused:
+            self._rechoke()
         # _SmoothIT
 
     def add_connection(self, connection, p = None):
@@ -12,6 +12,8 @@ import urlparse
 
 from BaseLib.Core.BitTornado.bitfield import Bitfield
 from BaseLib.Core.BitTornado.clock import clock
+from BaseLib.Core.BitTornado.piecebuffer import tostring, tobuffer
+from BaseLib.Core.BitTornado.SocketHandler import SEND_NOCOPY
 from BaseLib.Core.BitTornado.bencode import bencode,bdecode
 from BaseLib.Core.BitTornado.__init__ import version_short,decodePeerID,TRIBLER_PEERID_LETTER
 from BaseLib.Core.BitTornado.BT1.convert import tobinary,toint
@@ -108,8 +110,16 @@ class Connection:
         self.connecter = connecter
         self.got_anything = False
         self.next_upload = None
+        self.upload_class = None    # set by UploadScheduler.classify
         self.outqueue = []
         self.partial_message = None
+        self.partial_offset = 0     # bytes of partial_message passed to the socket
+        # FileRegions with the data of the current PIECE message when it is
+        # sent with sendfile(), partial_message is then only the header
+        self.partial_regions = None
+        # buffer view of the data of the current PIECE message when it is not
+        # copied into partial_message, which is then only the header
+        self.partial_data = None
         self.download = None
         self.upload = None
         self.send_choke_queued = False
@@ -296,7 +306,12 @@ class Connection:
         if not self.can_send_to():
             return 0
         if self.partial_message is None:
-            s = self.upload.get_upload_chunk()
+            # sendfile() sends the data unmodified, so not for HASHPIECE
+            # messages or when G2G needs to see the data
+            sendfile = (self.connecter.use_sendfile and not self.use_g2g
+                        and not self.connecter.merkle_torrent
+                        and self.connection.can_send_file())
+            s = self.upload.get_upload_chunk(sendfile)
             if s is None:
                 return 0
             # Merkle: send hashlist along with piece in HASHPIECE message
@@ -322,37 +337,126 @@ class Connection:
                     # old Tribler <= 4.5.2 style
                     self.partial_message = ''.join((
                                     tobinary(1+4+4+4+len(bhashlist)+len(piece)), HASHPIECE,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, tostring(piece) ))
                 else:
                     # Merkle BEP
                     self.partial_message = ''.join((
                                     tobinary(2+4+4+4+len(bhashlist)+len(piece)), EXTEND, hashpiece_msg_id,
-                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, piece.tostring() ))
+                                    tobinary(index), tobinary(begin), tobinary(len(bhashlist)), bhashlist, tostring(piece) ))
                     
+            elif type(piece) == ListType:
+                # FileRegions, the data follows the header with sendfile()
+                length = sum([len(region) for region in piece])
+                self.partial_message = ''.join((
+                            tobinary(length + 9), PIECE,
+                            tobinary(index), tobinary(begin)))
+                self.partial_regions = piece
+            elif self.connection.can_send_buffers():
+                # the socket sends the data from a view into the piece
+                self.partial_message = ''.join((
+                            tobinary(len(piece) + 9), PIECE,
+                            tobinary(index), tobinary(begin)))
+                self.partial_data = tobuffer(piece)
             else:
                 self.partial_message = ''.join((
                             tobinary(len(piece) + 9), PIECE, 
-                            tobinary(index), tobinary(begin), piece.tostring()))
+                            tobinary(index), tobinary(begin), tostring(piece)))
             if DEBUG_NORMAL_MSGS:
                 print >>sys.stderr,'sending chunk: '+str(index)+': '+str(begin)+'-'+str(begin+len(piece))
 
-        if bytes < len(self.partial_message):
-            self.connection.send_message_raw(self.partial_message[:bytes])
-            self.partial_message = self.partial_message[bytes:]
+        if self.partial_regions is not None:
+            return self._send_partial_file(bytes)
+        if self.partial_data is not None:
+            return self._send_partial_data(bytes)
+
+        if bytes < len(self.partial_message) - self.partial_offset:
+            # advance an offset instead of copying the rest of the message
+            end = self.partial_offset + bytes
+            self.connection.send_message_raw(self.partial_message[self.partial_offset:end])
+            self.partial_offset = end
             return bytes
 
-        q = [self.partial_message]
+        q = [self.partial_message[self.partial_offset:]]
+        q.extend(self._end_partial())
+        q = ''.join(q)
+        self.connection.send_message_raw(q)
+        return len(q)
+
+    def _send_partial_file(self, bytes):
+        """ send_partial() for a PIECE message whose data is sent with
+        sendfile(): passes the next bytes of the header and the regions to
+        the socket """
+        sent = min(bytes, len(self.partial_message) - self.partial_offset)
+        end = self.partial_offset + sent
+        header = self.partial_message[self.partial_offset:end]
+        self.partial_offset = end
+        regions = self.partial_regions
+        out = []
+        while regions and sent < bytes:
+            if len(regions[0]) > bytes - sent:
+                out.append(regions[0].split(bytes - sent))
+                sent = bytes
+            else:
+                region = regions.pop(0)
+                out.append(region)
+                sent += len(region)
+        if out:
+            self.connection.send_file_raw(out, header)
+        elif header:
+            self.connection.send_message_raw(header)
+        if regions or self.partial_offset < len(self.partial_message):
+            return sent
+
+        q = ''.join(self._end_partial())
+        if q:
+            self.connection.send_message_raw(q)
+        return sent + len(q)
+
+    def _send_partial_data(self, bytes):
+        """ send_partial() for a PIECE message whose data is in partial_data:
+        passes the next bytes of the header and views into the data to the
+        socket """
+        header = self.partial_message
+        data = self.partial_data
+        start = self.partial_offset
+        end = min(start + bytes, len(header) + len(data))
+        if start < len(header):
+            self.connection.send_message_raw(header[start:end])
+        if end > len(header):
+            a = max(start - len(header), 0)
+            b = end - len(header)
+            if b - a < SEND_NOCOPY:
+                # small parts are combined with other messages by the socket
+                self.connection.send_message_raw(str(data[a:b]))
+            elif a == 0 and b == len(data):
+                self.connection.send_message_raw(data)
+            else:
+                self.connection.send_message_raw(buffer(data, a, b - a))
+        self.partial_offset = end
+        sent = end - start
+        if end < len(header) + len(data):
+            return sent
+
+        q = ''.join(self._end_partial())
+        if q:
+            self.connection.send_message_raw(q)
+        return sent + len(q)
+
+    def _end_partial(self):
+        """ Clears the PIECE message that was passed to the socket, returns
+        the messages that were queued behind it """
         self.partial_message = None
+        self.partial_offset = 0
+        self.partial_regions = None
+        self.partial_data = None
         if self.send_choke_queued:
             self.send_choke_queued = False
             self.outqueue.append(tobinary(1)+CHOKE)
             self.upload.choke_sent()
             self.just_unchoked = 0
-        q.extend(self.outqueue)
+        q = self.outqueue
         self.outqueue = []
-        q = ''.join(q)
-        self.connection.send_message_raw(q)
-        return len(q)
+        return q
 
     def get_upload(self):
         return self.upload
@@ -366,6 +470,22 @@ class Connection:
     def backlogged(self):
         return not self.connection.is_flushed()
 
+    def get_queued_bytes(self):
+        """ Bytes waiting to be sent to this peer: the unsent part of the
+        current PIECE message, queued messages and the socket's send queue """
+        queued = self.connection.get_queued_bytes()
+        if self.partial_message:
+            length = len(self.partial_message)
+            if self.partial_data is not None:
+                length += len(self.partial_data)
+            queued += length - self.partial_offset
+        if self.partial_regions:
+            for region in self.partial_regions:
+                queued += len(region)
+        for s in self.outqueue:
+            queued += len(s)
+        return queued
+
     def got_request(self, i, p, l):
         self.upload.got_request(i, p, l)
         if self.just_unchoked:
@@ -591,14 +711,25 @@ class Connection:
             ipPortsToAsk = []
             for ((ip, port), nr) in sample_added_peers_with_id:
                 ipPortsToAsk.append((ip, port))
-            acceptedIPPorts = self.neighborselection.selectAsNeighbors(ipPortsToAsk) 
-            peers = []  
-            for ((ip, port), nr) in sample_added_peers_with_id:
-                if (ip, port) in acceptedIPPorts :
-                    peers.append(((ip, port), nr))     
-            self.connection.Encoder.start_connections(peers)
+            def reapply(acceptedIPPorts, dnsidlist = sample_added_peers_with_id):
+                # final rankings arrived (on the ranking thread), connect on the network thread
+                self.connecter.sched(lambda: self._connect_accepted(dnsidlist, acceptedIPPorts))
+            acceptedIPPorts = self.neighborselection.selectAsNeighbors(ipPortsToAsk, callback = reapply) 
+            self._connect_accepted(sample_added_peers_with_id, acceptedIPPorts)
             # _smoothIT
 
+    # smoothIT_
+    def _connect_accepted(self, dnsidlist, acceptedIPPorts):
+        if self.closed:
+            return
+        # acceptedIPPorts is a NeighborList, membership tests are O(1)
+        peers = []  
+        for ((ip, port), nr) in dnsidlist:
+            if (ip, port) in acceptedIPPorts :
+                peers.append(((ip, port), nr))     
+        self.connection.Encoder.start_connections(peers)
+    # _smoothIT
+
     def get_extend_encryption(self):
         return self.extend_hs_dict.get('e',0)
     
@@ -929,6 +1060,7 @@ class Connecter:
         self.piece_size = piece_size
         self.config = config
         self.ratelimiter = ratelimiter
+        self.use_sendfile = config.get('sendfile', 0)
         self.rate_capped = False
         self.sched = sched
         self.totalup = totalup
@@ -1278,6 +1410,11 @@ class Connecter:
         # connection: Encrypter.Connection; c: Connecter.Connection
         c = self.connections[connection]    
         t = message[0]
+        if t != PIECE and type(message) is memoryview:
+            # Only PIECE messages are handled in place in the receive buffer of
+            # the Encrypter.Connection, their payload is copied by the
+            # StorageWrapper. All other messages are small and may be kept.
+            message = message.tobytes()
         # EXTEND handshake will be sent just after BT handshake, 
         # before BITFIELD even
 
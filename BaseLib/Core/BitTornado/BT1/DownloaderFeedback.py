@@ -3,6 +3,8 @@
 
 from threading import Event
 
+from BaseLib.Core.BitTornado.BT1.PieceCache import PieceCache
+
 try:
     True
 except:
@@ -117,6 +119,10 @@ class DownloaderFeedback:
         """ Called by SingleDownload to obtain download statistics to become the
         DownloadStates for each Download """
         s = {'stats': self.statistics.update()}
+        if PieceCache.hasInstance():
+            s['piece_cache'] = PieceCache.getInstance().get_stats(self.infohash)
+        else:
+            s['piece_cache'] = {}
         if getpeerlist:
             s['spew'] = self.spews()
         else:
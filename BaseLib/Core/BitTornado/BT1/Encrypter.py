@@ -3,7 +3,6 @@
 
 import sys
 from base64 import b64encode
-from cStringIO import StringIO
 from binascii import b2a_hex
 from socket import error as socketerror
 from urllib import quote
@@ -13,7 +12,8 @@ from sets import Set
 from traceback import print_exc
 
 from BaseLib.Core.BitTornado.BT1.MessageID import protocol_name,option_pattern
-from BaseLib.Core.BitTornado.BT1.convert import toint
+from BaseLib.Core.BitTornado.recvbuffer import RecvBuffer
+from BaseLib.Core.BitTornado.zerocopy import have_sendfile
 
 #smoothIT_
 import SisClient.PeerSelection.NeighborSelection
@@ -131,7 +131,8 @@ class Connection:
         self.complete = False
         self.keepalive = lambda: None
         self.closed = False
-        self.buffer = StringIO()
+        # filled by SocketHandler with recv_into(), see buffer_came_in()
+        self.recvbuf = RecvBuffer()
 # overlay        
         self.dns = dns
         self.support_extend_messages = False
@@ -185,6 +186,9 @@ class Connection:
     def is_flushed(self):
         return self.connection.is_flushed()
 
+    def get_queued_bytes(self):
+        return self.connection.get_queued_bytes()
+
     def supports_merklehash(self):
         return self.support_merklehash
 
@@ -290,13 +294,14 @@ class Connection:
         return 4, self.read_len
 
     def read_len(self, s):
-        l = toint(s)
+        l = unpack('>L', s)[0]
         if l > self.Encoder.max_len:
             return None
         return l, self.read_message
 
     def read_message(self, s):
-        if s != '':
+        # s is a memoryview into the receive buffer, see Connecter.got_message
+        if len(s):
             self.connecter.got_message(self, s)
         #else:
         #    print >>sys.stderr,"encoder: got keepalive from",s.getpeername()
@@ -355,20 +360,43 @@ class Connection:
         if not self.closed:
             self.connection.write(message)    # SingleSocket
 
+    def can_send_file(self):
+        """ True if data can be sent from files with sendfile(), the
+        connection must be a plain SingleSocket """
+        return have_sendfile and hasattr(self.connection, 'write_file')
+
+    def can_send_buffers(self):
+        """ True if buffer objects can be passed to send_message_raw(), the
+        connection must be a plain SingleSocket """
+        return hasattr(self.connection, 'write_file')
+
+    def send_file_raw(self, regions, header = ''):
+        if not self.closed:
+            self.connection.write_file(regions, header)    # SingleSocket
+
     def data_came_in(self, connection, s):
         self.Encoder.measurefunc(len(s))
+        if not self.closed:
+            self.recvbuf.write(s)
+            self._read_messages()
+
+    def buffer_came_in(self, connection, amount):
+        """ Called by SocketHandler after amount bytes were read into recvbuf """
+        self.Encoder.measurefunc(amount)
+        self._read_messages()
+
+    def _read_messages(self):
+        recvbuf = self.recvbuf
         while 1:
             if self.closed:
                 return
-            i = self.next_len - self.buffer.tell()
-            if i > len(s):
-                self.buffer.write(s)
+            m = recvbuf.read(self.next_len)
+            if m is None:
+                recvbuf.reserve(self.next_len)
                 return
-            self.buffer.write(s[:i])
-            s = s[i:]
-            m = self.buffer.getvalue()
-            self.buffer.reset()
-            self.buffer.truncate()
+            if not self.complete:
+                # the handshake is parsed with string operations
+                m = m.tobytes()
             try:
                 x = self.next_func(m)
             except:
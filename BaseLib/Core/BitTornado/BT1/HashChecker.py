@@ -0,0 +1,202 @@
+# see LICENSE.txt for license information
+
+import sys
+from collections import deque
+from threading import Thread, Lock, Condition, Event
+from traceback import print_exc
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.clock import clock
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# consecutive pieces are read from disk in runs of at most this many bytes
+READ_SIZE = 4194304
+
+
+class HashCheckJob:
+    """
+    Reads a run of consecutive pieces with one sequential read and hashes
+    them. When done, 'results' is a list of (piece, hash, hash of the first
+    'lastlen' bytes) tuples, or 'error' is set.
+    """
+    def __init__(self, read, pieces, piece_size, piecelen, lastlen):
+        self.read = read
+        self.pieces = pieces
+        self.piece_size = piece_size
+        self.piecelen = piecelen
+        self.lastlen = lastlen
+        self.results = None
+        self.error = None
+        self.cancelled = False
+        self.done = Event()
+        # called by the worker thread when the job is done
+        self.callback = None
+
+    def length(self):
+        return sum([self.piecelen(i) for i in self.pieces])
+
+    def run(self):
+        data = self.read(self.piece_size * self.pieces[0], self.length())
+        try:
+            buf = data.buf
+            results = []
+            offset = 0
+            for i in self.pieces:
+                length = self.piecelen(i)
+                # the sha object releases the GIL while hashing a buffer
+                sh = sha(buffer(buf, offset, self.lastlen))
+                sp = sh.digest()
+                sh.update(buffer(buf, offset + self.lastlen, length - self.lastlen))
+                results.append((i, sh.digest(), sp))
+                offset += length
+            self.results = results
+        finally:
+            data.release()
+
+    def wait(self, timeout):
+        self.done.wait(timeout)
+        return self.done.isSet()
+
+
+class HashCheckPool:
+    """
+    Worker threads that read and hash pieces for the hash checks of all
+    downloads. The number of threads caps the number of pieces that are
+    verified at the same time. Jobs are executed in the order they were
+    submitted.
+    """
+    __single = None
+    lock = Lock()
+
+    def __init__(self, numthreads = 2):
+        if HashCheckPool.__single:
+            raise RuntimeError, "HashCheckPool is Singleton"
+        HashCheckPool.__single = self
+
+        self.numthreads = numthreads
+        self.jobs = deque()
+        self.cond = Condition()
+        self.running = True
+        # throughput statistics
+        self.bytes_checked = 0L
+        self.busy_time = 0.0
+        self.busy_since = None
+        self.active = 0
+        self.threads = []
+        for x in xrange(numthreads):
+            t = Thread(target = self.run)
+            t.setDaemon(True)
+            t.setName("HashCheck"+t.getName())
+            t.start()
+            self.threads.append(t)
+
+    def getInstance(*args, **kw):
+        # Singleton pattern with double-checking
+        if HashCheckPool.__single is None:
+            HashCheckPool.lock.acquire()
+            try:
+                if HashCheckPool.__single is None:
+                    HashCheckPool(*args, **kw)
+            finally:
+                HashCheckPool.lock.release()
+        return HashCheckPool.__single
+    getInstance = staticmethod(getInstance)
+
+    def hasInstance():
+        return HashCheckPool.__single is not None
+    hasInstance = staticmethod(hasInstance)
+
+    def delInstance():
+        HashCheckPool.lock.acquire()
+        try:
+            if HashCheckPool.__single is not None:
+                HashCheckPool.__single.shutdown()
+                HashCheckPool.__single = None
+        finally:
+            HashCheckPool.lock.release()
+    delInstance = staticmethod(delInstance)
+
+    def submit(self, job):
+        self.cond.acquire()
+        try:
+            self.jobs.append(job)
+            self.cond.notify()
+        finally:
+            self.cond.release()
+
+    def cancel(self, jobs):
+        """ Jobs that did not start yet are skipped """
+        for job in jobs:
+            job.cancelled = True
+
+    def shutdown(self):
+        self.cond.acquire()
+        try:
+            self.running = False
+            self.cond.notifyAll()
+        finally:
+            self.cond.release()
+
+    def get_rate(self):
+        """ Returns the hash check throughput in MB/s while checking """
+        self.cond.acquire()
+        try:
+            busy = self.busy_time
+            if self.busy_since is not None:
+                busy += clock() - self.busy_since
+        finally:
+            self.cond.release()
+        if busy <= 0:
+            return 0.0
+        return self.bytes_checked / busy / 1048576.0
+
+    def run(self):
+        while True:
+            self.cond.acquire()
+            try:
+                while self.running and not self.jobs:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                job = self.jobs.popleft()
+                if self.active == 0:
+                    self.busy_since = clock()
+                self.active += 1
+            finally:
+                self.cond.release()
+
+            length = 0
+            if not job.cancelled:
+                try:
+                    job.run()
+                    length = job.length()
+                except Exception, e:
+                    if DEBUG:
+                        print_exc()
+                    job.error = e
+
+            # update the statistics first, waiters may read them once the
+            # job is done
+            self.cond.acquire()
+            try:
+                self.bytes_checked += length
+                self.active -= 1
+                if self.active == 0:
+                    self.busy_time += clock() - self.busy_since
+                    self.busy_since = None
+            finally:
+                self.cond.release()
+
+            job.done.set()
+            if job.callback is not None:
+                try:
+                    job.callback()
+                except:
+                    print_exc()
@@ -0,0 +1,203 @@
+# see LICENSE.txt for license information
+#
+# Peer lists of the tracker grouped by network location. The peers of a
+# torrent are kept in buckets, one per locality class, and a peer that
+# announces gets the peers of its own class first and a fraction of random
+# peers of other classes. The data sent for a peer is stored in the buckets
+# in all three reply formats, so a peer list is built with O(numwant) work.
+
+import socket
+import struct
+from random import sample
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+
+class PrefixClassifier:
+    """
+    Maps an IPv4 address to its locality class: the name of the longest
+    configured network that contains it (e.g. an AS number or a ranking
+    class of the SIS), otherwise its prefix of prefix_len bits. Other
+    addresses have class None.
+    """
+    def __init__(self, prefix_len = 16):
+        self.prefix_len = prefix_len
+        self.networks = {}      # length: {network: class}
+        self.lengths = []       # longest first
+
+    def add_network(self, ip, length, name):
+        networks = self.networks.get(length)
+        if networks is None:
+            networks = self.networks[length] = {}
+            self.lengths.append(length)
+            self.lengths.sort()
+            self.lengths.reverse()
+        networks[self._toint(ip) >> (32 - length)] = name
+
+    def read_classes(self, file):
+        """ Reads lines 'a.b.c.d/len class', '#' starts a comment """
+        f = open(file, 'r')
+        try:
+            for line in f:
+                line = line.split('#')[0].split()
+                if not line:
+                    continue
+                ip, length = line[0].split('/')
+                if len(line) > 1:
+                    name = line[1]
+                else:
+                    name = line[0]
+                self.add_network(ip, int(length), name)
+        finally:
+            f.close()
+
+    def _toint(self, ip):
+        try:
+            return struct.unpack('!L', socket.inet_aton(ip))[0]
+        except socket.error:
+            raise ValueError, "bad address"
+
+    def __call__(self, ip):
+        try:
+            n = self._toint(ip)
+        except (ValueError, TypeError):
+            return None
+        for length in self.lengths:
+            name = self.networks[length].get(n >> (32 - length))
+            if name is not None:
+                return name
+        return n >> (32 - self.prefix_len)
+
+
+class PeerBucket:
+    """ Set of peers with O(1) add, remove and access by position """
+    def __init__(self):
+        self.ids = []
+        self.data = []      # per peer: tuple of its data in the reply formats
+        self.pos = {}       # peerid: index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, peerid, data):
+        self.pos[peerid] = len(self.ids)
+        self.ids.append(peerid)
+        self.data.append(data)
+
+    def remove(self, peerid):
+        i = self.pos.pop(peerid)
+        last = len(self.ids) - 1
+        if i != last:
+            self.ids[i] = self.ids[last]
+            self.data[i] = self.data[last]
+            self.pos[self.ids[i]] = i
+        del self.ids[last]
+        del self.data[last]
+
+
+class LocalityIndex:
+    """
+    The peers of one torrent that passed the NAT check, in buckets per
+    locality class. Every bucket and the index as a whole keep leechers
+    and seeds apart, seeds do not get other seeds.
+    """
+    def __init__(self):
+        self.buckets = {}       # class: [leechers, seeds]
+        self.everyone = [PeerBucket(), PeerBucket()]
+        self.peers = {}         # peerid: [class, is_seed]
+
+    def __len__(self):
+        return len(self.peers)
+
+    def add(self, peerid, name, is_seed, data):
+        """ data: the peer in the reply formats of Tracker.peerlist """
+        if self.peers.has_key(peerid):
+            self.remove(peerid)
+        is_seed = int(bool(is_seed))
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = self.buckets[name] = [PeerBucket(), PeerBucket()]
+        bucket[is_seed].add(peerid, data)
+        self.everyone[is_seed].add(peerid, data)
+        self.peers[peerid] = [name, is_seed]
+
+    def remove(self, peerid):
+        name, is_seed = self.peers.pop(peerid)
+        bucket = self.buckets[name]
+        bucket[is_seed].remove(peerid)
+        self.everyone[is_seed].remove(peerid)
+        if not (bucket[0] or bucket[1]):
+            del self.buckets[name]
+
+    def set_seed(self, peerid):
+        if not self.peers.has_key(peerid):
+            return
+        name, is_seed = self.peers[peerid]
+        if is_seed:
+            return
+        bucket = self.buckets[name]
+        data = bucket[0].data[bucket[0].pos[peerid]]
+        self.remove(peerid)
+        self.add(peerid, name, True, data)
+
+    def _pick(self, lists, count, skip, result, return_type):
+        """ Adds up to count random peers of lists for which skip(peerid)
+        is False to result, looks at no more than 2*count+len(result)+1
+        peers """
+        total = sum([len(l) for l in lists])
+        tries = min(total, 2 * count + len(result) + 1)
+        if count <= 0 or not tries:
+            return
+        added = 0
+        for i in sample(xrange(total), tries):
+            for l in lists:
+                if i < len(l):
+                    break
+                i -= len(l)
+            peerid = l.ids[i]
+            if skip(peerid):
+                continue
+            result[peerid] = l.data[i][return_type]
+            added += 1
+            if added == count:
+                return
+
+    def get_peers(self, name, peerid, is_seed, rsize, return_type,
+                  remote_fraction):
+        """ Returns up to rsize peers for a peer of class name, in reply
+        format return_type: peers of the same class first, and about
+        remote_fraction*rsize random peers of other classes """
+        if is_seed:
+            kinds = 1
+        else:
+            kinds = 2
+        local = self.buckets.get(name, self.everyone)[:kinds]
+        everyone = self.everyone[:kinds]
+        peers = self.peers
+        local_peers = {}
+        remote_peers = {}
+
+        def skip_local(id):
+            return id == peerid or local_peers.has_key(id)
+        def skip_remote(id):
+            return (id == peerid or peers[id][0] == name
+                    or remote_peers.has_key(id))
+        def skip_any(id):
+            return skip_local(id) or remote_peers.has_key(id)
+
+        nremote = int(rsize * remote_fraction + 0.5)
+        self._pick(local, rsize - nremote, skip_local, local_peers, return_type)
+        self._pick(everyone, rsize - len(local_peers), skip_remote,
+                   remote_peers, return_type)
+        # fill up with whatever is left, e.g. if there are few remote peers
+        if len(local_peers) + len(remote_peers) < rsize:
+            self._pick(local, rsize - len(local_peers) - len(remote_peers),
+                       skip_any, local_peers, return_type)
+        if len(local_peers) + len(remote_peers) < rsize:
+            self._pick(everyone, rsize - len(local_peers) - len(remote_peers),
+                       skip_any, remote_peers, return_type)
+        return local_peers.values() + remote_peers.values()
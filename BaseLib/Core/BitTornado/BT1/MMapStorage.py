@@ -0,0 +1,221 @@
+# see LICENSE.txt for license information
+
+import os
+import sys
+from mmap import mmap, ACCESS_READ, ALLOCATIONGRANULARITY
+from threading import Lock
+from traceback import print_exc
+try:
+    from os import fsync
+except ImportError:
+    fsync = lambda x: None
+
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# files are mapped in windows of this size, so files larger than the address
+# space of a 32-bit process can be mapped too
+WINDOW_SIZE = 64 * 1048576
+assert WINDOW_SIZE % ALLOCATIONGRANULARITY == 0
+# number of windows that stay mapped when max_files_open is not limited
+DEFAULT_MAX_MAPS = 64
+
+
+class MMapBuffer:
+    """
+    Data read by MMapStorage: a list of buffer objects that point into the
+    memory maps, so reading does not copy the data. Has the interface of
+    piecebuffer.SingleBuffer. Slices are buffer objects as well, unless the
+    data spans several windows or files.
+    """
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.length = sum([len(c) for c in chunks])
+        if len(chunks) == 1:
+            self.buf = chunks[0]
+        else:
+            self.buf = ''.join([str(c) for c in chunks])
+
+    def __len__(self):
+        return self.length
+
+    def __getslice__(self, a, b):
+        if b > self.length:
+            b = self.length
+        if b < 0:
+            b += self.length
+        if a == 0 and b == self.length and len(self.chunks) == 1:
+            return self.buf
+        return buffer(self.buf, a, max(b - a, 0))
+
+    def getarray(self):
+        return MMapBuffer(self.chunks)
+
+    def tostring(self):
+        return str(self.buf)
+
+    __str__ = tostring
+
+    def release(self):
+        # the maps are unmapped when the last view is gone
+        self.chunks = None
+        self.buf = None
+
+
+class MMapStorage(Storage):
+    """
+    Storage that reads the files through memory maps. Every file is mapped in
+    windows of WINDOW_SIZE bytes. At most max_files_open windows stay mapped,
+    the least recently used window is dropped first. Reads return MMapBuffer
+    views into the maps.
+
+    Writes go through the file handles like in Storage and are flushed right
+    away, so the maps see them. Reading and writing take a lock per file
+    instead of the global lock of Storage, which only protects the handle
+    and map bookkeeping. Writes still take the global lock when the number
+    of open handles is limited.
+    """
+    def __init__(self, files, piece_length, doneflag, config,
+                 disabled_files = None):
+        Storage.__init__(self, files, piece_length, doneflag, config, disabled_files)
+        self.maps = {}          # (file, window): mmap
+        self.maplru = []        # (file, window), least recently used first
+        if self.max_files_open > 0:
+            self.max_maps = self.max_files_open
+        else:
+            self.max_maps = DEFAULT_MAX_MAPS
+        self.file_locks = {}
+
+    def _file_lock(self, file):
+        self.lock.acquire()
+        try:
+            lock = self.file_locks.get(file)
+            if lock is None:
+                lock = self.file_locks[file] = Lock()
+            return lock
+        finally:
+            self.lock.release()
+
+    def _get_map(self, file, window, needed):
+        """ Returns the map of a window of a file that is at least 'needed'
+        bytes long. Called with the lock of the file held. """
+        key = (file, window)
+        self.lock.acquire()
+        try:
+            m = self.maps.get(key)
+            if m is not None and len(m) >= needed:
+                if self.maplru[-1] != key:
+                    self.maplru.remove(key)
+                    self.maplru.append(key)
+                return m
+            if m is not None:
+                # the file grew since it was mapped
+                del self.maps[key]
+                self.maplru.remove(key)
+            h = self._get_file_handle(file, False)
+            if self.whandles.has_key(file):
+                h.flush()
+            start = window * WINDOW_SIZE
+            length = min(WINDOW_SIZE, os.fstat(h.fileno()).st_size - start)
+            if length < needed:
+                raise IOError('error reading data from '+ file)
+            m = mmap(h.fileno(), length, access = ACCESS_READ, offset = start)
+            self.maps[key] = m
+            self.maplru.append(key)
+            if len(self.maplru) > self.max_maps:
+                # views that still point into the map keep it alive
+                del self.maps[self.maplru.pop(0)]
+            return m
+        finally:
+            self.lock.release()
+
+    def _drop_maps(self, file):
+        self.lock.acquire()
+        try:
+            for key in self.maplru[:]:
+                if key[0] == file:
+                    del self.maps[key]
+                    self.maplru.remove(key)
+        finally:
+            self.lock.release()
+
+    def read(self, pos, amount, flush_first = False):
+        chunks = []
+        for file, pos, end in self._intervals(pos, amount):
+            if DEBUG:
+                print >>sys.stderr,'mmap reading '+file+' from '+str(pos)+' to '+str(end)+' amount '+str(amount)
+            lock = self._file_lock(file)
+            lock.acquire()
+            try:
+                try:
+                    if flush_first and self.whandles.has_key(file):
+                        self.lock.acquire()
+                        try:
+                            h = self._get_file_handle(file, False)
+                            h.flush()
+                            fsync(h)
+                        finally:
+                            self.lock.release()
+                    while pos < end:
+                        window = pos / WINDOW_SIZE
+                        start = window * WINDOW_SIZE
+                        stop = min(end, start + WINDOW_SIZE)
+                        m = self._get_map(file, window, stop - start)
+                        chunks.append(buffer(m, pos - start, stop - pos))
+                        pos = stop
+                except (IOError, OSError, ValueError, EnvironmentError), e:
+                    if DEBUG:
+                        print_exc()
+                    raise IOError('error reading data from '+ file)
+            finally:
+                lock.release()
+        return MMapBuffer(chunks)
+
+    def write(self, pos, s):
+        # might raise IOError
+        total = 0
+        for file, begin, end in self._intervals(pos, len(s)):
+            if DEBUG:
+                print >>sys.stderr,'mmap writing '+file+' from '+str(pos)+' to '+str(end)
+            if self.handlebuffer is not None:
+                # other files may close the handle when too many are open
+                lock = self.lock
+            else:
+                lock = self._file_lock(file)
+            lock.acquire()
+            try:
+                if lock is not self.lock:
+                    self.lock.acquire()
+                    try:
+                        h = self._get_file_handle(file, True)
+                    finally:
+                        self.lock.release()
+                else:
+                    h = self._get_file_handle(file, True)
+                h.seek(begin)
+                h.write(s[total: total + end - begin])
+                # make the data visible to the maps
+                h.flush()
+            finally:
+                lock.release()
+            total += end - begin
+
+    def delete_file(self, f):
+        self._drop_maps(self.files[f][0])
+        Storage.delete_file(self, f)
+
+    def close(self):
+        self.lock.acquire()
+        try:
+            self.maps = {}
+            self.maplru = []
+        finally:
+            self.lock.release()
+        Storage.close(self)
@@ -0,0 +1,208 @@
+# see LICENSE.txt for license information
+
+import sys
+from threading import Lock
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# fields of the entries of the LRU list
+PREV, NEXT, KEY, DATA = 0, 1, 2, 3
+
+
+class CachedPiece:
+    """
+    The part of a cached piece returned by StorageWrapper.do_get_piece. Has
+    the interface of piecebuffer.SingleBuffer, slices are buffer objects
+    that point into the cached string.
+    """
+    def __init__(self, data, begin, length):
+        self.data = data
+        self.begin = begin
+        self.length = int(length)
+
+    def __len__(self):
+        return self.length
+
+    def __getslice__(self, a, b):
+        if b > self.length:
+            b = self.length
+        if b < 0:
+            b += self.length
+        return buffer(self.data, self.begin + a, max(b - a, 0))
+
+    def getarray(self):
+        return self
+
+    def tostring(self):
+        if self.begin == 0 and self.length == len(self.data):
+            return self.data
+        return self.data[self.begin:self.begin + self.length]
+
+    __str__ = tostring
+
+    def release(self):
+        pass
+
+
+class PieceCache:
+    """
+    Keeps the data of recently read pieces of all downloads in memory, so
+    pieces that many peers request are read from disk only once. Pieces are
+    identified by (infohash, piece) and stored as strings. When the cache
+    holds more than max_size bytes the least recently used pieces are
+    dropped. Sequential readers like VideoOnDemand can have the next
+    'readahead' pieces loaded before they ask for them.
+    """
+    __single = None
+    lock = Lock()
+
+    def __init__(self, max_size, readahead = 0):
+        if PieceCache.__single:
+            raise RuntimeError, "PieceCache is Singleton"
+        PieceCache.__single = self
+
+        self.max_size = max_size
+        self.readahead = readahead
+        self.cache_lock = Lock()
+        self.entries = {}       # (infohash, piece): [prev, next, key, data]
+        # circular list of the entries, least recently used first
+        self.root = root = []
+        root[:] = [root, root, None, None]
+        self.size = 0
+        self.stats = {}         # infohash: [hits, misses, bytes, read ahead]
+
+    def getInstance(*args, **kw):
+        # Singleton pattern with double-checking
+        if PieceCache.__single is None:
+            PieceCache.lock.acquire()
+            try:
+                if PieceCache.__single is None:
+                    PieceCache(*args, **kw)
+            finally:
+                PieceCache.lock.release()
+        return PieceCache.__single
+    getInstance = staticmethod(getInstance)
+
+    def hasInstance():
+        return PieceCache.__single is not None
+    hasInstance = staticmethod(hasInstance)
+
+    def delInstance():
+        PieceCache.lock.acquire()
+        try:
+            PieceCache.__single = None
+        finally:
+            PieceCache.lock.release()
+    delInstance = staticmethod(delInstance)
+
+    def _stats(self, infohash):
+        stats = self.stats.get(infohash)
+        if stats is None:
+            stats = self.stats[infohash] = [0, 0, 0, 0]
+        return stats
+
+    def _unlink(self, entry):
+        entry[PREV][NEXT] = entry[NEXT]
+        entry[NEXT][PREV] = entry[PREV]
+
+    def _append(self, entry):
+        root = self.root
+        last = root[PREV]
+        entry[PREV] = last
+        entry[NEXT] = root
+        last[NEXT] = root[PREV] = entry
+
+    def _remove(self, entry):
+        self._unlink(entry)
+        del self.entries[entry[KEY]]
+        length = len(entry[DATA])
+        self.size -= length
+        self._stats(entry[KEY][0])[2] -= length
+
+    def get(self, infohash, piece):
+        """ Returns the data of the piece or None, counts a hit or miss """
+        self.cache_lock.acquire()
+        try:
+            entry = self.entries.get((infohash, piece))
+            stats = self._stats(infohash)
+            if entry is None:
+                stats[1] += 1
+                return None
+            stats[0] += 1
+            self._unlink(entry)
+            self._append(entry)
+            return entry[DATA]
+        finally:
+            self.cache_lock.release()
+
+    def has(self, infohash, piece):
+        return self.entries.has_key((infohash, piece))
+
+    def put(self, infohash, piece, data, readahead = False):
+        length = len(data)
+        if length > self.max_size:
+            return
+        key = (infohash, piece)
+        self.cache_lock.acquire()
+        try:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self._remove(entry)
+            entry = [None, None, key, data]
+            self.entries[key] = entry
+            self._append(entry)
+            self.size += length
+            stats = self._stats(infohash)
+            stats[2] += length
+            if readahead:
+                stats[3] += 1
+            while self.size > self.max_size:
+                if DEBUG:
+                    print >>sys.stderr,"PieceCache: dropping piece",self.root[NEXT][KEY][1]
+                self._remove(self.root[NEXT])
+        finally:
+            self.cache_lock.release()
+
+    def invalidate(self, infohash, piece):
+        """ Drops a piece whose data changed """
+        self.cache_lock.acquire()
+        try:
+            entry = self.entries.get((infohash, piece))
+            if entry is not None:
+                self._remove(entry)
+        finally:
+            self.cache_lock.release()
+
+    def drop(self, infohash):
+        """ Drops all pieces and statistics of a download """
+        self.cache_lock.acquire()
+        try:
+            for key, entry in self.entries.items():
+                if key[0] == infohash:
+                    self._remove(entry)
+            if self.stats.has_key(infohash):
+                del self.stats[infohash]
+        finally:
+            self.cache_lock.release()
+
+    def get_stats(self, infohash):
+        """ Returns the statistics of a download, see
+        DownloadState.get_piece_cache_stats() """
+        self.cache_lock.acquire()
+        try:
+            hits, misses, size, readahead = self.stats.get(infohash, [0, 0, 0, 0])
+            if hits + misses:
+                hitrate = float(hits) / (hits + misses)
+            else:
+                hitrate = 0.0
+            return {'hits': hits, 'misses': misses, 'hitrate': hitrate,
+                    'readahead': readahead, 'size': size,
+                    'total_size': self.size, 'max_size': self.max_size}
+        finally:
+            self.cache_lock.release()
@@ -164,7 +164,7 @@ class PiecePicker:
         elif self.has[piece] or self.priority[piece] == -1:
             return
         if numint == len(self.interests) - 1:
-            self.interests.append([])
+            self.interests.append(self._new_level())
         self._shift_over(piece, self.interests[numint], self.interests[numint + 1])
 
     def lost_have(self, piece):
@@ -211,21 +211,10 @@ class PiecePicker:
             level = self.numhaves[piece] + (self.priority_step * p)
             self.level_in_interests[piece] = level
             while len(self.interests) < level+1:
-                self.interests.append([])
+                self.interests.append(self._new_level())
 
             # insert at a random spot in the list at the current level
-            l2 = self.interests[level]
-            parray = self.pos_in_interests
-            newp = randrange(len(l2)+1)
-            if newp == len(l2):
-                parray[piece] = len(l2)
-                l2.append(piece)
-            else:
-                old = l2[newp]
-                parray[old] = len(l2)
-                l2.append(old)
-                l2[newp] = piece
-                parray[piece] = newp
+            self._insert_in_level(piece, level)
 
         # modelled after lost_have
 
@@ -251,6 +240,25 @@ class PiecePicker:
     def set_downloader(self,dl):
         self.downloader = dl
 
+    def _new_level(self):
+        """ Returns an empty interest level. """
+        return []
+
+    def _insert_in_level(self, piece, level):
+        """ Inserts 'piece' at a random place in interest level 'level'. """
+        l2 = self.interests[level]
+        parray = self.pos_in_interests
+        newp = randrange(len(l2)+1)
+        if newp == len(l2):
+            parray[piece] = len(l2)
+            l2.append(piece)
+        else:
+            old = l2[newp]
+            parray[old] = len(l2)
+            l2.append(old)
+            l2[newp] = piece
+            parray[piece] = newp
+
     def _shift_over(self, piece, l1, l2):
         """ Moves 'piece' from interests list l1 to l2. """
 
@@ -484,19 +492,8 @@ class PiecePicker:
             if self.has[piece]:
                 return True
             while len(self.interests) < level+1:
-                self.interests.append([])
-            l2 = self.interests[level]
-            parray = self.pos_in_interests
-            newp = randrange(len(l2)+1)
-            if newp == len(l2):
-                parray[piece] = len(l2)
-                l2.append(piece)
-            else:
-                old = l2[newp]
-                parray[old] = len(l2)
-                l2.append(old)
-                l2[newp] = piece
-                parray[piece] = newp
+                self.interests.append(self._new_level())
+            self._insert_in_level(piece, level)
             if self.removed_partials.has_key(piece):
                 del self.removed_partials[piece]
                 self.started.append(piece)
@@ -508,7 +505,7 @@ class PiecePicker:
         if self.has[piece]:
             return False
         while len(self.interests) < newint+1:
-            self.interests.append([])
+            self.interests.append(self._new_level())
         self._shift_over(piece, self.interests[numint], self.interests[newint])
         return False
 
@@ -547,7 +544,7 @@ class PiecePicker:
                     seedint = self.level_in_interests[piece]
                     self.level_in_interests[piece] += 1  # tweak it up one, so you don't duplicate effort
                     if seedint == len(self.interests) - 1:
-                        self.interests.append([])
+                        self.interests.append(self._new_level())
                     self._shift_over(piece, 
                                 self.interests[seedint], self.interests[seedint + 1])
                     self.seed_got_haves[piece] = 0       # reset this
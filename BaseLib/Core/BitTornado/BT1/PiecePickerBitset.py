@@ -0,0 +1,275 @@
+# see LICENSE.txt for license information
+
+from random import randrange
+from binascii import hexlify
+from string import maketrans
+
+from BaseLib.Core.BitTornado.BT1.PiecePicker import PiecePicker
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+DEBUG = False
+
+# reverses the order of the bits in a byte: the wire format of a bitfield
+# stores piece 0 in the highest bit of the first byte
+_reverse_bits = maketrans(''.join([chr(i) for i in xrange(256)]),
+                          ''.join([chr(int(('%08d' % int(bin(i)[2:]))[::-1], 2)) for i in xrange(256)]))
+
+class PieceSet:
+    """
+    Set of piece numbers packed into a bytearray: piece i is bit i % 8 of
+    byte i / 8. Adding and removing pieces changes a single byte. For bulk
+    operations the set is converted into a long (bit i = piece i). The long
+    is cached and updated along with the bytearray, which is cheaper than
+    converting the set again.
+    """
+    def __init__(self, numpieces, full = False):
+        self.numpieces = numpieces
+        if full:
+            self.bits = bytearray('\xff' * (numpieces >> 3))
+            if numpieces & 7:
+                self.bits.append((1 << (numpieces & 7)) - 1)
+            self.count = numpieces
+        else:
+            self.bits = bytearray((numpieces + 7) >> 3)
+            self.count = 0
+        self._long = None
+
+    def add(self, piece):
+        mask = 1 << (piece & 7)
+        byte = self.bits[piece >> 3]
+        if not byte & mask:
+            self.bits[piece >> 3] = byte | mask
+            self.count += 1
+            if self._long is not None:
+                self._long |= 1L << piece
+
+    def discard(self, piece):
+        mask = 1 << (piece & 7)
+        byte = self.bits[piece >> 3]
+        if byte & mask:
+            self.bits[piece >> 3] = byte & ~mask
+            self.count -= 1
+            if self._long is not None:
+                self._long ^= 1L << piece
+
+    def __contains__(self, piece):
+        return self.bits[piece >> 3] & (1 << (piece & 7)) != 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        """ Yields the pieces in ascending order """
+        for i in xrange(len(self.bits)):
+            byte = self.bits[i]
+            if byte:
+                for j in xrange(8):
+                    if byte & (1 << j):
+                        yield (i << 3) + j
+
+    def tolong(self):
+        if self._long is None:
+            if self.count:
+                self._long = long(hexlify(self.bits[::-1]), 16)
+            else:
+                self._long = 0L
+        return self._long
+
+def bitfield_to_long(haves):
+    """ Returns the pieces of a Bitfield as long, bit i = piece i """
+    s = haves.tostring()
+    if not s:
+        return 0L
+    return long(hexlify(s.translate(_reverse_bits)[::-1]), 16)
+
+def iter_pieces(pieces, start = 0):
+    """ Yields the pieces in the set given as long in ascending order,
+    starting at the lowest piece >= start and wrapping around. Every step
+    clears the lowest remaining piece instead of shifting the set down. """
+    low = pieces & ((1L << start) - 1)
+    for x in (pieces ^ low, low):
+        while x:
+            bit = x & -x
+            yield bit.bit_length() - 1
+            x ^= bit
+
+class PiecePickerBitset(PiecePicker):
+    """
+    Rarest-first piece picker that keeps every interest level, the started
+    pieces and the pieces of every peer as packed bitsets. Instead of testing
+    the pieces of the interest levels one by one, _next intersects each level
+    with the pieces of the peer and only calls wantfunc for the pieces in the
+    intersection. The interface is the one of PiecePicker.
+
+    Pieces within a level are not kept shuffled. Instead the search for the
+    first acceptable piece starts at a random position and wraps around.
+    """
+
+    def __init__(self, numpieces, *args, **kwargs):
+        # pieces of the peers: id(have Bitfield) -> [long, numfalse, Bitfield]
+        self.peer_pieces = {}
+        self.started_pieces = PieceSet(numpieces)
+        PiecePicker.__init__(self, numpieces, *args, **kwargs)
+
+    def _init_interests(self):
+        self.interests = [self._new_level() for x in xrange(self.priority_step)]
+        self.interests.append(PieceSet(self.numpieces, True))
+        self.level_in_interests = [self.priority_step] * self.numpieces
+
+    def _new_level(self):
+        return PieceSet(self.numpieces)
+
+    def _insert_in_level(self, piece, level):
+        self.interests[level].add(piece)
+
+    def _shift_over(self, piece, l1, l2):
+        """ Moves 'piece' from interest level l1 to l2. """
+        assert self.superseed or (not self.has[piece] and self.priority[piece] >= 0)
+        # PieceSet.discard and PieceSet.add, inlined
+        mask = 1 << (piece & 7)
+        byte = piece >> 3
+        l1.bits[byte] &= ~mask
+        l1.count -= 1
+        if l1._long is not None:
+            l1._long ^= 1L << piece
+        assert not l2.bits[byte] & mask
+        l2.bits[byte] |= mask
+        l2.count += 1
+        if l2._long is not None:
+            l2._long |= 1L << piece
+
+    def got_have(self, piece, connection = None):
+        PiecePicker.got_have(self, piece, connection)
+        # keep the bitset of the peer up to date, if it was built already
+        try:
+            haves = connection.download.have
+        except AttributeError:
+            return
+        entry = self.peer_pieces.get(id(haves))
+        if entry is not None and entry[2] is haves and haves[piece]:
+            entry[0] |= 1L << piece
+            entry[1] = haves.numfalse
+
+    def lost_peer(self, connection):
+        try:
+            del self.peer_pieces[id(connection.download.have)]
+        except (KeyError, AttributeError):
+            pass
+        PiecePicker.lost_peer(self, connection)
+
+    def requested(self, piece, begin = None, length = None):
+        PiecePicker.requested(self, piece, begin, length)
+        self.started_pieces.add(piece)
+
+    def _remove_from_interests(self, piece, keep_partial = False):
+        self.interests[self.level_in_interests[piece]].discard(piece)
+        self.started_pieces.discard(piece)
+        try:
+            self.started.remove(piece)
+            if keep_partial:
+                self.removed_partials[piece] = 1
+        except ValueError:
+            pass
+
+    def bump(self, piece):
+        """ Piece was received but contained bad data? """
+        self.started_pieces.discard(piece)
+        try:
+            self.started.remove(piece)
+        except ValueError:
+            pass
+
+    def set_priority(self, piece, p):
+        r = PiecePicker.set_priority(self, piece, p)
+        if piece in self.started:
+            # a removed partial was restored
+            self.started_pieces.add(piece)
+        return r
+
+    def _peer_pieces(self, haves):
+        """ Returns the pieces of a peer as long, or None if it has all pieces. """
+        if haves.complete():
+            return None
+        numfalse = haves.numfalse
+        entry = self.peer_pieces.get(id(haves))
+        if entry is None or entry[2] is not haves or entry[1] != numfalse:
+            if len(self.peer_pieces) > 2 * len(self.peer_connections) + 16:
+                # drop the entries of replaced bitfields
+                self.peer_pieces.clear()
+            entry = [bitfield_to_long(haves), numfalse, haves]
+            self.peer_pieces[id(haves)] = entry
+        return entry[0]
+
+# 2fastbt_
+    def _next(self, haves, wantfunc, complete_first, helper_con, willrequest=True, connection=None):
+# _2fastbt
+        """ Determine which piece to download next from a peer, see
+        PiecePicker._next. """
+
+        cutoff = self.numgot < self.rarest_first_cutoff
+        complete_first = (complete_first or cutoff) and not haves.complete()
+        peer = self._peer_pieces(haves)
+        helper = self.helper
+
+        best = None
+        bestnum = 2 ** 30
+
+        # select piece we started to download with best interest index. There
+        # are few started pieces, testing them one by one is cheaper than
+        # walking an intersection.
+        for i in self.started:
+# 2fastbt_
+            if haves[i] and wantfunc(i) and (helper is None or helper_con or not helper.is_ignored(i)):
+# _2fastbt
+                if self.level_in_interests[i] < bestnum:
+                    best = i
+                    bestnum = self.level_in_interests[i]
+
+        if best is not None:
+            if complete_first or (cutoff and len(self.interests) > self.cutoff):
+                return best
+
+        if haves.complete():
+            r = [ (0, min(bestnum, len(self.interests))) ]
+        elif cutoff and len(self.interests) > self.cutoff:
+            r = [ (self.cutoff, min(bestnum, len(self.interests))),
+                      (0, self.cutoff) ]
+        else:
+            r = [ (0, min(bestnum, len(self.interests))) ]
+
+        # every started piece of the peer below level bestnum was rejected by
+        # the loop above already, leave them out of the candidates
+        unstarted = ~self.started_pieces.tolong()
+
+        # select first acceptable piece, best interest index first.
+        for lo, hi in r:
+            for level in xrange(lo, hi):
+                pieces = self.interests[level]
+                if not pieces.count:
+                    continue
+                candidates = pieces.tolong() & unstarted
+                if peer is not None:
+                    candidates &= peer
+                if not candidates:
+                    continue
+                piece = self._first_wanted(candidates, wantfunc, helper_con)
+                if piece is not None:
+                    return piece
+
+        return best
+
+    def _first_wanted(self, candidates, wantfunc, helper_con):
+        """ Returns an acceptable piece of the candidates, the search starts at
+        a random piece and wraps around. """
+        helper = self.helper
+        for i in iter_pieces(candidates, randrange(self.numpieces)):
+# 2fastbt_
+            if wantfunc(i) and (helper is None or helper_con or not helper.is_ignored(i)):
+# _2fastbt
+                return i
+        return None
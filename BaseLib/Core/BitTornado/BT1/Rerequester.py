@@ -522,24 +522,35 @@ class Rerequester:
             # TODO: if we change to the second assignment for accepted IPPorts we accept only highly priorized peers
             toAccept = self.maxpeers - self.howmany()
             self.logger.debug("Ask for "+str(toAccept)+" more IPs")
-            acceptedIPPorts = self.neighborselection.selectAsNeighbors(ipPortsToAsk, toAccept)
-            self.logger.debug("Received "+str(acceptedIPPorts))
-            peers = []  
-            for ((ip, port), nr) in potential_peers:
-                if (ip, port) in acceptedIPPorts:
-                    peers.append(((ip, port), nr))     
-            self.logger.info("Connect to "+str(peers))
+            def reapply(acceptedIPPorts, potential_peers = potential_peers):
+                # final rankings arrived (on the ranking thread), connect on the network thread
+                self.externalsched(lambda: self._connect_accepted(potential_peers, acceptedIPPorts))
+            acceptedIPPorts = self.neighborselection.selectAsNeighbors(ipPortsToAsk, toAccept, reapply)
+            self._connect_accepted(potential_peers, acceptedIPPorts)
             # _smoothIT
-
-            if peers:
-                shuffle(peers)
-                self.connect(peers)    # Encoder.start_connections(peers)
             callback()
         except:
             print >>sys.stderr,"Rerequester: Error in postrequest"
             import traceback
             traceback.print_exc()
 
+    # smoothIT_
+    def _connect_accepted(self, potential_peers, acceptedIPPorts):
+        if self.stopped:
+            return
+        self.logger.debug("Received "+str(acceptedIPPorts))
+        # acceptedIPPorts is a NeighborList, membership tests are O(1)
+        peers = []  
+        for ((ip, port), nr) in potential_peers:
+            if (ip, port) in acceptedIPPorts:
+                peers.append(((ip, port), nr))     
+        self.logger.info("Connect to "+str(peers))
+
+        if peers:
+            shuffle(peers)
+            self.connect(peers)    # Encoder.start_connections(peers)
+    # _smoothIT
+
     def exception(self, callback):
         data = StringIO()
         print_exc(file = data)
@@ -2,6 +2,7 @@
 # see LICENSE.txt for license information
 
 from BaseLib.Core.BitTornado.piecebuffer import BufferPool
+from BaseLib.Core.BitTornado.zerocopy import FileRegion
 from threading import Lock
 from time import strftime, localtime
 import os
@@ -53,6 +54,8 @@ class Storage:
         so_far = 0L
         self.handles = {}
         self.whandles = {}
+        # {file: file object} duplicated handles used by FileRegions
+        self.region_handles = {}
         self.tops = {}
         self.sizes = {}
         self.mtimes = {}
@@ -199,6 +202,8 @@ class Storage:
     def _close(self, file):
         f = self.handles[file]
         del self.handles[file]
+        if self.region_handles.has_key(file):
+            del self.region_handles[file]
         if self.whandles.has_key(file):
             del self.whandles[file]
             f.flush()
@@ -324,6 +329,31 @@ class Storage:
             self.lock.release()
             total += end - begin
 
+    def get_file_regions(self, pos, amount):
+        """ Returns the data at pos as a list of FileRegions, so it can be
+        sent with sendfile() instead of being read. Pending writes to the
+        files are flushed first. """
+        regions = []
+        for file, pos, end in self._intervals(pos, amount):
+            try:
+                self.lock.acquire()
+                try:
+                    h = self._get_file_handle(file, False)
+                    if self.whandles.has_key(file):
+                        h.flush()
+                    f = self.region_handles.get(file)
+                    if f is None:
+                        f = os.fdopen(os.dup(h.fileno()), 'rb')
+                        self.region_handles[file] = f
+                finally:
+                    self.lock.release()
+            except (IOError, OSError), e:
+                if DEBUG:
+                    print_exc()
+                raise IOError('error reading data from '+ file)
+            regions.append(FileRegion(f, pos, end - pos))
+        return regions
+
     def top_off(self):
         for begin, end, offset, file in self.ranges:
             l = offset + end - begin
@@ -353,6 +383,7 @@ class Storage:
                 pass
         self.handles = {}
         self.whandles = {}
+        self.region_handles = {}
         self.handlebuffer = None
 
 
@@ -476,8 +507,11 @@ class Storage:
 
 
     def delete_file(self, f):
+        file = self.files[f][0]
+        if self.region_handles.has_key(file):
+            del self.region_handles[file]
         try:
-            os.remove(self.files[f][0])
+            os.remove(file)
         except:
             pass
 
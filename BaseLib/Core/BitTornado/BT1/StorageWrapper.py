@@ -6,12 +6,17 @@ from random import randrange
 from copy import deepcopy
 import pickle
 import traceback, sys
+from collections import deque
 
 from BaseLib.Core.Merkle.merkle import MerkleTree
 from BaseLib.Core.Utilities.Crypto import sha
 from BaseLib.Core.BitTornado.bitfield import Bitfield
 from BaseLib.Core.BitTornado.clock import clock
+from BaseLib.Core.BitTornado.piecebuffer import tostring
 from BaseLib.Core.BitTornado.bencode import bencode
+from BaseLib.Core.BitTornado.BT1.HashChecker import HashCheckPool, HashCheckJob, READ_SIZE
+from BaseLib.Core.BitTornado.BT1.PieceCache import PieceCache, CachedPiece
+from BaseLib.Core.BitTornado.BT1.MMapStorage import MMapBuffer
 
 try:
     True
@@ -23,6 +28,7 @@ from bisect import insort
 DEBUG = False
 
 STATS_INTERVAL = 0.2
+CHECK_WAIT = 0.05   # max time old_style_init waits for the hash check pool
 RARE_RAWSERVER_TASKID = -481  # This must be a rawserver task ID that is never valid.
 
 
@@ -75,7 +81,7 @@ class StorageWrapper:
             data_flunked = lambda x: None, 
             piece_from_live_source_func = lambda i,d: None, 
             backfunc = None, 
-            config = {}, unpauseflag = fakeflag(True)):
+            config = {}, unpauseflag = fakeflag(True), infohash = None):
         if DEBUG: print >>sys.stderr, "StorageWrapper: __init__: wrapped around", storage.files
         self.videoinfo = videoinfo
         self.storage = storage
@@ -92,7 +98,18 @@ class StorageWrapper:
         self.piece_from_live_source_func = piece_from_live_source_func
         self.backfunc = backfunc
         self.config = config
+        # time hashcheckfunc may block waiting for the hash check pool, never
+        # on the network thread
+        self.check_timeout = 0
+        # _initialize waits for a job of the hash check pool
+        self.check_waiting = False
         self.unpauseflag = unpauseflag
+        self.infohash = infohash
+        # session wide cache of hash checked pieces, keyed by infohash
+        if infohash is not None and PieceCache.hasInstance():
+            self.piece_cache = PieceCache.getInstance()
+        else:
+            self.piece_cache = None
 
         self.live_streaming = self.videoinfo['live']
         
@@ -136,6 +153,9 @@ class StorageWrapper:
         self.write_buf_size = 0L
         self.write_buf = {}   # structure:  piece: [(start, data), ...]
         self.write_buf_list = []
+        self.running_hashes = {}  # piece: [sha, length hashed] or None
+        self.verifying = {}       # piece: HashCheckJob
+        self.verified_func = None
         # Merkle:
         self.merkle_torrent = (root_hash is not None)
         self.root_hash = root_hash
@@ -167,6 +187,7 @@ class StorageWrapper:
 
 
     def old_style_init(self):
+        self.check_timeout = CHECK_WAIT
         while self.initialize_tasks:
             msg, done, init, next = self.initialize_tasks.pop(0)
             if init():
@@ -264,6 +285,9 @@ class StorageWrapper:
                 self.initialize_status(activity = msg, fractionDone = done)
                 self.initialize_next = next
 
+        if self.check_waiting:
+            # resumed by _hashcheck_job_done
+            return
         self.backfunc(self._initialize)
 
     def init_hashcheck(self):
@@ -313,6 +337,12 @@ class StorageWrapper:
                 self.check_targets[self.hashes[i]] = [i]
         self.check_total = len(self.check_list)
         self.check_numchecked = 0.0
+        self.check_jobs = None
+        if (HashCheckPool.hasInstance() and self.check_hashes
+            and not self.live_streaming):
+            self.check_jobs = deque()
+        self.check_bytes = 0L
+        self.check_start = clock()
         self.lastlen = self._piecelen(len(self.hashes) - 1)
         self.numchecked = 0.0
         if DEBUG:
@@ -336,7 +366,11 @@ class StorageWrapper:
     def hashcheckfunc(self):
         try:
             if self.flag.isSet():
+                if self.check_jobs:
+                    HashCheckPool.getInstance().cancel(self.check_jobs)
                 return None
+            if self.check_jobs is not None:
+                return self._hashcheck_parallel()
             if not self.check_list:
                 return None
             if self.live_streaming:
@@ -358,58 +392,117 @@ class StorageWrapper:
                 sh.update(d2[:])
                 d2.release()
                 s = sh.digest()
-
-
-                if DEBUG:
-                    if s != self.hashes[i]:
-                        print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
-
-                # Merkle: If we didn't read the hashes from persistent storage then
-                # we can't check anything. Exception is the case where we are the
-                # initial seeder. In that case we first calculate all hashes, 
-                # and then compute the hash tree. If the root hash equals the
-                # root hash in the .torrent we're a seeder. Otherwise, we are
-                # client with messed up data and no (local) way of checking it.
-                #
-                if not self.hashes_unpickled:
-                    if DEBUG:
-                        print "StorageWrapper: Merkle torrent, saving calculated hash",i
-                    self.initial_hashes[i] = s
-                    self._markgot(i, i)
-                elif s == self.hashes[i]:
-                    self._markgot(i, i)
-                elif (self.check_targets.get(s)
-                       and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
-                    self._markgot(self.check_targets[s].pop(), i)
-                    self.out_of_place += 1
-                elif (not self.have[-1] and sp == self.hashes[-1]
-                       and (i == len(self.hashes) - 1
-                            or not self._waspre(len(self.hashes) - 1))):
-                    self._markgot(len(self.hashes) - 1, i)
-                    self.out_of_place += 1
-                else:
-                    self.places[i] = i
+                self._hash_checked(i, s, sp)
             self.numchecked += 1
-            if self.amount_left == 0:
-                if not self.hashes_unpickled:
-                    # Merkle: The moment of truth. Are we an initial seeder?
-                    self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
-                    if self.merkletree.compare_root_hashes(self.root_hash):
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, initial seeder!"
-                        self.hashes = self.initial_hashes
-                    else:
-                        # Bad luck
-                        if DEBUG:
-                            print "StorageWrapper: Merkle torrent, NOT a seeder!"
-                        self.failed('download corrupted, hash tree does not compute; please delete and restart')
-                        return 1
-                self.finished()
-            return (self.numchecked / self.check_total)
+            return self._hashcheck_progress()
 
         except Exception, e:
             print_exc()
             self.failed('download corrupted: '+str(e)+'; please delete and restart')
+
+    def _hashcheck_parallel(self):
+        """ Hash check using the HashCheckPool: runs of consecutive pieces are
+        read and hashed by the worker threads, the results are processed in
+        order on this thread. """
+        pool = HashCheckPool.getInstance()
+        while self.check_list and len(self.check_jobs) < 2 * pool.numthreads:
+            run = [self.check_list.pop(0)]
+            length = self._piecelen(run[0])
+            while (self.check_list and self.check_list[0] == run[-1] + 1
+                   and length + self._piecelen(self.check_list[0]) <= READ_SIZE):
+                run.append(self.check_list.pop(0))
+                length += self._piecelen(run[-1])
+            job = HashCheckJob(self.storage.read, run, self.piece_size, self._piecelen, self.lastlen)
+            job.callback = lambda: self.backfunc(self._hashcheck_job_done)
+            self.check_jobs.append(job)
+            pool.submit(job)
+        if not self.check_jobs:
+            return None
+        job = self.check_jobs[0]
+        if not job.wait(self.check_timeout):
+            if not self.check_timeout:
+                # don't block the network thread, _initialize is resumed
+                # when the pool finished a job
+                self.check_waiting = True
+            return self.numchecked / self.check_total
+        self.check_jobs.popleft()
+        if job.error is not None:
+            pool.cancel(self.check_jobs)
+            self.failed('IO Error: ' + str(job.error))
+            return None
+        for i, s, sp in job.results:
+            self._hash_checked(i, s, sp)
+            self.numchecked += 1
+        self.check_bytes += job.length()
+        if not self.check_jobs:
+            if DEBUG:
+                print >>sys.stderr,"StorageWrapper: hashcheck: %.1f MB/s" % self.get_hashcheck_rate()
+        return self._hashcheck_progress()
+
+    def _hashcheck_job_done(self):
+        """ Called on the network thread when the hash check pool finished
+        one of our jobs """
+        if self.check_waiting:
+            self.check_waiting = False
+            self._initialize()
+
+    def get_hashcheck_rate(self):
+        """ Returns the speed of the hash check in MB/s """
+        elapsed = clock() - self.check_start
+        if elapsed <= 0:
+            return 0.0
+        return self.check_bytes / elapsed / 1048576.0
+
+    def _hash_checked(self, i, s, sp):
+        """ Piece at position i on disk hashes to s, its first self.lastlen
+        bytes hash to sp. """
+        if DEBUG:
+            if s != self.hashes[i]:
+                print >>sys.stderr,"StorageWrapper: hashcheckfunc: piece corrupt",i
+
+        # Merkle: If we didn't read the hashes from persistent storage then
+        # we can't check anything. Exception is the case where we are the
+        # initial seeder. In that case we first calculate all hashes, 
+        # and then compute the hash tree. If the root hash equals the
+        # root hash in the .torrent we're a seeder. Otherwise, we are
+        # client with messed up data and no (local) way of checking it.
+        #
+        if not self.hashes_unpickled:
+            if DEBUG:
+                print "StorageWrapper: Merkle torrent, saving calculated hash",i
+            self.initial_hashes[i] = s
+            self._markgot(i, i)
+        elif s == self.hashes[i]:
+            self._markgot(i, i)
+        elif (self.check_targets.get(s)
+               and self._piecelen(i) == self._piecelen(self.check_targets[s][-1])):
+            self._markgot(self.check_targets[s].pop(), i)
+            self.out_of_place += 1
+        elif (not self.have[-1] and sp == self.hashes[-1]
+               and (i == len(self.hashes) - 1
+                    or not self._waspre(len(self.hashes) - 1))):
+            self._markgot(len(self.hashes) - 1, i)
+            self.out_of_place += 1
+        else:
+            self.places[i] = i
+
+    def _hashcheck_progress(self):
+        if self.amount_left == 0:
+            if not self.hashes_unpickled:
+                # Merkle: The moment of truth. Are we an initial seeder?
+                self.merkletree = MerkleTree(self.piece_size,self.total_length,None,self.initial_hashes)
+                if self.merkletree.compare_root_hashes(self.root_hash):
+                    if DEBUG:
+                        print "StorageWrapper: Merkle torrent, initial seeder!"
+                    self.hashes = self.initial_hashes
+                else:
+                    # Bad luck
+                    if DEBUG:
+                        print "StorageWrapper: Merkle torrent, NOT a seeder!"
+                    self.failed('download corrupted, hash tree does not compute; please delete and restart')
+                    return 1
+            self.finished()
+        return (self.numchecked / self.check_total)
     
     
     def init_movedata(self):
@@ -605,7 +698,8 @@ class StorageWrapper:
 
     def is_unstarted(self, index):
         return (not self.have[index] and not self.numactive[index]
-                 and not self.dirty.has_key(index))
+                 and not self.dirty.has_key(index) 
+                 and not self.verifying.has_key(index))
 
     def get_hash(self, index):
         return self.hashes[index]
@@ -790,6 +884,10 @@ class StorageWrapper:
     ## Arno: don't think we need length here, FIXME 
     def piece_came_in(self, index, begin, hashlist, piece, baddataguard, source = None):
         assert not self.have[index]
+        if type(piece) is memoryview:
+            # points into the receive buffer of the connection, which is
+            # reused for the next message
+            piece = piece.tobytes()
         # Merkle: Check that the hashes are valid using the known root_hash
         # If so, put them in the hash tree and the normal list of hashes to
         # allow (1) us to send this piece to others using the right hashes
@@ -814,7 +912,7 @@ class StorageWrapper:
             old = self.read_raw(self.places[index], begin, len(piece))
             if old is None:
                 return True
-            if old[:].tostring() != piece:
+            if tostring(old[:]) != piece:
                 try:
                     self.failed_pieces[index][self.download_history[index][begin]] = 1
                 except:
@@ -824,6 +922,19 @@ class StorageWrapper:
         
         if not self._write_to_buffer(index, begin, piece):
             return True
+
+        # hash the piece while its blocks come in, as long as they come in
+        # order: [sha, number of bytes hashed], or None
+        if begin == 0:
+            self.running_hashes[index] = [sha(piece), len(piece)]
+        else:
+            running = self.running_hashes.get(index)
+            if running is not None:
+                if running[1] == begin:
+                    running[0].update(piece)
+                    running[1] += len(piece)
+                else:
+                    self.running_hashes[index] = None
         
         self.amount_obtained += len(piece)
         self.dirty.setdefault(index, []).append((begin, len(piece)))
@@ -843,6 +954,24 @@ class StorageWrapper:
         
         length = self._piecelen(index)
         # Check hash
+        running = self.running_hashes.pop(index, None)
+        if (running is not None and running[1] == length 
+            and not self.triple_check and not self.live_streaming):
+            # all blocks came in order, no need to read the piece back
+            return self._piece_checked(index, running[0].digest() == self.hashes[index])
+
+        if (self.verified_func is not None and HashCheckPool.hasInstance()
+            and not self.triple_check and not self.live_streaming):
+            # hash the piece on a worker thread, the result is handled 
+            # by a task on this thread
+            job = HashCheckJob(self.storage.read, [self.places[index]], 
+                               self.piece_size, lambda place: length, length)
+            job.piece = index
+            job.callback = lambda: self.backfunc(lambda: self._piece_verified(job))
+            self.verifying[index] = job
+            HashCheckPool.getInstance().submit(job)
+            return True
+
         data = self.read_raw(self.places[index], 0, length, 
                                      flush_first = self.triple_check)
         if data is None:
@@ -858,7 +987,37 @@ class StorageWrapper:
             data.release()
             if hash == self.hashes[index]:
                 pieceok = True
-                
+        return self._piece_checked(index, pieceok)
+
+    def _piece_verified(self, job):
+        """ Background hash check of a received piece done """
+        index = job.piece
+        if self.verifying.get(index) is not job:
+            return
+        del self.verifying[index]
+        if self.flag.isSet():
+            return
+        if job.error is not None:
+            self.failed('IO Error: ' + str(job.error))
+            return
+        if job.results is None:
+            # cancelled
+            return
+        place, hash, sp = job.results[0]
+        pieceok = (hash == self.hashes[index])
+        self._piece_checked(index, pieceok)
+        self.verified_func(index, pieceok)
+
+    def set_verified_func(self, func):
+        """ func(index, pieceok) is called when a piece that was hash checked
+        in the background passed or failed the check. """
+        self.verified_func = func
+
+    def is_verifying(self, index):
+        return self.verifying.has_key(index)
+
+    def _piece_checked(self, index, pieceok):
+        length = self._piecelen(index)
         if not pieceok: 
             self.amount_obtained -= length
             self.data_flunked(length, index)
@@ -934,6 +1093,8 @@ class StorageWrapper:
     def do_get_piece(self, index, begin, length):
         if not self.have[index]:
             return None
+        if self.piece_cache is not None and self.waschecked[index]:
+            return self._get_cached_piece(index, begin, length)
         data = None
         if not self.waschecked[index]:
             data = self.read_raw(self.places[index], 0, self._piecelen(index))
@@ -956,6 +1117,10 @@ class StorageWrapper:
         if data is not None:
             s = data[begin:begin+length]
             data.release()
+            if type(s) is buffer:
+                # MMapStorage: return a view with the interface of the
+                # other backends' data
+                s = MMapBuffer([s])
             return s
         data = self.read_raw(self.places[index], begin, length)
         if data is None:
@@ -964,6 +1129,62 @@ class StorageWrapper:
         data.release()
         return s
 
+    def _get_cached_piece(self, index, begin, length):
+        piecelen = self._piecelen(index)
+        if length == -1:
+            if begin > piecelen:
+                return None
+            length = piecelen - begin
+        elif begin + length > piecelen:
+            return None
+        data = self.piece_cache.get(self.infohash, index)
+        if data is None:
+            data = self._read_for_cache(index)
+            if data is None:
+                return None
+            self.piece_cache.put(self.infohash, index, data)
+        return CachedPiece(data, begin, length)
+
+    def _read_for_cache(self, index):
+        data = self.read_raw(self.places[index], 0, self._piecelen(index))
+        if data is None:
+            return None
+        s = tostring(data[:])
+        data.release()
+        return s
+
+    def read_ahead(self, index):
+        """ Called by sequential readers after reading a piece: loads the
+        next pieces into the piece cache in the background """
+        if self.piece_cache is None or not self.piece_cache.readahead:
+            return
+        end = min(index + 1 + self.piece_cache.readahead, len(self.hashes))
+        self.backfunc(lambda: self._read_ahead(index + 1, end))
+
+    def _read_ahead(self, begin, end):
+        cache = self.piece_cache
+        for i in xrange(begin, end):
+            if not self.have[i] or not self.waschecked[i] or cache.has(self.infohash, i):
+                continue
+            data = self._read_for_cache(i)
+            if data is None:
+                return
+            cache.put(self.infohash, i, data, readahead = True)
+
+    def get_piece_regions(self, index, begin, length):
+        """ Returns the (sub)piece as a list of FileRegions for sendfile(), or
+        None if it has to be read with get_piece(), e.g. because it was not
+        hash checked yet """
+        if not self.have[index] or not self.waschecked[index]:
+            return None
+        if begin + length > self._piecelen(index):
+            return None
+        try:
+            return self.storage.get_file_regions(self.piece_size * self.places[index] + begin,
+                                                 length)
+        except IOError:
+            return None
+
     def read_raw(self, piece, begin, length, flush_first = False):
         try:
             return self.storage.read(self.piece_size * piece + begin, 
@@ -1263,6 +1484,8 @@ class StorageWrapper:
         length = self._piecelen(piece)
         oldhave = self.have[piece]
         self.have[piece] = False
+        if self.piece_cache is not None:
+            self.piece_cache.invalidate(self.infohash, piece)
         #self.waschecked[piece] = False
         self.inactive_requests[piece] = 1
         if oldhave: 
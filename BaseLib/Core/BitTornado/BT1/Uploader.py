@@ -103,11 +103,18 @@ class Upload:
             self.was_ever_interested = True
             self.choker.interested(self.connection)
 
-    def get_upload_chunk(self):
+    def get_upload_chunk(self, sendfile = False):
+        """ With sendfile set, the returned piece is a list of FileRegions
+        if the storage can provide them """
         if self.choked or not self.buffer:
             return None
         index, begin, length = self.buffer.pop(0)
-        if self.config['buffer_reads']:
+        regions = None
+        if sendfile:
+            regions = self.storage.get_piece_regions(index, begin, length)
+        if regions is not None:
+            piece, hashlist = regions, []
+        elif self.config['buffer_reads']:
             if index != self.piecedl:
                 if self.piecebuf:
                     self.piecebuf.release()
@@ -132,12 +139,12 @@ class Upload:
             if piece is None:
                 self.connection.close()
                 return None
-        self.measure.update_rate(len(piece))
-        self.totalup.update_rate(len(piece))
+        self.measure.update_rate(length)
+        self.totalup.update_rate(length)
 
         status = Status.get_status_holder("LivingLab")
         s_upload = status.get_or_create_status_element("uploaded",0)
-        s_upload.inc(len(piece))
+        s_upload.inc(length)
 
         # BarterCast counter
         self.connection.total_uploaded += length
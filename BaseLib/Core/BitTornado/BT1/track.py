@@ -16,6 +16,7 @@ from BaseLib.Core.BitTornado.bencode import bencode, bdecode, Bencached
 from BaseLib.Core.BitTornado.zurllib import urlopen
 from urllib import quote, unquote
 from Filter import Filter
+from LocalityIndex import LocalityIndex, PrefixClassifier
 from urlparse import urlparse
 from os.path import exists
 from cStringIO import StringIO
@@ -187,6 +188,12 @@ class Tracker:
         self.cached = {}    # format: infohash: [[time1, l1, s1], [time2, l2, s2], [time3, l3, s3]]
         self.cached_t = {}  # format: infohash: [time, cache]
         self.times = {}
+        # Peers by the expiry interval of their last announce: the peers in
+        # expiring have not announced since the last expire_downloaders and
+        # are removed by the next one
+        self.announced = {}     # (infohash, peerid): 1
+        self.expiring = {}      # (infohash, peerid): 1
+        self.maybe_empty = {}   # infohash: 1, torrents that may have no peers left
         self.state = {}
         self.seedcount = {}
 
@@ -219,6 +226,22 @@ class Tracker:
         self.downloads = self.state.setdefault('peers', {})
         self.completed = self.state.setdefault('completed', {})
 
+        # Peer lists are sampled from an index of the peers of each torrent.
+        # In locality mode peers get the peers of their own network first.
+        self.localities = {}    # infohash: LocalityIndex
+        if config.get('tracker_locality', 0):
+            classifier = PrefixClassifier(config.get('tracker_locality_prefix_len', 16))
+            if config.get('tracker_locality_classes'):
+                try:
+                    classifier.read_classes(config['tracker_locality_classes'])
+                except (IOError, OSError, ValueError):
+                    print '**warning** unable to read locality classes'
+            self.locality_classifier = classifier
+            self.remote_fraction = config.get('tracker_locality_remote_fraction', 0.2)
+        else:
+            self.locality_classifier = lambda ip: None
+            self.remote_fraction = 0
+
         self.becache = {}   # format: infohash: [[l1, s1], [l2, s2], [l3, s3]]
         for infohash, ds in self.downloads.items():
             self.seedcount[infohash] = 0
@@ -242,6 +265,9 @@ class Tracker:
             self.times[x] = {}
             for y in self.downloads[x].keys():
                 self.times[x][y] = 0
+                self.expiring[(x, y)] = 1
+            if not self.downloads[x]:
+                self.maybe_empty[x] = 1
 
         self.trackerid = createPeerID('-T-')
         seed(self.trackerid)
@@ -638,6 +664,8 @@ class Tracker:
 
 
     def add_data(self, infohash, event, ip, paramslist):
+        if not self.downloads.has_key(infohash):
+            self.maybe_empty[infohash] = 1
         peers = self.downloads.setdefault(infohash, {})
         ts = self.times.setdefault(infohash, {})
         self.completed.setdefault(infohash, 0)
@@ -690,6 +718,7 @@ class Tracker:
         
         elif not peer:
             ts[myid] = clock()
+            self.touch_peer(infohash, myid)
             peer = {'ip': ip, 'port': port, 'left': left}
             if mykey:
                 peer['key'] = mykey
@@ -715,6 +744,7 @@ class Tracker:
                 return rsize    # return w/o changing stats
 
             ts[myid] = clock()
+            self.touch_peer(infohash, myid)
             if not left and peer['left']:
                 self.completed[infohash] += 1
                 self.seedcount[infohash] += 1
@@ -722,6 +752,7 @@ class Tracker:
                     for bc in self.becache[infohash]:
                         bc[1][myid] = bc[0][myid]
                         del bc[0][myid]
+                    self.localities[infohash].set_seed(myid)
             if peer['left']:
                 peer['left'] = left
 
@@ -744,6 +775,7 @@ class Tracker:
                         y = not peer['left']
                         for x in l:
                             del x[y][myid]
+                        self.localities[infohash].remove(myid)
                         if not self.natcheck or islocal:
                             del peer['nat'] # restart NAT testing
                 if natted and natted < self.natcheck:
@@ -759,7 +791,14 @@ class Tracker:
         return rsize
 
 
-    def peerlist(self, infohash, stopped, tracker, is_seed, return_type, rsize):
+    def set_locality_classifier(self, classify):
+        """ Sets the function that maps the IP address of a peer to its
+        locality class in locality mode, e.g. to use the ranking of the
+        SIS. Applies to the peers that pass the NAT check from then on. """
+        self.locality_classifier = classify
+
+    def peerlist(self, infohash, stopped, tracker, is_seed, return_type, rsize,
+                 ip = None, peerid = None):
         data = {}    # return data
         seeds = self.seedcount[infohash]
         data['complete'] = seeds
@@ -791,6 +830,19 @@ class Tracker:
             data['peers'] = []
             return data
 
+        # Peers harvested from other trackers are only in the caches below
+        if not self.config['tracker_multitracker_enabled']:
+            locality = self.localities.get(infohash)
+            if locality is None:
+                data['peers'] = []
+            else:
+                data['peers'] = locality.get_peers(self.locality_classifier(ip),
+                                    peerid, is_seed, rsize, return_type,
+                                    self.remote_fraction)
+            if return_type == 2:
+                data['peers'] = ''.join(data['peers'])
+            return data
+
         bc = self.becache.setdefault(infohash,[[{}, {}], [{}, {}], [{}, {}]])
         len_l = len(bc[0][0])
         len_s = len(bc[0][1])
@@ -951,7 +1003,8 @@ class Tracker:
 
             rsize = self.add_data(infohash, event, ip, paramslist)
             # data was updated, so dump becache to console
-            self.dump_becache_to_console()
+            if self.config.get('tracker_dump_becache', 1):
+                self.dump_becache_to_console()
 
         except ValueError, e:
             print_exc()
@@ -974,7 +1027,7 @@ class Tracker:
             
         data = self.peerlist(infohash, event=='stopped',
                              params('tracker'), not params('left'),
-                             return_type, rsize)
+                             return_type, rsize, ip, params('peer_id'))
 
         if paramslist.has_key('scrape'):
             data['scrape'] = self.scrapedata(infohash, False)
@@ -990,6 +1043,12 @@ class Tracker:
                                               'peer id': peerid}))
         bc[1][not not_seed][peerid] = Bencached(bencode({'ip': ip, 'port': port}))
         bc[2][not not_seed][peerid] = compact_peer_info(ip, port)
+        locality = self.localities.get(infohash)
+        if locality is None:
+            locality = self.localities[infohash] = LocalityIndex()
+        locality.add(peerid, self.locality_classifier(ip), not not_seed,
+                     (bc[0][not not_seed][peerid], bc[1][not not_seed][peerid],
+                      bc[2][not not_seed][peerid]))
 
 
     def natchecklog(self, peerid, ip, port, result):
@@ -1112,6 +1171,12 @@ class Tracker:
                 print '**warning** unable to read banned_IP list'
                 
 
+    def touch_peer(self, infohash, peerid):
+        key = (infohash, peerid)
+        if self.expiring.has_key(key):
+            del self.expiring[key]
+        self.announced[key] = 1
+
     def delete_peer(self, infohash, peerid):
         dls = self.downloads[infohash]
         peer = dls[peerid]
@@ -1122,22 +1187,35 @@ class Tracker:
             y = not peer['left']
             for x in l:
                 del x[y][peerid]
+            self.localities[infohash].remove(peerid)
         del self.times[infohash][peerid]
         del dls[peerid]
+        key = (infohash, peerid)
+        if self.announced.has_key(key):
+            del self.announced[key]
+        if self.expiring.has_key(key):
+            del self.expiring[key]
+        if not dls:
+            self.maybe_empty[infohash] = 1
 
     def expire_downloaders(self):
-        for x in self.times.keys():
-            for myid, t in self.times[x].items():
-                if t < self.prevtime:
-                    self.delete_peer(x,myid)
+        for infohash, peerid in self.expiring.keys():
+            self.delete_peer(infohash, peerid)
+        self.expiring = self.announced
+        self.announced = {}
         self.prevtime = clock()
         if (self.keep_dead != 1):
-            for key, value in self.downloads.items():
-                if len(value) == 0 and (
+            for key in self.maybe_empty.keys():
+                value = self.downloads.get(key)
+                if value is not None and len(value) == 0 and (
                         self.allowed is None or not self.allowed.has_key(key) ):
-                    del self.times[key]
+                    if self.times.has_key(key):
+                        del self.times[key]
                     del self.downloads[key]
                     del self.seedcount[key]
+                    if self.localities.has_key(key):
+                        del self.localities[key]
+        self.maybe_empty = {}
         self.rawserver.add_task(self.expire_downloaders, self.timeout_downloaders_interval)
 
 
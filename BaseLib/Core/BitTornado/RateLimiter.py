@@ -3,7 +3,10 @@
 
 from clock import clock
 from CurrentRateMeasure import Measure
+from subnetparse import IP_List
 from math import sqrt
+from collections import deque
+from threading import Lock
 import sys
 
 try:
@@ -33,16 +36,86 @@ UP_DELAY_NEXT = 2
 SLOTS_STARTING = 6
 SLOTS_FACTOR = 1.66/1000
 
+# Uploads are shared by deficit round robin: an active node may send QUANTUM
+# bytes per unit of weight before the next node of its parent gets a turn.
+# Nodes without uploads are not in the round, their share goes to the others.
+QUANTUM = 16384
+
+class ShareClass:
+    """
+    Leaf of the upload share tree: the uploads of one class of peers of a
+    download (e.g. 'local' or 'remote'). The connections that have data to
+    send form a ring linked by their next_upload attribute and are served
+    round robin.
+    """
+    def __init__(self, name, weight = 1):
+        self.name = name
+        self.weight = weight
+        self.last = None
+        self.deficit = 0
+
+    def is_active(self):
+        return self.last is not None
+
+    def add(self, conn):
+        """ Returns True if the class was not active before """
+        assert conn.next_upload is None
+        if self.last is None:
+            self.last = conn
+            conn.next_upload = conn
+            return True
+        conn.next_upload = self.last.next_upload
+        self.last.next_upload = conn
+# 2fastbt_
+        if not conn.connection.is_coordinator_con():
+            self.last = conn
+# _2fastbt
+        return False
+
+    def send(self, unitsize):
+        """ Lets the next connection send up to unitsize bytes, returns the
+        number of bytes it sent """
+        cur = self.last.next_upload
+        bytes = cur.send_partial(unitsize)
+        if bytes == 0 or cur.backlogged():
+            if self.last is cur:
+                self.last = None
+            else:
+                self.last.next_upload = cur.next_upload
+            cur.next_upload = None
+        else:
+# 2fastbt_
+            if not cur.connection.is_coordinator_con() or not cur.upload.buffer:
+# _2fastbt
+                self.last = cur
+        return bytes
+
+
 class RateLimiter:
-    def __init__(self, sched, unitsize, slotsfunc = lambda x: None):
+    """
+    Upload rate limit of a download. Its uploads are grouped in ShareClasses
+    that share the upload rate by weight. Without a parent the RateLimiter
+    schedules its own sending, with an UploadScheduler as parent the
+    parent decides when the download may send and the RateLimiter only
+    enforces its own limit.
+    """
+    def __init__(self, sched, unitsize, slotsfunc = lambda x: None,
+                 parent = None, weight = 1):
         self.sched = sched
-        self.last = None
         self.unitsize = unitsize
         self.slotsfunc = slotsfunc
         self.measure = Measure(MAX_RATE_PERIOD)
         self.autoadjust = False
         self.upload_rate = MAX_RATE * 1000
+        self.lasttime = clock()
+        self.bytes_sent = 0
         self.slots = SLOTS_STARTING    # garbage if not automatic
+        self.parent = parent
+        self.weight = weight
+        self.deficit = 0
+        self.classes = {}           # name: ShareClass
+        self.active = deque()       # ShareClasses with uploads, round robin
+        self.waiting = False        # out of the parent's round until the rate allows sending
 
     def set_upload_rate(self, rate):
         if DEBUG: 
@@ -65,56 +138,85 @@ class RateLimiter:
         self.lasttime = clock()
         self.bytes_sent = 0
 
+    def set_weight(self, weight):
+        self.weight = weight
+
+    def _get_class(self, conn):
+        if self.parent is None:
+            name = None
+        else:
+            name = self.parent.classify(conn)
+        c = self.classes.get(name)
+        if c is None:
+            if self.parent is None:
+                weight = 1
+            else:
+                weight = self.parent.get_class_weight(name)
+            c = self.classes[name] = ShareClass(name, weight)
+        return c
+
     def queue(self, conn):
         if DEBUG: print >>sys.stderr, "RateLimiter: queue", conn
-        assert conn.next_upload is None
-        if self.last is None:
-            self.last = conn
-            conn.next_upload = conn
+        c = self._get_class(conn)
+        if not c.add(conn):
+            return
+        c.deficit = c.weight * QUANTUM
+        self.active.append(c)
+        if len(self.active) > 1 or self.waiting:
+            return
+        if self.parent is None:
             self.try_send(True)
         else:
-            conn.next_upload = self.last.next_upload
-            self.last.next_upload = conn
-# 2fastbt_
-            if not conn.connection.is_coordinator_con():
-                self.last = conn
-# _2fastbt
+            self._update(True)
+            self.parent.activate(self)
 
-    def try_send(self, check_time = False):
-        if DEBUG: print >>sys.stderr, "RateLimiter: try_send"
+    def send_unit(self):
+        """ Lets the next class send one unit, returns the number of bytes
+        sent """
+        c = self.active[0]
+        bytes = c.send(self.unitsize)
+        self.measure.update_rate(bytes)
+        c.deficit -= bytes
+        if not c.is_active():
+            self.active.popleft()
+        elif c.deficit <= 0:
+            c.deficit += c.weight * QUANTUM
+            self.active.rotate(-1)
+        return bytes
+
+    def _update(self, check_time = False):
         t = clock()
         self.bytes_sent -= (t - self.lasttime) * self.upload_rate
         #print 'try_send: bytes_sent: %s' % self.bytes_sent
         self.lasttime = t
         if check_time:
             self.bytes_sent = max(self.bytes_sent, 0)
-        cur = self.last.next_upload
-        while self.bytes_sent <= 0:
-            bytes = cur.send_partial(self.unitsize)
-            self.bytes_sent += bytes
-            self.measure.update_rate(bytes)
-            if bytes == 0 or cur.backlogged():
-                if self.last is cur:
-                    self.last = None
-                    cur.next_upload = None
-                    break
-                else:
-                    self.last.next_upload = cur.next_upload
-                    cur.next_upload = None
-                    cur = self.last.next_upload
-            else:
-# 2fastbt_
-                if not cur.connection.is_coordinator_con() or not cur.upload.buffer:
-# _2fastbt
-                    self.last = cur
-                    cur = cur.next_upload
-# 2fastbt_
-                else:
-                    pass
-# _2fastbt
-        else:
+
+    def try_send(self, check_time = False):
+        if DEBUG: print >>sys.stderr, "RateLimiter: try_send"
+        self._update(check_time)
+        while self.bytes_sent <= 0 and self.active:
+            self.bytes_sent += self.send_unit()
+        if self.active:
             self.sched(self.try_send, self.bytes_sent / self.upload_rate)
 
+    def may_send(self):
+        """ Called by the parent: True if the upload rate allows sending now.
+        Otherwise the RateLimiter leaves the parent's round and comes back
+        when it may send again. """
+        self._update()
+        if self.bytes_sent <= 0:
+            return True
+        self.waiting = True
+        self.sched(self._rejoin, self.bytes_sent / self.upload_rate)
+        return False
+
+    def _rejoin(self):
+        self.waiting = False
+        if self.active:
+            self.parent.activate(self)
+
+
     def adjust_sent(self, bytes):
         if DEBUG: print >>sys.stderr, "RateLimiter: adjust_sent", bytes
         self.bytes_sent = min(self.bytes_sent+bytes, self.upload_rate*3)
@@ -164,5 +266,125 @@ class RateLimiter:
             self.autoadjustup = UP_DELAY_NEXT
 
 
+class UploadScheduler:
+    """
+    Root of the upload share tree: the upload rate of the session, shared
+    by the RateLimiters of the downloads according to their weights. Within
+    a download, uploads to peers in the local networks and to other peers
+    are shared according to the class weights. Unused capacity of a node is
+    used by the other nodes with the same parent. Every send is scheduled
+    in constant time.
+    """
+    __single = None
+    lock = Lock()
+
+    def __init__(self, sched, upload_rate = 0, local_prefixes = [],
+                 local_weight = 1, remote_weight = 1):
+        if UploadScheduler.__single:
+            raise RuntimeError, "UploadScheduler is Singleton"
+        UploadScheduler.__single = self
+
+        self.sched = sched
+        self.measure = Measure(MAX_RATE_PERIOD)
+        self.active = deque()       # RateLimiters with uploads, round robin
+        self.local_ips = IP_List()
+        for prefix in local_prefixes:
+            self.add_local_prefix(prefix)
+        self.class_weights = {'local': local_weight, 'remote': remote_weight}
+        self.set_upload_rate(upload_rate)
+
+    def getInstance(*args, **kw):
+        # Singleton pattern with double-checking
+        if UploadScheduler.__single is None:
+            UploadScheduler.lock.acquire()
+            try:
+                if UploadScheduler.__single is None:
+                    UploadScheduler(*args, **kw)
+            finally:
+                UploadScheduler.lock.release()
+        return UploadScheduler.__single
+    getInstance = staticmethod(getInstance)
+
+    def hasInstance():
+        return UploadScheduler.__single is not None
+    hasInstance = staticmethod(hasInstance)
+
+    def delInstance():
+        UploadScheduler.lock.acquire()
+        try:
+            UploadScheduler.__single = None
+        finally:
+            UploadScheduler.lock.release()
+    delInstance = staticmethod(delInstance)
+
+    def set_upload_rate(self, rate):
+        """ rate in KB/s, 0 is unlimited """
+        if not rate:
+            rate = MAX_RATE
+        self.upload_rate = rate * 1000
+        self.lasttime = clock()
+        self.bytes_sent = 0
+
+    def set_class_weight(self, name, weight):
+        """ Applies to the classes that are created from now on """
+        self.class_weights[name] = weight
 
+    def get_class_weight(self, name):
+        return self.class_weights.get(name, 1)
 
+    def add_local_prefix(self, prefix):
+        """ Adds a local network as 'a.b.c.d/bits' """
+        if prefix.find('/') < 0:
+            ip, depth = prefix, 256
+        else:
+            ip, depth = prefix.split('/')
+            depth = int(depth)
+        self.local_ips.append(ip, depth)
+
+    def classify(self, conn):
+        """ Returns the class of the uploads to a connection: 'local' if the
+        peer is in one of the local networks, otherwise 'remote' """
+        name = conn.upload_class
+        if name is None:
+            try:
+                if self.local_ips.includes(conn.get_ip()):
+                    name = 'local'
+                else:
+                    name = 'remote'
+            except ValueError:
+                name = 'remote'
+            conn.upload_class = name
+        return name
+
+    def activate(self, limiter):
+        """ Called by a RateLimiter that has uploads again """
+        limiter.deficit = limiter.weight * QUANTUM
+        self.active.append(limiter)
+        if len(self.active) == 1:
+            self.try_send(True)
+
+    def try_send(self, check_time = False):
+        if DEBUG: print >>sys.stderr, "UploadScheduler: try_send"
+        t = clock()
+        self.bytes_sent -= (t - self.lasttime) * self.upload_rate
+        self.lasttime = t
+        if check_time:
+            self.bytes_sent = max(self.bytes_sent, 0)
+        active = self.active
+        while self.bytes_sent <= 0 and active:
+            limiter = active[0]
+            if not limiter.may_send():
+                active.popleft()
+                continue
+            bytes = limiter.send_unit()
+            self.bytes_sent += bytes
+            limiter.bytes_sent += bytes
+            limiter.deficit -= bytes
+            self.measure.update_rate(bytes)
+            if not limiter.active:
+                active.popleft()
+            elif limiter.deficit <= 0:
+                limiter.deficit += limiter.weight * QUANTUM
+                active.rotate(-1)
+        if active:
+            self.sched(self.try_send, self.bytes_sent / self.upload_rate)
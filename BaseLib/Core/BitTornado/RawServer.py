@@ -1,7 +1,7 @@
 # Written by Bram Cohen and Pawel Garbacki
 # see LICENSE.txt for license information
 
-from bisect import insort
+from heapq import heappush, heappop, heapify
 from SocketHandler import SocketHandler
 import socket
 from cStringIO import StringIO
@@ -45,10 +45,35 @@ def autodetect_socket_style():
 
 READSIZE = 100000
 
+class TaskHandle:
+    """ Returned by RawServer.add_task(), allows to cancel a single scheduled
+    task. Cancelled tasks are skipped and dropped from the timer heap lazily. """
+    def __init__(self, func, delay, id, rawserver):
+        self.func = func
+        self.delay = delay
+        self.id = id
+        self.rawserver = rawserver
+        self.cancelled = False
+        self.scheduled = False      # in the timer heap of the RawServer
+        self.dropped = False        # counted in RawServer.cancelled_tasks
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.rawserver._task_cancelled(self)
+
+def task_name(func):
+    """ Name of the type of a scheduled task, used to account its run time """
+    im_class = getattr(func, 'im_class', None)
+    name = getattr(func, '__name__', None) or func.__class__.__name__
+    if im_class is not None:
+        return im_class.__name__ + '.' + name
+    return name
+
 class RawServer:
     def __init__(self, doneflag, timeout_check_interval, timeout, noisy = True,
                  ipv6_enable = True, failfunc = lambda x: None, errorfunc = None,
-                 sockethandler = None, excflag = Event()):
+                 sockethandler = None, excflag = Event(), poll_backend = None):
         self.timeout_check_interval = timeout_check_interval
         self.timeout = timeout
         self.servers = {}
@@ -59,15 +84,20 @@ class RawServer:
         self.failfunc = failfunc
         self.errorfunc = errorfunc
         self.exccount = 0
-        self.funcs = []
+        self.funcs = []             # heap of (time due, sequence number, TaskHandle)
+        self.task_seq = 0           # keeps tasks due at the same time in FIFO order
+        self.tasks_by_id = {}       # id -> {TaskHandle: True} for scheduled tasks with an id
+        self.cancelled_tasks = 0    # cancelled tasks still in the heap
+        self.task_stats = {}        # task name -> [calls, total time, max time]
         self.externally_added = []
         self.finished = Event()
         self.tasks_to_kill = []
+        self.tasks_cancelled = []   # TaskHandles cancelled since the last _kill_tasks
         self.excflag = excflag
         self.lock = RLock()        
 
         if sockethandler is None:
-            sockethandler = SocketHandler(timeout, ipv6_enable, READSIZE)
+            sockethandler = SocketHandler(timeout, ipv6_enable, READSIZE, poll_backend)
         self.sockethandler = sockethandler
 
         self.thread_ident = None
@@ -78,21 +108,41 @@ class RawServer:
     def get_exception_flag(self):
         return self.excflag
 
-    def _add_task(self, func, delay, id = None):
-        if delay < 0:
-            delay = 0
-        insort(self.funcs, (clock() + delay, func, id))
+    def _add_task(self, task):
+        if task.cancelled:
+            return
+        self.task_seq += 1
+        heappush(self.funcs, (clock() + task.delay, self.task_seq, task))
+        task.scheduled = True
+        if task.id is not None:
+            tasks = self.tasks_by_id.get(task.id)
+            if tasks is None:
+                tasks = self.tasks_by_id[task.id] = {}
+            tasks[task] = True
+
+    def _task_removed(self, task):
+        if task.id is not None:
+            tasks = self.tasks_by_id.get(task.id)
+            if tasks is not None:
+                tasks.pop(task, None)
+                if not tasks:
+                    del self.tasks_by_id[task.id]
 
     def add_task(self, func, delay = 0, id = None):
+        """ Schedule func to be called on the network thread after delay seconds.
+        Can be called from any thread. Returns a TaskHandle that allows to cancel
+        the task. """
         #if DEBUG:
         #    print >>sys.stderr,"rawserver: add_task(",func,delay,")"
         if delay < 0:
             delay = 0
+        task = TaskHandle(func, delay, id, self)
         self.lock.acquire()
-        self.externally_added.append((func, delay, id))
+        self.externally_added.append(task)
         if self.thread_ident != get_ident():
             self.interrupt_socket.interrupt()
         self.lock.release()
+        return task
 
     def scan_for_timeouts(self):
         self.add_task(self.scan_for_timeouts, self.timeout_check_interval)
@@ -121,10 +171,11 @@ class RawServer:
 
     def pop_external(self):
         self.lock.acquire()
-        while self.externally_added:
-            (a, b, c) = self.externally_added.pop(0)
-            self._add_task(a, b, c)
+        externally_added = self.externally_added
+        self.externally_added = []
         self.lock.release()
+        for task in externally_added:
+            self._add_task(task)
 
     def listen_forever(self, handler):
         if DEBUG:
@@ -157,19 +208,23 @@ class RawServer:
                     
                     
                     while self.funcs and self.funcs[0][0] <= clock():
-                        garbage1, func, id = self.funcs.pop(0)
-                        if id in self.tasks_to_kill:
-                            pass
+                        garbage1, garbage2, task = heappop(self.funcs)
+                        task.scheduled = False
+                        if task.dropped:
+                            self.cancelled_tasks -= 1
+                            continue
+                        self._task_removed(task)
+                        if task.cancelled:
+                            continue
+                        func = task.func
                         try:
 #                            print func.func_name
                             if DEBUG:
                                 if func.func_name != "_bgalloc":
                                     print >> sys.stderr,"RawServer:f",func.func_name
-                            #st = time.time()
+                            st = clock()
                             func()
-                            #et = time.time()
-                            #diff = et - st
-                            #print >>sys.stderr,func,"took %.5f" % (diff)
+                            self._account_task(func, clock() - st)
                             
                         except (SystemError, MemoryError), e:
                             self.failfunc(e)
@@ -228,18 +283,69 @@ class RawServer:
     def wait_until_finished(self):
         self.finished.wait()
 
+    def _task_cancelled(self, task):
+        """ Called by TaskHandle.cancel(), from any thread """
+        self.lock.acquire()
+        self.tasks_cancelled.append(task)
+        self.lock.release()
+
+    def _drop_task(self, task):
+        """ Forget a cancelled task that is still in the timer heap """
+        if task.scheduled and not task.dropped:
+            task.dropped = True
+            self._task_removed(task)
+            self.cancelled_tasks += 1
+
     def _kill_tasks(self):
+        if self.tasks_cancelled:
+            self.lock.acquire()
+            tasks_cancelled = self.tasks_cancelled
+            self.tasks_cancelled = []
+            self.lock.release()
+            for task in tasks_cancelled:
+                self._drop_task(task)
         if self.tasks_to_kill:
-            new_funcs = []
-            for (t, func, id) in self.funcs:
-                if id not in self.tasks_to_kill:
-                    new_funcs.append((t, func, id))
-            self.funcs = new_funcs
+            tasks_to_kill = self.tasks_to_kill
             self.tasks_to_kill = []
+            for id in tasks_to_kill:
+                for task in self.tasks_by_id.get(id, {}).keys():
+                    task.cancelled = True
+                    self._drop_task(task)
+        # drop cancelled tasks once they make up most of the heap
+        if self.cancelled_tasks and self.cancelled_tasks > len(self.funcs) / 2:
+            funcs = []
+            for entry in self.funcs:
+                task = entry[2]
+                if task.dropped:
+                    task.scheduled = False
+                else:
+                    funcs.append(entry)
+            self.funcs = funcs
+            heapify(self.funcs)
+            self.cancelled_tasks = 0
 
     def kill_tasks(self, id):
+        """ Cancel all scheduled tasks with the given id """
         self.tasks_to_kill.append(id)
 
+    def _account_task(self, func, duration):
+        name = task_name(func)
+        stats = self.task_stats.get(name)
+        if stats is None:
+            self.task_stats[name] = [1, duration, duration]
+        else:
+            stats[0] += 1
+            stats[1] += duration
+            if duration > stats[2]:
+                stats[2] = duration
+
+    def get_task_stats(self):
+        """ Returns a dict mapping task names to (calls, total time, max time) """
+        stats = {}
+        for name, (calls, total, longest) in self.task_stats.items():
+            stats[name] = (calls, total, longest)
+        return stats
+
     def exception(self,e,kbint=False):
         if not kbint:
             self.excflag.set()
@@ -67,7 +67,7 @@ class SingleRawServer:
         if id is default_task_id:
             id = self.info_hash
         if not self.finished:
-            self.rawserver.add_task(func, delay, id)
+            return self.rawserver.add_task(func, delay, id)
 
 #    def bind(self, port, bind = '', reuse = False):
 #        pass    # not handled here
@@ -6,14 +6,24 @@ import errno
 try:
     from select import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
     timemult = 1000
+    have_poll = True
 except ImportError:
     from selectpoll import poll, POLLIN, POLLOUT, POLLERR, POLLHUP
     timemult = 1
+    have_poll = False
+try:
+    import epollpoll
+except ImportError:
+    epollpoll = None
+import selectpoll
 from time import sleep
 from clock import clock
+from zerocopy import FileRegion, MSG_MORE
 import sys
 from random import shuffle, randrange
 from traceback import print_exc
+from collections import deque
+from itertools import islice
 
 try:
     True
@@ -25,11 +35,51 @@ DEBUG = False
 
 all = POLLIN | POLLOUT
 
+# Small queued messages are combined and sent with a single send() call, up to
+# SEND_COALESCE bytes or IOV_MAX messages. Messages of SEND_NOCOPY bytes or more
+# are sent from their own buffer, partial writes only advance an offset. They
+# can be buffer objects, e.g. views into the data of a piece; only strings are
+# combined.
+# Queued FileRegions are sent with sendfile(), never combined with messages.
+SEND_COALESCE = 2 ** 16
+SEND_NOCOPY = 2 ** 14
+IOV_MAX = 1024
+
 if sys.platform == 'win32':
     SOCKET_BLOCK_ERRORCODE=10035    # WSAEWOULDBLOCK
 else:
     SOCKET_BLOCK_ERRORCODE=errno.EWOULDBLOCK
 
+# Event backends in order of preference: epoll (Linux), poll, select
+POLL_BACKENDS = ['epoll', 'poll', 'select']
+
+def default_poll_backend():
+    """ The best event backend available on this platform """
+    if epollpoll is not None:
+        return 'epoll'
+    if have_poll:
+        return 'poll'
+    return 'select'
+
+def create_poll(backend):
+    """
+    Returns a (poll object, timeout multiplier) tuple for the given event
+    backend. All poll objects offer the interface of select.poll, the
+    multiplier converts a timeout in seconds into the unit expected by their
+    poll().
+    """
+    if backend == 'epoll':
+        if epollpoll is None:
+            raise ValueError('epoll is not available on this platform')
+        return epollpoll.poll(), 1000
+    if backend == 'poll':
+        if not have_poll:
+            raise ValueError('poll is not available on this platform')
+        return poll(), timemult
+    if backend == 'select':
+        return selectpoll.poll(), 1
+    raise ValueError('unknown event backend ' + str(backend))
+
 class InterruptSocketHandler:
     @staticmethod
     def data_came_in(interrupt_socket, data):
@@ -88,7 +138,9 @@ class SingleSocket:
         self.socket_handler = socket_handler
         self.socket = sock
         self.handler = handler
-        self.buffer = []
+        self.buffer = deque()   # strings waiting to be sent
+        self.offset = 0         # bytes of buffer[0] that have been sent already
+        self.queued_bytes = 0   # unsent bytes in buffer
         self.last_hit = clock()
         self.fileno = sock.fileno()
         self.connected = False
@@ -162,7 +214,9 @@ class SingleSocket:
         self.connected = False
         sock = self.socket
         self.socket = None
-        self.buffer = []
+        self.buffer = deque()
+        self.offset = 0
+        self.queued_bytes = 0
         del self.socket_handler.single_sockets[self.fileno]
         self.socket_handler.poll.unregister(sock)
         sock.close()
@@ -173,6 +227,10 @@ class SingleSocket:
     def is_flushed(self):
         return not self.buffer
 
+    def get_queued_bytes(self):
+        """ Number of bytes written to this socket that have not been sent yet """
+        return self.queued_bytes
+
     def write(self, s):
 #        self.check.write(s)
         # Arno: fishy concurrency problem, sometimes self.socket is None
@@ -180,26 +238,58 @@ class SingleSocket:
             return
         #assert self.socket is not None
         self.buffer.append(s)
+        self.queued_bytes += len(s)
         if len(self.buffer) == 1:
             self.try_write()
 
+    def write_file(self, regions, header = ''):
+        """ Queues FileRegions, they are sent with sendfile(). header is
+        sent before them. """
+        if self.socket is None:
+            return
+        buf = self.buffer
+        was_empty = not buf
+        if header:
+            buf.append(header)
+            self.queued_bytes += len(header)
+        for region in regions:
+            self.queued_bytes += len(region)
+            if buf and isinstance(buf[-1], FileRegion) and region.follows(buf[-1]):
+                # one sendfile() call for consecutive blocks
+                buf[-1].length += region.length
+            else:
+                buf.append(region)
+        if was_empty:
+            self.try_write()
+
     def try_write(self):
         
         if self.connected:
             dead = False
             try:
                 while self.buffer:
-                    buf = self.buffer[0]
-                    amount = self.socket.send(buf)
+                    buffer0 = self.buffer[0]
+                    if isinstance(buffer0, FileRegion):
+                        wanted = len(buffer0) - self.offset
+                        amount = buffer0.sendto(self.socket, self.offset)
+                    else:
+                        buf = self._next_send()
+                        wanted = len(buf)
+                        if self.queued_bytes > wanted and \
+                           isinstance(self.buffer[-1], FileRegion):
+                            # data from a file follows, e.g. the header of a
+                            # PIECE message: don't send a short segment
+                            amount = self.socket.send(buf, MSG_MORE)
+                        else:
+                            amount = self.socket.send(buf)
                     self.data_sent += amount # RePEX: Measurement TODO: Remove when measurement test has been done
                     if amount == 0:
                         self.skipped += 1
                         break
                     self.skipped = 0
-                    if amount != len(buf):
-                        self.buffer[0] = buf[amount:]
+                    self._sent(amount)
+                    if amount != wanted:
                         break
-                    del self.buffer[0]
             except socket.error, e:
                 #if DEBUG:
                 #    print_exc(file=sys.stderr)
@@ -221,16 +311,48 @@ class SingleSocket:
         else:
             self.socket_handler.poll.register(self.socket, POLLIN)
         
+    def _next_send(self):
+        """ Returns the data to pass to the next send() call """
+        buffer0 = self.buffer[0]
+        if len(buffer0) - self.offset >= SEND_NOCOPY or len(self.buffer) == 1:
+            if self.offset:
+                return buffer(buffer0, self.offset)
+            return buffer0
+        parts = [buffer0[self.offset:]]
+        size = len(parts[0])
+        for buf in islice(self.buffer, 1, IOV_MAX):
+            # only strings are joined, views and file regions are sent alone
+            if (size + len(buf) > SEND_COALESCE or len(buf) >= SEND_NOCOPY
+                or not isinstance(buf, str)):
+                break
+            parts.append(buf)
+            size += len(buf)
+        if len(parts) == 1:
+            return parts[0]
+        return ''.join(parts)
+
+    def _sent(self, amount):
+        """ Removes amount sent bytes from the front of the queue """
+        self.queued_bytes -= amount
+        amount += self.offset
+        buf = self.buffer
+        while buf and amount >= len(buf[0]):
+            amount -= len(buf.popleft())
+        self.offset = amount
+
     def set_handler(self, handler):    # can be: NewSocketHandler, Encoder, En_Connection
         self.handler = handler
 
 
 class SocketHandler:
-    def __init__(self, timeout, ipv6_enable, readsize = 100000):
+    def __init__(self, timeout, ipv6_enable, readsize = 100000, poll_backend = None):
         self.timeout = timeout
         self.ipv6_enable = ipv6_enable
         self.readsize = readsize
-        self.poll = poll()
+        if poll_backend is None:
+            poll_backend = default_poll_backend()
+        self.poll_backend = poll_backend
+        self.poll, self.timemult = create_poll(poll_backend)
         # {socket: SingleSocket}
         self.single_sockets = {}
         self.dead_from_write = []
@@ -297,6 +419,12 @@ class SocketHandler:
                 self.poll.register(server, POLLIN)
             except socket.error, e:
                 for server in self.servers.values():
+                    try:
+                        # unregister first, a cached epoll interest mask
+                        # would otherwise outlive the fd number
+                        self.poll.unregister(server)
+                    except:
+                        pass
                     try:
                         server.close()
                     except:
@@ -525,7 +653,11 @@ class SocketHandler:
                         print >> sys.stderr,"SocketHandler: Got event, connect socket got error",s.ip,s.port
                     self._close_socket(s)
                     continue
-                if (event & POLLIN):
+                if (event & POLLIN) and getattr(s.handler, 'recvbuf', None) is not None:
+                    # the handler parses the data in place, see recvbuffer.py
+                    if not self._recv_into(s):
+                        continue
+                elif (event & POLLIN):
                     try:
                         s.last_hit = clock()
                         data = s.socket.recv(100000)
@@ -555,6 +687,31 @@ class SocketHandler:
                     if s.is_flushed():
                         s.handler.connection_flushed(s)
 
+    def _recv_into(self, s):
+        """ Reads into the receive buffer of the handler and passes the number
+        of bytes read to handler.buffer_came_in(). Returns False if the socket
+        was closed. """
+        try:
+            s.last_hit = clock()
+            amount = s.handler.recvbuf.recv_from(s.socket, self.readsize)
+            if not amount:
+                if DEBUG:
+                    print >> sys.stderr,"SocketHandler: no-data closing connection",s.get_ip(),s.get_port()
+                self._close_socket(s)
+                return False
+            s.data_received += amount # RePEX: Measurement TODO: Remove when measurement test has been done
+            s.handler.buffer_came_in(s, amount)
+        except socket.error, e:
+            if DEBUG:
+                print >> sys.stderr,"SocketHandler: Socket error",str(e)
+            code, msg = e
+            if code != SOCKET_BLOCK_ERRORCODE:
+                if DEBUG:
+                    print >> sys.stderr,"SocketHandler: closing connection because not WOULDBLOCK",s.get_ip(),"error",code
+                self._close_socket(s)
+                return False
+        return True
+
     def close_dead(self):
         while self.dead_from_write:
             old = self.dead_from_write
@@ -572,7 +729,7 @@ class SocketHandler:
         s.handler.connection_lost(s)
 
     def do_poll(self, t):
-        r = self.poll.poll(t*timemult)
+        r = self.poll.poll(t*self.timemult)
         if r is None:
             connects = len(self.single_sockets)
             to_close = int(connects*0.05)+1 # close 5% of sockets
@@ -589,7 +746,8 @@ class SocketHandler:
 
     def get_stats(self):
         return { 'interfaces': self.interfaces, 
-                 'port': self.port }
+                 'port': self.port,
+                 'poll_backend': self.poll_backend }
 
 
     def shutdown(self):
@@ -599,10 +757,17 @@ class SocketHandler:
             except:
                 pass
         for server in self.servers.values():
+            try:
+                self.poll.unregister(server)
+            except:
+                pass
             try:
                 server.close()
             except:
                 pass
+        # the epoll backend holds a fd of its own
+        if hasattr(self.poll, 'close'):
+            self.poll.close()
 
     #
     # Interface for Khasmir, called from RawServer
@@ -8,32 +8,26 @@ except:
     False = 0
     bool = lambda x: not not x
 
-try:
-    sum([1])
-    negsum = lambda a: len(a) - sum(a)
-except:
-    negsum = lambda a: reduce(lambda x, y: x + (not y), a, 0)
-    
-def _int_to_booleans(x):
-    r = []
-    for i in range(8):
-        r.append(bool(x & 0x80))
-        x <<= 1
-    return tuple(r)
-
-lookup_table = []
-reverse_lookup_table = {}
-for i in xrange(256):
-    x = _int_to_booleans(i)
-    lookup_table.append(x)
-    reverse_lookup_table[x] = chr(i)
+from binascii import hexlify, unhexlify
+
+def popcount(bits):
+    """ Returns the number of set bits in a string or bytearray """
+    if not bits:
+        return 0
+    return bin(long(hexlify(bits), 16)).count('1')
 
 
 class Bitfield:
+    """
+    Bitfield of 'length' pieces, packed into a bytearray in the format of the
+    BITFIELD message: piece 0 is the highest bit of the first byte, the
+    padding bits of the last byte are zero. The number of missing pieces is
+    kept in 'numfalse'.
+    """
     def __init__(self, length = None, bitstring = None, copyfrom = None):
         if copyfrom is not None:
             self.length = copyfrom.length
-            self.array = copyfrom.array[:]
+            self.bits = copyfrom.bits[:]
             self.numfalse = copyfrom.numfalse
             return
         if length is None:
@@ -43,51 +37,112 @@ class Bitfield:
             extra = len(bitstring) * 8 - length
             if extra < 0 or extra >= 8:
                 raise ValueError
-            t = lookup_table
-            r = []
-            for c in bitstring:
-                r.extend(t[ord(c)])
-            if extra > 0:
-                if r[-extra:] != [0] * extra:
-                    raise ValueError
-                del r[-extra:]
-            self.array = r
-            self.numfalse = negsum(r)
+            bits = bytearray(bitstring)
+            if extra > 0 and bits[-1] & ((1 << extra) - 1):
+                raise ValueError
+            self.bits = bits
+            self.numfalse = length - popcount(bits)
         else:
-            self.array = [False] * length
+            self.bits = bytearray((length + 7) >> 3)
             self.numfalse = length
 
     def __setitem__(self, index, val):
-        val = bool(val)
-        self.numfalse += self.array[index]-val
-        self.array[index] = val
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError, "bitfield index out of range"
+        mask = 0x80 >> (index & 7)
+        byte = self.bits[index >> 3]
+        if val:
+            if not byte & mask:
+                self.bits[index >> 3] = byte | mask
+                self.numfalse -= 1
+        elif byte & mask:
+            self.bits[index >> 3] = byte & ~mask
+            self.numfalse += 1
 
     def __getitem__(self, index):
-        return self.array[index]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError, "bitfield index out of range"
+        return self.bits[index >> 3] & (0x80 >> (index & 7)) != 0
 
     def __len__(self):
         return self.length
 
+    def __iter__(self):
+        for index in xrange(self.length):
+            yield self.bits[index >> 3] & (0x80 >> (index & 7)) != 0
+
     def tostring(self):
-        booleans = self.array
-        t = reverse_lookup_table
-        s = len(booleans) % 8
-        r = [ t[tuple(booleans[x:x+8])] for x in xrange(0, len(booleans)-s, 8) ]
-        if s:
-            r += t[tuple(booleans[-s:] + ([0] * (8-s)))]
-        return ''.join(r)
+        """ Returns the payload of a BITFIELD message """
+        return str(self.bits)
 
     def complete(self):
         return not self.numfalse
 
+    def count(self):
+        """ Returns the number of pieces that are set """
+        return self.length - self.numfalse
+
     def copy(self):
-        return self.array[:self.length]
+        return self.toboollist()
 
     def toboollist(self):
-        bools = [False] * self.length
-        for piece in range(0,self.length):
-            bools[piece] = self.array[piece]
-        return bools
+        return list(self)
+
+    def tolong(self):
+        """ Returns the bits as long, piece 0 is the highest bit of a number
+        of 8 * len(self.tostring()) bits. """
+        if not self.bits:
+            return 0L
+        return long(hexlify(self.bits), 16)
+
+    def _fromlong(self, x):
+        """ Returns a new Bitfield of the same length holding the bits of x,
+        see tolong. """
+        b = Bitfield(self.length)
+        if x:
+            h = '%x' % x
+            b.bits = bytearray(unhexlify('0' * (2 * len(self.bits) - len(h)) + h))
+            b.numfalse = self.length - bin(x).count('1')
+        return b
+
+    def __and__(self, other):
+        assert self.length == other.length
+        return self._fromlong(self.tolong() & other.tolong())
+
+    def __or__(self, other):
+        assert self.length == other.length
+        return self._fromlong(self.tolong() | other.tolong())
+
+    def andnot(self, other):
+        """ Returns the pieces that are set in self but not in other """
+        assert self.length == other.length
+        return self._fromlong(self.tolong() & ~other.tolong())
+
+    def first_set(self, start = 0, end = None):
+        """ Returns the first piece in [start, end) that is set, or None """
+        if end is None or end > self.length:
+            end = self.length
+        if start >= end:
+            return None
+        bits = self.bits
+        # skip the empty bytes quickly
+        first = start >> 3
+        byte = bits[first] & (0xff >> (start & 7))
+        if not byte:
+            rest = bits[first + 1:(end + 7) >> 3]
+            stripped = rest.lstrip('\x00')
+            if not stripped:
+                return None
+            first += 1 + len(rest) - len(stripped)
+            byte = stripped[0]
+        piece = (first << 3) + 8 - byte.bit_length()
+        if piece >= end:
+            return None
+        return piece
 
 
 def test_bitfield():
@@ -8,13 +8,15 @@ from urlparse import urlparse
 from BT1.btformats import check_message
 from BT1.Choker import Choker
 from BT1.Storage import Storage
+from BT1.MMapStorage import MMapStorage
 from BT1.StorageWrapper import StorageWrapper
+from BT1.PieceCache import PieceCache
 from BT1.FileSelector import FileSelector
 from BT1.Uploader import Upload
 from BT1.Downloader import Downloader
 from BT1.HTTPDownloader import HTTPDownloader
 from BT1.Connecter import Connecter
-from RateLimiter import RateLimiter
+from RateLimiter import RateLimiter, UploadScheduler
 from BT1.Encrypter import Encoder
 from RawServer import RawServer, autodetect_socket_style
 from BT1.Rerequester import Rerequester
@@ -22,6 +24,7 @@ from BT1.DownloaderFeedback import DownloaderFeedback
 from RateMeasure import RateMeasure
 from CurrentRateMeasure import Measure
 from BT1.PiecePicker import PiecePicker
+from BT1.PiecePickerBitset import PiecePickerBitset
 from BT1.Statistics import Statistics
 from bencode import bencode, bdecode
 from BaseLib.Core.Utilities.Crypto import sha
@@ -155,6 +158,9 @@ class BT1Download:
                 # Ric: Start SVC VoD service TODO
                 self.picker = PiecePickerSVC(self.len_pieces, config['rarest_first_cutoff'], 
                              config['rarest_first_priority_cutoff'], helper = self.helper, piecesize=self.piecesize)
+            elif config.get('bitset_piece_picker', 0):
+                self.picker = PiecePickerBitset(self.len_pieces, config['rarest_first_cutoff'], 
+                             config['rarest_first_priority_cutoff'], helper = self.helper)
             else:
                 self.picker = PiecePicker(self.len_pieces, config['rarest_first_cutoff'], 
                              config['rarest_first_priority_cutoff'], helper = self.helper)
@@ -286,6 +292,15 @@ class BT1Download:
         if not self.doneflag.isSet():
             self.logerrorfunc('piece %d failed hash check, re-downloading it' % index)
 
+    def _piece_verified(self, index, pieceok):
+        """ A received piece was hash checked in the background """
+        if pieceok:
+            self.picker.complete(index)
+            self.downloader.check_complete(index)
+            self.connecter.got_piece(index)
+        else:
+            self.downloader.piece_flunked(index)
+
     def _piece_from_live_source(self,index,data):
         if self.videostatus.live_streaming and self.voddownload is not None:
             return self.voddownload.piece_from_live_source(index,data)
@@ -325,7 +340,11 @@ class BT1Download:
             except:
                 pass
 
-        self.storage = Storage(self.files, self.info['piece length'], 
+        if self.config.get('mmap_storage', 0):
+            storage_class = MMapStorage
+        else:
+            storage_class = Storage
+        self.storage = storage_class(self.files, self.info['piece length'], 
                                self.doneflag, self.config, disabled_files)
 
         # Merkle: Are we dealing with a Merkle torrent y/n?
@@ -338,7 +357,7 @@ class BT1Download:
             self._finished, self._failed,
             statusfunc, self.doneflag, self.config['check_hashes'],
             self._data_flunked, self._piece_from_live_source, self.rawserver.add_task,
-            self.config, self.unpauseflag)
+            self.config, self.unpauseflag, self.infohash)
             
         if self.selector_enabled:
             self.fileselector = FileSelector(self.files, self.info['piece length'], 
@@ -411,9 +430,14 @@ class BT1Download:
         if ratelimiter:
             self.ratelimiter = ratelimiter
         else:
+            if UploadScheduler.hasInstance():
+                parent = UploadScheduler.getInstance()
+            else:
+                parent = None
             self.ratelimiter = RateLimiter(self.rawserver.add_task, 
                                            self.config['upload_unit_size'], 
-                                           self.setConns)
+                                           self.setConns, parent,
+                                           self.config.get('upload_weight', 1))
             self.ratelimiter.set_upload_rate(self.config['max_upload_rate'])
         
         self.ratemeasure = RateMeasure()
@@ -434,6 +458,7 @@ class BT1Download:
                             self.ratelimiter, self.info.has_key('root hash'),
                             self.rawserver.add_task, self.coordinator, self.helper, self.get_extip_func, self.port, self.use_g2g,self.infohash,self.response.get('announce',None))
 # _2fastbt
+        self.storagewrapper.set_verified_func(self._piece_verified)
         self.encoder = Encoder(self.connecter, self.rawserver, 
             self.myid, self.config['max_message_length'], self.rawserver.add_task, 
             self.config['keepalive_interval'], self.infohash, 
@@ -619,6 +644,8 @@ class BT1Download:
             self.storagewrapper.sync()
             self.storage.close()
             self.rerequest_stopped()
+        if PieceCache.hasInstance():
+            PieceCache.getInstance().drop(self.infohash)
         resumedata = None
         if self.fileselector and self.started:
             if not self.failed:
@@ -0,0 +1,95 @@
+# see LICENSE.txt for license information
+#
+# poll class backed by select.epoll, used on Linux. It offers the interface of
+# select.poll so that SocketHandler can use it as a drop-in replacement.
+
+import sys
+import errno
+from types import IntType
+from select import epoll as _epoll, EPOLLIN, EPOLLOUT, EPOLLERR, EPOLLHUP
+
+# epoll reports events with the same bit values as poll
+POLLIN = EPOLLIN
+POLLOUT = EPOLLOUT
+POLLERR = EPOLLERR
+POLLHUP = EPOLLHUP
+
+DEBUG = False
+
+# epoll refuses timeouts that do not fit into a C int of milliseconds
+MAX_TIMEOUT = 2 ** 31 - 1
+
+class poll:
+    """
+    Level-triggered epoll with the register/unregister/poll interface of
+    select.poll. The interest mask of every registered fd is remembered, so
+    registering a fd again with an unchanged mask (e.g. after every write of a
+    SingleSocket) does not cost a system call, only real changes are passed to
+    the kernel with epoll_ctl(MOD). Events of all ready fds are returned in a
+    single batch of at most maxevents entries.
+    """
+    def __init__(self, maxevents = -1):
+        self.epoll = _epoll()
+        self.maxevents = maxevents
+        self.masks = {}         # fd -> currently registered interest mask
+        self.modify_calls = 0   # number of epoll_ctl calls, for statistics
+
+    def register(self, f, t):
+        if type(f) != IntType:
+            f = f.fileno()
+        old = self.masks.get(f)
+        if old == t:
+            return
+        self.modify_calls += 1
+        if old is None:
+            try:
+                self.epoll.register(f, t)
+            except IOError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+                self.epoll.modify(f, t)
+        else:
+            try:
+                self.epoll.modify(f, t)
+            except IOError, e:
+                # The fd was closed without being unregistered and its number
+                # has been reused since, the kernel forgot about the old one
+                if e.errno != errno.ENOENT:
+                    raise
+                self.epoll.register(f, t)
+        self.masks[f] = t
+
+    def unregister(self, f):
+        if type(f) != IntType:
+            f = f.fileno()
+        if self.masks.pop(f, None) is None:
+            return
+        self.modify_calls += 1
+        try:
+            self.epoll.unregister(f)
+        except (IOError, ValueError), e:
+            # already removed by the kernel because the fd was closed
+            if DEBUG:
+                print >>sys.stderr,"epollpoll: unregister",f,"failed",str(e)
+
+    def poll(self, timeout = None):
+        """ timeout is given in milliseconds, like for select.poll """
+        if timeout is None or timeout < 0 or timeout > MAX_TIMEOUT:
+            timeout = -1
+        else:
+            timeout = timeout / 1000.0
+        try:
+            return self.epoll.poll(timeout, self.maxevents)
+        except IOError, e:
+            if e.errno == errno.EINTR:
+                return []
+            raise
+
+    def get_mask(self, f):
+        if type(f) != IntType:
+            f = f.fileno()
+        return self.masks.get(f)
+
+    def close(self):
+        self.masks = {}
+        self.epoll.close()
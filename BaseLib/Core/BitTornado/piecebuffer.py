@@ -84,3 +84,18 @@ class BufferPool:
 
 _pool = BufferPool()
 PieceBuffer = _pool.new
+
+def tostring(data):
+    """ Returns the bytes of data read from storage: an array, a buffer
+    object or a string """
+    if type(data) is array:
+        return data.tostring()
+    return str(data)
+
+def tobuffer(data):
+    """ Returns a buffer object with the bytes of data read from storage,
+    without copying them if possible """
+    if type(data) in (array, str, buffer):
+        return buffer(data)
+    # MMapBuffer and CachedPiece slices are buffer objects
+    return data[:]
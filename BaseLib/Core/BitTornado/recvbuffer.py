@@ -0,0 +1,102 @@
+# see LICENSE.txt for license information
+#
+# Receive buffer of a single connection. Data is read from the socket with
+# recv_into() straight into a preallocated bytearray and handed out as
+# memoryview slices, so parsing length-prefixed messages does not allocate
+# or copy strings.
+
+DEBUG = False
+
+INITIAL_SIZE = 2 ** 15
+# read at least this many bytes per recv_into(), compact the buffer otherwise
+MIN_READ = 2 ** 12
+
+class RecvBuffer:
+    """
+    Reusable bytearray holding the unread data between start and end. Consumed
+    data is not moved; when the free space at the tail runs low the unread rest
+    is moved back to the front, so the buffer is used like a ring, but every
+    message handed out stays contiguous.
+
+    The memoryviews returned by read() point into the buffer and are only
+    valid until the next call of recv_from() or write(): whoever wants to keep
+    the data must copy it (e.g. with tobytes()).
+    """
+    def __init__(self, size = INITIAL_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def capacity(self):
+        return len(self.buf)
+
+    def recv_from(self, sock, maxlen):
+        """ Reads up to maxlen bytes from the socket into the buffer and returns
+        the number of bytes read, 0 means the connection was closed. """
+        if len(self.buf) - self.end < MIN_READ:
+            self._compact()
+            if len(self.buf) - self.end < MIN_READ:
+                self._grow(self.end + MIN_READ)
+        free = len(self.buf) - self.end
+        amount = sock.recv_into(self.view[self.end:], min(maxlen, free))
+        self.end += amount
+        return amount
+
+    def write(self, s):
+        """ Appends data that was received by other means """
+        self.reserve(len(self) + len(s))
+        end = self.end + len(s)
+        self.buf[self.end:end] = s
+        self.end = end
+
+    def read(self, n):
+        """ Returns the next n bytes as memoryview and consumes them, or None if
+        less than n bytes are buffered. """
+        start = self.start
+        end = start + n
+        if end > self.end:
+            return None
+        m = self.view[start:end]
+        if end == self.end:
+            # everything consumed, start again at the front
+            self.start = self.end = 0
+        else:
+            self.start = end
+        return m
+
+    def reserve(self, n):
+        """ Makes sure that n bytes of unread data fit into the buffer
+        without wrapping around. """
+        if self.start + n <= len(self.buf):
+            return
+        if n > len(self.buf):
+            self._grow(n)
+        else:
+            self._compact()
+
+    def _compact(self):
+        length = self.end - self.start
+        if length and self.start:
+            # slicing the bytearray copies, source and target may overlap
+            self.buf[:length] = self.buf[self.start:self.end]
+        self.start = 0
+        self.end = length
+
+    def _grow(self, n):
+        size = len(self.buf)
+        while size < n:
+            size *= 2
+        if DEBUG:
+            print "recvbuffer: growing from", len(self.buf), "to", size
+        buf = bytearray(size)
+        length = self.end - self.start
+        buf[:length] = self.view[self.start:self.end]
+        # memoryviews handed out before still point into the old buffer
+        self.buf = buf
+        self.view = memoryview(buf)
+        self.start = 0
+        self.end = length
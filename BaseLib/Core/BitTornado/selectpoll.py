@@ -8,10 +8,15 @@ from time import sleep
 from types import IntType
 from bisect import bisect
 from sets import Set
-POLLIN = 1
-POLLOUT = 2
-POLLERR = 8
-POLLHUP = 16
+# use the values of select.poll where it exists, so that this class can also
+# be used as a fallback on platforms that have poll
+try:
+    from select import POLLIN, POLLOUT, POLLERR, POLLHUP
+except ImportError:
+    POLLIN = 1
+    POLLOUT = 2
+    POLLERR = 8
+    POLLHUP = 16
 
 DEBUG = False
 
@@ -0,0 +1,83 @@
+# see LICENSE.txt for license information
+#
+# Sends file data to a socket with the sendfile() system call, so the data
+# is copied from the page cache to the socket inside the kernel instead of
+# being read into a Python string first. Python 2 has no os.sendfile, on
+# Linux the C library function is called through ctypes. have_sendfile is
+# False on other platforms, callers then use the normal send path.
+
+import os
+import sys
+import socket
+
+try:
+    True
+except:
+    True = 1
+    False = 0
+
+have_sendfile = False
+# send() flag: more data follows right away (Linux)
+MSG_MORE = getattr(socket, 'MSG_MORE', 0x8000)
+if sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno = True)
+        _sendfile64 = _libc.sendfile64
+        _sendfile64.argtypes = [ctypes.c_int, ctypes.c_int,
+                                ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+        _sendfile64.restype = ctypes.c_ssize_t
+        have_sendfile = True
+    except (ImportError, OSError, AttributeError):
+        pass
+
+
+def sendfile(out_fd, in_fd, offset, count):
+    """ Sends count bytes from offset in file in_fd to socket out_fd. Returns
+    the number of bytes sent, raises socket.error like socket.send() """
+    off = ctypes.c_int64(offset)
+    sent = _sendfile64(out_fd, in_fd, ctypes.byref(off), count)
+    if sent < 0:
+        err = ctypes.get_errno()
+        raise socket.error(err, os.strerror(err))
+    return sent
+
+
+class FileRegion:
+    """
+    A range of bytes in a file that is queued on a SingleSocket. 'file' is a
+    file object with its own descriptor, so the region stays valid when
+    Storage closes its handle. Regions of the same file share the object,
+    the descriptor is closed when the last region is gone.
+    """
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = int(length)
+
+    def __len__(self):
+        return self.length
+
+    def follows(self, region):
+        """ True if this region starts where 'region' ends in the same file """
+        return self.file is region.file and \
+               self.offset == region.offset + region.length
+
+    def sendto(self, sock, start = 0):
+        """ Sends the region from 'start' on, returns the number of bytes sent """
+        return sendfile(sock.fileno(), self.file.fileno(),
+                        self.offset + start, self.length - start)
+
+    def split(self, amount):
+        """ Returns a region for the first amount bytes and removes them from
+        this one """
+        head = FileRegion(self.file, self.offset, amount)
+        self.offset += amount
+        self.length -= amount
+        return head
+
+    def tostring(self):
+        self.file.seek(self.offset)
+        return self.file.read(self.length)
@@ -597,6 +597,20 @@ class DownloadConfigInterface:
         @return A number of peers. """
         return self.dlconfig['rarest_first_priority_cutoff']
 
+    def set_bitset_piece_picker(self,value):
+        """ Whether to select pieces with the bitset based rarest-first engine,
+        which is faster for torrents with many pieces when the peers own few
+        of them. Not used for
+        video-on-demand downloads.
+        @param value Boolean.
+        """
+        self.dlconfig['bitset_piece_picker'] = value
+
+    def get_bitset_piece_picker(self):
+        """ Returns whether the bitset based piece picker is used.
+        @return Boolean. """
+        return self.dlconfig['bitset_piece_picker']
+
     def set_min_uploads(self,value):
         """ The number of uploads to fill out to with extra optimistic unchokes.
         @param value A number of uploads.
@@ -620,6 +634,45 @@ class DownloadConfigInterface:
         @return A number of files. """
         return self.dlconfig['max_files_open']
 
+    def set_mmap_storage(self,value):
+        """ Whether to read the files through memory maps, which avoids
+        copying the data that is uploaded. The number of mapped windows of 
+        64 MB is limited by max_files_open.
+        @param value Boolean.
+        """
+        self.dlconfig['mmap_storage'] = value
+
+    def get_mmap_storage(self):
+        """ Returns whether the files are read through memory maps.
+        @return Boolean. """
+        return self.dlconfig['mmap_storage']
+
+    def set_sendfile(self,value):
+        """ Whether to send uploaded pieces straight from the files to the
+        socket with sendfile(), which avoids copying the data into the
+        process. Only used on Linux and for plain connections; HASHPIECE
+        messages of Merkle torrents and G2G connections use the normal path.
+        @param value Boolean.
+        """
+        self.dlconfig['sendfile'] = value
+
+    def get_sendfile(self):
+        """ Returns whether uploaded pieces are sent with sendfile().
+        @return Boolean. """
+        return self.dlconfig['sendfile']
+
+    def set_upload_weight(self,value):
+        """ Share of this download in the upload rate of the session, see
+        SessionConfig.set_total_max_upload_rate(). A download with weight 2
+        may upload twice as much as one with weight 1 (default = 1).
+        @param value An integer. """
+        self.dlconfig['upload_weight'] = value
+
+    def get_upload_weight(self):
+        """ Returns the share of this download in the session upload rate.
+        @return An integer. """
+        return self.dlconfig['upload_weight']
+
     def set_round_robin_period(self,value):
         """ The number of seconds between the client's switching upload targets.
         @param value A number of seconds.
@@ -302,6 +302,25 @@ class DownloadState(Serializable):
         else:
             return self.stats['vod_stats']
 
+    def get_piece_cache_stats(self):
+        """ Returns a dictionary of statistics of the session's piece cache
+        (see SessionConfig.set_piece_cache_size). The keys contained are:
+        <pre>
+        'hits' = number of pieces of this download read from the cache
+        'misses' = number of pieces of this download read from disk
+        'hitrate' = hits / (hits + misses)
+        'readahead' = number of pieces loaded ahead of video playback
+        'size' = bytes of this download in the cache
+        'total_size' = bytes in the cache
+        'max_size' = memory budget of the cache in bytes
+        </pre>, or no keys if there is no piece cache.
+        @return Dict.
+        """
+        if self.stats is None:
+            return {}
+        else:
+            return self.stats.get('piece_cache', {})
+
 
 
     def get_log_messages(self):
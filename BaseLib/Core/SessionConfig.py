@@ -183,6 +183,92 @@ class SessionConfigInterface:
         @return A number of seconds. """
         return self.sessconfig['timeout_check_interval']
 
+    def set_hashcheck_threads(self,value):
+        """ Number of threads that hash check the data on disk when downloads
+        are started. The threads are shared by all downloads, so this also
+        caps the number of pieces that are verified at the same time. The
+        threads also verify received pieces whose blocks did not arrive in
+        order. With 0 all checks run on the network thread (default = 0).
+        @param value An integer. """
+        self.sessconfig['hashcheck_threads'] = value
+
+    def get_hashcheck_threads(self):
+        """ Returns the number of hash check threads.
+        @return An integer. """
+        return self.sessconfig['hashcheck_threads']
+
+    def set_piece_cache_size(self,value):
+        """ Memory budget in MB of the cache of pieces read from disk. The
+        cache is shared by all downloads, the least recently used pieces are
+        dropped first. It saves disk reads when many peers request the same
+        pieces. With 0 there is no cache (default = 0).
+        @param value An integer. """
+        self.sessconfig['piece_cache_size'] = value
+
+    def get_piece_cache_size(self):
+        """ Returns the memory budget of the piece cache in MB.
+        @return An integer. """
+        return self.sessconfig['piece_cache_size']
+
+    def set_piece_cache_readahead(self,value):
+        """ Number of pieces after the current one that are loaded into the
+        piece cache when a video is played (default = 4).
+        @param value An integer. """
+        self.sessconfig['piece_cache_readahead'] = value
+
+    def get_piece_cache_readahead(self):
+        """ Returns the number of pieces read ahead for video playback.
+        @return An integer. """
+        return self.sessconfig['piece_cache_readahead']
+
+    def set_total_max_upload_rate(self,value):
+        """ Upload rate in KB/s that all downloads together may use. The
+        rate is shared by the downloads according to their upload weights
+        (DownloadConfig.set_upload_weight), a download that does not use its
+        share leaves it to the others. The max_upload_rate of a download
+        still limits that download. 0 means unlimited (default = 0).
+        @param value An integer. """
+        self.sessconfig['total_max_upload_rate'] = value
+
+    def get_total_max_upload_rate(self):
+        """ Returns the upload rate limit of the session in KB/s.
+        @return An integer. """
+        return self.sessconfig['total_max_upload_rate']
+
+    def set_upload_local_prefixes(self,value):
+        """ Networks whose peers are local, e.g. the networks of the ISP, as
+        a list of 'a.b.c.d/bits' strings. The uploads of a download to local
+        and to other peers share its upload rate according to the local and
+        remote upload weights (default = []).
+        @param value A list of strings. """
+        self.sessconfig['upload_local_prefixes'] = value
+
+    def get_upload_local_prefixes(self):
+        """ Returns the networks whose peers are local.
+        @return A list of strings. """
+        return self.sessconfig['upload_local_prefixes']
+
+    def set_upload_local_weight(self,value):
+        """ Weight of the uploads to local peers (default = 1).
+        @param value An integer. """
+        self.sessconfig['upload_local_weight'] = value
+
+    def get_upload_local_weight(self):
+        """ Returns the weight of the uploads to local peers.
+        @return An integer. """
+        return self.sessconfig['upload_local_weight']
+
+    def set_upload_remote_weight(self,value):
+        """ Weight of the uploads to peers outside the local networks
+        (default = 1).
+        @param value An integer. """
+        self.sessconfig['upload_remote_weight'] = value
+
+    def get_upload_remote_weight(self):
+        """ Returns the weight of the uploads to remote peers.
+        @return An integer. """
+        return self.sessconfig['upload_remote_weight']
+
     #
     # Enable/disable Tribler features 
     #
@@ -1018,6 +1104,72 @@ class SessionConfigInterface:
         @return A number of seconds. """
         return self.sessconfig['tracker_multitracker_http_timeout']
 
+    def set_tracker_locality(self,value):
+        """ Whether the internal tracker returns the peers in the network
+        of the announcing peer first (default = False). The peers are grouped
+        in locality classes, see set_tracker_locality_prefix_len() and
+        set_tracker_locality_classes(). Not used when the multitracker is
+        enabled.
+        @param value Boolean.
+        """
+        self.sessconfig['tracker_locality'] = value
+
+    def get_tracker_locality(self):
+        """ Returns whether the internal tracker prefers local peers.
+        @return Boolean. """
+        return self.sessconfig['tracker_locality']
+
+    def set_tracker_locality_prefix_len(self,value):
+        """ Peers whose IP addresses have the same prefix of this many bits
+        are in the same locality class (default = 16).
+        @param value A number of bits.
+        """
+        self.sessconfig['tracker_locality_prefix_len'] = value
+
+    def get_tracker_locality_prefix_len(self):
+        """ Returns the prefix length of the locality classes.
+        @return A number of bits. """
+        return self.sessconfig['tracker_locality_prefix_len']
+
+    def set_tracker_locality_classes(self,value):
+        """ File that assigns networks to locality classes, e.g. to AS
+        numbers or ranking classes of the SIS. Each line is 'a.b.c.d/len
+        class', the longest matching network counts. Peers outside these
+        networks are classified by their address prefix (default = none).
+        @param value An absolute path name.
+        """
+        self.sessconfig['tracker_locality_classes'] = value
+
+    def get_tracker_locality_classes(self):
+        """ Returns the file with the locality classes.
+        @return An absolute path name. """
+        return self.sessconfig['tracker_locality_classes']
+
+    def set_tracker_locality_remote_fraction(self,value):
+        """ Fraction of a peer list that is filled with random peers of
+        other locality classes (default = 0.2).
+        @param value A float between 0 and 1.
+        """
+        self.sessconfig['tracker_locality_remote_fraction'] = value
+
+    def get_tracker_locality_remote_fraction(self):
+        """ Returns the fraction of remote peers in a peer list.
+        @return A float. """
+        return self.sessconfig['tracker_locality_remote_fraction']
+
+    def set_tracker_dump_becache(self,value):
+        """ Whether the internal tracker prints all peers of all torrents
+        to stderr after every announce (default = True). This takes time in
+        proportion to the number of peers, turn it off on busy trackers.
+        @param value Boolean.
+        """
+        self.sessconfig['tracker_dump_becache'] = value
+
+    def get_tracker_dump_becache(self):
+        """ Returns whether the internal tracker dumps its peers.
+        @return Boolean. """
+        return self.sessconfig['tracker_dump_becache']
+
 
     #
     # For Tribler superpeer servers
@@ -920,6 +920,7 @@ class SVCTransporter(MovieOnDemandTransporter):
         data = self.storagewrapper.do_get_piece(piece, 0, length)
         if data is None:
             return None
+        self.storagewrapper.read_ahead(piece)
         return data.tostring()
 
     def reset_bitrate_prediction(self):
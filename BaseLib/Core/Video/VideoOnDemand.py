@@ -1123,6 +1123,7 @@ class MovieOnDemandTransporter(MovieTransport):
         data = self.storagewrapper.do_get_piece(piece, begin, length)
         if data is None:
             return None
+        self.storagewrapper.read_ahead(piece)
         return data.tostring()
 
     def reset_bitrate_prediction(self):
@@ -44,6 +44,13 @@ sessdefaults['timeout'] = 300.0
 sessdefaults['timeout_check_interval'] = 60.0
 sessdefaults['eckeypairfilename'] = None
 sessdefaults['megacache'] = True
+sessdefaults['hashcheck_threads'] = 0 # 0 = check the data on disk on the network thread
+sessdefaults['piece_cache_size'] = 0 # MB, 0 = no piece cache
+sessdefaults['piece_cache_readahead'] = 4 # pieces loaded ahead of VOD playback
+sessdefaults['total_max_upload_rate'] = 0 # KB/s shared by all downloads, 0 = unlimited
+sessdefaults['upload_local_prefixes'] = [] # networks whose peers get the 'local' upload share
+sessdefaults['upload_local_weight'] = 1
+sessdefaults['upload_remote_weight'] = 1
 sessdefaults['overlay'] = True
 sessdefaults['crawler'] = True
 sessdefaults['buddycast'] = True
@@ -132,6 +139,11 @@ trackerdefaults['tracker_logfile'] = None
 trackerdefaults['tracker_allow_get'] = 1
 trackerdefaults['tracker_keep_dead'] = 0
 trackerdefaults['tracker_scrape_allowed'] = ITRACKSCRAPE_ALLOW_FULL
+trackerdefaults['tracker_locality'] = 0 # return peers of the same network first
+trackerdefaults['tracker_locality_prefix_len'] = 16
+trackerdefaults['tracker_locality_classes'] = '' # file with 'network/len class' lines
+trackerdefaults['tracker_locality_remote_fraction'] = 0.2
+trackerdefaults['tracker_dump_becache'] = 1 # print all peers to stderr after every announce
 
 # smoothit_
 # added those fields to the hash (see detailed comment in BaseLib/Core/
@@ -187,8 +199,12 @@ dldefaults['breakup_seed_bitfield'] = 1
 dldefaults['snub_time'] = 30.0
 dldefaults['rarest_first_cutoff'] = 2
 dldefaults['rarest_first_priority_cutoff'] = 5
+dldefaults['bitset_piece_picker'] = 0 # use the bitset based rarest-first engine (PiecePickerBitset)
 dldefaults['min_uploads'] = 4
 dldefaults['max_files_open'] = 50
+dldefaults['mmap_storage'] = 0 # read the files through memory maps (MMapStorage)
+dldefaults['sendfile'] = 0 # send uploaded data from the files with sendfile()
+dldefaults['upload_weight'] = 1 # share of the session upload rate, see total_max_upload_rate
 dldefaults['round_robin_period'] = 30
 dldefaults['super_seeder'] = 0
 dldefaults['security'] = 1
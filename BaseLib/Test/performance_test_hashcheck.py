@@ -0,0 +1,83 @@
+# see LICENSE.txt for license information
+#
+# Measures the speed of the initial hash check of StorageWrapper, serially on
+# the calling thread and with the HashCheckPool. The data file is written
+# just before the check, so it is likely served from the page cache: the
+# numbers show the CPU bound part of the check.
+
+import os
+import sys
+import tempfile
+import optparse
+from threading import Event
+from time import time
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.StorageWrapper import StorageWrapper
+from BaseLib.Core.BitTornado.BT1.HashChecker import HashCheckPool
+
+def create_file(filename, size, piece_size):
+    hashes = []
+    f = open(filename, 'wb')
+    written = 0
+    while written < size:
+        piece = os.urandom(min(piece_size, size - written))
+        hashes.append(sha(piece).digest())
+        f.write(piece)
+        written += len(piece)
+    f.close()
+    return hashes
+
+def check(filename, size, piece_size, hashes):
+    config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+    doneflag = Event()
+    storage = Storage([(filename, size)], piece_size, doneflag, config)
+    failures = []
+    def failed(s):
+        failures.append(s)
+    def backfunc(func, delay = 0, id = None):
+        pass
+    sw = StorageWrapper({'live': False}, storage, 2 ** 14, hashes, piece_size,
+                        None, lambda: None, failed, backfunc = backfunc,
+                        config = config)
+    # pretend the whole file is there, so it is hash checked
+    sw._waspre = lambda piece: True
+    start = time()
+    sw.old_style_init()
+    elapsed = time() - start
+    storage.close()
+    if failures:
+        print >>sys.stderr, "Hash check failed:", failures
+    if sw.amount_left:
+        print >>sys.stderr, "Hash check did not find all pieces"
+    return elapsed
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--size", type="int", dest="size", default=256,
+                      help="size of the data in MB")
+    parser.add_option("-p", "--piece-size", type="int", dest="piece_size", default=256,
+                      help="piece size in KB")
+    parser.add_option("-t", "--threads", type="int", dest="threads", default=4,
+                      help="number of hash check threads")
+    (options, args) = parser.parse_args()
+
+    size = options.size * 1048576
+    piece_size = options.piece_size * 1024
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        print >>sys.stderr, "Writing %d MB" % options.size
+        hashes = create_file(filename, size, piece_size)
+        elapsed = check(filename, size, piece_size, hashes)
+        print "%-12s %10.1f MB/s" % ("serial", options.size / elapsed)
+        pool = HashCheckPool.getInstance(options.threads)
+        elapsed = check(filename, size, piece_size, hashes)
+        print "%-12s %10.1f MB/s   (pool reports %.1f MB/s)" % ("%d threads" % options.threads, options.size / elapsed, pool.get_rate())
+        HashCheckPool.delInstance()
+    finally:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
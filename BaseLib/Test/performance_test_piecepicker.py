@@ -0,0 +1,103 @@
+# see LICENSE.txt for license information
+#
+# Microbenchmark of the piece pickers on a synthetic swarm. Every peer owns a
+# random fraction of the pieces; the benchmark measures the time needed to
+# process the bitfields of all peers and the time per next() call while
+# pieces are requested, completed and announced by the peers.
+
+import sys
+import random
+import optparse
+from time import time
+
+from BaseLib.Core.BitTornado.bitfield import Bitfield
+from BaseLib.Core.BitTornado.BT1.PiecePicker import PiecePicker
+from BaseLib.Core.BitTornado.BT1.PiecePickerBitset import PiecePickerBitset
+
+class Download:
+    def __init__(self, have):
+        self.have = have
+
+class Peer:
+    def __init__(self, have):
+        self.download = Download(have)
+
+def create_swarm(options):
+    random.seed(options.seed)
+    bitfields = []
+    for i in xrange(options.peers):
+        fraction = random.uniform(options.min_fraction, options.max_fraction)
+        bits = [random.random() < fraction for j in xrange(options.pieces)]
+        bitfields.append(bits)
+    return bitfields
+
+def run(picker_class, bitfields, options):
+    random.seed(options.seed)
+    picker = picker_class(options.pieces, rarest_first_cutoff = 0)
+    peers = []
+    start = time()
+    for bits in bitfields:
+        peer = Peer(Bitfield(options.pieces))
+        picker.got_peer(peer)
+        for i in xrange(options.pieces):
+            if bits[i]:
+                peer.download.have[i] = True
+                picker.got_have(i, peer)
+        peers.append(peer)
+    setup = time() - start
+
+    # pieces of which all chunks have been requested are not wanted
+    requested = {}
+    wantfunc = lambda piece: not requested.has_key(piece)
+    picks = 0
+    start = time()
+    for i in xrange(options.picks):
+        peer = peers[randomint(len(peers))]
+        piece = picker.next(peer.download.have, wantfunc, None)
+        picks += 1
+        if piece is None:
+            continue
+        picker.requested(piece)
+        requested[piece] = True
+        if len(requested) > options.active:
+            # oldest request finished, a random peer announces a piece
+            done = requested.keys()[0]
+            del requested[done]
+            picker.complete(done)
+            other = peers[randomint(len(peers))]
+            missing = randomint(options.pieces)
+            if not other.download.have[missing]:
+                other.download.have[missing] = True
+                picker.got_have(missing, other)
+    elapsed = time() - start
+    return setup, elapsed / picks
+
+def randomint(n):
+    return int(random.random() * n)
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-n", "--pieces", type="int", dest="pieces", default=50000,
+                      help="number of pieces of the torrent")
+    parser.add_option("-p", "--peers", type="int", dest="peers", default=200,
+                      help="number of connected peers")
+    parser.add_option("-k", "--picks", type="int", dest="picks", default=2000,
+                      help="number of next() calls to measure")
+    parser.add_option("-a", "--active", type="int", dest="active", default=200,
+                      help="number of pieces that are requested at the same time")
+    parser.add_option("--min-fraction", type="float", dest="min_fraction", default=0.05,
+                      help="minimum fraction of the pieces a peer owns")
+    parser.add_option("--max-fraction", type="float", dest="max_fraction", default=0.95,
+                      help="maximum fraction of the pieces a peer owns")
+    parser.add_option("-s", "--seed", type="int", dest="seed", default=1)
+    (options, args) = parser.parse_args()
+
+    print >>sys.stderr, "Creating swarm of %d peers on %d pieces" % (options.peers, options.pieces)
+    bitfields = create_swarm(options)
+    print "%-20s %12s %14s" % ("picker", "setup (s)", "next() (ms)")
+    for picker_class in (PiecePicker, PiecePickerBitset):
+        setup, per_pick = run(picker_class, bitfields, options)
+        print "%-20s %12.2f %14.3f" % (picker_class.__name__, setup, per_pick * 1000)
+
+if __name__ == "__main__":
+    main()
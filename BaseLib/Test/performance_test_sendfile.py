@@ -0,0 +1,123 @@
+# see LICENSE.txt for license information
+#
+# Measures seeding over a loopback connection: blocks are sent as PIECE
+# messages through SingleSocket, either read from Storage and framed like
+# Connecter.send_partial does, or as a header followed by FileRegions that
+# are sent with sendfile(). A thread receives and discards the data. The CPU
+# time is that of the whole process, so it includes the receiving side.
+# The data file is written just before, so it is likely served from the page
+# cache.
+
+import os
+import sys
+import socket
+import random
+import select
+import tempfile
+import optparse
+from threading import Event, Thread
+from time import time, clock
+
+from BaseLib.Core.BitTornado.SocketHandler import SingleSocket
+from BaseLib.Core.BitTornado.piecebuffer import tostring
+from BaseLib.Core.BitTornado.BT1.convert import tobinary
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.zerocopy import have_sendfile
+
+BLOCK_SIZE = 2 ** 14
+
+class FakePoll:
+    def register(self, sock, mask):
+        pass
+
+class FakeSocketHandler:
+    def __init__(self):
+        self.poll = FakePoll()
+        self.dead_from_write = []
+
+def create_file(filename, size):
+    f = open(filename, 'wb')
+    chunk = os.urandom(1048576)
+    for i in xrange(size / len(chunk)):
+        f.write(chunk)
+    f.close()
+
+def drain(sock):
+    buf = bytearray(2 ** 18)
+    while sock.recv_into(buf):
+        pass
+
+def seed(filename, size, piece_size, numblocks, sendfile):
+    storage = Storage([(filename, size)], piece_size, Event(), {'max_files_open': 50})
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.connect(listener.getsockname())
+    peer, addr = listener.accept()
+    receiver = Thread(target = drain, args = (peer,))
+    receiver.start()
+    sock.setblocking(0)
+    s = SingleSocket(FakeSocketHandler(), sock, None)
+    s.connected = True
+
+    random.seed(1)
+    sent = 0
+    start, cpu = time(), clock()
+    for i in xrange(numblocks):
+        index = random.randrange(size / piece_size)
+        begin = random.randrange(piece_size / BLOCK_SIZE) * BLOCK_SIZE
+        pos = index * piece_size + begin
+        header = ''.join((tobinary(BLOCK_SIZE + 9), 'PIECE', tobinary(index), tobinary(begin)))
+        if sendfile:
+            s.write_file(storage.get_file_regions(pos, BLOCK_SIZE), header)
+        else:
+            piece = storage.read(pos, BLOCK_SIZE)
+            s.write(header + tostring(piece))
+            piece.release()
+        sent += len(header) + BLOCK_SIZE
+        while s.get_queued_bytes() > 4 * BLOCK_SIZE:
+            select.select([], [sock], [])
+            s.try_write()
+    while not s.is_flushed():
+        select.select([], [sock], [])
+        s.try_write()
+    sock.shutdown(socket.SHUT_WR)
+    receiver.join()
+    elapsed, cpu = time() - start, clock() - cpu
+    sock.close()
+    peer.close()
+    listener.close()
+    storage.close()
+    return sent / 1048576.0, elapsed, cpu
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--size", type="int", dest="size", default=256,
+                      help="size of the data in MB")
+    parser.add_option("-p", "--piece-size", type="int", dest="piece_size", default=256,
+                      help="piece size in KB")
+    parser.add_option("-u", "--upload", type="int", dest="upload", default=2048,
+                      help="amount of data to seed in MB")
+    (options, args) = parser.parse_args()
+
+    if not have_sendfile:
+        print >>sys.stderr, "sendfile() is not available on this platform"
+        sys.exit(1)
+    size = options.size * 1048576
+    piece_size = options.piece_size * 1024
+    numblocks = options.upload * 1048576 / BLOCK_SIZE
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        print >>sys.stderr, "Writing %d MB" % options.size
+        create_file(filename, size)
+        print "%-12s %12s %12s" % ("path", "MB/s", "CPU s/GB")
+        for name, sendfile in (("send", False), ("sendfile", True)):
+            mb, elapsed, cpu = seed(filename, size, piece_size, numblocks, sendfile)
+            print "%-12s %12.1f %12.3f" % (name, mb / elapsed, cpu * 1024 / mb)
+    finally:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+# see LICENSE.txt for license information
+#
+# Loopback benchmark for the event backends of SocketHandler. Opens the given
+# number of peer connections to a RawServer listening on 127.0.0.1, pushes a
+# fixed amount of data through every connection and reports the CPU time
+# spent per MB transferred for each backend.
+
+import os
+import sys
+import optparse
+from threading import Event
+from time import time
+
+from BaseLib.Core.BitTornado.RawServer import RawServer
+from BaseLib.Core.BitTornado.SocketHandler import POLL_BACKENDS, create_poll
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+class Sink:
+    """ Handler of the accepting side, counts the received bytes """
+    def __init__(self, benchmark):
+        self.benchmark = benchmark
+
+    def external_connection_made(self, s):
+        s.set_handler(self)
+
+    def data_came_in(self, s, data):
+        self.benchmark.received(len(data))
+
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+class Source:
+    """ Handler of the connecting side, keeps the send buffer of the
+    connection filled until all chunks have been written """
+    def __init__(self, chunk, chunks):
+        self.chunk = chunk
+        self.remaining = chunks
+
+    def write_next(self, s):
+        # a write that is sent completely does not trigger connection_flushed
+        while self.remaining > 0 and s.is_flushed():
+            self.remaining -= 1
+            s.write(self.chunk)
+
+    def connection_flushed(self, s):
+        self.write_next(s)
+
+    def data_came_in(self, s, data):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+class Benchmark:
+    def __init__(self, backend, options):
+        self.backend = backend
+        self.options = options
+        self.doneflag = Event()
+        self.total = options.connections * options.chunks * options.chunksize
+        self.received_bytes = 0
+        self.connected = 0
+        self.rawserver = RawServer(self.doneflag, 60, 600, ipv6_enable = False,
+                                   poll_backend = backend)
+        sockethandler = self.rawserver.sockethandler
+        sockethandler.max_connects = 2 * options.connections + 10
+        self.port = self.rawserver.find_and_bind(0, options.minport, options.maxport,
+                                                 bind = ['127.0.0.1'], reuse = True)
+        self.chunk = 'x' * options.chunksize
+
+    def received(self, amount):
+        self.received_bytes += amount
+        if self.received_bytes >= self.total:
+            self.doneflag.set()
+
+    def connect_batch(self):
+        # connect in batches, so the listen backlog (64) of the server does not overflow
+        batch = min(self.options.batch, self.options.connections - self.connected)
+        for i in xrange(batch):
+            source = Source(self.chunk, self.options.chunks)
+            s = self.rawserver.start_connection(('127.0.0.1', self.port), source)
+            source.write_next(s)
+        self.connected += batch
+        if self.connected < self.options.connections:
+            self.rawserver.add_task(self.connect_batch, 0.01)
+
+    def run(self):
+        self.rawserver.add_task(self.connect_batch, 0)
+        self.rawserver.add_task(self.doneflag.set, self.options.timeout)
+        cpu_start = sum(os.times()[:2])
+        wall_start = time()
+        self.rawserver.listen_forever(Sink(self))
+        cpu = sum(os.times()[:2]) - cpu_start
+        wall = time() - wall_start
+        poll = self.rawserver.sockethandler.poll
+        self.rawserver.shutdown()
+        return cpu, wall, getattr(poll, 'modify_calls', None)
+
+def raise_fd_limit(needed):
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        if hard != resource.RLIM_INFINITY:
+            needed = min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-c", "--connections", type="int", dest="connections", default=2000,
+                      help="number of simultaneous peer connections")
+    parser.add_option("-s", "--chunksize", type="int", dest="chunksize", default=16384,
+                      help="size of a single write in bytes")
+    parser.add_option("-n", "--chunks", type="int", dest="chunks", default=32,
+                      help="number of chunks sent over every connection")
+    parser.add_option("-b", "--batch", type="int", dest="batch", default=20,
+                      help="connections opened every 10 ms")
+    parser.add_option("-B", "--backends", dest="backends", default=",".join(POLL_BACKENDS),
+                      help="comma separated list of event backends to compare")
+    parser.add_option("-t", "--timeout", type="float", dest="timeout", default=120,
+                      help="abort a run after this many seconds")
+    parser.add_option("--minport", type="int", dest="minport", default=20000)
+    parser.add_option("--maxport", type="int", dest="maxport", default=30000)
+    (options, args) = parser.parse_args()
+
+    raise_fd_limit(2 * options.connections + 100)
+    megabytes = options.connections * options.chunks * options.chunksize / float(2**20)
+    print "%d connections, %.1f MB per run" % (options.connections, megabytes)
+    print "%-8s %10s %10s %12s %14s" % ("backend", "wall (s)", "cpu (s)", "cpu ms/MB", "epoll_ctl")
+    for backend in options.backends.split(","):
+        try:
+            create_poll(backend)
+        except ValueError, e:
+            print "%-8s %s" % (backend, str(e))
+            continue
+        if backend == 'select' and options.connections * 2 >= 1024:
+            # select() cannot watch fds beyond FD_SETSIZE
+            print "%-8s skipped, too many connections for select()" % backend
+            continue
+        benchmark = Benchmark(backend, options)
+        cpu, wall, modify_calls = benchmark.run()
+        transferred = benchmark.received_bytes / float(2**20)
+        if benchmark.received_bytes < benchmark.total:
+            print >>sys.stderr, "%s: timeout, only %.1f of %.1f MB transferred" % (backend, transferred, megabytes)
+        print "%-8s %10.2f %10.2f %12.2f %14s" % (backend, wall, cpu, 1000 * cpu / max(transferred, 0.001),
+                                               modify_calls is None and '-' or modify_calls)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+# see LICENSE.txt for license information
+#
+# Measures the upload path of a seed: pieces are read from storage like
+# Uploader does with buffer_reads, and every 16 KB block is turned into the
+# header of a PIECE message and a view of its data like Connecter.send_partial
+# does. Compares Storage with
+# MMapStorage. The data file is written just before, so it is likely served
+# from the page cache.
+
+import os
+import sys
+import random
+import tempfile
+import optparse
+from threading import Event
+from time import time, clock
+
+from BaseLib.Core.BitTornado.piecebuffer import tobuffer
+from BaseLib.Core.BitTornado.BT1.convert import tobinary
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.MMapStorage import MMapStorage
+
+BLOCK_SIZE = 2 ** 14
+
+def create_file(filename, size):
+    f = open(filename, 'wb')
+    chunk = os.urandom(1048576)
+    for i in xrange(size / len(chunk)):
+        f.write(chunk)
+    f.close()
+
+def seed(storage_class, filename, size, piece_size, numpieces):
+    storage = storage_class([(filename, size)], piece_size, Event(), {'max_files_open': 50})
+    random.seed(1)
+    sent = 0
+    start, cpu = time(), clock()
+    for i in xrange(numpieces):
+        index = random.randrange(size / piece_size)
+        piecebuf = storage.read(index * piece_size, piece_size)
+        for begin in xrange(0, piece_size, BLOCK_SIZE):
+            piece = piecebuf[begin:begin + BLOCK_SIZE]
+            header = ''.join((tobinary(len(piece) + 9), 'PIECE',
+                              tobinary(index), tobinary(begin)))
+            data = tobuffer(piece)
+            sent += len(header) + len(data)
+        piecebuf.release()
+    elapsed, cpu = time() - start, clock() - cpu
+    storage.close()
+    return sent / 1048576.0, elapsed, cpu
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-s", "--size", type="int", dest="size", default=256,
+                      help="size of the data in MB")
+    parser.add_option("-p", "--piece-size", type="int", dest="piece_size", default=256,
+                      help="piece size in KB")
+    parser.add_option("-n", "--pieces", type="int", dest="pieces", default=4000,
+                      help="number of pieces to upload")
+    (options, args) = parser.parse_args()
+
+    size = options.size * 1048576
+    piece_size = options.piece_size * 1024
+    fd, filename = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        print >>sys.stderr, "Writing %d MB" % options.size
+        create_file(filename, size)
+        print "%-12s %12s %12s" % ("storage", "MB/s", "CPU ms/MB")
+        for storage_class in (Storage, MMapStorage):
+            mb, elapsed, cpu = seed(storage_class, filename, size, piece_size, options.pieces)
+            print "%-12s %12.1f %12.3f" % (storage_class.__name__, mb / elapsed, cpu * 1000 / mb)
+    finally:
+        os.remove(filename)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# see LICENSE.txt for license information
+#
+# Measures announce handling of the built-in tracker: Tracker.get is called
+# directly with announce URLs, first once for every peer, then for random
+# peers that re-announce. Prints the announces per second and the latency
+# percentiles of the re-announces, and the time that expire_downloaders
+# takes when the peers that did not re-announce expire.
+
+import os
+import sys
+import random
+import tempfile
+import optparse
+from time import time
+from urllib import quote
+
+from BaseLib.Core.defaults import trackerdefaults
+from BaseLib.Core.BitTornado.BT1.track import Tracker
+
+class FakeRawServer:
+    def add_task(self, func, delay = 0, id = None):
+        pass
+
+class FakeConnection:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def get_ip(self):
+        return self.ip
+
+def peer_ip(n):
+    return '10.%d.%d.%d' % ((n >> 16) & 255, (n >> 8) & 255, n & 255 or 1)
+
+def announce_path(infohash, n, numwant, compact, event = None):
+    query = ['info_hash=' + quote(infohash),
+             'peer_id=' + quote('%020d' % n),
+             'port=%d' % (6881 + n % 1000),
+             'uploaded=0', 'downloaded=0',
+             'left=%d' % (n % 4 and 1000 or 0),
+             'numwant=%d' % numwant]
+    if compact:
+        query.append('compact=1')
+    if event:
+        query.append('event=' + event)
+    return '/announce?' + '&'.join(query)
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+def main():
+    parser = optparse.OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-t", "--torrents", type="int", dest="torrents", default=10,
+                      help="number of torrents")
+    parser.add_option("-p", "--peers", type="int", dest="peers", default=50000,
+                      help="number of peers, spread over the torrents")
+    parser.add_option("-a", "--announces", type="int", dest="announces", default=100000,
+                      help="number of re-announces to measure")
+    parser.add_option("-n", "--numwant", type="int", dest="numwant", default=50,
+                      help="peers per reply")
+    parser.add_option("-r", "--reannounce", type="float", dest="reannounce", default=0.8,
+                      help="fraction of the peers that re-announce before expiry")
+    parser.add_option("--no-compact", action="store_false", dest="compact", default=True,
+                      help="request replies with peer dictionaries")
+    parser.add_option("--locality", action="store_true", dest="locality", default=False,
+                      help="enable the locality mode of the tracker")
+    parser.add_option("--dump", action="store_true", dest="dump", default=False,
+                      help="dump all peers to stderr after every announce")
+    (options, args) = parser.parse_args()
+
+    config = dict(trackerdefaults)
+    dfile = tempfile.mktemp()
+    config['tracker_dfile'] = dfile
+    config['tracker_nat_check'] = 0
+    config['tracker_locality'] = int(options.locality)
+    config['tracker_dump_becache'] = int(options.dump)
+    tracker = Tracker(config, FakeRawServer())
+    infohashes = ['%020d' % i for i in xrange(options.torrents)]
+    # the torrents are known to the tracker like with tracker_allowed_dir,
+    # TrackerStatistics logs their names
+    tracker.allowed = {}
+    for infohash in infohashes:
+        tracker.allowed[infohash] = {'name': 'torrent' + infohash, 'length': 0}
+
+    random.seed(1)
+    print >>sys.stderr, "Announcing %d peers" % options.peers
+    start = time()
+    for n in xrange(options.peers):
+        infohash = infohashes[n % options.torrents]
+        tracker.get(FakeConnection(peer_ip(n)),
+                    announce_path(infohash, n, options.numwant, options.compact, 'started'),
+                    {})
+    elapsed = time() - start
+    print "%-24s %12.0f" % ("started/s", options.peers / elapsed)
+
+    tracker.expire_downloaders()
+    active = random.sample(xrange(options.peers), int(options.peers * options.reannounce))
+    latencies = []
+    start = time()
+    for i in xrange(options.announces):
+        n = active[i % len(active)]
+        infohash = infohashes[n % options.torrents]
+        path = announce_path(infohash, n, options.numwant, options.compact)
+        t = time()
+        tracker.get(FakeConnection(peer_ip(n)), path, {})
+        latencies.append(time() - t)
+    elapsed = time() - start
+    latencies.sort()
+    print "%-24s %12.0f" % ("announces/s", options.announces / elapsed)
+    for p in (0.5, 0.99, 0.999):
+        print "%-24s %12.3f" % ("latency p%g (ms)" % (p * 100), percentile(latencies, p) * 1000)
+    print "%-24s %12.3f" % ("latency max (ms)", latencies[-1] * 1000)
+
+    start = time()
+    tracker.expire_downloaders()
+    print "%-24s %12.3f" % ("expiry (ms)", (time() - start) * 1000)
+    print "%-24s %12d" % ("peers left", sum([len(d) for d in tracker.downloads.values()]))
+    if os.path.exists(dfile):
+        os.remove(dfile)
+
+if __name__ == "__main__":
+    main()
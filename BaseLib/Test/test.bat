@@ -19,6 +19,20 @@ python test_ut_pex.py
 python test_bartercast.py
 python test_g2g.py
 python test_TimedTaskQueue.py
+python test_rawserver_tasks.py
+python test_sockethandler_poll.py
+python test_recvbuffer.py
+python test_sendqueue.py
+python test_piecepicker_bitset.py
+python test_bitfield.py
+python test_hashcheck.py
+python test_piece_verify.py
+python test_mmapstorage.py
+python test_sendfile.py
+python test_piececache.py
+python test_ratelimiter_shares.py
+python test_localityindex.py
+python test_tracker_expiry.py
 python test_crawler.py
 python test_friendship_crawler.py
 python test_multicast.py
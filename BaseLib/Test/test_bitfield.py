@@ -0,0 +1,70 @@
+import random
+import unittest
+
+from BaseLib.Core.BitTornado.bitfield import Bitfield, popcount, test_bitfield
+
+def make(length, pieces):
+    b = Bitfield(length)
+    for i in pieces:
+        b[i] = True
+    return b
+
+class TestBitfield(unittest.TestCase):
+
+    def test_wire_format(self):
+        test_bitfield()
+
+    def test_roundtrip(self):
+        random.seed(3)
+        for length in (1, 7, 8, 9, 1000, 40001):
+            pieces = random.sample(xrange(length), length / 3)
+            b = make(length, pieces)
+            self.assertEquals(length - len(set(pieces)), b.numfalse)
+            s = b.tostring()
+            self.assertEquals((length + 7) / 8, len(s))
+            c = Bitfield(length, s)
+            self.assertEquals(b.numfalse, c.numfalse)
+            self.assertEquals(b.toboollist(), c.toboollist())
+            self.assertEquals(len(set(pieces)), popcount(s))
+
+    def test_setitem(self):
+        b = Bitfield(10)
+        b[9] = 1
+        b[9] = 1
+        self.assertEquals(9, b.numfalse)
+        b[9] = 0
+        self.assertEquals(10, b.numfalse)
+        b[-1] = 1
+        self.assertTrue(b[9])
+        self.assertTrue(b[-1])
+        self.assertFalse(b[-2])
+        self.assertRaises(IndexError, b.__setitem__, 10, 1)
+        # the padding bits of the last byte are not readable either
+        self.assertRaises(IndexError, b.__getitem__, 10)
+        self.assertRaises(IndexError, b.__getitem__, 16)
+        self.assertRaises(IndexError, b.__getitem__, -11)
+        self.assertEquals(10, len(list(b)))
+
+    def test_bulk_operations(self):
+        a = make(20, [1, 5, 17])
+        b = make(20, [5, 6, 19])
+        self.assertEquals([5], [i for i in xrange(20) if (a & b)[i]])
+        self.assertEquals([1, 5, 6, 17, 19], [i for i in xrange(20) if (a | b)[i]])
+        self.assertEquals([1, 17], [i for i in xrange(20) if a.andnot(b)[i]])
+        self.assertEquals(15, (a | b).numfalse)
+        self.assertEquals(2, a.andnot(b).count())
+        # the operands are not changed
+        self.assertEquals(3, a.count())
+
+    def test_first_set(self):
+        b = make(100, [3, 40, 99])
+        self.assertEquals(3, b.first_set())
+        self.assertEquals(40, b.first_set(4))
+        self.assertEquals(40, b.first_set(40))
+        self.assertEquals(None, b.first_set(4, 40))
+        self.assertEquals(99, b.first_set(41))
+        self.assertEquals(None, Bitfield(100).first_set())
+        self.assertEquals(None, b.first_set(50, 10))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+from threading import Event
+from Queue import Queue
+
+from BaseLib.Core.BitTornado.clock import clock
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.StorageWrapper import StorageWrapper
+from BaseLib.Core.BitTornado.BT1.HashChecker import HashCheckPool, HashCheckJob
+
+PIECE_SIZE = 2 ** 15
+NUMPIECES = 37
+
+class TestHashCheck(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        pieces = [os.urandom(PIECE_SIZE) for i in xrange(NUMPIECES - 1)]
+        pieces.append(os.urandom(1000))
+        self.hashes = [sha(p).digest() for p in pieces]
+        self.size = sum([len(p) for p in pieces])
+        # corrupt two pieces
+        self.corrupt = [5, 20]
+        for i in self.corrupt:
+            pieces[i] = 'x' * PIECE_SIZE
+        os.write(fd, ''.join(pieces))
+        os.close(fd)
+
+    def tearDown(self):
+        HashCheckPool.delInstance()
+        os.remove(self.filename)
+
+    def check(self):
+        config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+        storage = Storage([(self.filename, self.size)], PIECE_SIZE, Event(), config)
+        failures = []
+        sw = StorageWrapper({'live': False}, storage, 2 ** 14, self.hashes, PIECE_SIZE,
+                            None, lambda: None, failures.append,
+                            backfunc = lambda func, delay = 0, id = None: None,
+                            config = config)
+        sw._waspre = lambda piece: True
+        self.assertTrue(sw.old_style_init())
+        storage.close()
+        self.assertEquals([], failures)
+        return sw
+
+    def test_parallel_matches_serial(self):
+        serial = self.check()
+        HashCheckPool.getInstance(3)
+        parallel = self.check()
+        self.assertEquals(serial.have.tostring(), parallel.have.tostring())
+        self.assertEquals(NUMPIECES - len(self.corrupt), parallel.have.count())
+        for i in self.corrupt:
+            self.assertFalse(parallel.have[i])
+        self.assertTrue(parallel.have[-1])
+        self.assertEquals(serial.amount_left, parallel.amount_left)
+        self.assertTrue(HashCheckPool.getInstance().get_rate() > 0)
+
+    def test_network_thread_is_not_blocked(self):
+        # initialize() as run by the network thread: the tasks posted by the
+        # pool workers are executed in a loop standing in for the RawServer
+        serial = self.check()
+        HashCheckPool.getInstance(2)
+        config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+        storage = Storage([(self.filename, self.size)], PIECE_SIZE, Event(), config)
+        tasks = Queue()
+        sw = StorageWrapper({'live': False}, storage, 2 ** 14, self.hashes, PIECE_SIZE,
+                            None, lambda: None, self.fail,
+                            backfunc = lambda func, delay = 0, id = None: tasks.put(func),
+                            config = config)
+        sw._waspre = lambda piece: True
+        checks = []
+        hashcheckfunc = sw.initialize_tasks[0][3]
+        def count_checks():
+            checks.append(1)
+            return hashcheckfunc()
+        sw.initialize_tasks[0][3] = count_checks
+        done = []
+        sw.initialize(lambda success: done.append(success))
+        while not done:
+            func = tasks.get(True, 5)
+            st = clock()
+            func()
+            self.assertTrue(clock() - st < 0.04)
+        storage.close()
+        self.assertEquals([True], done)
+        self.assertEquals(serial.have.tostring(), sw.have.tostring())
+        # no polling while the pool is busy
+        self.assertTrue(len(checks) < NUMPIECES, len(checks))
+
+    def test_read_error(self):
+        def read(pos, amount):
+            raise IOError('error reading data')
+        pool = HashCheckPool.getInstance(1)
+        job = HashCheckJob(read, [0, 1], PIECE_SIZE, lambda i: PIECE_SIZE, PIECE_SIZE)
+        pool.submit(job)
+        self.assertTrue(job.wait(5))
+        self.assertEquals(None, job.results)
+        self.assertTrue(isinstance(job.error, IOError))
+
+if __name__ == "__main__":
+    unittest.main()
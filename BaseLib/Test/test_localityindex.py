@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from BaseLib.Core.BitTornado.BT1.LocalityIndex import LocalityIndex, PrefixClassifier, PeerBucket
+
+def peer(n):
+    return '%020d' % n
+
+def data(n):
+    return ('full%d' % n, 'noid%d' % n, 'c%d' % n)
+
+class TestPrefixClassifier(unittest.TestCase):
+
+    def test_prefix(self):
+        classify = PrefixClassifier(16)
+        self.assertEquals(classify('130.83.1.2'), classify('130.83.200.1'))
+        self.assertNotEquals(classify('130.83.1.2'), classify('130.84.1.2'))
+        self.assertEquals(None, classify('::1'))
+        self.assertEquals(None, classify(None))
+
+    def test_classes_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, '# ISP networks\n10.0.0.0/8 AS1\n10.1.0.0/16 AS2\n\n192.168.0.0/16\n')
+        os.close(fd)
+        try:
+            classify = PrefixClassifier(24)
+            classify.read_classes(filename)
+        finally:
+            os.remove(filename)
+        self.assertEquals('AS1', classify('10.200.1.1'))
+        self.assertEquals('AS2', classify('10.1.3.4'))
+        self.assertEquals('192.168.0.0/16', classify('192.168.3.3'))
+        self.assertEquals(classify('11.0.0.1'), classify('11.0.0.200'))
+
+
+class TestLocalityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = LocalityIndex()
+
+    def test_bucket_remove(self):
+        bucket = PeerBucket()
+        for i in xrange(5):
+            bucket.add(peer(i), data(i))
+        bucket.remove(peer(1))
+        bucket.remove(peer(4))
+        self.assertEquals(3, len(bucket))
+        for id in (peer(0), peer(2), peer(3)):
+            self.assertEquals(id, bucket.ids[bucket.pos[id]])
+
+    def test_small_swarm(self):
+        for i in xrange(5):
+            self.index.add(peer(i), i % 2, False, data(i))
+        peers = self.index.get_peers(0, peer(0), False, 50, 2, 0.2)
+        self.assertEquals(['c1', 'c2', 'c3', 'c4'], sorted(peers))
+        # local peers first
+        self.assertEquals(['c2', 'c4'], sorted(peers[:2]))
+
+    def test_local_first(self):
+        for i in xrange(1000):
+            self.index.add(peer(i), i % 10, False, data(i))
+        peers = self.index.get_peers(3, peer(3), False, 50, 1, 0.2)
+        self.assertEquals(50, len(peers))
+        local = [p for p in peers if int(p[4:]) % 10 == 3]
+        self.assertEquals(40, len(local))
+        self.assertEquals(local, peers[:40])
+        self.assertFalse('noid3' in peers)
+
+    def test_few_remote_peers(self):
+        for i in xrange(100):
+            self.index.add(peer(i), 'isp', False, data(i))
+        self.index.add(peer(100), 'other', False, data(100))
+        peers = self.index.get_peers('isp', peer(0), False, 50, 0, 0.5)
+        self.assertEquals(50, len(peers))
+        self.assertEquals(50, len(dict.fromkeys(peers)))
+
+    def test_seeds(self):
+        for i in xrange(10):
+            self.index.add(peer(i), 0, i < 5, data(i))
+        self.index.set_seed(peer(9))
+        peers = self.index.get_peers(0, peer(0), True, 50, 2, 0.2)
+        self.assertEquals(['c5', 'c6', 'c7', 'c8'], sorted(peers))
+        self.index.remove(peer(5))
+        peers = self.index.get_peers(0, peer(20), False, 50, 2, 0.2)
+        self.assertEquals(9, len(peers))
+        self.assertEquals(9, len(self.index))
+
+if __name__ == "__main__":
+    unittest.main()
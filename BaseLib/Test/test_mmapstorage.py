@@ -0,0 +1,115 @@
+import os
+import tempfile
+import shutil
+import unittest
+from array import array
+from threading import Event
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.piecebuffer import tostring, tobuffer
+from BaseLib.Core.BitTornado.BT1 import MMapStorage as mmapstorage
+from BaseLib.Core.BitTornado.BT1.MMapStorage import MMapStorage
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.StorageWrapper import StorageWrapper
+
+PIECE_SIZE = 4096
+
+class TestMMapStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.window_size = mmapstorage.WINDOW_SIZE
+        mmapstorage.WINDOW_SIZE = 2 * mmapstorage.ALLOCATIONGRANULARITY
+        self.sizes = [3 * mmapstorage.WINDOW_SIZE + 100, 5000, 7 * mmapstorage.WINDOW_SIZE]
+        self.files = [(os.path.join(self.dir, str(i)), size) for i, size in enumerate(self.sizes)]
+        self.data = os.urandom(sum(self.sizes))
+
+    def tearDown(self):
+        mmapstorage.WINDOW_SIZE = self.window_size
+        shutil.rmtree(self.dir)
+
+    def create(self, max_files_open = 50):
+        config = {'max_files_open': max_files_open}
+        return MMapStorage(self.files, PIECE_SIZE, Event(), config)
+
+    def write_all(self, storage):
+        for pos in xrange(0, len(self.data), 10000):
+            storage.write(pos, self.data[pos:pos + 10000])
+
+    def test_read_write(self):
+        storage = self.create()
+        self.write_all(storage)
+        for pos, amount in [(0, 10), (mmapstorage.WINDOW_SIZE - 5, 10), (self.sizes[0] - 7, 5020),
+                            (len(self.data) - 100, 100), (0, len(self.data))]:
+            data = storage.read(pos, amount)
+            self.assertEquals(amount, len(data))
+            self.assertEquals(self.data[pos:pos + amount], data.tostring())
+            self.assertEquals(self.data[pos + 3:pos + 8], str(data[3:8]))
+            data.release()
+        storage.close()
+        # the plain Storage sees the same files
+        storage = Storage(self.files, PIECE_SIZE, Event(), {'max_files_open': 50})
+        self.assertEquals(self.data, storage.read(0, len(self.data))[:].tostring())
+        storage.close()
+
+    def test_views_do_not_copy(self):
+        storage = self.create()
+        self.write_all(storage)
+        data = storage.read(100, 1000)
+        self.assertEquals(buffer, type(data[:]))
+        self.assertEquals(buffer, type(data[10:20]))
+        self.assertEquals(self.data[100:1100], tostring(data[:]))
+        storage.close()
+
+    def test_maps_are_limited(self):
+        storage = self.create(max_files_open = 2)
+        self.write_all(storage)
+        self.assertEquals(self.data, storage.read(0, len(self.data)).tostring())
+        self.assertTrue(len(storage.maps) <= 2)
+        self.assertEquals(len(storage.maps), len(storage.maplru))
+        storage.close()
+
+    def test_file_grows(self):
+        storage = self.create()
+        storage.write(0, self.data[:1000])
+        self.assertEquals(self.data[:1000], storage.read(0, 1000).tostring())
+        storage.write(1000, self.data[1000:5000])
+        self.assertEquals(self.data[:5000], storage.read(0, 5000).tostring())
+        self.assertRaises(IOError, storage.read, 0, 6000)
+        storage.close()
+
+    def test_get_unchecked_piece(self):
+        # pieces found on disk without check_hashes are hashed on their first
+        # read, the part returned has the interface of the other backends
+        numpieces = 5
+        size = numpieces * PIECE_SIZE
+        self.files = [(os.path.join(self.dir, 'piece'), size)]
+        storage = self.create()
+        storage.write(0, self.data[:size])
+        hashes = [sha(self.data[i:i + PIECE_SIZE]).digest() for i in xrange(0, size, PIECE_SIZE)]
+        config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+        failures = []
+        sw = StorageWrapper({'live': False}, storage, 2 ** 12, hashes, PIECE_SIZE,
+                            None, lambda: None, failures.append,
+                            check_hashes = False,
+                            backfunc = lambda func, delay = 0, id = None: None,
+                            config = config)
+        sw._waspre = lambda piece: True
+        self.assertTrue(sw.old_style_init())
+        self.assertFalse(sw.waschecked[1])
+        piece = sw.do_get_piece(1, 100, PIECE_SIZE - 200)
+        self.assertEquals(self.data[PIECE_SIZE + 100:2 * PIECE_SIZE - 100], piece.tostring())
+        self.assertEquals(PIECE_SIZE - 200, len(tobuffer(piece)))
+        self.assertTrue(sw.waschecked[1])
+        self.assertEquals([], failures)
+        storage.close()
+
+    def test_tostring(self):
+        self.assertEquals('abc', tostring(array('c', 'abc')))
+        self.assertEquals('bc', tostring(buffer('abc', 1)))
+        self.assertEquals('abc', tostring('abc'))
+        self.assertEquals('bc', str(tobuffer(buffer('abc', 1))))
+        self.assertEquals(buffer, type(tobuffer(array('c', 'abc'))))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import tempfile
+import unittest
+from threading import Event
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.StorageWrapper import StorageWrapper
+from BaseLib.Core.BitTornado.BT1.HashChecker import HashCheckPool
+
+PIECE_SIZE = 2 ** 16
+BLOCK_SIZE = 2 ** 14
+NUMPIECES = 4
+
+class TestPieceVerify(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.pieces = [os.urandom(PIECE_SIZE) for i in xrange(NUMPIECES - 1)]
+        self.pieces.append(os.urandom(1000))
+        hashes = [sha(p).digest() for p in self.pieces]
+        size = sum([len(p) for p in self.pieces])
+        config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+        self.storage = Storage([(self.filename, size)], PIECE_SIZE, Event(), config)
+        self.tasks = []
+        self.verified = []
+        self.flunked = []
+        self.sw = StorageWrapper({'live': False}, self.storage, BLOCK_SIZE, hashes, PIECE_SIZE,
+                                 None, lambda: None, self.fail,
+                                 data_flunked = lambda length, index: self.flunked.append(index),
+                                 backfunc = self.backfunc, config = config)
+        self.sw.set_verified_func(lambda index, ok: self.verified.append((index, ok)))
+        self.assertTrue(self.sw.old_style_init())
+        self.tasks = []
+        self.reads = 0
+        read_raw = self.sw.read_raw
+        def counting_read_raw(*args, **kwargs):
+            self.reads += 1
+            return read_raw(*args, **kwargs)
+        self.sw.read_raw = counting_read_raw
+
+    def tearDown(self):
+        HashCheckPool.delInstance()
+        self.storage.close()
+        os.remove(self.filename)
+
+    def backfunc(self, func, delay = 0, id = None):
+        self.tasks.append(func)
+
+    def receive(self, index, order, data = None):
+        """ Requests all blocks of a piece and feeds them in the given order """
+        if data is None:
+            data = self.pieces[index]
+        blocks = []
+        while self.sw.do_I_have_requests(index):
+            blocks.append(self.sw.new_request(index))
+        results = []
+        for i in order(range(len(blocks))):
+            begin, length = blocks[i]
+            results.append(self.sw.piece_came_in(index, begin, [], data[begin:begin+length], None))
+        return results[-1]
+
+    def run_tasks(self):
+        job = self.sw.verifying.values()[0]
+        self.assertTrue(job.wait(5))
+        # the callback posts a task after the job is done
+        for i in xrange(100):
+            if self.tasks:
+                break
+            job.done.wait(0.01)
+        tasks, self.tasks = self.tasks, []
+        for task in tasks:
+            task()
+
+    def test_in_order_is_not_read_back(self):
+        self.assertTrue(self.receive(0, lambda l: l))
+        self.assertTrue(self.sw.do_I_have(0))
+        self.assertEquals(0, self.reads)
+        self.assertTrue(self.receive(NUMPIECES - 1, lambda l: l))
+        self.assertTrue(self.sw.do_I_have(NUMPIECES - 1))
+
+    def test_in_order_bad_data(self):
+        self.assertFalse(self.receive(1, lambda l: l, 'x' * PIECE_SIZE))
+        self.assertFalse(self.sw.do_I_have(1))
+        self.assertEquals([1], self.flunked)
+        self.assertTrue(self.sw.do_I_have_requests(1))
+
+    def test_out_of_order_without_pool(self):
+        self.assertTrue(self.receive(2, lambda l: l[::-1]))
+        self.assertTrue(self.sw.do_I_have(2))
+        self.assertEquals(1, self.reads)
+
+    def test_out_of_order_in_background(self):
+        HashCheckPool.getInstance(1)
+        self.assertTrue(self.receive(2, lambda l: l[::-1]))
+        self.assertFalse(self.sw.do_I_have(2))
+        self.assertFalse(self.sw.is_unstarted(2))
+        self.run_tasks()
+        self.assertTrue(self.sw.do_I_have(2))
+        self.assertEquals([(2, True)], self.verified)
+
+        self.assertTrue(self.receive(1, lambda l: l[::-1], 'y' * PIECE_SIZE))
+        self.run_tasks()
+        self.assertFalse(self.sw.do_I_have(1))
+        self.assertEquals([(2, True), (1, False)], self.verified)
+        self.assertEquals([1], self.flunked)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+from threading import Event
+
+from BaseLib.Core.Utilities.Crypto import sha
+from BaseLib.Core.BitTornado.piecebuffer import tostring
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.BT1.StorageWrapper import StorageWrapper
+from BaseLib.Core.BitTornado.BT1.PieceCache import PieceCache
+
+PIECE_SIZE = 2 ** 16
+NUMPIECES = 8
+INFOHASH = 'i' * 20
+
+class TestPieceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = PieceCache.getInstance(1000, 2)
+
+    def tearDown(self):
+        PieceCache.delInstance()
+
+    def test_lru_eviction(self):
+        for i in xrange(4):
+            self.cache.put(INFOHASH, i, str(i) * 300)
+        # piece 0 was dropped to stay within 1000 bytes
+        self.assertEquals(None, self.cache.get(INFOHASH, 0))
+        self.assertEquals('1' * 300, self.cache.get(INFOHASH, 1))
+        self.cache.put(INFOHASH, 4, '4' * 300)
+        # 1 was used more recently than 2
+        self.assertFalse(self.cache.has(INFOHASH, 2))
+        self.assertTrue(self.cache.has(INFOHASH, 1))
+        self.assertEquals(900, self.cache.size)
+
+    def test_too_large(self):
+        self.cache.put(INFOHASH, 0, 'x' * 1001)
+        self.assertEquals(0, self.cache.size)
+
+    def test_replace_and_invalidate(self):
+        self.cache.put(INFOHASH, 0, 'a' * 100)
+        self.cache.put(INFOHASH, 0, 'b' * 200)
+        self.assertEquals(200, self.cache.size)
+        self.cache.invalidate(INFOHASH, 0)
+        self.assertEquals(0, self.cache.size)
+        self.assertEquals(None, self.cache.get(INFOHASH, 0))
+
+    def test_stats_and_drop(self):
+        other = 'o' * 20
+        self.cache.put(INFOHASH, 0, 'a' * 100)
+        self.cache.put(other, 0, 'b' * 200)
+        self.cache.get(INFOHASH, 0)
+        self.cache.get(INFOHASH, 1)
+        self.cache.get(INFOHASH, 0)
+        stats = self.cache.get_stats(INFOHASH)
+        self.assertEquals((2, 1, 100, 300, 1000),
+                          (stats['hits'], stats['misses'], stats['size'],
+                           stats['total_size'], stats['max_size']))
+        self.assertAlmostEquals(2.0 / 3, stats['hitrate'])
+        self.cache.drop(INFOHASH)
+        self.assertEquals(0, self.cache.get_stats(INFOHASH)['hits'])
+        self.assertEquals(200, self.cache.size)
+        self.assertEquals('b' * 200, self.cache.get(other, 0))
+
+
+class TestStorageWrapperCache(unittest.TestCase):
+
+    def setUp(self):
+        PieceCache.getInstance(3 * PIECE_SIZE, 2)
+        fd, self.filename = tempfile.mkstemp()
+        self.pieces = [os.urandom(PIECE_SIZE) for i in xrange(NUMPIECES - 1)]
+        self.pieces.append(os.urandom(1000))
+        os.write(fd, ''.join(self.pieces))
+        os.close(fd)
+        hashes = [sha(p).digest() for p in self.pieces]
+        size = sum([len(p) for p in self.pieces])
+        config = {'max_files_open': 50, 'write_buffer_size': 4, 'auto_flush': 0}
+        self.storage = Storage([(self.filename, size)], PIECE_SIZE, Event(), config)
+        self.tasks = []
+        self.sw = StorageWrapper({'live': False}, self.storage, 2 ** 14, hashes, PIECE_SIZE,
+                                 None, lambda: None, self.fail, backfunc = self.backfunc,
+                                 config = config, infohash = INFOHASH)
+        self.sw._waspre = lambda piece: True
+        self.assertTrue(self.sw.old_style_init())
+        self.assertEquals(0, self.sw.amount_left)
+        self.tasks = []
+        self.reads = 0
+        read_raw = self.sw.read_raw
+        def counting_read_raw(*args, **kwargs):
+            self.reads += 1
+            return read_raw(*args, **kwargs)
+        self.sw.read_raw = counting_read_raw
+
+    def tearDown(self):
+        PieceCache.delInstance()
+        self.storage.close()
+        os.remove(self.filename)
+
+    def backfunc(self, func, delay = 0, id = None):
+        self.tasks.append(func)
+
+    def test_hits_are_not_read(self):
+        for i in xrange(3):
+            data = self.sw.do_get_piece(1, 0, -1)
+            self.assertEquals(self.pieces[1], tostring(data[0:PIECE_SIZE]))
+            data.release()
+        self.assertEquals(1, self.reads)
+        data = self.sw.do_get_piece(1, 100, 50)
+        self.assertEquals(self.pieces[1][100:150], data.tostring())
+        self.assertEquals(None, self.sw.do_get_piece(1, PIECE_SIZE - 10, 11))
+        self.assertEquals(1, self.reads)
+        stats = PieceCache.getInstance().get_stats(INFOHASH)
+        self.assertEquals((3, 1), (stats['hits'], stats['misses']))
+
+    def test_last_piece(self):
+        data = self.sw.do_get_piece(NUMPIECES - 1, 0, -1)
+        self.assertEquals(1000, len(data))
+        self.assertEquals(self.pieces[-1], data.tostring())
+
+    def test_read_ahead(self):
+        self.sw.do_get_piece(5, 0, -1)
+        self.sw.read_ahead(5)
+        for task in self.tasks:
+            task()
+        self.assertEquals(3, self.reads)
+        cache = PieceCache.getInstance()
+        self.assertTrue(cache.has(INFOHASH, 6))
+        self.assertTrue(cache.has(INFOHASH, 7))
+        self.assertEquals(2, cache.get_stats(INFOHASH)['readahead'])
+        self.assertEquals(self.pieces[6], self.sw.do_get_piece(6, 0, -1).tostring())
+        self.assertEquals(3, self.reads)
+
+    def test_live_invalidate(self):
+        self.sw.do_get_piece(2, 0, -1)
+        self.sw.live_invalidate(2)
+        self.assertFalse(PieceCache.getInstance().has(INFOHASH, 2))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import random
+import unittest
+
+from BaseLib.Core.BitTornado.bitfield import Bitfield
+from BaseLib.Core.BitTornado.BT1.PiecePicker import PiecePicker
+from BaseLib.Core.BitTornado.BT1.PiecePickerBitset import PiecePickerBitset, PieceSet, iter_pieces
+
+class FakeDownload:
+    def __init__(self, have):
+        self.have = have
+
+class FakeConnection:
+    def __init__(self, numpieces):
+        self.download = FakeDownload(Bitfield(numpieces))
+
+class TestPieceSet(unittest.TestCase):
+
+    def test_set(self):
+        s = PieceSet(20)
+        s.add(3)
+        s.add(17)
+        s.add(3)
+        self.assertEquals(2, len(s))
+        self.assertTrue(17 in s)
+        self.assertFalse(4 in s)
+        self.assertEquals((1 << 3) | (1 << 17), s.tolong())
+        s.discard(3)
+        s.discard(3)
+        self.assertEquals([17], list(s))
+        self.assertEquals(1 << 17, s.tolong())
+        s.add(4)
+        self.assertEquals((1 << 4) | (1 << 17), s.tolong())
+
+    def test_full(self):
+        for n in (0, 1, 8, 13):
+            s = PieceSet(n, True)
+            self.assertEquals(n, len(s))
+            self.assertEquals(range(n), list(s))
+            self.assertEquals((1 << n) - 1, s.tolong())
+
+    def test_iter_pieces(self):
+        x = (1 << 0) | (1 << 5) | (1 << 9) | (1 << 70)
+        self.assertEquals([0, 5, 9, 70], list(iter_pieces(x)))
+        self.assertEquals([9, 70, 0, 5], list(iter_pieces(x, 6)))
+        self.assertEquals([9, 70, 0, 5], list(iter_pieces(x, 9)))
+        self.assertEquals([0, 5, 9, 70], list(iter_pieces(x, 71)))
+        self.assertEquals([], list(iter_pieces(0, 3)))
+
+class TestPiecePickerBitset(unittest.TestCase):
+
+    numpieces = 300
+
+    def setUp(self):
+        random.seed(42)
+        self.picker = PiecePickerBitset(self.numpieces, rarest_first_cutoff = 0)
+        self.reference = PiecePicker(self.numpieces, rarest_first_cutoff = 0)
+        self.peers = [FakeConnection(self.numpieces) for i in xrange(10)]
+
+    def got_have(self, peer, piece):
+        if not peer.download.have[piece]:
+            peer.download.have[piece] = True
+            self.picker.got_have(piece, peer)
+            self.reference.got_have(piece, peer)
+
+    def check_next(self, wantfunc = lambda piece: True):
+        for peer in self.peers:
+            haves = peer.download.have
+            piece = self.picker.next(haves, wantfunc, None)
+            expected = self.reference.next(haves, wantfunc, None)
+            if expected is None:
+                self.assertEquals(None, piece)
+                continue
+            self.assertTrue(haves[piece])
+            self.assertTrue(wantfunc(piece))
+            # both pick from the same interest level
+            self.assertEquals(self.reference.level_in_interests[expected],
+                              self.picker.level_in_interests[piece])
+
+    def test_rarest_first(self):
+        for peer in self.peers:
+            for piece in random.sample(xrange(self.numpieces), 100):
+                self.got_have(peer, piece)
+        self.check_next()
+        # a piece only one peer has is picked from that peer
+        rare = self.peers[0]
+        self.got_have(rare, self.numpieces - 1)
+        counts = [sum([p.download.have[i] for p in self.peers]) for i in xrange(self.numpieces)]
+        piece = self.picker.next(rare.download.have, lambda piece: True, None)
+        self.assertEquals(min([counts[i] for i in xrange(self.numpieces) if rare.download.have[i]]), counts[piece])
+
+    def test_wantfunc_and_started(self):
+        for peer in self.peers:
+            for piece in random.sample(xrange(self.numpieces), 50):
+                self.got_have(peer, piece)
+        unwanted = set(random.sample(xrange(self.numpieces), 150))
+        wantfunc = lambda piece: piece not in unwanted
+        self.check_next(wantfunc)
+        for piece in random.sample(xrange(self.numpieces), 20):
+            self.picker.requested(piece)
+            self.reference.requested(piece)
+        self.check_next(wantfunc)
+        self.check_next()
+
+    def test_complete_and_priority(self):
+        for peer in self.peers:
+            for piece in xrange(0, self.numpieces, 3):
+                self.got_have(peer, piece)
+        for piece in xrange(0, self.numpieces, 2):
+            self.picker.complete(piece)
+            self.reference.complete(piece)
+        for piece in xrange(1, self.numpieces, 5):
+            self.picker.set_priority(piece, -1)
+            self.reference.set_priority(piece, -1)
+        self.check_next()
+        for peer in self.peers:
+            piece = self.picker.next(peer.download.have, lambda piece: True, None)
+            self.assertFalse(self.picker.has[piece])
+            self.assertFalse(self.picker.is_blocked(piece))
+
+    def test_lost_have(self):
+        peer = self.peers[0]
+        for piece in xrange(10):
+            self.got_have(peer, piece)
+        for piece in xrange(5):
+            self.picker.lost_have(piece)
+            self.reference.lost_have(piece)
+        self.assertEquals(self.reference.level_in_interests, self.picker.level_in_interests)
+        for level, pieces in enumerate(self.picker.interests):
+            self.assertEquals(sorted(self.reference.interests[level]), list(pieces))
+
+    def test_seed(self):
+        seed = Bitfield(self.numpieces, '\xff' * (self.numpieces / 8) + '\xf0')
+        self.assertTrue(seed.complete())
+        piece = self.picker.next(seed, lambda piece: True, None)
+        self.assertTrue(0 <= piece < self.numpieces)
+
+if __name__ == "__main__":
+    unittest.main()
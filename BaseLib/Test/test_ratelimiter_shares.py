@@ -0,0 +1,148 @@
+import unittest
+
+import BaseLib.Core.BitTornado.RateLimiter as RateLimiterModule
+from BaseLib.Core.BitTornado.RateLimiter import RateLimiter, UploadScheduler
+
+UNIT = 1000
+STEP = 0.01
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.tasks = []
+
+    def __call__(self):
+        return self.now
+
+    def add_task(self, func, delay = 0):
+        self.tasks.append((self.now + delay, func))
+
+    def run(self, seconds):
+        end = self.now + seconds
+        while self.now < end:
+            self.now += STEP
+            due = [task for task in self.tasks if task[0] <= self.now]
+            self.tasks = [task for task in self.tasks if task[0] > self.now]
+            for when, func in due:
+                func()
+
+class FakeConnection:
+    """ The parts of Connecter.Connection that RateLimiter uses, always has
+    data to send unless it was given a budget """
+    def __init__(self, ip = '1.2.3.4', budget = None):
+        self.ip = ip
+        self.budget = budget
+        self.sent = 0
+        self.next_upload = None
+        self.upload_class = None
+        self.connection = self
+        self.upload = self
+        self.buffer = []
+
+    def is_coordinator_con(self):
+        return False
+
+    def get_ip(self):
+        return self.ip
+
+    def send_partial(self, bytes):
+        if self.budget is not None:
+            bytes = min(bytes, self.budget - self.sent)
+        self.sent += bytes
+        return bytes
+
+    def backlogged(self):
+        return False
+
+class TestRateLimiterShares(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.oldclock = RateLimiterModule.clock
+        RateLimiterModule.clock = self.clock
+
+    def tearDown(self):
+        RateLimiterModule.clock = self.oldclock
+        UploadScheduler.delInstance()
+
+    def make_limiter(self, parent = None, weight = 1, rate = 0):
+        limiter = RateLimiter(self.clock.add_task, UNIT, parent = parent, weight = weight)
+        limiter.set_upload_rate(rate)
+        return limiter
+
+    def assertShare(self, expected, sent, total):
+        self.assertAlmostEquals(expected, float(sent) / total, 1)
+
+    def test_single_limiter(self):
+        limiter = self.make_limiter(rate = 50)
+        a, b = FakeConnection(), FakeConnection()
+        limiter.queue(a)
+        limiter.queue(b)
+        self.clock.run(10)
+        self.assertAlmostEquals(500000, a.sent + b.sent, -4)
+        self.assertShare(0.5, a.sent, a.sent + b.sent)
+
+    def test_weights(self):
+        root = UploadScheduler.getInstance(self.clock.add_task, 100)
+        a = FakeConnection()
+        b = FakeConnection()
+        self.make_limiter(root, 1).queue(a)
+        self.make_limiter(root, 3).queue(b)
+        self.clock.run(10)
+        self.assertAlmostEquals(1000000, a.sent + b.sent, -4)
+        self.assertShare(0.25, a.sent, a.sent + b.sent)
+
+    def test_borrowing(self):
+        root = UploadScheduler.getInstance(self.clock.add_task, 100)
+        a = FakeConnection(budget = 100000)
+        b = FakeConnection()
+        limiter = self.make_limiter(root, 3)
+        limiter.queue(a)
+        self.make_limiter(root, 1).queue(b)
+        self.clock.run(10)
+        # b uses what a leaves when it runs out of data
+        self.assertEquals(100000, a.sent)
+        self.assertAlmostEquals(900000, b.sent, -4)
+        self.assertFalse(limiter in root.active)
+
+    def test_torrent_limit(self):
+        root = UploadScheduler.getInstance(self.clock.add_task, 100)
+        a = FakeConnection()
+        b = FakeConnection()
+        self.make_limiter(root, 1, 20).queue(a)
+        self.make_limiter(root, 1).queue(b)
+        self.clock.run(10)
+        self.assertAlmostEquals(200000, a.sent, -4)
+        self.assertAlmostEquals(800000, b.sent, -4)
+
+    def test_requeue(self):
+        root = UploadScheduler.getInstance(self.clock.add_task, 100)
+        limiter = self.make_limiter(root)
+        a = FakeConnection(budget = 5000)
+        limiter.queue(a)
+        self.clock.run(1)
+        self.assertEquals(5000, a.sent)
+        self.assertEquals(None, a.next_upload)
+        a.budget = 10000
+        limiter.queue(a)
+        self.clock.run(1)
+        self.assertEquals(10000, a.sent)
+
+    def test_peer_classes(self):
+        root = UploadScheduler.getInstance(self.clock.add_task, 100,
+                                           ['10.0.0.0/8'], 3, 1)
+        limiter = self.make_limiter(root)
+        local = FakeConnection('10.1.2.3')
+        remote = [FakeConnection('130.83.1.%d' % i) for i in xrange(3)]
+        limiter.queue(local)
+        for conn in remote:
+            limiter.queue(conn)
+        self.clock.run(10)
+        self.assertEquals('local', local.upload_class)
+        self.assertEquals('remote', remote[0].upload_class)
+        total = local.sent + sum([conn.sent for conn in remote])
+        self.assertShare(0.75, local.sent, total)
+
+
+if __name__ == "__main__":
+    unittest.main()
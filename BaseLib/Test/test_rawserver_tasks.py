@@ -0,0 +1,89 @@
+import unittest
+from threading import Event
+
+from BaseLib.Core.BitTornado.RawServer import RawServer
+
+class TestRawServerTasks(unittest.TestCase):
+    
+    def setUp(self):
+        self.doneflag = Event()
+        self.rawserver = RawServer(self.doneflag, 60, 60, ipv6_enable = False)
+        self.calls = []
+        
+    def tearDown(self):
+        self.rawserver.shutdown()
+    
+    def run_tasks(self, timeout = 0.5):
+        self.rawserver.add_task(self.doneflag.set, timeout)
+        self.rawserver.listen_forever(None)
+    
+    def task(self, name):
+        return lambda: self.calls.append(name)
+
+    def test_order(self):
+        self.rawserver.add_task(self.task('c'), 0.2)
+        self.rawserver.add_task(self.task('a'), 0)
+        self.rawserver.add_task(self.task('b'), 0.1)
+        self.rawserver.add_task(self.task('a2'), 0)
+        self.run_tasks()
+        self.assertEquals(['a', 'a2', 'b', 'c'], self.calls)
+
+    def test_cancel_handle(self):
+        handle = self.rawserver.add_task(self.task('cancelled'), 0.1)
+        self.rawserver.add_task(self.task('kept'), 0.1)
+        handle.cancel()
+        self.run_tasks()
+        self.assertEquals(['kept'], self.calls)
+        
+    def test_cancel_handle_bookkeeping(self):
+        handles = [self.rawserver.add_task(self.task(i), 10, id = 'torrent1')
+                   for i in range(10)]
+        self.rawserver.pop_external()
+        for handle in handles[:4]:
+            handle.cancel()
+        handles[0].cancel()
+        self.rawserver._kill_tasks()
+        self.assertEquals(4, self.rawserver.cancelled_tasks)
+        self.assertEquals(6, len(self.rawserver.tasks_by_id['torrent1']))
+        # compaction drops the cancelled tasks once they are the majority
+        for handle in handles[4:]:
+            handle.cancel()
+        self.rawserver._kill_tasks()
+        self.assertEquals(0, self.rawserver.cancelled_tasks)
+        self.assertFalse(self.rawserver.tasks_by_id.has_key('torrent1'))
+        self.assertEquals(1, len(self.rawserver.funcs)) # scan_for_timeouts
+
+    def test_kill_tasks(self):
+        self.rawserver.add_task(self.task('a'), 0.1, id = 'torrent1')
+        self.rawserver.add_task(self.task('b'), 0.2, id = 'torrent1')
+        self.rawserver.add_task(self.task('c'), 0.1, id = 'torrent2')
+        def kill():
+            self.rawserver.kill_tasks('torrent1')
+        self.rawserver.add_task(kill, 0)
+        self.run_tasks()
+        self.assertEquals(['c'], self.calls)
+        self.assertFalse(self.rawserver.tasks_by_id.has_key('torrent1'))
+        
+    def test_task_stats(self):
+        self.rawserver.add_task(self.task_method, 0)
+        self.rawserver.add_task(self.task_method, 0.05)
+        self.run_tasks()
+        calls, total, longest = self.rawserver.get_task_stats()['TestRawServerTasks.task_method']
+        self.assertEquals(2, calls)
+        self.assertTrue(total >= longest >= 0)
+        
+    def task_method(self):
+        self.calls.append('method')
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRawServerTasks))
+    
+    return suite
+        
+def main():
+    unittest.main(defaultTest='test_suite')
+
+    
+if __name__ == '__main__':
+    main()     
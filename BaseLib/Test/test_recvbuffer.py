@@ -0,0 +1,128 @@
+import unittest
+from struct import pack, unpack
+from threading import Event
+
+from BaseLib.Core.BitTornado.RawServer import RawServer
+from BaseLib.Core.BitTornado.recvbuffer import RecvBuffer, MIN_READ
+
+class FakeSocket:
+    def __init__(self, data):
+        self.data = data
+
+    def recv_into(self, view, nbytes):
+        chunk = self.data[:nbytes]
+        self.data = self.data[nbytes:]
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+class MessageReader:
+    """ Parses length-prefixed messages in place, like Encrypter.Connection """
+    def __init__(self, doneflag, count):
+        self.recvbuf = RecvBuffer(1024)
+        self.doneflag = doneflag
+        self.count = count
+        self.messages = []
+        self.next_len, self.next_func = 4, self.read_len
+
+    def external_connection_made(self, s):
+        s.set_handler(self)
+
+    def buffer_came_in(self, s, amount):
+        while True:
+            m = self.recvbuf.read(self.next_len)
+            if m is None:
+                self.recvbuf.reserve(self.next_len)
+                return
+            self.next_len, self.next_func = self.next_func(m)
+
+    def read_len(self, m):
+        return unpack('>L', m)[0], self.read_message
+
+    def read_message(self, m):
+        self.messages.append(m.tobytes())
+        if len(self.messages) == self.count:
+            self.doneflag.set()
+        return 4, self.read_len
+
+    def data_came_in(self, s, data):
+        raise AssertionError('recvbuf not used')
+
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+class Writer:
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+class TestRecvBuffer(unittest.TestCase):
+
+    def test_read(self):
+        buf = RecvBuffer(64)
+        buf.write('abcdef')
+        self.assertEquals(None, buf.read(7))
+        self.assertEquals('abc', buf.read(3).tobytes())
+        self.assertEquals(3, len(buf))
+        self.assertEquals('def', buf.read(3).tobytes())
+        # all data consumed, the next data is stored at the front
+        self.assertEquals(0, buf.start)
+        self.assertEquals(0, buf.end)
+
+    def test_reserve_compacts(self):
+        buf = RecvBuffer(16)
+        buf.write('x' * 12 + 'abcd')
+        buf.read(12)
+        buf.reserve(10)
+        self.assertEquals(0, buf.start)
+        self.assertEquals(16, buf.capacity())
+        buf.write('efghij')
+        self.assertEquals('abcdefghij', buf.read(10).tobytes())
+
+    def test_reserve_grows(self):
+        buf = RecvBuffer(16)
+        buf.write('abc')
+        view = buf.read(1)
+        buf.reserve(100)
+        self.assertTrue(buf.capacity() >= 100)
+        self.assertEquals('a', view.tobytes())
+        self.assertEquals('bc', buf.read(2).tobytes())
+
+    def test_recv_from(self):
+        buf = RecvBuffer(2 * MIN_READ)
+        data = ''.join([chr(i % 256) for i in xrange(5 * MIN_READ)])
+        sock = FakeSocket(data)
+        received = []
+        while True:
+            amount = buf.recv_from(sock, MIN_READ + 10)
+            if not amount:
+                break
+            self.assertTrue(amount <= MIN_READ + 10)
+            m = buf.read(min(len(buf), 1000))
+            received.append(m.tobytes())
+        received.append(buf.read(len(buf)).tobytes())
+        self.assertEquals(data, ''.join(received))
+
+class TestRecvInto(unittest.TestCase):
+
+    def test_loopback(self):
+        doneflag = Event()
+        rawserver = RawServer(doneflag, 60, 60, ipv6_enable = False)
+        try:
+            port = rawserver.find_and_bind(0, 20000, 30000, bind = ['127.0.0.1'], reuse = True)
+            messages = ['', 'x', 'y' * 5000, 'z' * 100]
+            reader = MessageReader(doneflag, len(messages))
+            s = rawserver.start_connection(('127.0.0.1', port), Writer())
+            s.write(''.join([pack('>L', len(m)) + m for m in messages]))
+            rawserver.add_task(doneflag.set, 5)
+            rawserver.listen_forever(reader)
+            self.assertEquals(messages, reader.messages)
+        finally:
+            rawserver.shutdown()
+
+if __name__ == "__main__":
+    unittest.main()
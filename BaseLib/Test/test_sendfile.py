@@ -0,0 +1,105 @@
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from threading import Event
+
+from BaseLib.Core.BitTornado.SocketHandler import SingleSocket
+from BaseLib.Core.BitTornado.BT1.Storage import Storage
+from BaseLib.Core.BitTornado.zerocopy import have_sendfile
+
+class FakePoll:
+    def register(self, sock, mask):
+        pass
+
+class FakeSocketHandler:
+    def __init__(self):
+        self.poll = FakePoll()
+        self.dead_from_write = []
+
+def recvall(sock, amount):
+    data = []
+    while amount > 0:
+        s = sock.recv(amount)
+        if not s:
+            break
+        data.append(s)
+        amount -= len(s)
+    return ''.join(data)
+
+class TestSendfile(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.data = [os.urandom(40000), os.urandom(30000)]
+        files = []
+        for i, data in enumerate(self.data):
+            name = os.path.join(self.dir, 'f%d' % i)
+            open(name, 'wb').write(data)
+            files.append((name, len(data)))
+        self.storage = Storage(files, 2 ** 14, Event(), {'max_files_open': 50})
+        self.sender, self.receiver = socket.socketpair()
+        self.sender.setblocking(0)
+        self.s = SingleSocket(FakeSocketHandler(), self.sender, None)
+        self.s.connected = True
+
+    def tearDown(self):
+        self.storage.close()
+        self.sender.close()
+        self.receiver.close()
+        shutil.rmtree(self.dir)
+
+    def test_regions_span_files(self):
+        regions = self.storage.get_file_regions(39000, 2000)
+        self.assertEquals([1000, 1000], [len(r) for r in regions])
+        self.assertEquals(self.data[0][39000:] + self.data[1][:1000],
+                          ''.join([r.tostring() for r in regions]))
+        # regions of a file share one duplicated descriptor
+        region = self.storage.get_file_regions(100, 10)[0]
+        self.assertTrue(region.file is regions[0].file)
+
+    def test_split(self):
+        region = self.storage.get_file_regions(0, 1000)[0]
+        head = region.split(300)
+        self.assertEquals(self.data[0][:300], head.tostring())
+        self.assertEquals(self.data[0][300:1000], region.tostring())
+        self.assertTrue(region.follows(head))
+
+    def test_consecutive_regions_are_merged(self):
+        self.s.connected = False
+        regions = self.storage.get_file_regions(0, 1000)
+        self.s.write_file([regions[0].split(400)])
+        self.s.write_file(regions)
+        self.assertEquals(1, len(self.s.buffer))
+        self.assertEquals(1000, self.s.get_queued_bytes())
+
+    if have_sendfile:
+        def test_send_regions_between_messages(self):
+            self.s.write('header')
+            self.s.write_file(self.storage.get_file_regions(39000, 2000))
+            self.s.write('trailer')
+            self.assertTrue(self.s.is_flushed())
+            expected = 'header' + self.data[0][39000:] + self.data[1][:1000] + 'trailer'
+            self.assertEquals(expected, recvall(self.receiver, len(expected)))
+
+        def test_partial_sendfile(self):
+            # more than the socket buffer can take
+            size = self.sender.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF) * 4
+            data = os.urandom(size)
+            name = os.path.join(self.dir, 'big')
+            open(name, 'wb').write(data)
+            storage = Storage([(name, size)], 2 ** 14, Event(), {'max_files_open': 50})
+            self.s.write_file(storage.get_file_regions(0, size))
+            self.assertFalse(self.s.is_flushed())
+            received = []
+            while not self.s.is_flushed():
+                received.append(self.receiver.recv(65536))
+                self.s.try_write()
+            self.assertEquals(0, self.s.get_queued_bytes())
+            received.append(recvall(self.receiver, size - len(''.join(received))))
+            self.assertEquals(data, ''.join(received))
+            storage.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import unittest
+
+from BaseLib.Core.BitTornado.SocketHandler import SingleSocket, SEND_NOCOPY, SEND_COALESCE
+
+class FakePoll:
+    def register(self, sock, mask):
+        pass
+
+class FakeSocketHandler:
+    def __init__(self):
+        self.poll = FakePoll()
+        self.dead_from_write = []
+
+class FakeSocket:
+    """ Accepts at most limit bytes per send() call """
+    def __init__(self, limit):
+        self.limit = limit
+        self.sends = []
+
+    def fileno(self):
+        return 42
+
+    def getsockname(self):
+        return ('127.0.0.1', 1)
+
+    def getpeername(self):
+        return ('127.0.0.1', 2)
+
+    def send(self, data):
+        data = str(data)[:self.limit]
+        self.sends.append(data)
+        return len(data)
+
+class TestSendQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.sock = FakeSocket(10 ** 9)
+        self.s = SingleSocket(FakeSocketHandler(), self.sock, None)
+
+    def test_small_messages_are_coalesced(self):
+        # not connected yet: the messages are queued
+        for i in xrange(100):
+            self.s.write('m%02d' % i)
+        self.assertEquals(300, self.s.get_queued_bytes())
+        self.s.connected = True
+        self.s.try_write()
+        self.assertEquals(1, len(self.sock.sends))
+        self.assertEquals(''.join(['m%02d' % i for i in xrange(100)]), self.sock.sends[0])
+        self.assertTrue(self.s.is_flushed())
+        self.assertEquals(0, self.s.get_queued_bytes())
+
+    def test_coalescing_is_bounded(self):
+        for i in xrange(3):
+            self.s.write('x' * (SEND_NOCOPY - 1))
+        self.s.write('y' * SEND_COALESCE)
+        self.s.connected = True
+        self.s.try_write()
+        self.assertEquals([3 * (SEND_NOCOPY - 1), SEND_COALESCE], [len(x) for x in self.sock.sends])
+
+    def test_buffers_are_not_joined(self):
+        # the header of a PIECE message and a view into its data
+        data = 'd' * SEND_NOCOPY
+        self.s.write('header')
+        self.s.write(buffer(data))
+        self.s.write('have')
+        self.s.connected = True
+        self.s.try_write()
+        self.assertEquals(['header', data, 'have'], self.sock.sends)
+
+    def test_small_buffers_are_not_joined(self):
+        data = 'd' * 5000
+        self.s.write('x' * 13)
+        self.s.write(buffer(data))
+        self.s.write('have')
+        self.s.connected = True
+        self.s.try_write()
+        # once it is at the front the view is copied like a string
+        self.assertEquals(['x' * 13, data + 'have'], self.sock.sends)
+        self.assertTrue(self.s.is_flushed())
+
+    def test_partial_writes(self):
+        self.sock.limit = 1000
+        piece = ''.join([chr(i % 256) for i in xrange(SEND_NOCOPY * 2)])
+        self.s.write(piece)
+        self.s.write('have')
+        self.s.connected = True
+        while not self.s.is_flushed():
+            self.assertEquals(len(piece) + 4 - 1000 * len(self.sock.sends), self.s.get_queued_bytes())
+            self.s.try_write()
+        self.assertEquals(piece + 'have', ''.join(self.sock.sends))
+        self.assertEquals(0, self.s.offset)
+
+if __name__ == "__main__":
+    unittest.main()
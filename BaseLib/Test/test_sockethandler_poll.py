@@ -0,0 +1,111 @@
+import socket
+import unittest
+from threading import Event
+
+from BaseLib.Core.BitTornado.RawServer import RawServer
+from BaseLib.Core.BitTornado.SocketHandler import POLLIN, POLLOUT, POLL_BACKENDS, create_poll
+from BaseLib.Core.BitTornado import SocketHandler
+
+class Receiver:
+    def __init__(self, expected, doneflag):
+        self.expected = expected
+        self.doneflag = doneflag
+        self.data = []
+
+    def external_connection_made(self, s):
+        s.set_handler(self)
+
+    def data_came_in(self, s, data):
+        self.data.append(data)
+        if len(''.join(self.data)) >= self.expected:
+            self.doneflag.set()
+
+    def connection_flushed(self, s):
+        pass
+
+    def connection_lost(self, s):
+        pass
+
+class TestEpollPoll(unittest.TestCase):
+
+    def setUp(self):
+        if SocketHandler.epollpoll is None:
+            self.skipTest("epoll is not available")
+        self.poll, timemult = create_poll('epoll')
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sock.close()
+
+    def test_unchanged_mask_is_not_passed_on(self):
+        self.poll.register(self.sock, POLLIN)
+        self.poll.register(self.sock, POLLIN)
+        self.assertEquals(1, self.poll.modify_calls)
+        self.poll.register(self.sock, POLLIN | POLLOUT)
+        self.poll.register(self.sock.fileno(), POLLIN | POLLOUT)
+        self.assertEquals(2, self.poll.modify_calls)
+        self.assertEquals(POLLIN | POLLOUT, self.poll.get_mask(self.sock))
+        self.poll.unregister(self.sock)
+        self.poll.unregister(self.sock)
+        self.assertEquals(3, self.poll.modify_calls)
+        self.assertEquals(None, self.poll.get_mask(self.sock))
+
+    def test_reused_fd(self):
+        fd = self.sock.fileno()
+        self.poll.register(self.sock, POLLIN)
+        self.sock.close()
+        # the kernel dropped the closed fd, the next socket usually gets its number
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.poll.register(self.sock, POLLOUT)
+        events = self.poll.poll(100)
+        self.assertEquals([(self.sock.fileno(), POLLOUT)], events)
+
+    def test_failed_bind_unregisters_servers(self):
+        handler = SocketHandler.SocketHandler(60, False, poll_backend = 'epoll')
+        self.sock.bind(('127.0.0.1', 0))
+        port = self.sock.getsockname()[1]
+        registered = []
+        register = handler.poll.register
+        def record(f, t):
+            registered.append(f.fileno())
+            register(f, t)
+        handler.poll.register = record
+        try:
+            # the second server cannot get the port, bind closes the first one
+            self.assertRaises(socket.error, handler.bind, port, ['127.0.0.1', '127.0.0.1'])
+            self.assertEquals(1, len(registered))
+            self.assertEquals({}, handler.poll.masks)
+        finally:
+            handler.shutdown()
+        self.assertTrue(handler.poll.epoll.closed)
+
+class TestPollBackends(unittest.TestCase):
+
+    def transfer(self, backend):
+        doneflag = Event()
+        rawserver = RawServer(doneflag, 60, 60, ipv6_enable = False, poll_backend = backend)
+        try:
+            port = rawserver.find_and_bind(0, 20000, 30000, bind = ['127.0.0.1'], reuse = True)
+            receiver = Receiver(100000, doneflag)
+            s = rawserver.start_connection(('127.0.0.1', port), receiver)
+            s.write('x' * 100000)
+            rawserver.add_task(doneflag.set, 5)
+            rawserver.listen_forever(receiver)
+            self.assertEquals('x' * 100000, ''.join(receiver.data))
+            self.assertEquals(backend, rawserver.sockethandler.poll_backend)
+        finally:
+            rawserver.shutdown()
+
+    def test_backends(self):
+        for backend in POLL_BACKENDS:
+            try:
+                create_poll(backend)
+            except ValueError:
+                continue
+            self.transfer(backend)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, create_poll, 'kqueue')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import unittest
+from urllib import quote
+
+from BaseLib.Core.defaults import trackerdefaults
+from BaseLib.Core.BitTornado.bencode import bdecode
+from BaseLib.Core.BitTornado.BT1.track import Tracker
+
+TORRENT1 = '1' * 20
+TORRENT2 = '2' * 20
+
+class FakeRawServer:
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, func, delay = 0, id = None):
+        self.tasks.append(func)
+
+class FakeConnection:
+    def __init__(self, ip):
+        self.ip = ip
+
+    def get_ip(self):
+        return self.ip
+
+def peer(n):
+    return '%020d' % n
+
+class TestTrackerExpiry(unittest.TestCase):
+
+    def setUp(self):
+        config = dict(trackerdefaults)
+        self.dfile = tempfile.mktemp()
+        config['tracker_dfile'] = self.dfile
+        config['tracker_nat_check'] = 0
+        config['tracker_dump_becache'] = 0
+        self.rawserver = FakeRawServer()
+        self.tracker = Tracker(config, self.rawserver)
+        # TrackerStatistics logs the names of the torrents
+        self.tracker.allowed = {TORRENT1: {'name': 'torrent1'},
+                                TORRENT2: {'name': 'torrent2'}}
+
+    def tearDown(self):
+        if os.path.exists(self.dfile):
+            os.remove(self.dfile)
+
+    def announce(self, infohash, n, event = None):
+        path = ('/announce?info_hash=%s&peer_id=%s&port=%d&uploaded=0&downloaded=0'
+                '&left=100&compact=1' % (quote(infohash), peer(n), 6881 + n))
+        if event:
+            path += '&event=' + event
+        code, msg, headers, data = self.tracker.get(FakeConnection('10.0.0.%d' % n), path, {})
+        self.assertEquals(200, code)
+        return bdecode(data)
+
+    def peers(self, infohash):
+        return sorted(self.tracker.downloads.get(infohash, {}).keys())
+
+    def test_stale_peers_expire(self):
+        for n in xrange(1, 7):
+            self.announce(TORRENT1, n, 'started')
+        self.tracker.expire_downloaders()
+        # nobody is older than one interval yet
+        self.assertEquals([peer(n) for n in xrange(1, 7)], self.peers(TORRENT1))
+        for n in (2, 4, 6):
+            self.announce(TORRENT1, n)
+        self.tracker.expire_downloaders()
+        self.assertEquals([peer(2), peer(4), peer(6)], self.peers(TORRENT1))
+        for n in (1, 3, 5):
+            self.assertFalse(self.tracker.expiring.has_key((TORRENT1, peer(n))))
+            self.assertFalse(self.tracker.times[TORRENT1].has_key(peer(n)))
+        # the expired peers are not handed out anymore
+        reply = self.announce(TORRENT1, 2)
+        self.assertEquals(2 * 6, len(reply['peers']))
+        self.tracker.expire_downloaders()
+        self.tracker.expire_downloaders()
+        self.assertEquals([], self.peers(TORRENT1))
+        self.assertEquals({}, self.tracker.announced)
+        self.assertEquals({}, self.tracker.expiring)
+
+    def test_reannounce_moves_peer(self):
+        self.announce(TORRENT1, 1, 'started')
+        self.tracker.expire_downloaders()
+        key = (TORRENT1, peer(1))
+        self.assertTrue(self.tracker.expiring.has_key(key))
+        self.announce(TORRENT1, 1)
+        self.assertFalse(self.tracker.expiring.has_key(key))
+        self.assertTrue(self.tracker.announced.has_key(key))
+
+    def test_stopped_peer_is_removed(self):
+        self.announce(TORRENT1, 1, 'started')
+        self.announce(TORRENT1, 2, 'started')
+        self.announce(TORRENT1, 1, 'stopped')
+        self.assertEquals([peer(2)], self.peers(TORRENT1))
+        self.assertFalse(self.tracker.announced.has_key((TORRENT1, peer(1))))
+
+    def test_empty_torrents_are_removed(self):
+        self.announce(TORRENT1, 1, 'started')
+        self.announce(TORRENT2, 2, 'started')
+        self.tracker.expire_downloaders()
+        self.announce(TORRENT2, 2)
+        # torrents that are still allowed are kept when they run empty
+        self.tracker.expire_downloaders()
+        self.assertEquals([], self.peers(TORRENT1))
+        self.assertTrue(self.tracker.downloads.has_key(TORRENT1))
+        del self.tracker.allowed[TORRENT1]
+        self.tracker.maybe_empty[TORRENT1] = 1
+        self.announce(TORRENT2, 2)
+        self.tracker.expire_downloaders()
+        self.assertFalse(self.tracker.downloads.has_key(TORRENT1))
+        self.assertFalse(self.tracker.seedcount.has_key(TORRENT1))
+        self.assertEquals([peer(2)], self.peers(TORRENT2))
+        self.assertEquals({}, self.tracker.maybe_empty)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,6 +11,7 @@ from SisClient.Common.CommonPeerHandlers import PeerActivityReportEmitter, PeerH
 from SisClient.Testbed.Utils import utils as Testbed_utils
 from threading import RLock
 from SisClient.Common.PeerConfiguration import ConfigurationException
+from SisClient.Common import ReportUploader
 import CacheConsole
 import Ratemanager
 import ReplacementStrategy
@@ -118,7 +119,9 @@ class Cache:
                                                                   self.sconfig,
                                                                   self._cache_config.get_compress_xml_reports(),
                                                                   self._cache_config.get_serialization_method(),
-                                                                  is_iop=True))
+                                                                  is_iop=True,
+                                                                  compress_level=self._cache_config.get_report_compress_level(),
+                                                                  keyframe_interval=self._cache_config.get_report_keyframe_interval()))
                 
     def _init_selector(self):
         selector = None
@@ -160,6 +163,11 @@ class Cache:
         self.sconfig.set_overlay(False)
         self.sconfig.set_megacache(False)
         self.sconfig.set_upnp_mode(simpledefs.UPNPMODE_DISABLED)
+        if self._cache_config.get_rate_management() == 'on_demand':
+            # the engine shares the upload limit between the downloads, see
+            # Ratemanager.ShareOnDemand
+            self.sconfig.set_total_max_upload_rate(self._cache_config.get_upload_limit())
+            self.sconfig.set_upload_local_prefixes(self._cache_config.get_ip_prefixes() or [])
         self.session = API.Session(self.sconfig)
         global session
         session = self.session
@@ -265,7 +273,10 @@ class Cache:
         dlcfg = API.DownloadStartupConfig()
         dlcfg.set_dest_dir(self.save_dir)
         dlcfg.set_max_speed(simpledefs.DOWNLOAD, 1)
-        dlcfg.set_max_speed(simpledefs.UPLOAD, 1)
+        if self._cache_config.get_rate_management() == 'on_demand':
+            dlcfg.set_max_speed(simpledefs.UPLOAD, 0)
+        else:
+            dlcfg.set_max_speed(simpledefs.UPLOAD, 1)
         dlcfg.set_max_uploads(self._cache_config.get_max_upload_slots_per_download())
         min_uploads = min(dlcfg.get_min_uploads(), self._cache_config.get_max_upload_slots_per_download())
         dlcfg.set_min_uploads(min_uploads)
@@ -470,6 +481,8 @@ def on_exit(signal=None, func=None):
     session.shutdown()
     logger.warn("wait some time") 
     time.sleep(1) # wait some time so session can stop gracefully
+    # send the reports that are still queued
+    ReportUploader.getInstance().shutdown(timeout=1.0)
     logger.warn("sys exit (session shutdown takes too long?)")
     sys.exit()
 
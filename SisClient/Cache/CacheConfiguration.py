@@ -57,6 +57,8 @@ class CacheConfiguration(PeerConfiguration):
                    'rate_interval'              :   (int, self.set_rate_interval, self.get_rate_interval),
                    'report_interval'            :   (float, self.set_report_interval, self.get_report_interval),
                    'compress_xml_reports'       :   (lambda x: x == 'True', self.set_compress_xml_reports, self.get_compress_xml_reports),
+                   'report_compress_level'      :   (int, self.set_report_compress_level, self.get_report_compress_level),
+                   'report_keyframe_interval'   :   (int, self.set_report_keyframe_interval, self.get_report_keyframe_interval),
                    'serialization_method'       :   (str, self.set_serialization_method, self.get_serialization_method),
                    'space_limit'                :   (int, self.set_space_limit, self.get_space_limit),
                    'cache_directory'            :   (str, self.set_directory, self.get_directory),
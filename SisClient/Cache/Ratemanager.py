@@ -102,6 +102,12 @@ class ShareEqual(RateManager):
 
 class ShareOnDemand(RateManager, Thread):
     ''' Shares unused transmission rates between the other downloads.
+    
+        The upload limit is enforced by the session (see
+        SessionConfig.set_total_max_upload_rate), whose scheduler gives the
+        rate that a download does not use to the others on every send. The
+        downloads themselves upload without limit. Download rates are still
+        adjusted every rate_interval seconds.
     '''
     
     def __init__(self):
@@ -114,6 +120,11 @@ class ShareOnDemand(RateManager, Thread):
             cache.update_download_settings()
     
     def set_speed(self,dir, downloads):  
+        if dir == UPLOAD:
+            for (download, ds) in downloads:
+                if download.get_max_speed(UPLOAD) != 0:
+                    download.set_max_speed(UPLOAD, 0)
+            return
         todo = []
         available = self.speed_limit[dir]
         self._logger.info("Available %s speed is %d " % (dir, available))
@@ -14,6 +14,7 @@ from BaseLib.Core.API import DownloadStartupConfig
 
 from SisClient.Client.ClientConfiguration import ClientConfiguration
 from SisClient.Common import constants
+from SisClient.Common import ReportUploader
 from SisClient.Testbed.Utils.utils import set_exit_handler
 from SisClient.Testbed.Utils.utils import files_list
 from SisClient.Testbed.Utils.utils import FileUtils
@@ -138,7 +139,9 @@ class Client(object):
                                                                  scfg,
                                                                  self._config.get_compress_xml_reports(),
                                                                  self._config.get_serialization_method(),
-                                                                 report_interval=self._config.get_report_interval()))
+                                                                 report_interval=self._config.get_report_interval(),
+                                                                 compress_level=self._config.get_report_compress_level(),
+                                                                 keyframe_interval=self._config.get_report_keyframe_interval()))
                 
         setup_directories()
         self._logger.info("Client directory is at %s" % self._config.get_directory())
@@ -212,6 +215,8 @@ class Client(object):
             download.stop()
         # shutting down session
         self._session.shutdown(checkpoint=False, gracetime=2.0)
+        # send the reports that are still queued
+        ReportUploader.getInstance().shutdown()
         # call the provided method (cleanup purposes)
         self._cleanup(signal, func)
         os._exit(0)
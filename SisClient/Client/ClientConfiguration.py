@@ -48,6 +48,8 @@ class ClientConfiguration(PeerConfiguration):
             'report_to'         : (str, self.set_report_to, self.get_report_to),
             'serialization_method'  : (str, self.set_serialization_method, self.get_serialization_method),
             'compress_xml_reports'  : (lambda x: x == 'True', self.set_compress_xml_reports, self.get_compress_xml_reports),
+            'report_compress_level' : (int, self.set_report_compress_level, self.get_report_compress_level),
+            'report_keyframe_interval'  : (int, self.set_report_keyframe_interval, self.get_report_keyframe_interval),
             'report_interval'       : (float, self.set_report_interval, self.get_report_interval),
             'internal_id'           : (int, self.set_id, self.get_id),
             'activity_report_interval'      : (int, self.set_activity_report_interval, self.get_activity_report_interval),
@@ -1,15 +1,15 @@
 import logging
 import os
-import pickle
 import time
-import urllib
 
 from binascii import b2a_hex
 from traceback import print_exc
 from BaseLib.Core import simpledefs
 
 from SisClient.Cache.IoP_WSClientImpl import IoP_WSClientImpl
+from SisClient.Common import ReportUploader
 from SisClient.Common.PeerCallbackInterface import PeerCallbackInterface
+from SisClient.Utils import report_delta
 from SisClient.Utils import serialize
 from SisClient.Utils.common_utils import get_id
 
@@ -45,7 +45,8 @@ class PeerHTTPReporter(PeerCallbackInterface):
     '''
     Reporter for the SmoothIT monitoring interface.
     '''
-    def __init__(self, name, id, serverAddress, scfg, compress=False, ser_method='xml', is_iop=False, report_interval=5.0):
+    def __init__(self, name, id, serverAddress, scfg, compress=False, ser_method='xml', is_iop=False, report_interval=5.0,
+                 compress_level=9, uploader=None, keyframe_interval=0):
         self._logger = logging.getLogger("Status.%s" % id)
         self.serverAddress = serverAddress
         self.report_interval = report_interval 
@@ -60,6 +61,22 @@ class PeerHTTPReporter(PeerCallbackInterface):
             if self.compress_xml_reports:
                 self._logger.warn("Enable report compression")
         self.method = ser_method
+        self.codec = serialize.get_codec(ser_method, compress and compress_level or 0)
+        if keyframe_interval and ser_method == 'xml':
+            self._logger.warn("The monitoring server does not take incremental reports, send full reports")
+            keyframe_interval = 0
+        self.keyframe_interval = keyframe_interval
+        # events of the reports that were skipped since the last report
+        self._skipped_events = dict()
+        # reports are sent in the background, shared with the other reporters
+        self.uploader = uploader or ReportUploader.getInstance()
+        self.channel = None
+        if self.serverAddress:
+            try:
+                self.channel = self.uploader.get_http_channel(self.serverAddress, self.codec,
+                                                              keyframe_interval)
+            except ReportUploader.ReportUploadError:
+                self._logger.error("Cannot report to %s" % self.serverAddress, exc_info=True)
         
     def _dispatch_data_to_server(self, report):
         # report at regular intervals
@@ -69,31 +86,22 @@ class PeerHTTPReporter(PeerCallbackInterface):
             self.last_report_ts[filename] = 0
             
         if now - self.last_report_ts[filename] < self.report_interval:
+            if self.keyframe_interval:
+                # incremental reports do not lose the events in between
+                report = report_delta.merge_events(self._skipped_events.get(filename, {}), report)
+                self._skipped_events[filename] = dict([(field, report.get(field))
+                                                       for field in report_delta.EVENTS])
             return
         self.last_report_ts[filename] = now
+        if self._skipped_events.has_key(filename):
+            report = report_delta.merge_events(self._skipped_events.pop(filename), report)
         
-        if self.serverAddress in ["", None]:
+        if self.channel is None:
             self._logger.info("No monitor server specified, skip reporting")
             return
         
-        # serialize the report dict
-        dispatch = None
-        self._logger.info(self.method)
-        if (self.method == "xml"):
-            dispatch = serialize.serialize(report, 
-                                           compress=self.compress_xml_reports,
-                                           encodeBase64=True)
-        else :
-            dispatch = pickle.dumps(report)
-        
-        try: 
-            self._logger.info("send report to "+self.serverAddress)
-            sock = urllib.urlopen(self.serverAddress, dispatch, proxies={})
-            result = sock.read()
-            sock.close()
-        except:
-            self._logger.error("Failed to send report to %s" % self.serverAddress, exc_info=True)
-            #self._logger.info("Report was %s" % report)
+        # a newer report of the same download replaces one that is still queued
+        self.uploader.submit(self.channel, report, key=filename)
         
     def state_callback(self, ds):
         
@@ -333,13 +341,34 @@ class PeerLocalReporter(PeerCallbackInterface):
     
 #___________________________________________________________________________________________________
 
+class ActivityReportChannel(ReportUploader.ReportChannel):
+    '''
+    Sends activity reports to the IoP endpoint of the SIS. A report is the
+    list of download tuples of one download, the reports of a batch are sent
+    in one call.
+    '''
+    max_batch = ReportUploader.MAX_BATCH
+    
+    def __init__(self, ws, own_addr):
+        self._ws = ws
+        self._own_address = own_addr
+        
+    def send(self, reports):
+        downloads = []
+        for report in reports:
+            downloads.extend(report)
+        self._ws.report_activity(self._own_address[0], self._own_address[1], downloads)
+
 class PeerActivityReportEmitter(PeerCallbackInterface):
-    def __init__(self, own_addr, emit_interval, sis_iop_endpoint_url="http://localhost:8080/sis/IoPEndpoint"):
+    def __init__(self, own_addr, emit_interval, sis_iop_endpoint_url="http://localhost:8080/sis/IoPEndpoint",
+                 uploader=None):
         self._emit_interval = emit_interval # in seconds
         self._ws = IoP_WSClientImpl(sis_iop_endpoint_url)
         self._last_timestamp = time.time()
         self._own_address = own_addr
         self._logger = logging.getLogger("Status.%s" % self.__class__.__name__)
+        self._uploader = uploader or ReportUploader.getInstance()
+        self._channel = ActivityReportChannel(self._ws, own_addr)
     
     def state_callback(self, ds):
         self._logger.debug("state_callback called")
@@ -359,7 +388,7 @@ class PeerActivityReportEmitter(PeerCallbackInterface):
             torrent_size = d.get_def().get_length()
             downloads = [ ( torrent_id, torrent_url, torrent_size, torrent_progress ) ]
         
-            self._ws.report_activity(self._own_address[0], self._own_address[1], downloads)
+            self._uploader.submit(self._channel, downloads, key=torrent_id)
             self._last_timestamp = ts
         except:
             self._logger.error("an error occured: could not retrieve torrent stats from resp. download object")
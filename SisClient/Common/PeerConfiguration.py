@@ -31,6 +31,8 @@ class PeerConfiguration(object):
         self._report_interval = 10.0
         self._ip_prefixes = ['127.0.0.1/24']
         self._compress_xml_reports = False
+        self._report_compress_level = 9
+        self._report_keyframe_interval = 0
         self._serialization_method = 'xml'
         self._locality_pref = float(0.9)
         self._max_upload_slots_per_download = dldefaults['max_uploads']
@@ -152,6 +154,20 @@ class PeerConfiguration(object):
     def set_compress_xml_reports(self, compress_xml_reports):
         self._compress_xml_reports = compress_xml_reports
         
+    def get_report_compress_level(self):
+        return self._report_compress_level
+    
+    def set_report_compress_level(self, report_compress_level):
+        assert 1 <= report_compress_level <= 9
+        self._report_compress_level = report_compress_level
+        
+    def get_report_keyframe_interval(self):
+        return self._report_keyframe_interval
+    
+    def set_report_keyframe_interval(self, report_keyframe_interval):
+        assert report_keyframe_interval >= 0
+        self._report_keyframe_interval = report_keyframe_interval
+        
     def get_locality_preference(self):
         return self._locality_pref
         
@@ -0,0 +1,378 @@
+import httplib
+import logging
+import socket
+import threading
+import time
+import urlparse
+
+from collections import deque
+
+from SisClient.Utils import report_delta
+
+'''
+Background pipeline for status reports. Reporters submit their reports to
+the process-wide ReportUploader and return immediately. A worker thread
+sends the queued reports in batches, one batch per request, over a
+persistent connection per destination.
+
+<code>
+uploader = ReportUploader.getInstance()
+channel = uploader.get_http_channel("http://localhost:8888/", codec)
+uploader.submit(channel, report, key=filename)
+</code>
+
+A destination is a ReportChannel. It decides how many reports fit into one
+request, how they are encoded and how often it may be contacted. Reports
+submitted with a key replace the queued report of the same key and channel,
+e.g. an older status report of the same download. If the queue is full the
+oldest report is dropped.
+'''
+
+MAX_QUEUE = 200         # reports waiting to be sent
+MAX_BATCH = 20          # reports per request
+SEND_TIMEOUT = 10.0     # seconds
+LATENCY_SAMPLES = 100   # sends the latency metrics are averaged over
+
+_instance = None
+_instance_lock = threading.Lock()
+
+def getInstance():
+    global _instance
+    _instance_lock.acquire()
+    try:
+        if _instance is None:
+            _instance = ReportUploader()
+        return _instance
+    finally:
+        _instance_lock.release()
+
+class ReportUploadError(Exception):
+    pass
+
+#___________________________________________________________________________________________________
+
+class ReportChannel(object):
+    '''
+    A destination of reports. send is only called by the worker thread of
+    the uploader and may block up to its timeout.
+    '''
+    max_batch = 1
+    # minimum time in seconds between the starts of two sends
+    interval = 0.0
+
+    def merge(self, queued_report, report):
+        '''Returns the report that replaces a queued report of the same key.'''
+        return report
+
+    def send(self, reports):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+class HTTPReportChannel(ReportChannel):
+    '''
+    POSTs reports to a URL over a keep-alive connection. A batch of several
+    reports is encoded as one list, a single report as itself.
+    
+    With a keyframe_interval the reports of a download are sent as deltas
+    against the report that was sent before (see report_delta). The deltas
+    are computed when the reports are sent, so reports that are replaced in
+    the queue or dropped do not break them. A failed send makes the next
+    report of every download a keyframe.
+    '''
+    def __init__(self, url, codec, max_batch=MAX_BATCH, timeout=SEND_TIMEOUT, keyframe_interval=0):
+        scheme, netloc, path, query = urlparse.urlsplit(url)[:4]
+        if scheme not in ("http", "https") or not netloc:
+            raise ReportUploadError("Cannot send reports to %s" % url)
+        self.url = url
+        self.codec = codec
+        self.max_batch = max_batch
+        self._scheme = scheme
+        self._netloc = netloc
+        self._path = path or "/"
+        if query:
+            self._path += "?" + query
+        self._timeout = timeout
+        self._conn = None
+        self._delta_encoder = None
+        if keyframe_interval:
+            self._delta_encoder = report_delta.ReportDeltaEncoder(keyframe_interval)
+
+    def encode(self, reports):
+        if len(reports) == 1:
+            return self.codec.encode(reports[0])
+        return self.codec.encode(reports)
+
+    def handle_response(self, data):
+        pass
+
+    def merge(self, queued_report, report):
+        if self._delta_encoder is not None:
+            # the events of the replaced report are only in this one
+            return report_delta.merge_events(queued_report, report)
+        return report
+
+    def send(self, reports):
+        if self._delta_encoder is None:
+            self.handle_response(self.post(self.encode(reports)))
+            return
+        try:
+            reports = [self._delta_encoder.encode(report) for report in reports]
+            self.handle_response(self.post(self.encode(reports)))
+        except:
+            self._delta_encoder.reset()
+            raise
+
+    def post(self, body):
+        '''POSTs body and returns the response body. A request on a reused
+        connection is repeated once on a new connection, the server may have
+        closed it in the meantime.'''
+        while True:
+            reused = self._conn is not None
+            if not reused:
+                if self._scheme == "https":
+                    self._conn = httplib.HTTPSConnection(self._netloc, timeout=self._timeout)
+                else:
+                    self._conn = httplib.HTTPConnection(self._netloc, timeout=self._timeout)
+            try:
+                self._conn.request("POST", self._path, body,
+                                   { "Content-Type" : "application/x-www-form-urlencoded" })
+                response = self._conn.getresponse()
+                data = response.read()
+            except (httplib.HTTPException, socket.error):
+                self.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                self.close()
+            if response.status >= 300:
+                raise ReportUploadError("%s answered %d %s" % (self.url, response.status, response.reason))
+            return data
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+#___________________________________________________________________________________________________
+
+class ReportUploader(object):
+    '''
+    Bounded queue of reports and the worker thread that sends them. The
+    thread is started with the first report.
+    '''
+    def __init__(self, max_queue=MAX_QUEUE):
+        self._logger = logging.getLogger("Status.ReportUploader")
+        self._max_queue = max_queue
+        self._cond = threading.Condition()
+        # entries [channel, key, report], oldest first
+        self._queue = deque()
+        # (channel, key): entry of a queued report that has a key
+        self._queued = {}
+        self._channels = {}
+        # channel: time its last send started
+        self._last_send = {}
+        self._thread = None
+        self._stopped = False
+        self._flushing = False
+        self._sending = False
+        self._latencies = deque()
+        self._metrics = { "submitted"      : 0,
+                          "coalesced"      : 0,
+                          "dropped"        : 0,
+                          "sent_reports"   : 0,
+                          "sent_batches"   : 0,
+                          "failed_batches" : 0,
+                          "max_queue_depth": 0 }
+
+    def get_http_channel(self, url, codec, keyframe_interval=0):
+        '''Returns the channel to url for reports encoded by codec, reporters
+        with the same destination share it. A keyframe_interval enables
+        delta reports.'''
+        key = (url, codec.name, codec.compress_level, keyframe_interval)
+        self._cond.acquire()
+        try:
+            if not self._channels.has_key(key):
+                # the monitoring server takes a single XML report per request
+                max_batch = MAX_BATCH
+                if codec.name == "xml":
+                    max_batch = 1
+                self._channels[key] = HTTPReportChannel(url, codec, max_batch,
+                                                        keyframe_interval=keyframe_interval)
+            return self._channels[key]
+        finally:
+            self._cond.release()
+
+    def submit(self, channel, report, key=None):
+        '''Queues report for channel. Returns False if the uploader is shut
+        down.'''
+        self._cond.acquire()
+        try:
+            if self._stopped:
+                return False
+            self._metrics["submitted"] += 1
+            if key is not None:
+                entry = self._queued.get((channel, key))
+                if entry is not None:
+                    entry[2] = channel.merge(entry[2], report)
+                    self._metrics["coalesced"] += 1
+                    return True
+            if len(self._queue) >= self._max_queue:
+                self._remove(self._queue.popleft())
+                self._metrics["dropped"] += 1
+            entry = [channel, key, report]
+            self._queue.append(entry)
+            if key is not None:
+                self._queued[(channel, key)] = entry
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], len(self._queue))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="ReportUploader")
+                self._thread.setDaemon(True)
+                self._thread.start()
+            self._cond.notifyAll()
+            return True
+        finally:
+            self._cond.release()
+
+    def get_metrics(self):
+        '''Returns the counters of the uploader, the current queue depth and
+        the send latency in seconds (of the last LATENCY_SAMPLES sends).'''
+        self._cond.acquire()
+        try:
+            metrics = dict(self._metrics)
+            metrics["queue_depth"] = len(self._queue)
+            if self._latencies:
+                metrics["send_latency_last"] = self._latencies[-1]
+                metrics["send_latency_avg"] = sum(self._latencies) / len(self._latencies)
+                metrics["send_latency_max"] = max(self._latencies)
+            else:
+                metrics["send_latency_last"] = metrics["send_latency_avg"] = metrics["send_latency_max"] = 0.0
+            return metrics
+        finally:
+            self._cond.release()
+
+    def flush(self, timeout=None):
+        '''Waits until all queued reports are sent, ignoring the intervals of
+        the channels. Returns False if they were not sent within timeout.'''
+        self._cond.acquire()
+        try:
+            self._flushing = True
+            self._cond.notifyAll()
+            deadline = timeout is not None and time.time() + timeout
+            while self._queue or self._sending:
+                remaining = None
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                self._cond.wait(remaining)
+            self._flushing = False
+            return not (self._queue or self._sending)
+        finally:
+            self._cond.release()
+
+    def shutdown(self, timeout=2.0):
+        '''Sends what is queued for up to timeout seconds, then stops the
+        worker thread and closes the channels.'''
+        sent = self.flush(timeout)
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            if not sent:
+                self._logger.warn("Dropped %d reports at shutdown" % len(self._queue))
+            self._queue.clear()
+            self._queued.clear()
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _remove(self, entry):
+        channel, key = entry[0], entry[1]
+        if key is not None and self._queued.get((channel, key)) is entry:
+            del self._queued[(channel, key)]
+
+    def _next_batch(self, now):
+        '''Removes the reports of the channel with the oldest due report from
+        the queue. Returns the channel and its reports, or None and the time
+        until the next channel is due.'''
+        wait = None
+        for entry in self._queue:
+            channel = entry[0]
+            due = self._last_send.get(channel, 0.0) + channel.interval
+            if due <= now or self._flushing:
+                break
+            if wait is None or due - now < wait:
+                wait = due - now
+        else:
+            return None, wait
+        reports = []
+        remaining = deque()
+        for entry in self._queue:
+            if entry[0] is channel and len(reports) < channel.max_batch:
+                self._remove(entry)
+                reports.append(entry[2])
+            else:
+                remaining.append(entry)
+        self._queue = remaining
+        return channel, reports
+
+    def _run(self):
+        try:
+            while True:
+                self._cond.acquire()
+                try:
+                    self._sending = False
+                    self._cond.notifyAll()
+                    while True:
+                        if self._stopped:
+                            for channel in self._last_send.keys():
+                                channel.close()
+                            return
+                        channel, reports = self._next_batch(time.time())
+                        if channel is not None:
+                            break
+                        self._cond.wait(reports)
+                    self._sending = True
+                    start = self._last_send[channel] = time.time()
+                finally:
+                    self._cond.release()
+                self._send(channel, reports, start)
+        except:
+            if time is None:
+                # the interpreter shuts down and has cleared the module globals
+                return
+            self._logger.exception("Report uploader failed")
+            self._cond.acquire()
+            try:
+                # the next submit() starts a new worker
+                self._thread = None
+                self._sending = False
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+
+    def _send(self, channel, reports, start):
+        try:
+            channel.send(reports)
+            failed = False
+        except:
+            self._logger.warning("Failed to send %d reports" % len(reports), exc_info=True)
+            failed = True
+        latency = time.time() - start
+        self._cond.acquire()
+        try:
+            if failed:
+                self._metrics["failed_batches"] += 1
+            else:
+                self._metrics["sent_batches"] += 1
+                self._metrics["sent_reports"] += len(reports)
+            self._latencies.append(latency)
+            if len(self._latencies) > LATENCY_SAMPLES:
+                self._latencies.popleft()
+            depth = len(self._queue)
+        finally:
+            self._cond.release()
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Sent %d reports in %.1f ms, queue depth %d" % (len(reports), 1000 * latency, depth))
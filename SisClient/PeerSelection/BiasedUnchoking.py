@@ -44,11 +44,13 @@ class BiasedUnchoking(object):
             raise RuntimeError("Unsupported peer selection mode: "+mode)
     
     
-    def selectConnections(self, connections, number=-1):
+    def selectConnections(self, connections, number=-1, callback=None):
         '''
         Returns a subset of the given connections due to the concrete implementation.
+        If the selection was based on provisional rankings, callback is called without
+        arguments (possibly from another thread) once the final rankings are available.
         '''
-        return self.selection.selectConnections(connections, number)
+        return self.selection.selectConnections(connections, number, callback)
 
 
 # No filtering of connections takes place
@@ -58,7 +60,7 @@ class NoFiltering(BiasedUnchoking):
         pass
     
     # don't filter peers before unchoking
-    def selectConnections(self, connections, number=-1):
+    def selectConnections(self, connections, number=-1, callback=None):
         return connections
 
 # Filter locally in dependency of remotely determined preferences
@@ -68,7 +70,7 @@ class SISFiltering(BiasedUnchoking):
         self.policy = policy
         assert policy
     
-    def selectConnections(self, connections, number=-1):
+    def selectConnections(self, connections, number=-1, callback=None):
         '''
         Remote filtering: 
         returns number connections or number-1 connections, if there aren't number connections with a rating better than 0
@@ -83,7 +85,10 @@ class SISFiltering(BiasedUnchoking):
         logger.debug("USING REMOTE FILTERING")
         logger.debug("REQUESTED - " + str(toAsk))
         
-        rankedIPs = self.policy.getRankedPeers(toAsk)
+        deferred = None
+        if callback is not None:
+            deferred = lambda rankedIPs: callback()
+        rankedIPs = self.policy.getRankedPeers(toAsk, deferred)
         
         if rankedIPs is None:
             # Failed to obtain ranking! what to do?
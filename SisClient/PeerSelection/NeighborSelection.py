@@ -37,6 +37,27 @@ def createMechanism(mode, rankingSource = None, exclude_below = None, locality_p
         raise Exception("Unsupported neighbor selection mode: "+mode)
     return _instance
 
+class NeighborList(list):
+    '''
+    Result of a neighbor selection: a list of (ip, port) tuples in rank order
+    (best first) with O(1) membership tests and rank lookups. Must not be modified.
+    '''
+    
+    def __init__(self, ipPortList=()):
+        list.__init__(self, ipPortList)
+        self._ranks = {}
+        for i in xrange(len(self)-1, -1, -1):
+            self._ranks[self[i]] = i
+    
+    def __contains__(self, ipPort):
+        return ipPort in self._ranks
+    
+    def rank_of(self, ipPort):
+        '''
+        Returns the position of ipPort in the selection (0 is best) or None.
+        '''
+        return self._ranks.get(ipPort)
+
 class NeighborSelection:
     '''
     Abstract class which provides a method to select peers in dependence of the used mode. The concrete 
@@ -47,10 +68,12 @@ class NeighborSelection:
     def __init__(self):
         self._logger = logging.getLogger("NeighborSelection")
     
-    def selectAsNeighbors(self, ipPortList, number=-1):
+    def selectAsNeighbors(self, ipPortList, number=-1, callback=None):
         '''
-        Returns a reorded list of the given IP-Port-Tupels due to the concrete implementation.
+        Returns a reorded NeighborList of the given IP-Port-Tupels due to the concrete implementation.
         If number is given, the result contains at most number elements, else it contains all peers.
+        If the selection was based on provisional rankings, callback is called later (possibly
+        from another thread) with the selection based on the final rankings.
         '''          
         raise NotImplementedError()
     
@@ -82,7 +105,8 @@ class NeighborSelection:
         random.shuffle(others)
         result.extend(others[0:other_nr])
         assert len(result)==number, "result has size %d instead of expected %d" % (len(result), number)
-        self._logger.info("Result: %s" % str(result))    
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info("Result: %s" % str(result))    
         
         return result
 
@@ -96,12 +120,11 @@ class NoFiltering(NeighborSelection):
         self._logger.info("Don't use biased neighbor filtering")
     
     # no filtering before adding new IPs of other leechers and seeders
-    def selectAsNeighbors(self, ipPortList, number=-1):
+    def selectAsNeighbors(self, ipPortList, number=-1, callback=None):
         if number < 0:
             number = len(ipPortList)
-        result = ipPortList[0:number]
+        result = NeighborList(ipPortList[0:number])
         self._logger.debug(" NOT USING ANY FILTERING")
-        self._logger.debug(" ADDING - " + str(result))
         return result
     
     # accept every peer
@@ -130,39 +153,39 @@ class SISFiltering(NeighborSelection):
         self._logger.info("USE REGULAR FILTERING with rankingSource=%s, exclude_below=%f" % (rankingSource, self.exclude_below))
         
     # remote filtering before adding new IPs of other leechers and seeders
-    def selectAsNeighbors(self, ipPortList, number=-1):
+    def selectAsNeighbors(self, ipPortList, number=-1, callback=None):
         #print "SELECT AS NEIGHBORS FOR", ipPortList
         self._logger.debug(" USING REMOTE FILTERING")
-        self._logger.debug(" REQUESTED - " + str(ipPortList))
-        ipList = []
-        for (ip, port) in ipPortList:
-            ipList.append(ip)
-        rankedIPs = self.rankingSource.getRankedPeers(ipList)
+        ipList = [ip for (ip, port) in ipPortList]
         
+        deferred = None
+        if callback is not None:
+            # the ranking source may answer provisionally, so re-apply the final ranking later
+            def deferred(rankedIPs):
+                callback(self._selectRanked(ipPortList, rankedIPs, number))
+        rankedIPs = self.rankingSource.getRankedPeers(ipList, deferred)
+        return self._selectRanked(ipPortList, rankedIPs, number)
+    
+    def _selectRanked(self, ipPortList, rankedIPs, number):
         #print "ranked: ", rankedIPs
         if rankedIPs is None:
             # Failed to connect to SIS
             self._logger.warn(" SIS COMMUNICATION FAILED - PROCEED IN NORMAL MODE")
-            return ipPortList
-        filtered = []
-        #lowRanking = []
-        for (ip, port) in ipPortList:
-            if int(rankedIPs[ip]) >= self.exclude_below:
-                filtered.append((ip, port))
-            else:
-                self._logger.debug("Skip remote ip %s because its rating is too low!" % ip)
-            # completely ignore low rankings
-            #else:
-            #    lowRanking.append((ip, port))
-            
-        #print "filtered=", filtered
-        # now set according to the filtering!
-        my_key = lambda x : rankedIPs[x[0]] # ip part ranked by the mechanism
-        filtered.sort(key=my_key, reverse = True)
-        #print "sorted=", filtered
-        result = self._fillUp(filtered, number, locality_pref=self.locality_pref)
-        self._logger.debug(" Ranked IPs are: - " + str(rankedIPs))
-        self._logger.debug(" ADDING - " + str(result))
+            return NeighborList(ipPortList)
+        # completely ignore low rankings, decorate the others with their rank once
+        exclude_below = self.exclude_below
+        decorated = []
+        for ipPort in ipPortList:
+            rank = int(rankedIPs[ipPort[0]])
+            if rank >= exclude_below:
+                decorated.append((rank, ipPort))
+        # now set according to the filtering! (stable, highest ranks first)
+        decorated.sort(key=lambda x: x[0], reverse = True)
+        filtered = [ipPort for (rank, ipPort) in decorated]
+        result = NeighborList(self._fillUp(filtered, number, locality_pref=self.locality_pref))
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug(" Ranked IPs are: - " + str(rankedIPs))
+            self._logger.debug(" Skipped %d peers because their rating is too low" % (len(ipPortList) - len(filtered)))
         return result
     
     # decide remotely if the peer with given ip should be accepted
@@ -194,11 +217,8 @@ class CacheFiltering(NeighborSelection):
         self.allowed_ips = []
         self._logger.debug("USE CACHE-FILTERING")
     
-    def selectAsNeighbors(self, ipPortList, number=-1):
-        result = []
-        for (ip, port) in ipPortList:
-            if self.is_local(ip):
-                result.append((ip,port))
+    def selectAsNeighbors(self, ipPortList, number=-1, callback=None):
+        result = NeighborList([(ip, port) for (ip, port) in ipPortList if self.is_local(ip)])
         self._logger.debug(" USING CACHE FILTERING")
         self._logger.debug(" REQUESTED - " + str(ipPortList))
         self._logger.debug(" ADDING - " + str(result))
@@ -236,11 +256,8 @@ class CachePortFiltering(NeighborSelection):
         self.allowed_ports= (10011, 10012, 10014, 10015, 10001)
         self._logger.info("USE CACHE-PORT-FILTERING with allowed ports %s" % self.allowed_ports)
     
-    def selectAsNeighbors(self, ipPortList, number=-1):
-        result = []
-        for (ip, port) in ipPortList:
-            if self.allowed_ports.__contains__(port):
-                result.append((ip,port))
+    def selectAsNeighbors(self, ipPortList, number=-1, callback=None):
+        result = NeighborList([(ip, port) for (ip, port) in ipPortList if port in self.allowed_ports])
         self._logger.debug(" USING CACHE-PORT FILTERING")
         self._logger.debug(" REQUESTED - " + str(ipPortList))
         self._logger.debug(" ADDING - " + str(result))
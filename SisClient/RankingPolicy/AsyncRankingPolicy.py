@@ -0,0 +1,178 @@
+import time
+import logging
+import threading
+from Queue import Queue, Empty
+
+from SisClient.RankingPolicy.RankingPolicy import RankingPolicy
+from SisClient.RankingPolicy.RankingCache import RankingCache, MAX_ENTRIES
+
+# ranking handed out for IPs whose SIS preference is not known yet
+PROVISIONAL_RANKING = 0
+# time (in seconds) the worker waits for further lookups before sending a request
+COALESCE_WINDOW = 0.05
+# time (in seconds) the provisional ranking of IPs whose lookup failed is cached
+FAILURE_TTL = 5
+
+class AsyncRankingPolicy(RankingPolicy):
+    '''
+    Non-blocking front-end for a (potentially slow) ranking source like the
+    SIS Communicator.
+
+    getRankedPeers answers immediately: IPs that were ranked before are served
+    from a local cache, all other IPs get a provisional ranking. The missing IPs
+    are resolved by a background worker thread using the wrapped policy. Callers
+    that pass a callback are notified with the final ranking once all of their
+    IPs have been resolved, so that they can re-apply it.
+
+    One instance is shared by all downloads of a session. Lookups that arrive
+    within coalesce_window seconds are merged into a single request, IPs that
+    are already in flight are not requested again. If the wrapped policy fails,
+    the provisional ranking is cached for failure_ttl seconds only, so that the
+    IPs are requested again soon.
+
+    Callbacks are invoked on the worker thread. Callers living on the RawServer
+    network thread must hand the work over to it (e.g. via RawServer.add_task).
+    '''
+
+    def __init__(self, policy, max_time_in_cache=60, provisional_ranking=PROVISIONAL_RANKING,
+                 coalesce_window=COALESCE_WINDOW, max_cache_size=MAX_ENTRIES,
+                 failure_ttl=FAILURE_TTL):
+        RankingPolicy.__init__(self)
+        assert isinstance(policy, RankingPolicy), policy
+        self._logger = logging.getLogger("AsyncRankingPolicy")
+        self.policy = policy
+        self.max_time_in_cache = max_time_in_cache
+        self.provisional_ranking = provisional_ranking
+        self.coalesce_window = coalesce_window
+        self.failure_ttl = failure_ttl
+
+        self.ipcache = RankingCache(max_time_in_cache, max_cache_size)
+        self._in_flight = {}    # ip -> list of waiters interested in that ip
+        self._lock = threading.Lock()
+        self._requests = Queue()
+        self._worker = None
+        self.request_number = 0 # count requests passed to the wrapped policy
+
+    def __str__(self):
+        return "AsyncRankingPolicy(%s)" % self.policy
+
+    def getRankedPeers(self, iplist, callback=None):
+        '''Returns a ranking for all IPs in iplist without blocking. Rankings of
+           IPs that are not cached are provisional. If callback is given and
+           at least one ranking was provisional, callback is called later with
+           the final ranking dictionary for the complete iplist.
+        '''
+        result = dict()
+        missing = []
+        self._lock.acquire()
+        try:
+            for ip in iplist:
+                if result.has_key(ip):
+                    continue
+                value = self.ipcache.get(ip)
+                if value is not None:
+                    result[ip] = value
+                else:
+                    result[ip] = self.provisional_ranking
+                    missing.append(ip)
+            if not missing:
+                return result
+
+            waiter = None
+            if callback is not None:
+                waiter = _RankingWaiter(dict(result), missing, callback)
+            to_request = []
+            for ip in missing:
+                if not self._in_flight.has_key(ip):
+                    self._in_flight[ip] = []
+                    to_request.append(ip)
+                if waiter is not None:
+                    self._in_flight[ip].append(waiter)
+        finally:
+            self._lock.release()
+
+        self._logger.debug("Provisional rankings for %s, requesting %s" % (missing, to_request))
+        if to_request:
+            self._submit(to_request)
+        return result
+
+    def _submit(self, iplist):
+        self._requests.put(iplist)
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, name="AsyncRankingWorker")
+            self._worker.setDaemon(True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            iplist = self._collect()
+            try:
+                self.request_number += 1
+                ranking = self.policy.getRankedPeers(iplist)
+            except:
+                self._logger.error("Ranking source %s failed" % self.policy, exc_info=True)
+                ranking = None
+            self._resolve(iplist, ranking)
+
+    def _collect(self):
+        '''Blocks until a lookup arrives and merges all further lookups arriving
+           within the coalescing window into one list of IPs.
+        '''
+        iplist = list(self._requests.get())
+        deadline = time.time() + self.coalesce_window
+        while True:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    iplist.extend(self._requests.get(True, remaining))
+                else:
+                    # take whatever queued up while the last request was running
+                    iplist.extend(self._requests.get_nowait())
+            except Empty:
+                break
+        self._logger.debug("Coalesced %d IPs into one request" % len(iplist))
+        return iplist
+
+    def _resolve(self, iplist, ranking):
+        '''Stores the final rankings of the given IPs and notifies all waiters
+           that do not wait for any other IP.
+        '''
+        now = time.time()
+        ttl = None
+        if ranking is None:
+            ttl = self.failure_ttl
+        completed = []
+        self._lock.acquire()
+        try:
+            for ip in iplist:
+                if ranking is not None and ranking.has_key(ip):
+                    value = ranking[ip]
+                else:
+                    value = self.provisional_ranking
+                self.ipcache.put(ip, value, now, ttl)
+                for waiter in self._in_flight.pop(ip, []):
+                    if waiter.resolve(ip, value):
+                        completed.append(waiter)
+            self.ipcache.expire(now)
+        finally:
+            self._lock.release()
+
+        for waiter in completed:
+            try:
+                waiter.callback(waiter.ranking)
+            except:
+                self._logger.error("Ranking callback failed", exc_info=True)
+
+class _RankingWaiter:
+    ''' Collects the final rankings for a single getRankedPeers call. '''
+
+    def __init__(self, ranking, missing, callback):
+        self.ranking = ranking
+        self.missing = set(missing)
+        self.callback = callback
+
+    def resolve(self, ip, value):
+        '''Returns True if this was the last missing ranking.'''
+        self.ranking[ip] = value
+        self.missing.discard(ip)
+        return len(self.missing) == 0
@@ -7,6 +7,7 @@ from ZSI.wstools import WSDLTools
 from SisClient.RankingPolicy.WebService import ClientService_client as WS
 from traceback import print_exc
 import SisClient.RankingPolicy.RankingPolicy as RankingPolicy
+from SisClient.RankingPolicy.RankingCache import RankingCache, MAX_ENTRIES
 
 __author__ = "Sebastian Schmidt, Markus Günther"
 
@@ -24,15 +25,20 @@ class request:
         self._extentions = extentions
 
 class Communicator(RankingPolicy.RankingPolicy):
-    def __init__(self, sis_url=None, simple=False, max_time_in_cache=60):
+    def __init__(self, sis_url=None, simple=False, max_time_in_cache=60, max_cache_size=MAX_ENTRIES,
+                 raise_errors=False):
         self._logger = logging.getLogger("Communicator")
         
+        # if True, failed SIS requests raise instead of returning DEFAULT_RANKING,
+        # so that callers can tell failures from real rankings
+        self.raise_errors = raise_errors
+        
         # defines the maximum amount of time (in seconds) a cached ip address
         # resides in the cache. after MAX_TIME_IN_CACHE seconds the ip address
         # will be deleted from the ip cache.
         self.MAX_TIME_IN_CACHE = max_time_in_cache
         
-        self.ipcache = {}
+        self.ipcache = RankingCache(max_time_in_cache, max_cache_size)
         self.simple=simple
         loc = WS.ClientServiceLocator()
         self.request_number = 0# count requests
@@ -60,27 +66,32 @@ class Communicator(RankingPolicy.RankingPolicy):
            and a second list which contains those IP addresses that are not
            stored in the cache.
            
-           Returns the tuple (nonCachedIps, cachedIps)
+           Returns the tuple (nonCachedIps, cachedIps, prefForCachedIps)
         '''
-        cachedIps = [ip for ip in iplist if ip in self.ipcache.keys()]
-        nonCachedIps = [ip for ip in iplist if ip not in cachedIps]
+        cachedIps = []
+        nonCachedIps = []
+        prefForCachedIps = {}
+        for ip in iplist:
+            preference = self.ipcache.get(ip)
+            if preference is None:
+                nonCachedIps.append(ip)
+            else:
+                cachedIps.append(ip)
+                prefForCachedIps[ip] = preference
         
-        return nonCachedIps, cachedIps
+        return nonCachedIps, cachedIps, prefForCachedIps
     
     def _build_request_entries(self, listOfIps):
-        '''Build a list of request entries for a given list of IP addresses.
-           Checks if those addresses are stored in the IP cache before adding
-           a request entry to the resulting list.
+        '''Build a list of request entries for a given list of (non-cached)
+           IP addresses.
            
            Returns a list of request entries.
         '''
-        # TODO: redundant check for caching inside, the ips are already cached
         requests = []
         j = 0
         for ip in listOfIps:
-            if ip not in self.ipcache.keys():
-                requests.append(requestEntry(ip, [str(j)]))
-                j += 1
+            requests.append(requestEntry(ip, [str(j)]))
+            j += 1
                 
         return requests
     
@@ -92,36 +103,28 @@ class Communicator(RankingPolicy.RankingPolicy):
         else:
             return self.srv.getRankedPeerList(endpoint)
         
-    def _map_ip_to_preference(self, result):
-        '''Consumes a result object and builds a dictionary of IPs (key) with
-           their preferences as values.
+    def _map_ip_to_preference(self, result, requestedIps):
+        '''Consumes a result object and builds a dictionary of the requested
+           IPs (key) with their preferences as values. IPs that were ranked as
+           part of a prefix (<IP>/<BITRANGE>) get the preference of the longest
+           matching prefix.
         '''
         chosenIps = dict([(responseEntry._ipAddress, responseEntry._preference)
                           for responseEntry in result._response._entries])
+        for ip in requestedIps:
+            if not chosenIps.has_key(ip):
+                chosenIps[ip] = self.ipcache.get(ip, DEFAULT_RANKING)
         return chosenIps
     
     def _cache_ip_addresses(self, result):
         ts = time.time()
         for responseEntry in result._response._entries:
-            self.ipcache[responseEntry._ipAddress] = {
-                    'timestamp'    :   ts,
-                    'preference'   :   responseEntry._preference
-            }
-    
-    def _get_pref_for_cached_ips(self, cachedIps):
-        '''Returns a dictionary containing preferences for all cached IP
-           addresses.
-        '''
-        return dict([(ip, self.ipcache[ip]["preference"]) for ip in cachedIps])
+            self.ipcache.put(responseEntry._ipAddress, responseEntry._preference, ts)
     
     def _update_ipcache(self):
         '''Checks for "old" IP addresses in the cache and removes them.
         '''
-        ts = time.time()
-        for ip in self.ipcache.keys():
-            timeInCache = ts - self.ipcache[ip]['timestamp']
-            if timeInCache > self.MAX_TIME_IN_CACHE:
-                del self.ipcache[ip]
+        self.ipcache.expire()
 
     def _get_sum(self, x, y):
         '''
@@ -133,7 +136,7 @@ class Communicator(RankingPolicy.RankingPolicy):
         req._arg1 = 10
         return self.srv.add(req)._sum
 
-    def getRankedPeers(self, iplist):
+    def getRankedPeers(self, iplist, callback=None):
         '''Returns a dictionary of IP addresses (keys) with their preferences
            as values.
         '''
@@ -142,8 +145,7 @@ class Communicator(RankingPolicy.RankingPolicy):
         # remove duplicates
         iplist = list(set(iplist))
         # filter non-cached and cached ips into disjoint lists
-        nonCachedIps, cachedIps = self._filter_iplist(iplist)
-        prefForCachedIps = self._get_pref_for_cached_ips(cachedIps)
+        nonCachedIps, cachedIps, prefForCachedIps = self._filter_iplist(iplist)
         
         self._logger.debug("Cached IPs: %s" % str(cachedIps))
         self._logger.debug("Non-cached IPs: %s" % str(nonCachedIps))
@@ -166,10 +168,12 @@ class Communicator(RankingPolicy.RankingPolicy):
             self._logger.info("Connect to SIS, send : " + str(nonCachedIps))
             result = self._get_result(self.simple, endpoint)
             self._cache_ip_addresses(result)
-            chosenIps = self._map_ip_to_preference(result)
+            chosenIps = self._map_ip_to_preference(result, nonCachedIps)
             self._logger.info("Connection to SIS succeed, received : "+ str(chosenIps))
         except:
             self._logger.error("FAILED TO CONNECT TO SIS at %s" % self.srv.url, exc_info=True)
+            if self.raise_errors:
+                raise
             #raise RuntimeError("SIS communication failed. stop")
             chosenIps = {}
             for ip in nonCachedIps:
@@ -0,0 +1,141 @@
+import time
+import heapq
+from collections import OrderedDict
+
+from SisClient.Utils import ipaddr_utils
+
+# upper bound for the number of cached IPs and prefixes
+MAX_ENTRIES = 50000
+
+class RankingCache:
+    '''
+    Bounded cache for rankings received from the SIS.
+
+    Rankings are stored per IP address or per covering IP prefix (<IP>/<BITRANGE>)
+    if the SIS ranked a whole prefix. Lookups of single IPs are dictionary
+    lookups, prefixes are looked up once per distinct prefix length. Entries
+    expire max_time_in_cache seconds after they were stored, expiry is driven by
+    a heap ordered by expiration time, so that only expired entries are touched.
+    If the cache holds more than max_entries entries, the least recently used
+    ones are evicted.
+    '''
+
+    def __init__(self, max_time_in_cache=60, max_entries=MAX_ENTRIES):
+        assert max_entries > 0
+        self.max_time_in_cache = max_time_in_cache
+        self.max_entries = max_entries
+        # key -> (expiration time, preference) in LRU order, oldest first.
+        # keys are IP strings or (bitrange, prefix as long number) tuples
+        self._entries = OrderedDict()
+        self._expiry_heap = []
+        self._prefix_lengths = {}   # bitrange -> number of cached prefixes
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, ip):
+        return self._find(ip, time.time()) is not None
+
+    def get(self, ip, default=None):
+        '''Returns the preference for the given IP, or default if neither the IP nor
+           a covering prefix is cached.
+        '''
+        now = time.time()
+        key = self._find(ip, now)
+        if key is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        # mark as recently used
+        entry = self._entries.pop(key)
+        self._entries[key] = entry
+        return entry[1]
+
+    def put(self, ip_or_prefix, preference, now=None, ttl=None):
+        '''Stores the preference of a single IP or of an IP prefix in the format
+           <IP>/<BITRANGE>. The entry expires after ttl seconds, by default after
+           max_time_in_cache seconds.
+        '''
+        if now is None:
+            now = time.time()
+        if ttl is None:
+            ttl = self.max_time_in_cache
+        if ipaddr_utils.is_reference_ip_addr_admissible(ip_or_prefix):
+            ip, bitrange = ipaddr_utils._extract_addr_and_bitrange(ip_or_prefix)
+            key = (bitrange, ipaddr_utils._cut_off_irrelevant_bits(ipaddr_utils.ip_addr_to_long_number(ip), bitrange))
+        else:
+            key = ip_or_prefix
+        expires = now + ttl
+        self._remove(key)
+        self._entries[key] = (expires, preference)
+        if type(key) == tuple:
+            self._prefix_lengths[key[0]] = self._prefix_lengths.get(key[0], 0) + 1
+        heapq.heappush(self._expiry_heap, (expires, key))
+        while len(self._entries) > self.max_entries:
+            oldest = self._entries.iterkeys().next()
+            self._remove(oldest)
+            self.evictions += 1
+        if len(self._expiry_heap) > 2 * len(self._entries) + 64:
+            self._compact_heap()
+
+    def expire(self, now=None):
+        '''Removes all entries whose lifetime has passed.'''
+        if now is None:
+            now = time.time()
+        heap = self._expiry_heap
+        while heap and heap[0][0] < now:
+            expires, key = heapq.heappop(heap)
+            entry = self._entries.get(key)
+            # skip heap entries of refreshed or evicted keys
+            if entry is not None and entry[0] == expires:
+                self._remove(key)
+                self.expirations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._expiry_heap = []
+        self._prefix_lengths = {}
+
+    def get_stats(self):
+        return { 'size'        : len(self._entries),
+                 'hits'        : self.hits,
+                 'misses'      : self.misses,
+                 'expirations' : self.expirations,
+                 'evictions'   : self.evictions }
+
+    def _find(self, ip, now):
+        '''Returns the key of a valid entry for the IP, the IP itself is preferred over
+           the longest matching prefix.
+        '''
+        candidates = [ip]
+        if self._prefix_lengths:
+            try:
+                long_ip = ipaddr_utils.ip_addr_to_long_number(ip)
+            except:
+                long_ip = None
+            if long_ip is not None:
+                for bitrange in sorted(self._prefix_lengths.keys(), reverse=True):
+                    candidates.append((bitrange, ipaddr_utils._cut_off_irrelevant_bits(long_ip, bitrange)))
+        for key in candidates:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    return key
+                self._remove(key)
+                self.expirations += 1
+        return None
+
+    def _remove(self, key):
+        if self._entries.pop(key, None) is not None and type(key) == tuple:
+            bitrange = key[0]
+            self._prefix_lengths[bitrange] -= 1
+            if self._prefix_lengths[bitrange] == 0:
+                del self._prefix_lengths[bitrange]
+
+    def _compact_heap(self):
+        self._expiry_heap = [(expires, key) for (key, (expires, pref)) in self._entries.iteritems()]
+        heapq.heapify(self._expiry_heap)
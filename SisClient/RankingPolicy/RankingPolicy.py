@@ -1,6 +1,8 @@
 import sys
 import socket
 import logging
+import threading
+from collections import OrderedDict
 
 from SisClient.Utils import ipaddr_utils
 
@@ -21,20 +23,17 @@ def selectRankingSource(source, conf=None):
         ranking = OddEvenPolicy()
     elif source == 'geoip':
         ranking = GeoIPPolicy()
-    elif source == 'sis':
+    elif source in ('sis', 'sis_simple'):
         import Communicator
+        from AsyncRankingPolicy import AsyncRankingPolicy
         assert conf != None
         assert conf.get_sis_client_endpoint() != None
         assert conf.get_rating_cache_interval() != None
-        ranking = Communicator.Communicator(conf.get_sis_client_endpoint(), simple=False,
-                                            max_time_in_cache=conf.get_rating_cache_interval())
-    elif source == 'sis_simple':
-        import Communicator
-        assert conf != None
-        assert conf.get_sis_client_endpoint() != None
-        assert conf.get_rating_cache_interval() != None
-        ranking = Communicator.Communicator(conf.get_sis_client_endpoint(), simple=True,
-                                            max_time_in_cache=conf.get_rating_cache_interval())
+        communicator = Communicator.Communicator(conf.get_sis_client_endpoint(), simple=(source == 'sis_simple'),
+                                                 max_time_in_cache=conf.get_rating_cache_interval(),
+                                                 raise_errors=True)
+        # never block the network thread on SOAP calls
+        ranking = AsyncRankingPolicy(communicator, max_time_in_cache=conf.get_rating_cache_interval())
     elif source == 'ip_pre':
         assert conf != None
         assert conf.get_ip_prefixes() != None
@@ -53,9 +52,13 @@ class RankingPolicy:
     def __init__(self):
         self._logger = logging.getLogger("RankingPolicy")
     
-    def getRankedPeers(self, iplist):
+    def getRankedPeers(self, iplist, callback=None):
         ''' Return a ranked dictionary, containing all ips from the ip list together
         with a non-negative integer ranking as a dictionary -{"IP":"value"}.
+        
+        Non-blocking policies may return provisional rankings for some ips. In this
+        case the optional callback is called later with the final ranking dictionary.
+        Policies that always return final rankings ignore the callback.
         '''
         raise NotImplementedError("Must be implemented by subsclasses")
 
@@ -65,7 +68,7 @@ class DummyPolicy(RankingPolicy):
     def __init__(self):
         RankingPolicy.__init__(self)
     
-    def getRankedPeers(self, iplist):
+    def getRankedPeers(self, iplist, callback=None):
         res = dict()
         for ip in iplist:
             res[ip] = 100
@@ -85,7 +88,7 @@ class SameHostPolicy(RankingPolicy):
         else:
             self.ip_addr = own_ip
 
-    def getRankedPeers(self, iplist):
+    def getRankedPeers(self, iplist, callback=None):
         #return RankingPolicy.getRankedPeers(self, iplist)
         res = dict()
         for ip in iplist:
@@ -95,65 +98,121 @@ class SameHostPolicy(RankingPolicy):
                 res[ip] = 0
         return res
     
-# # TODO: check if pygeoip is installed!
-geo_ip_found = False
-try:
-    import pygeoip
+GEOIP_CITY_DB = "resources/GeoLiteCity.dat"
+GEOIP_ASN_DB = "resources/GeoIPASNum.dat"
+
+# number of ip addresses whose locality bucket is memoized
+GEOIP_CACHE_SIZE = 20000
+
+# rankings for the locality buckets, from near to far
+GEOIP_SAME_CITY = 1000
+GEOIP_SAME_REGION = 500
+GEOIP_SAME_ASN = 400
+GEOIP_SAME_COUNTRY = 250
+GEOIP_OTHER = 0
+
+_geoip_databases = {}
+_geoip_lock = threading.Lock()
+
+def load_geoip_database(path, required=True):
+    ''' Open the GeoIP database at the given path on first use (memory-mapped where pygeoip
+    supports it) and share it among all policies. Returns None if the database is not
+    available and not required.
+    '''
+    _geoip_lock.acquire()
     try:
-        path = "resources/GeoLiteCity.dat"
-        gi_city = pygeoip.GeoIP(path)
-        #gi_isp = pygeoip.GeoIP("resources/GeoIPISP.dat")
-        geo_ip_found = True
-    except:
-        print >>sys.stderr, "Missing the required geoip database for GeoIPPolicy (if desired) %s, you can find it here: http://geolite.maxmind.com/download/geoip/database/" % path
-except:
-    print >>sys.stderr, "pygeoip is not installed! GeoIPPolicy cannot be used...(see http://code.google.com/p/pygeoip/ to download it)"
+        if not _geoip_databases.has_key(path):
+            try:
+                import pygeoip
+            except ImportError:
+                print >>sys.stderr, "pygeoip is not installed! GeoIPPolicy cannot be used...(see http://code.google.com/p/pygeoip/ to download it)"
+                raise Exception("Geo ip is not installed!")
+            try:
+                if hasattr(pygeoip, 'MMAP_CACHE'):
+                    _geoip_databases[path] = pygeoip.GeoIP(path, pygeoip.MMAP_CACHE)
+                else:
+                    _geoip_databases[path] = pygeoip.GeoIP(path)
+            except:
+                if required:
+                    print >>sys.stderr, "Missing the required geoip database for GeoIPPolicy (if desired) %s, you can find it here: http://geolite.maxmind.com/download/geoip/database/" % path
+                    raise Exception("Geo ip is not installed!")
+                _geoip_databases[path] = None
+        return _geoip_databases[path]
+    finally:
+        _geoip_lock.release()
     
 class GeoIPPolicy(SameHostPolicy):
-    ''' Rank the same host with a positive value, all other with 0.
+    ''' Rank peers by their geographic distance: same city, same region, same autonomous
+    system (if the ASN database is available), same country or other.
     '''
 
-    def __init__(self, own_ip=None):
+    def __init__(self, own_ip=None, city_db=GEOIP_CITY_DB, asn_db=GEOIP_ASN_DB, cache_size=GEOIP_CACHE_SIZE):
         SameHostPolicy.__init__(self, own_ip)
-        if not geo_ip_found:
-            raise Exception("Geo ip is not installed!")
-        self.own_ip_info = gi_city.record_by_addr(self.ip_addr)
+        self.gi_city = load_geoip_database(city_db)
+        self.gi_asn = load_geoip_database(asn_db, required=False)
+        self.cache_size = cache_size
+        # ip -> locality bucket, in LRU order
+        self._buckets = OrderedDict()
+        self._set_own_location()
+
+    def _set_own_location(self):
+        self.own_ip_info = self.gi_city.record_by_addr(self.ip_addr)
+        self.own_location = self._location(self.ip_addr, self.own_ip_info)
+        self._buckets.clear()
         self._logger.info("ip info %s for ip addr %s " % (self.own_ip_info, self.ip_addr))
         #print "own info: ", self.own_ip_info
 
-    def getRankedPeers(self, iplist):
+    def _location(self, ip, info):
+        if not info:
+            return None
+        asn = None
+        if self.gi_asn is not None:
+            asn = self.gi_asn.org_by_addr(ip)
+        return (info.get('city'), info.get('region'), info.get('region_name'), info.get('country_name'), asn)
+
+    def _bucket(self, ip):
+        own = self.own_location
+        other = self._location(ip, self.gi_city.record_by_addr(ip))
+        if own is None or other is None:
+            return GEOIP_OTHER
+        if _same_field(own[0], other[0]):
+            return GEOIP_SAME_CITY
+        elif _same_field(own[1], other[1]) or _same_field(own[2], other[2]):
+            return GEOIP_SAME_REGION
+        elif _same_field(own[4], other[4]):
+            return GEOIP_SAME_ASN
+        elif _same_field(own[3], other[3]):
+            return GEOIP_SAME_COUNTRY
+        return GEOIP_OTHER
+
+    def rank_many(self, iplist):
+        ''' Rank all ips in one pass, looking up only ips that were not ranked before. '''
         if self.own_ip_info is None:
             # Probably we got a local IP address before, so try now to get the right one from the session (created AFTER this policy!)
             from BaseLib.Core.Session import Session
             self.ip_addr = Session.get_instance().get_external_ip()
-            self.own_ip_info = gi_city.record_by_addr(self.ip_addr)
-            self._logger.info("ip info %s for ip addr %s " % (self.own_ip_info, self.ip_addr))
-        #return RankingPolicy.getRankedPeers(self, iplist)
+            self._set_own_location()
+        buckets = self._buckets
         res = dict()
         for ip in iplist:
-            other = gi_city.record_by_addr(ip)
-            if self._compareFiled(self.own_ip_info, other, 'city'):
-                res[ip] = 1000
-            elif self._compareFiled(self.own_ip_info, other, 'region') \
-            or self._compareFiled(self.own_ip_info, other, 'region_name'):
-                res[ip] = 500
-            elif self._compareFiled(self.own_ip_info, other, 'country_name'):
-                res[ip] = 250
-            else:
-                res[ip] = 0
-         
+            bucket = buckets.pop(ip, None)
+            if bucket is None:
+                bucket = self._bucket(ip)
+            buckets[ip] = bucket
+            res[ip] = bucket
+        while len(buckets) > self.cache_size:
+            buckets.popitem(last=False)
+        return res
+
+    def getRankedPeers(self, iplist, callback=None):
+        res = self.rank_many(iplist)
         if self._logger.isEnabledFor(logging.DEBUG):
             self._logger.debug("Ranked iplist %s" % str(res)) 
             
         return res
-    
-    def _compareFiled(self, info1, info2, field_name):
-        if info1 and info2 and info1.has_key(field_name) and info2.has_key(field_name):
-            value1 = info1[field_name]
-            value2 = info2[field_name]
-            if value1 and value2:
-                return value1==value2
-        return False
+
+def _same_field(value1, value2):
+    return bool(value1 and value2 and value1 == value2)
     
 class OddEvenPolicy(RankingPolicy):
     ''' Distinguish odd (-->0) and even (--> larger than 0) IP addresses.
@@ -161,7 +220,7 @@ class OddEvenPolicy(RankingPolicy):
     def __init__(self):
         RankingPolicy.__init__(self)
     
-    def getRankedPeers(self, iplist):
+    def getRankedPeers(self, iplist, callback=None):
         res = dict()
         for ip in iplist:
             # can switch between odd and even rankings here, why not offer both? local_odd, local_even, local_strict
@@ -192,6 +251,10 @@ class OddEvenPolicy(RankingPolicy):
         return result
 
 class SameIPPrefixPolicy(RankingPolicy):
+    ''' Rank peers by the longest matching reference prefix. Prefixes are given as
+    <IP>/<BITRANGE> (ranked with 100) or <IP>/<BITRANGE>=<WEIGHT>, all other peers are
+    ranked with 0.
+    '''
     
     def __init__(self, list_of_reference_ip_addr=[]):
         RankingPolicy.__init__(self)
@@ -199,26 +262,19 @@ class SameIPPrefixPolicy(RankingPolicy):
         self.set_ip_prefixes(list_of_reference_ip_addr)
         assert len(self.ref_ip_addrs)>0, "no ip prefix set"
                 
-        #check provided ranges for consistency:
-        for prefix in self.ref_ip_addrs:
-            (ip, bitrange) = ipaddr_utils._extract_addr_and_bitrange(prefix)
-            assert ipaddr_utils.validIP(ip) and bitrange>=0 and bitrange <=32, "Invalid ip range " + prefix 
-        
-        
         self._logger.info("Use IP prefix based policy with the prefixes: %s" % self.ref_ip_addrs)
     
     def set_ip_prefixes(self, ip_prefixes):
         self.ref_ip_addrs = [ip_addr for ip_addr in ip_prefixes if ipaddr_utils.is_reference_ip_addr_admissible(ip_addr)]
+        # checks the provided ranges for consistency
+        self.prefix_trie = ipaddr_utils.IPPrefixTrie(self.ref_ip_addrs)
         self._logger.info("Set local ip prefixes to %s" % self.ref_ip_addrs)
     
-    def getRankedPeers(self, iplist):
-        res = dict()
-        self._logger.debug("Peers to rank %s" % str(iplist))
-        for ip in iplist:
-            res[ip] = 0
-            for reference_ip in self.ref_ip_addrs:
-                if ipaddr_utils.matches_ip_prefix(ip, reference_ip):
-                    res[ip] = 100
-                    break
-        self._logger.debug("Ranked vs prefixes %s as: %s" % (str(self.ref_ip_addrs), str(res)))
+    def rank_many(self, iplist):
+        return self.prefix_trie.rank_many(iplist)
+    
+    def getRankedPeers(self, iplist, callback=None):
+        res = self.rank_many(iplist)
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug("Ranked vs prefixes %s as: %s" % (str(self.ref_ip_addrs), str(res)))
         return res
\ No newline at end of file
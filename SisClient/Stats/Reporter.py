@@ -5,14 +5,57 @@
 # Collects statistics about a download/VOD session, and sends it
 # home on a regular interval.
 
-import sys,urllib,zlib,pickle
+import sys,zlib,pickle
 from time import time
 from traceback import print_exc
 from BaseLib.Core.Session import Session
+from SisClient.Common import ReportUploader
 
 PHONEHOME = False
+PHONEHOME_URL = "http://client-reporter.smoothit.org"
 DEBUG = True
 
+class PhoneHomeChannel(ReportUploader.HTTPReportChannel):
+    """ Sends the collected reports of a Reporter. The server answers with
+    the interval of the next report, 0 stops the reporting. """
+    def __init__( self, reporter ):
+        ReportUploader.HTTPReportChannel.__init__( self, PHONEHOME_URL, None, max_batch=ReportUploader.MAX_QUEUE )
+        self.reporter = reporter
+
+    def _get_interval( self ):
+        return self.reporter.report_interval
+
+    interval = property( _get_interval )
+
+    def encode( self, reports ):
+        return zlib.compress( pickle.dumps( reports ), 9 ).encode("base64")
+
+    def handle_response( self, result ):
+        try:
+            result = int(result)
+        except ValueError, e:
+            # page did not obtain an integer
+            print >>sys.stderr,"report: got %s" % (result,)
+            print_exc(file=sys.stderr)
+            self.reporter.do_reporting = False
+            return
+
+        if result == 0:
+            # remote server is not recording, so don't bother sending info
+            self.reporter.do_reporting = False
+        else:
+            self.reporter.report_interval = result
+        if DEBUG: print >>sys.stderr,"\nreport: succes. will report again (%s) in %s seconds" % (self.reporter.do_reporting,self.reporter.report_interval)
+
+    def send( self, reports ):
+        try:
+            ReportUploader.HTTPReportChannel.send( self, reports )
+        except:
+            # error contacting server
+            print_exc(file=sys.stderr)
+            self.reporter.do_reporting = False
+            raise
+
 class Reporter:
     def __init__( self, sconfig ):
         self.sconfig = sconfig
@@ -31,8 +74,10 @@ class Reporter:
         # self.connected[id] = timestamp when last seen
         self.connected = {}
 
-        # collected reports
-        self.buffered_reports = []
+        # collected reports are queued in the uploader until the interval
+        # has passed
+        self.uploader = ReportUploader.getInstance()
+        self.channel = PhoneHomeChannel( self )
 
         # whether to phone home to send collected data
         self.do_reporting = True
@@ -40,9 +85,6 @@ class Reporter:
         # send data at this interval (seconds)
         self.report_interval = 30
 
-        # send first report immediately
-        self.last_report_ts = 0
-
         # record when we started (used as a session id)
         self.epoch = time()
 
@@ -56,48 +98,10 @@ class Reporter:
             print >>sys.stderr,"\nreport: (NOT) phoning home."
             return
 
-        # add reports to buffer
-        self.buffered_reports.append( report )
-
-        # only process at regular intervals
-        now = time()
-        if now - self.last_report_ts < self.report_interval:
-            return
-        self.last_report_ts = now
-
-        # send complete buffer
-        s = pickle.dumps( self.buffered_reports )
-        self.buffered_reports = []
-
+        # the uploader sends the first report immediately, the following
+        # ones together after report_interval seconds
         if DEBUG: print >>sys.stderr,"\nreport: phoning home."
-        try:
-            data = zlib.compress( s, 9 ).encode("base64")
-            #sock = urllib.urlopen("http://swpreporter.tribler.org/reporting/report.cgi",data)
-            sock = urllib.urlopen("http://client-reporter.smoothit.org",data)
-            result = sock.read()
-            sock.close()
-
-            result = int(result)
-
-            if result == 0:
-                # remote server is not recording, so don't bother sending info
-                self.do_reporting = False
-            else:
-                self.report_interval = result
-        except IOError, e:
-            # error contacting server
-            print_exc(file=sys.stderr)
-            self.do_reporting = False
-        except ValueError, e:
-            # page did not obtain an integer
-            print >>sys.stderr,"report: got %s" % (result,)
-            print_exc(file=sys.stderr)
-            self.do_reporting = False
-        except:
-            # any other error
-            print_exc(file=sys.stderr)
-            self.do_reporting = False
-        if DEBUG: print >>sys.stderr,"\nreport: succes. reported %s bytes, will report again (%s) in %s seconds" % (len(data),self.do_reporting,self.report_interval)
+        self.uploader.submit( self.channel, report )
 
     def report_stat( self, ds ):
         chokestr = lambda b: ["c","C"][int(bool(b))]
@@ -0,0 +1,96 @@
+import time
+import unittest
+import threading
+
+from SisClient.RankingPolicy.RankingPolicy import RankingPolicy, OddEvenPolicy
+from SisClient.RankingPolicy.AsyncRankingPolicy import AsyncRankingPolicy
+from SisClient.PeerSelection import NeighborSelection
+
+class BlockingPolicy(RankingPolicy):
+    ''' Odd/even ranking that blocks until it is released, like a slow SIS. '''
+    def __init__(self):
+        RankingPolicy.__init__(self)
+        self.release = threading.Event()
+        self.requests = []
+
+    def getRankedPeers(self, iplist, callback=None):
+        self.requests.append(list(iplist))
+        self.release.wait()
+        return OddEvenPolicy().getRankedPeers(iplist)
+
+class FailingPolicy(RankingPolicy):
+    ''' Ranking source that is not reachable. '''
+    def __init__(self):
+        RankingPolicy.__init__(self)
+        self.requests = 0
+
+    def getRankedPeers(self, iplist, callback=None):
+        self.requests += 1
+        raise IOError("SIS not reachable")
+
+class TestAsyncRanking(unittest.TestCase):
+    def setUp(self):
+        self.blocking = BlockingPolicy()
+        self.policy = AsyncRankingPolicy(self.blocking, max_time_in_cache=60, coalesce_window=0.2)
+        self.results = []
+        self.done = threading.Event()
+
+    def tearDown(self):
+        self.blocking.release.set()
+
+    def _callback(self, ranking):
+        self.results.append(ranking)
+        self.done.set()
+
+    def testProvisionalRankingDoesNotBlock(self):
+        iplist = ['209.34.91.45', '209.34.91.44']
+        ranked = self.policy.getRankedPeers(iplist, self._callback)
+        self.assertEquals({'209.34.91.45': 0, '209.34.91.44': 0}, ranked)
+        self.assertEquals([], self.results)
+
+        self.blocking.release.set()
+        self.done.wait(5)
+        self.assertEquals([{'209.34.91.45': 0, '209.34.91.44': 100}], self.results)
+
+        # now served from the cache without another request
+        ranked = self.policy.getRankedPeers(iplist, self._callback)
+        self.assertEquals({'209.34.91.45': 0, '209.34.91.44': 100}, ranked)
+        self.assertEquals(1, len(self.blocking.requests))
+
+    def testLookupsAreCoalesced(self):
+        # both lookups arrive within the coalescing window, the shared ip is requested once
+        self.policy.getRankedPeers(['209.34.91.44'])
+        self.policy.getRankedPeers(['209.34.91.44', '81.19.23.42'], self._callback)
+        self.blocking.release.set()
+        self.done.wait(5)
+        self.assertEquals([['209.34.91.44', '81.19.23.42']], self.blocking.requests)
+        self.assertEquals([{'209.34.91.44': 100, '81.19.23.42': 100}], self.results)
+        self.assertEquals(1, self.policy.request_number)
+
+    def testNeighborSelectionReappliesRanking(self):
+        mech = NeighborSelection.SISFiltering(1.0, self.policy, exclude_below=1)
+        iplist = [('209.34.91.45', 123), ('209.34.91.44', 123)]
+        # provisional rankings are below the threshold, nobody is accepted yet
+        self.assertEquals([], mech.selectAsNeighbors(iplist, callback=self._callback))
+        self.blocking.release.set()
+        self.done.wait(5)
+        self.assertEquals([[('209.34.91.44', 123)]], self.results)
+
+    def testFailuresAreCachedShortly(self):
+        failing = FailingPolicy()
+        policy = AsyncRankingPolicy(failing, max_time_in_cache=60, coalesce_window=0, failure_ttl=0.2)
+        policy.getRankedPeers(['209.34.91.44'], self._callback)
+        self.done.wait(5)
+        self.assertEquals([{'209.34.91.44': 0}], self.results)
+        # the provisional ranking is served from the cache for failure_ttl only
+        self.assertEquals({'209.34.91.44': 0}, policy.getRankedPeers(['209.34.91.44']))
+        self.assertEquals(1, failing.requests)
+        time.sleep(0.3)
+        self.done.clear()
+        policy.getRankedPeers(['209.34.91.44'], self._callback)
+        self.done.wait(5)
+        self.assertEquals(2, failing.requests)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAsyncRanking)
+    unittest.TextTestRunner(verbosity=2).run(suite)
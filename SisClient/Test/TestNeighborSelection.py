@@ -52,6 +52,22 @@ class TestNeighborSelection(unittest.TestCase):
         mech = NeighborSelection.SISFiltering(1.0, ranking)
         self.tryOddEvenMech(mech)
         
+    def testNeighborList(self):
+        ranking = OddEvenPolicy()
+        mech = NeighborSelection.SISFiltering(1.0, ranking)
+        iplist = [('209.34.91.45', 123), ('209.34.91.44', 123), ('209.34.91.47', 123), ('81.19.23.42', 123)]
+        filtered = mech.selectAsNeighbors(iplist, 2)
+        self.assertTrue(isinstance(filtered, NeighborSelection.NeighborList))
+        self.assertTrue(('209.34.91.44', 123) in filtered)
+        self.assertFalse(('209.34.91.45', 123) in filtered)
+        self.assertEquals(0, filtered.rank_of(filtered[0]))
+        self.assertEquals(1, filtered.rank_of(filtered[1]))
+        self.assertEquals(None, filtered.rank_of(('209.34.91.45', 123)))
+        
+        unfiltered = NeighborSelection.NoFiltering().selectAsNeighbors(iplist)
+        self.assertTrue(isinstance(unfiltered, NeighborSelection.NeighborList))
+        self.assertTrue(('81.19.23.42', 123) in unfiltered)
+        
     def testMechanismCreation(self):
         self.assertEquals(NeighborSelection.ns_instance(), None)
         
@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from SisClient.RankingPolicy.RankingCache import RankingCache
+
+class TestRankingCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = RankingCache(max_time_in_cache=60, max_entries=3)
+
+    def testSingleIps(self):
+        self.cache.put('130.83.85.17', 100)
+        self.assertEquals(100, self.cache.get('130.83.85.17'))
+        self.assertEquals(None, self.cache.get('130.83.85.18'))
+        self.assertEquals(-1, self.cache.get('130.83.85.18', -1))
+        self.assertEquals(1, self.cache.hits)
+        self.assertEquals(2, self.cache.misses)
+
+    def testLongestPrefixWins(self):
+        self.cache.put('130.83.0.0/16', 50)
+        self.cache.put('130.83.85.0/24', 100)
+        self.cache.put('130.83.32.67', 10)
+        self.assertEquals(100, self.cache.get('130.83.85.17'))
+        self.assertEquals(50, self.cache.get('130.83.32.1'))
+        self.assertEquals(10, self.cache.get('130.83.32.67'))
+        self.assertEquals(None, self.cache.get('88.56.172.31'))
+        self.assertTrue('130.83.1.1' in self.cache)
+
+    def testExpiry(self):
+        self.cache.put('130.83.85.17', 100, now=time.time() - 61)
+        self.cache.put('130.83.0.0/16', 50, now=time.time() - 61)
+        self.cache.put('88.56.172.31', 0)
+        self.cache.expire()
+        self.assertEquals(1, len(self.cache))
+        self.assertEquals(2, self.cache.expirations)
+        self.assertEquals(None, self.cache.get('130.83.85.17'))
+        self.assertEquals(0, self.cache.get('88.56.172.31'))
+
+    def testRefreshKeepsEntryAlive(self):
+        self.cache.put('130.83.85.17', 100, now=time.time() - 61)
+        self.cache.put('130.83.85.17', 50)
+        self.cache.expire()
+        self.assertEquals(50, self.cache.get('130.83.85.17'))
+        self.assertEquals(0, self.cache.expirations)
+
+    def testLruEviction(self):
+        for ip in ['1.1.1.1', '2.2.2.2', '3.3.3.3']:
+            self.cache.put(ip, 100)
+        self.cache.get('1.1.1.1') # 2.2.2.2 is now the least recently used entry
+        self.cache.put('4.4.4.4', 100)
+        self.assertEquals(3, len(self.cache))
+        self.assertEquals(1, self.cache.evictions)
+        self.assertFalse('2.2.2.2' in self.cache)
+        self.assertTrue('1.1.1.1' in self.cache)
+
+if __name__ == "__main__":
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestRankingCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
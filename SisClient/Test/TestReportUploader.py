@@ -0,0 +1,226 @@
+import threading
+import time
+import unittest
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+from SisClient.Common import ReportUploader
+from SisClient.Utils import report_delta
+from SisClient.Utils import serialize
+
+class BlockingChannel(ReportUploader.ReportChannel):
+    '''Records the batches it gets, blocks until it is released.'''
+    def __init__(self, max_batch=1, interval=0.0):
+        self.max_batch = max_batch
+        self.interval = interval
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+        self.entered = threading.Event()
+
+    def send(self, reports):
+        self.entered.set()
+        self.release.wait()
+        self.batches.append(list(reports))
+
+class FailingChannel(ReportUploader.ReportChannel):
+    def send(self, reports):
+        raise IOError("monitor is down")
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('content-length')))
+        self.server.bodies.append(body)
+        self.server.ports.add(self.client_address[1])
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+class TestReportUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.uploader = ReportUploader.ReportUploader(max_queue=5)
+
+    def tearDown(self):
+        self.uploader.shutdown(timeout=1.0)
+
+    def _block(self, channel):
+        '''Lets the worker hang in a send of channel.'''
+        channel.release.clear()
+        self.uploader.submit(channel, "blocker")
+        self.assertTrue(channel.entered.wait(2.0))
+
+    def testBatches(self):
+        channel = BlockingChannel(max_batch=3)
+        self._block(channel)
+        for i in xrange(4):
+            self.uploader.submit(channel, i)
+        channel.release.set()
+        self.assertTrue(self.uploader.flush(2.0))
+        self.assertEquals([["blocker"], [0, 1, 2], [3]], channel.batches)
+        metrics = self.uploader.get_metrics()
+        self.assertEquals(5, metrics["sent_reports"])
+        self.assertEquals(3, metrics["sent_batches"])
+        self.assertEquals(0, metrics["queue_depth"])
+        self.assertTrue(metrics["send_latency_max"] > 0.0)
+
+    def testCoalescing(self):
+        channel = BlockingChannel(max_batch=10)
+        self._block(channel)
+        self.uploader.submit(channel, "a1", key="a")
+        self.uploader.submit(channel, "b1", key="b")
+        self.uploader.submit(channel, "a2", key="a")
+        channel.release.set()
+        self.uploader.flush(2.0)
+        self.assertEquals(["a2", "b1"], channel.batches[1])
+        self.assertEquals(1, self.uploader.get_metrics()["coalesced"])
+        # a report is only replaced while it is queued
+        self.uploader.submit(channel, "a3", key="a")
+        self.uploader.flush(2.0)
+        self.assertEquals(["a3"], channel.batches[2])
+
+    def testOldestReportsAreDropped(self):
+        channel = BlockingChannel(max_batch=10)
+        self._block(channel)
+        for i in xrange(8):
+            self.uploader.submit(channel, i, key=i)
+        self.assertEquals(5, self.uploader.get_metrics()["queue_depth"])
+        channel.release.set()
+        self.uploader.flush(2.0)
+        self.assertEquals([3, 4, 5, 6, 7], channel.batches[1])
+        self.assertEquals(3, self.uploader.get_metrics()["dropped"])
+
+    def testSubmitDoesNotBlock(self):
+        slow, other = BlockingChannel(), BlockingChannel()
+        self._block(slow)
+        start = time.time()
+        self.uploader.submit(other, "report")
+        self.assertTrue(time.time() - start < 0.5)
+        slow.release.set()
+        self.uploader.flush(2.0)
+        self.assertEquals([["report"]], other.batches)
+
+    def testInterval(self):
+        channel = BlockingChannel(max_batch=10, interval=60.0)
+        self.uploader.submit(channel, 1)
+        self.assertTrue(channel.entered.wait(2.0))
+        self.uploader.submit(channel, 2)
+        self.uploader.submit(channel, 3)
+        time.sleep(0.1)
+        self.assertEquals([[1]], channel.batches)
+        # a flush does not wait for the interval
+        self.assertTrue(self.uploader.flush(2.0))
+        self.assertEquals([[1], [2, 3]], channel.batches)
+
+    def testFailedSend(self):
+        self.uploader.submit(FailingChannel(), "report")
+        self.uploader.flush(2.0)
+        metrics = self.uploader.get_metrics()
+        self.assertEquals(1, metrics["failed_batches"])
+        self.assertEquals(0, metrics["sent_reports"])
+
+    def testWorkerError(self):
+        next_batch = self.uploader._next_batch
+        def broken(now):
+            self.uploader._next_batch = next_batch
+            raise ValueError("bug")
+        self.uploader._next_batch = broken
+        channel = BlockingChannel()
+        self.uploader.submit(channel, 1)
+        deadline = time.time() + 2.0
+        while self.uploader._thread is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEquals(None, self.uploader._thread)
+        # the next report starts a new worker, which sends both
+        self.uploader.submit(channel, 2)
+        self.assertTrue(self.uploader.flush(2.0))
+        self.assertEquals([[1], [2]], channel.batches)
+
+    def testShutdown(self):
+        channel = BlockingChannel()
+        self.uploader.submit(channel, 1)
+        self.uploader.shutdown(1.0)
+        self.assertEquals([[1]], channel.batches)
+        self.assertFalse(self.uploader.submit(channel, 2))
+
+    def _start_server(self):
+        server = HTTPServer(("127.0.0.1", 0), RecordingHandler)
+        server.bodies = []
+        server.ports = set()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+        return server
+
+    def testKeepAlive(self):
+        server = self._start_server()
+        try:
+            url = "http://127.0.0.1:%d/" % server.server_address[1]
+            codec = serialize.get_codec("binary")
+            channel = self.uploader.get_http_channel(url, codec)
+            self.assertTrue(channel is self.uploader.get_http_channel(url, codec))
+            for i in xrange(3):
+                self.uploader.submit(channel, { "id" : i })
+                self.assertTrue(self.uploader.flush(2.0))
+            self.assertEquals([{ "id" : i } for i in xrange(3)],
+                              [serialize.decode_report(body) for body in server.bodies])
+            self.assertEquals(1, len(server.ports))
+            # XML reports are not batched
+            xml_channel = self.uploader.get_http_channel(url, serialize.get_codec("xml"))
+            self.assertEquals(1, xml_channel.max_batch)
+        finally:
+            # closes the connection, the handler waits for further requests
+            self.uploader.shutdown(1.0)
+            server.shutdown()
+            server.server_close()
+
+    def testDeltaReports(self):
+        server = self._start_server()
+        try:
+            url = "http://127.0.0.1:%d/" % server.server_address[1]
+            channel = self.uploader.get_http_channel(url, serialize.get_codec("binary"), keyframe_interval=3)
+            reports = [{ "id" : 1, "filename" : "a", "timestamp" : i, "down_total" : 2 * i,
+                         "peers" : [{ "id" : "p", "down_rate" : i % 2 }], "blockstats" : [i] }
+                       for i in xrange(4)]
+            for report in reports:
+                self.uploader.submit(channel, report, key="a")
+                self.assertTrue(self.uploader.flush(2.0))
+            received = [serialize.decode_report(body) for body in server.bodies]
+            self.assertEquals([False, True, True, False], [report_delta.is_delta(r) for r in received])
+            decoder = report_delta.ReportDeltaDecoder()
+            for report, body in zip(reports, received):
+                full = decoder.decode(body)
+                del full["seq"]
+                self.assertEquals(report, full)
+            # a replaced report passes on its events
+            merged = channel.merge(reports[0], reports[1])
+            self.assertEquals([0, 1], merged["blockstats"])
+        finally:
+            self.uploader.shutdown(1.0)
+            server.shutdown()
+            server.server_close()
+
+    def testDeltaReportsAfterFailure(self):
+        channel = ReportUploader.HTTPReportChannel("http://127.0.0.1:1/", serialize.get_codec("binary"),
+                                                   keyframe_interval=10)
+        sent = []
+        channel.post = sent.append
+        report = { "id" : 1, "filename" : "a", "timestamp" : 0 }
+        channel.send([report])
+        channel.send([report])
+        self.assertTrue(report_delta.is_delta(serialize.decode_report(sent[-1])))
+        def fail(body):
+            raise IOError("connection refused")
+        channel.post = fail
+        self.assertRaises(IOError, channel.send, [report])
+        channel.post = sent.append
+        channel.send([report])
+        self.assertFalse(report_delta.is_delta(serialize.decode_report(sent[-1])))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,6 +29,13 @@ class TestSameIPPrefixPolicy(unittest.TestCase):
         self.assertEquals(ranked_ips['83.57.32.2'], 100)
         self.assertEquals(ranked_ips['76.32.32.12'], 0)
         
+    def testWeightedPrefixes(self):
+        reference_ips = [ "130.83.0.0/16=250", "130.83.27.0/24=1000", "83.27.1.1/8" ]
+        policy = SameIPPrefixPolicy(reference_ips)
+        ranked_ips = policy.rank_many([ "130.83.27.100", "130.83.28.1", "83.57.32.2", "76.32.32.12" ])
+        self.assertEquals({ "130.83.27.100" : 1000, "130.83.28.1" : 250,
+                            "83.57.32.2" : 100, "76.32.32.12" : 0 }, ranked_ips)
+        
     def testDefaultIfNoRefIpsProvided(self):
         try:
             policy = SameIPPrefixPolicy()
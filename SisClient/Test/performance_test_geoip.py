@@ -0,0 +1,69 @@
+import optparse
+import random
+import sys
+import time
+
+from SisClient.RankingPolicy import RankingPolicy
+
+def create_peer_list(size, population):
+    ''' Synthetic tracker responses: size peers drawn from a population of public IPs. '''
+    ips = []
+    while len(ips) < population:
+        first = random.randint(1, 223)
+        if first in (10, 127):
+            continue
+        ips.append("%d.%d.%d.%d" % (first, random.randint(0, 255), random.randint(0, 255), random.randint(1, 254)))
+    return [random.choice(ips) for i in xrange(size)]
+
+def rank_uncached(policy, iplist):
+    ''' rank_many without memoization: every IP of the list is looked up, also the
+    ones that occur several times. '''
+    res = dict()
+    for ip in iplist:
+        res[ip] = policy._bucket(ip)
+    return res
+
+def measure(rank, iplist, rounds):
+    timings = []
+    for i in xrange(rounds):
+        start = time.time()
+        rank(iplist)
+        timings.append(time.time() - start)
+    return timings
+
+def parse_options():
+    parser = optparse.OptionParser(usage="Usage: " + sys.argv[0] + " [options]",
+                                   description="Measures the GeoIP ranking of a synthetic peer list.")
+    parser.add_option("-n", "--peers", action="store", dest="peers", default=10000, type="int",
+                      help="Number of IPs in the peer list. Defaults to 10000.")
+    parser.add_option("-p", "--population", action="store", dest="population", default=5000, type="int",
+                      help="Number of distinct IPs the peer list is drawn from. Defaults to 5000.")
+    parser.add_option("-r", "--rounds", action="store", dest="rounds", default=5, type="int",
+                      help="Number of ranking rounds. Defaults to 5.")
+    parser.add_option("-o", "--own_ip", action="store", dest="own_ip", default="130.83.139.168",
+                      help="Own IP address. Defaults to 130.83.139.168 (Darmstadt).")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    options, args = parse_options()
+    random.seed(42)
+    iplist = create_peer_list(options.peers, options.population)
+
+    start = time.time()
+    try:
+        memoized = RankingPolicy.GeoIPPolicy(options.own_ip)
+    except Exception, e:
+        print >>sys.stderr, "GeoIPPolicy is not available: %s" % e
+        sys.exit(1)
+    print >>sys.stdout, "Opened GeoIP database in %.3f s" % (time.time() - start)
+    uncached = lambda iplist: rank_uncached(memoized, iplist)
+
+    for name, rank in (("no memoization", uncached), ("memoized", memoized.rank_many)):
+        timings = measure(rank, iplist, options.rounds)
+        print >>sys.stdout, "%-15s first pass %.3f s (%.0f IPs/s), later passes %.3f s (%.0f IPs/s)" % \
+            (name, timings[0], len(iplist) / timings[0],
+             min(timings[1:] or timings), len(iplist) / min(timings[1:] or timings))
+    ranked = memoized.rank_many(iplist)
+    for bucket in (RankingPolicy.GEOIP_SAME_CITY, RankingPolicy.GEOIP_SAME_REGION, RankingPolicy.GEOIP_SAME_ASN,
+                   RankingPolicy.GEOIP_SAME_COUNTRY, RankingPolicy.GEOIP_OTHER):
+        print >>sys.stdout, "bucket %4d: %d IPs" % (bucket, len([ip for ip in ranked if ranked[ip] == bucket]))
@@ -0,0 +1,88 @@
+import optparse
+import random
+import sys
+import threading
+import time
+
+from SisClient.RankingPolicy.RankingPolicy import RankingPolicy, OddEvenPolicy
+from SisClient.RankingPolicy.AsyncRankingPolicy import AsyncRankingPolicy
+
+class SimulatedSIS(RankingPolicy):
+    ''' Odd/even ranking that simulates the round trip time of a SOAP request. '''
+    def __init__(self, rtt):
+        RankingPolicy.__init__(self)
+        self.rtt = rtt
+        self.round_trips = 0
+        self.ranked_ips = 0
+
+    def getRankedPeers(self, iplist, callback=None):
+        self.round_trips += 1
+        self.ranked_ips += len(iplist)
+        time.sleep(self.rtt)
+        return OddEvenPolicy().getRankedPeers(iplist)
+
+def create_swarms(options):
+    ''' Every torrent sees a random sample of a shared peer population. '''
+    population = ["10.%d.%d.%d" % (random.randint(0, 255), random.randint(0, 255), random.randint(1, 254))
+                  for i in xrange(options.population)]
+    return [random.sample(population, options.peers) for i in xrange(options.torrents)]
+
+def run(options, coalesce_window):
+    sis = SimulatedSIS(options.rtt / 1000.0)
+    policy = AsyncRankingPolicy(sis, max_time_in_cache=60, coalesce_window=coalesce_window)
+    swarms = create_swarms(options)
+
+    latencies = []
+    lock = threading.Lock()
+    finished = threading.Semaphore(0)
+    def make_callback(started):
+        def callback(ranking):
+            lock.acquire()
+            latencies.append(time.time() - started)
+            lock.release()
+            finished.release()
+        return callback
+
+    # the network thread: every torrent announces once, spread over the announce spread
+    start = time.time()
+    blocked = 0.0
+    waiting = 0
+    for iplist in swarms:
+        before = time.time()
+        ranking = policy.getRankedPeers(iplist, make_callback(before))
+        blocked = max(blocked, time.time() - before)
+        if [ip for ip in iplist if ip in policy._in_flight]:
+            waiting += 1
+        time.sleep(options.spread / 1000.0 / options.torrents)
+    for i in xrange(waiting):
+        finished.acquire()
+    total = time.time() - start
+
+    latencies.sort()
+    print >>sys.stdout, "coalesce window %4.0f ms: %3d SIS round trips, %5d IPs ranked, " \
+        "latency median %6.1f ms / max %6.1f ms, max network thread stall %.2f ms, total %.2f s" % \
+        (coalesce_window * 1000, sis.round_trips, sis.ranked_ips,
+         1000 * latencies[len(latencies) / 2] if latencies else 0,
+         1000 * latencies[-1] if latencies else 0, 1000 * blocked, total)
+
+def parse_options():
+    parser = optparse.OptionParser(usage="Usage: " + sys.argv[0] + " [options]",
+                                   description="Counts the SIS round trips and ranking latency " + \
+                                   "of a simulated multi-torrent session.")
+    parser.add_option("-t", "--torrents", action="store", dest="torrents", default=50, type="int",
+                      help="Number of torrents in the session. Defaults to 50.")
+    parser.add_option("-p", "--peers", action="store", dest="peers", default=50, type="int",
+                      help="Peers per tracker response. Defaults to 50.")
+    parser.add_option("-n", "--population", action="store", dest="population", default=1000, type="int",
+                      help="Number of distinct peer IPs in all swarms. Defaults to 1000.")
+    parser.add_option("-r", "--rtt", action="store", dest="rtt", default=20.0, type="float",
+                      help="Simulated SIS round trip time in ms. Defaults to 20.")
+    parser.add_option("-s", "--spread", action="store", dest="spread", default=500.0, type="float",
+                      help="Time in ms over which the torrents announce. Defaults to 500.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    options, args = parse_options()
+    random.seed(42)
+    for window in (0.0, 0.01, 0.05, 0.1):
+        run(options, window)
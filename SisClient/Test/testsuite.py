@@ -13,6 +13,9 @@ from TestSameHostRanking import TestSameHostRanking
 from TestBiasedUnchoking import TestBiasedUnchoking
 from TestGeoIPRanking import TestGeoIPRanking
 from TestSameIPPrefix import TestSameIPPrefixPolicy
+from TestAsyncRanking import TestAsyncRanking
+from TestRankingCache import TestRankingCache
+from TestReportUploader import TestReportUploader
 
 if __name__ == "__main__":
     #logging.disable(logging.DEBUG)
@@ -25,6 +28,9 @@ if __name__ == "__main__":
                 unittest.makeSuite(TestGeoIPRanking, 'test'),
                 unittest.makeSuite(TestBiasedUnchoking, 'test'),
                 unittest.makeSuite(TestSameIPPrefixPolicy, 'test'),
+                unittest.makeSuite(TestAsyncRanking, 'test'),
+                unittest.makeSuite(TestRankingCache, 'test'),
+                unittest.makeSuite(TestReportUploader, 'test'),
                 #IoP related tests
                 unittest.makeSuite(TestLocalFolder, 'test'),
                 unittest.makeSuite(TestTorrentSelection, 'testNoSis'),
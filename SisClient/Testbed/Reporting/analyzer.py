@@ -4,6 +4,7 @@ import sys
 import time
 
 from BaseLib.Core.simpledefs import *
+from SisClient.Utils.report_delta import ReportDeltaDecoder
 
 class ReportAnalyzer:
     '''Receives status reports from clients, reduces the received information
@@ -15,6 +16,8 @@ class ReportAnalyzer:
         self._joined = {}
         # injected callback function
         self._callback = callback
+        # the last reassembled report of every download
+        self._decoder = ReportDeltaDecoder()
         
         # configure logging for this class
         # we actually need two different loggers
@@ -43,6 +46,7 @@ class ReportAnalyzer:
         self._satisfied = []
         self._reports = {}
         self._joined = {}
+        self._decoder = ReportDeltaDecoder()
         
     def _log_to_file(self, client, report):
         str = "%i\t%s\t%s\t%i" % \
@@ -112,13 +116,26 @@ class ReportAnalyzer:
         '''
         return len(self._conditions) == 0
         
+    def reassemble(self, report):
+        '''Returns the full report for a report as it was received. Clients
+           that send incremental reports send deltas between their full
+           reports. The method returns None for a delta that cannot be
+           reassembled because a report before it got lost.
+        '''
+        full_report = self._decoder.decode(report)
+        if full_report is None:
+            self._logger.debug("Dropped a delta report of client %s, waiting for the next full report." %
+                               report["id"])
+        return full_report
+    
     def put_report(self, report):
         '''Clients of ReportAnalyzer use this method to dispatch a report
            to this class. Before the received report is stored for future
            reference, put_report reduces it so that only the minimum amount
            of required information remains. After that, it starts the
            evaluation against all remaining conditions (a new report
-           could change the status of a remaining condition). 
+           could change the status of a remaining condition). Received
+           reports have to be passed through reassemble first.
         '''
         self._logger.debug("Received a new report.")
         client = report["id"]
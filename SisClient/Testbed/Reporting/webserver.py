@@ -1,19 +1,22 @@
 import cgi, time, zlib
 import select
 import sys
-import pickle
 import optparse
 
 from analyzer import ReportAnalyzer
 from SisClient.Testbed.Utils.statistic import Statistic
+from SisClient.Utils import serialize
 from os import curdir, sep
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
-from threading import Thread
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
 
 __author__ = "Markus Guenther"
 
 analyzer = ReportAnalyzer()
 statistic = Statistic()
+# the handlers of concurrent connections share the analyzer
+report_lock = Lock()
 
 class ReportHandler(BaseHTTPRequestHandler):
     '''
@@ -21,7 +24,12 @@ class ReportHandler(BaseHTTPRequestHandler):
     the base directory of a webserver instance. The POST data should contain
     reports from clients. Currently, those reports are processed and written
     to a log file.
+    
+    Clients keep their connection open between reports, several reports
+    may be sent at once as a list.
     '''
+    protocol_version = "HTTP/1.1"
+    
     def do_HEAD(self):
         '''
         The HEAD command is not implemented and therefore prohibited. The
@@ -52,11 +60,26 @@ class ReportHandler(BaseHTTPRequestHandler):
         
         ctype, pdict = cgi.parse_header(self.headers.getheader('content-type'))
         length = int(self.headers.getheader('content-length'))
-        report = pickle.load(self.rfile)
+        # reports are either pickled or in the binary report format
+        try:
+            reports = serialize.decode_report(self.rfile.read(length))
+        except serialize.SerializationException:
+            self.send_error(400)
+            return
+        if not isinstance(reports, list):
+            reports = [reports]
         
-        # dispatch the report to the analyzer
-        analyzer.put_report(report)
-        statistic.add_report(report)
+        # dispatch the reports to the analyzer
+        report_lock.acquire()
+        try:
+            for report in reports:
+                report = analyzer.reassemble(report)
+                if report is None:
+                    continue
+                analyzer.put_report(report)
+                statistic.add_report(report)
+        finally:
+            report_lock.release()
         
         # throw away additional data [see bug #427345]
         while select.select([self.rfile._sock], [], [], 0)[0]:
@@ -64,7 +87,12 @@ class ReportHandler(BaseHTTPRequestHandler):
                 break
             
         self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
         
+class ReportServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    
 if __name__ == "__main__":
     parser = optparse.OptionParser(usage="USAGE: " + sys.argv[0] + " [options]")
     
@@ -78,7 +106,7 @@ if __name__ == "__main__":
     (options, args) = parser.parse_args()
     
     try:
-        server = HTTPServer((options.server_url, options.server_port), ReportHandler)
+        server = ReportServer((options.server_url, options.server_port), ReportHandler)
         print "Server running at: %s:%s" % (options.server_url, options.server_port)
         while True:
             server.handle_request()
@@ -3,6 +3,7 @@ import logging
 
 from SisClient.Testbed.Reporting.analyzer import *
 from SisClient.Testbed.Conditions import *
+from SisClient.Utils.report_delta import ReportDeltaEncoder
 
 class TestAnalyzer(unittest.TestCase):
     def setUp(self):
@@ -343,6 +344,37 @@ class TestAnalyzer(unittest.TestCase):
         self.assertEquals(0, len(analyzer.get_remaining_conditions()))
         self.assertEquals(4, len(analyzer.get_satisfied_conditions()))
         
+    def test_delta_reports(self):
+        conditions = []
+        conditions.append(ChangedStatusCondition(
+            1, 'DLSTATUS_DOWNLOADING',
+            'DLSTATUS_SEEDING', 'test.rar'))
+        analyzer = ReportAnalyzer()
+        analyzer.set_conditions(conditions)
+        
+        encoder = ReportDeltaEncoder(keyframe_interval=10)
+        report = {
+              "id" : 1,
+              "filename" : "test.rar",
+              "timestamp": time.time(),
+              "status" : DLSTATUS_DOWNLOADING,
+              "progress": 50.0,
+              "down_total" : 100.0,
+              "down_rate" : 10.0,
+              "up_total": 0.0,
+              "up_rate":0.0
+              }
+        analyzer.put_report(analyzer.reassemble(encoder.encode(report)))
+        report = dict(report)
+        report.update({ "status" : DLSTATUS_SEEDING, "progress" : 100.0, "down_total" : 200.0 })
+        delta = encoder.encode(report)
+        self.assertFalse(delta.has_key("up_total"))
+        full = analyzer.reassemble(delta)
+        self.assertEquals(200.0, full["down_total"])
+        analyzer.put_report(full)
+        
+        self.assertTrue(analyzer.satisfied_all_conditions())
+        
 def main():
     logging.basicConfig(level=logging.WARNING)
     unittest.main()
@@ -253,7 +253,9 @@ class PlayerApp(wx.App,InstanceConnectionHandler):
                                             self.sconfig,
                                             self.sc.get_compress_xml_reports(),
                                             self.sc.get_serialization_method(),
-                                            report_interval=self.sc.get_report_interval()))
+                                            report_interval=self.sc.get_report_interval(),
+                                            compress_level=self.sc.get_report_compress_level(),
+                                            keyframe_interval=self.sc.get_report_keyframe_interval()))
 
             if self.sc.get_sis_url() != None:
                 ip_addr = self.s.get_external_ip()
@@ -21,11 +21,31 @@ __author__ = "Markus Guenther"
 class SupporterXMLRPCServer(object):
     def __init__(self, supporter):
         self._supporter = supporter # instance of SupporterServer (in order to notify it)
+        self._supportees = []
     
     def receive_peer_list(self, list_of_peer_tuples):
         # tuples adhere to the form (peer_id, ip, port)
         print >>sys.stdout, 'Received a list of peers to be unchoked...', list_of_peer_tuples
-        self._supporter.push_supportee_list_to_choker(list_of_peer_tuples)
+        self._supportees = [tuple(peer) for peer in list_of_peer_tuples]
+        self._supporter.push_supportee_list_to_choker(list(self._supportees))
+        return True
+    
+    def receive_peer_list_delta(self, added_peers, removed_peers):
+        '''Updates the list of peers to be unchoked with the peers that were assigned to or
+        removed from this supporter since the last list it received. Tuples adhere to the
+        form (peer_id, ip, port).
+        
+        @return:
+            True
+        '''
+        print >>sys.stdout, 'Received changes of the peers to be unchoked...', added_peers, removed_peers
+        removed = dict.fromkeys([tuple(peer) for peer in removed_peers])
+        supportees = [peer for peer in self._supportees if not removed.has_key(peer)]
+        for peer in added_peers:
+            if tuple(peer) not in supportees:
+                supportees.append(tuple(peer))
+        self._supportees = supportees
+        self._supporter.push_supportee_list_to_choker(list(self._supportees))
         return True
     
     def is_alive(self):
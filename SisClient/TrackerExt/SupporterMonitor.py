@@ -1,8 +1,13 @@
+import heapq
 import logging
 import threading
 import time
 import xmlrpclib
 import sys
+from collections import deque
+from itertools import count
+
+from BaseLib.Core.APIImplementation.ThreadPool import ThreadPool
 
 __author__ = "Markus Guenther"
 
@@ -17,6 +22,9 @@ PEER_REQUIRED_MSGS = 5
 PEER_STATUS_APPROVAL_TIME = PEER_REQUIRED_MSGS * ( 1 + 0.150 )
 PEER_REMOVAL_TIME = 20 # removes a monitored peer if the last activity was reported more 
 #than PEER_REMOVAL_TIME seconds ago
+UPDATE_INTERVAL = 1.0 # seconds between two asynchronous state updates
+SUPPORTER_CALL_TIMEOUT = 2.0 # seconds an XML-RPC call to a supporter may take at most
+DISPATCH_THREADS = 8 # number of threads that contact supporters in parallel
 
 PEER_TYPE_SEEDER = 0
 PEER_TYPE_LEECHER = 1
@@ -192,6 +200,7 @@ class MonitoredPeer(object):
         self._ts_last_received_msg = None # there is a difference between the request message window
                                           # and this one here! (this is set for ALL message types)
         self._state = DefaultState(self)
+        self._state_listener = None
         self._timeout_timer = None
         self.reset_support_cycle()
         # assign given parameters using class methods (they perform further checks on validity)
@@ -375,7 +384,22 @@ class MonitoredPeer(object):
             NoneType
         '''
         assert isinstance(state, State)
+        old_state = self._state
         self._state = state
+        if self._state_listener is not None:
+            self._state_listener(self, old_state, state)
+            
+    def set_state_listener(self, listener):
+        '''Sets a callable that is notified about every state change of this MonitoredPeer.
+        SupporterMonitor uses this to keep its per-state indexes up to date.
+        
+        @param listener:
+            Callable taking the arguments (monitored_peer, old_state, new_state), or NoneType
+        
+        @return:
+            NoneType
+        '''
+        self._state_listener = listener
         
     def get_state(self):
         '''@return:
@@ -451,7 +475,7 @@ class MonitoredPeer(object):
         @return:
             NoneType
         '''
-        self._state = StarvingState(self)
+        self.set_state(StarvingState(self))
     
     def received_support_required_message(self):
         '''Handler method for the event that the associated monitored peer sent MSG_SUPPORT_REQUIRED.
@@ -522,6 +546,28 @@ class MonitoredPeer(object):
         '''
         return self._timeout_timer == None
     
+    def next_deadline(self, now):
+        '''Computes the earliest point in time at or after now at which this peer might change
+        its state without receiving a message: its removal time, the is-alive timeouts of its
+        last request and the expiry of the timeout timer.
+        
+        @param now:
+            The current time
+        
+        @return:
+            The timestamp of the next deadline. NoneType, if no message was received yet.
+        '''
+        if self._ts_last_received_msg is None:
+            return None
+        deadlines = [self._ts_last_received_msg + PEER_REMOVAL_TIME]
+        ts_last_request = self.get_ts_last_request()
+        if ts_last_request is not None:
+            deadlines.append(ts_last_request + IS_ALIVE_TIMEOUT_BOUND)
+            deadlines.append(ts_last_request + 10)
+        if not self.timeout_timer_stopped():
+            deadlines.append(self._timeout_timer + PEER_TIMEOUT_BOUND)
+        return min([d for d in deadlines if d >= now] or [deadlines[0]])
+    
 #___________________________________________________________________________________________________
     
 class MonitoredSupporter(object):
@@ -664,6 +710,14 @@ class MonitoredSupporter(object):
         # TODO (mgu): Is this method called somewhere?
         return len(self._supported_peers) - self.get_min_peer() >= 0
     
+    def set_updated(self):
+        '''Marks the supportee list as changed, so that it is dispatched again.
+        
+        @return:
+            NoneType
+        '''
+        self._updated = True
+        
     def reset_update_counter(self):
         #print>>sys.stderr.write("Old state: %s\n" % self._updated)
         value = self._updated
@@ -701,43 +755,82 @@ class SupporterMonitor(object):
     upon the receipt of a peer message. SupporterMonitor also triggers state changes for peers
     as well as supporters asynchronously by calling its update method in regular intervals of
     1 second.
+    
+    Peers are indexed by their ID and by their current state, and every peer has a deadline in
+    a queue at which it might time out. Active supporters are kept in a heap ordered by their
+    available slots. An update thus only touches the peers whose deadline has passed and the
+    peers and supporters whose state changed since the last update.
     '''
     def __init__(self):
         self._logger = logging.getLogger("Tracker.SupporterMonitor")
         self._dispatcher = SupporteeListDispatcher(self)
-        self._monitored_peers = []
+        # mapping: peer ID => MonitoredPeer
+        self._monitored_peers = {}
+        # mapping: state class => {peer ID => MonitoredPeer}
+        self._peers_by_state = { DefaultState   : {},
+                                 WatchedState   : {},
+                                 StarvingState  : {},
+                                 SupportedState : {} }
+        # starving peers in the order in which they started to starve. may contain peers that
+        # are no longer starving, those are skipped when taken from the queue
+        self._starving_queue = deque()
+        # heap of (deadline, peer ID) and the valid deadline for every peer ID
+        self._deadline_queue = []
+        self._deadlines = {}
         self._monitored_supporters = []
-        self._active_supporters = []
+        # mapping: active MonitoredSupporter => its current key in the capacity heap
+        self._active_supporters = {}
+        # heap of (-available slots, sequence number, MonitoredSupporter)
+        self._capacity_heap = []
+        self._sequence = count()
+        # mapping: peer ID => MonitoredSupporter the peer is assigned to
+        self._supporter_of = {}
+        # assigned peers that left the SUPPORTED state since the last update
+        self._released_peers = {}
         self._lock = threading.Lock()
-        self.schedule_next_asynchronous_update()
-        # FIXME: pass it to states differently ...
-        # TODO: underneath two lines should be obsolete!
-        #global monitored_peers
-        #monitored_peers = self._monitored_peers
         
         # contains supporter servers that were marked as dead (last communication was not
         # successful) and should be removed in the next update cycle (we cant do this
         # directly because of concurrency issues)
         self._dead_supporters = []
         
-    def schedule_next_asynchronous_update(self):
-        '''Schedules the next asynchronous state update for peers and supporters.
+        self._stopped = threading.Event()
+        self._scheduler = threading.Thread(target=self._run_scheduler)
+        self._scheduler.setName("SupporterMonitor" + self._scheduler.getName())
+        self._scheduler.setDaemon(True)
+        self._scheduler.start()
+        
+    def _run_scheduler(self):
+        # body of the scheduler thread, performs an update every UPDATE_INTERVAL seconds
+        try:
+            while not self._stopped.isSet():
+                started = time.time()
+                try:
+                    self.update_states()
+                except:
+                    self._logger.exception("Asynchronous state update failed")
+                self._stopped.wait(max(0, UPDATE_INTERVAL - (time.time() - started)))
+        except:
+            if time is None:
+                # the daemon thread may still run while the interpreter shuts down and
+                # clears the module globals
+                return
+            self._logger.exception("Scheduler of the state updates failed")
+            
+    def shutdown(self):
+        '''Stops the asynchronous state updates and the threads that contact supporters.
         
         @return:
             NoneType
         '''
-        for th in threading.enumerate():
-            if th.getName() == "MainThread" and not th.isAlive():
-                return
-        
-        t = threading.Timer(1.0, self.update_states)
-        t.start()
+        self._stopped.set()
+        self._dispatcher.shutdown()
         
     def get_monitored_peers(self):
         '''@return:
             List containing MonitoredPeer instances
         '''
-        return self._monitored_peers
+        return self._monitored_peers.values()
     
     def get_monitored_supporters(self):
         '''@return:
@@ -748,12 +841,16 @@ class SupporterMonitor(object):
     
     def get_active_supporters(self):
         '''@return:
-            List containing all MonitoredSupporter instances that reside in the ACTIVE state
+            List containing all MonitoredSupporter instances that reside in the ACTIVE state,
+            ordered by decreasing value of their available slots
         '''
-        return self._active_supporters
+        active = [(key, s) for s, key in self._active_supporters.items()]
+        active.sort()
+        return [s for key, s in active]
         
     def register_monitored_peer(self, id, ip, port, peer_type):
-        '''Registers a peer at the monitor.
+        '''Registers a peer at the monitor. A peer that registers again from another address
+        replaces the MonitoredPeer instance with the same ID.
         
         @param id:
             ID of the peer to be registered
@@ -771,10 +868,15 @@ class SupporterMonitor(object):
         self._lock.acquire()
         
         mp = MonitoredPeer(id, ip, port, peer_type)
-        if mp not in self._monitored_peers:
-            self._monitored_peers.append(mp)
-        else:
+        existing = self._monitored_peers.get(id)
+        if existing is not None and existing == mp:
             mp = None
+        else:
+            if existing is not None:
+                self.unregister_monitored_peer(existing)
+            mp.set_state_listener(self._peer_state_changed)
+            self._monitored_peers[id] = mp
+            self._peers_by_state[DefaultState][id] = mp
             
         self._lock.release()
         
@@ -783,7 +885,8 @@ class SupporterMonitor(object):
         return mp
     
     def unregister_monitored_peer(self, monitored_peer):
-        '''Unregisters a previously registered peer from the monitor.
+        '''Unregisters a previously registered peer from the monitor. If the peer is assigned
+        to a supporter, it is removed from the supportee list of that supporter.
         
         @param monitored_peer:
             Instance of MonitoredPeer that shall be unregistered from the monitor
@@ -794,8 +897,18 @@ class SupporterMonitor(object):
         assert monitored_peer is not None
         assert isinstance(monitored_peer, MonitoredPeer)
         
-        if monitored_peer in self._monitored_peers:
-            self._monitored_peers.remove(monitored_peer)
+        id = monitored_peer.get_id()
+        if self._monitored_peers.get(id) is not monitored_peer:
+            return
+        del self._monitored_peers[id]
+        self._peers_by_state[monitored_peer.get_state().__class__].pop(id, None)
+        self._deadlines.pop(id, None)
+        self._released_peers.pop(id, None)
+        monitored_peer.set_state_listener(None)
+        supporter = self._supporter_of.pop(id, None)
+        if supporter is not None:
+            supporter.remove_supported_peer(monitored_peer)
+            self._supporter_changed(supporter)
             
     def register_monitored_supporter(self, id, addr, min_peer, max_peer):
         '''Registers a supporter server at the monitor.
@@ -828,7 +941,8 @@ class SupporterMonitor(object):
         return ms
             
     def unregister_monitored_supporter(self, monitored_supporter):
-        '''Unregisters a previously registered supporter from the monitor.
+        '''Unregisters a previously registered supporter from the monitor. The peers that
+        were assigned to it become STARVING again.
         
         @param monitored_supporter:
             Instance of MonitoredSupporter that shall be unregistered from the monitor
@@ -840,19 +954,53 @@ class SupporterMonitor(object):
         assert isinstance(monitored_supporter, MonitoredSupporter)
 
         if monitored_supporter in self._monitored_supporters:
+            for mp in monitored_supporter.get_supported_peers():
+                self._supporter_of.pop(mp.get_id(), None)
             monitored_supporter.cancel_support_for_all_peers()
+            self._active_supporters.pop(monitored_supporter, None)
             self._monitored_supporters.remove(monitored_supporter)
             self._dispatcher.unregister_proxy(monitored_supporter)
             
     def order_active_supporters(self):
-        '''Orders all active supporters by decreasing value of their available slots.
+        '''Rebuilds the heap that orders all active supporters by decreasing value of their
+        available slots. The heap is maintained on every assignment, so this is only needed
+        if the supportee lists were changed from outside of the monitor.
         
         @return:
             NoneType
         '''
-        tmp = [ (s,s.available_slots()) for s in self._active_supporters]
-        tmp.sort(lambda x,y: cmp(y[1],x[1]))
-        self._active_supporters = [ s[0] for s in tmp ]
+        self._capacity_heap = []
+        for s in self._active_supporters.keys():
+            self._push_supporter(s)
+        
+    def _push_supporter(self, monitored_supporter):
+        # (re-)inserts an active supporter into the capacity heap, older entries of the same
+        # supporter become invalid and are dropped when they reach the top of the heap
+        if len(self._capacity_heap) > 4 * len(self._active_supporters) + 64:
+            self.order_active_supporters()
+        key = (-monitored_supporter.available_slots(), self._sequence.next())
+        self._active_supporters[monitored_supporter] = key
+        heapq.heappush(self._capacity_heap, key + (monitored_supporter,))
+        
+    def _top_active_supporter(self):
+        # returns the active supporter with the most available slots, NoneType if there is none
+        heap = self._capacity_heap
+        while heap:
+            slots, seq, s = heap[0]
+            if self._active_supporters.get(s) == (slots, seq):
+                return s
+            heapq.heappop(heap)
+        return None
+        
+    def _supporter_changed(self, monitored_supporter):
+        # updates the position of an active supporter after its supportee list changed and
+        # inactivates it once no peer is assigned to it any more
+        if not self._active_supporters.has_key(monitored_supporter):
+            return
+        if monitored_supporter.assigned_slots() == 0:
+            self.inactivate_supporter(monitored_supporter)
+        else:
+            self._push_supporter(monitored_supporter)
         
     def filter_peers_by_state(self, state_class):
         '''Extracts peers with the given state from the list of all registered peers.
@@ -864,57 +1012,98 @@ class SupporterMonitor(object):
         @return:
             List of registered monitored peers that currently reside in the given state
         '''
-        return [mp for mp in self._monitored_peers if isinstance(mp.get_state(), state_class)]
+        if self._peers_by_state.has_key(state_class):
+            return self._peers_by_state[state_class].values()
+        return [mp for mp in self._monitored_peers.itervalues() if isinstance(mp.get_state(), state_class)]
     
     def remaining_active_supporters_with_capacity(self):
         '''@return:
             Boolean value, indicating whether we have at least one active supporter that still
             has available slots
         '''
-        return len(self._active_supporters) != 0 and self._active_supporters[0].available_slots() > 0
+        s = self._top_active_supporter()
+        return s is not None and s.available_slots() > 0
     
     def update_states(self):
         '''Performs an asynchronous state update of all registered monitored peers and supporters.
         The method looks for starving peers and tries to assign them to active supporters. If
         starving peers remain afterwards, it tries to activate new supporters in order to support
-        those starving peers. Dispatches supportee lists to all active supporters at the end
-        of the state update.
+        those starving peers. Dispatches supportee lists to all supporters whose supportees
+        changed at the end of the state update, and checks if the supporters are alive.
+        Supporters are contacted in the background, without holding the monitor lock.
         
         @return:
             NoneType
         '''
         self._lock.acquire()
-        self._remove_timedout_peers()
-        self._mark_dead_supporters()
-        self._remove_dead_supporters()
-        
-        self._enforce_update_of_monitored_peers()
-        self._enforce_update_of_monitored_supporters()
-
-        self._assign_starving_peers_to_active_supporters()
-        # at this point, we still might have some starving peers left, but no active
-        # servers with free capacities. but we can see if we are able to activate more
-        # supporters.
-        self._check_for_activation_of_new_supporters()
+        try:
+            self._update_due_peers()
+            self._remove_dead_supporters()
+            
+            self._enforce_update_of_monitored_supporters()
+    
+            self._assign_starving_peers_to_active_supporters()
+            # at this point, we still might have some starving peers left, but no active
+            # servers with free capacities. but we can see if we are able to activate more
+            # supporters.
+            self._check_for_activation_of_new_supporters()
+        finally:
+            self._lock.release()
         # now send new peer_lists to supporters
         self._dispatcher.dispatch_peer_lists()
-        self._lock.release()
-        self.schedule_next_asynchronous_update()
+        self._mark_dead_supporters()
         
-    def _remove_timedout_peers(self):
-        '''Removes peers for which the last activity was reported more than PEER_REMOVAL_TIME
-        seconds ago.
+    def _peer_state_changed(self, monitored_peer, old_state, new_state):
+        # state listener of all registered peers, keeps the state indexes up to date
+        if old_state.__class__ is new_state.__class__:
+            return
+        id = monitored_peer.get_id()
+        self._peers_by_state[old_state.__class__].pop(id, None)
+        self._peers_by_state[new_state.__class__][id] = monitored_peer
+        if isinstance(new_state, StarvingState):
+            self._starving_queue.append(monitored_peer)
+        if self._supporter_of.has_key(id) and not isinstance(new_state, SupportedState):
+            self._released_peers[id] = monitored_peer
+            
+    def _schedule_peer(self, monitored_peer, now=None):
+        # (re-)inserts the next deadline of a peer into the deadline queue
+        if now is None:
+            now = time.time()
+        deadline = monitored_peer.next_deadline(now)
+        if deadline is None:
+            return
+        id = monitored_peer.get_id()
+        if self._deadlines.get(id) == deadline:
+            return
+        self._deadlines[id] = deadline
+        heapq.heappush(self._deadline_queue, (deadline, id))
+        
+    def _update_due_peers(self):
+        '''Handles the peers whose deadline has passed. Removes peers for which the last activity
+        was reported more than PEER_REMOVAL_TIME seconds ago and triggers an update on the
+        remaining ones, since peer status transitions might happen asynchronously (after a
+        timer runs out).
         
         @return:
             NoneType
         '''
-        peers_to_be_removed = []
-        ts = time.time()
-        for mp in self.get_monitored_peers():
-            if (ts - mp.get_ts_last_message()) >= PEER_REMOVAL_TIME:
-                peers_to_be_removed.append(mp)
-        for mp in peers_to_be_removed:
-            self.unregister_monitored_peer(mp)
+        now = time.time()
+        queue = self._deadline_queue
+        due = []
+        while queue and queue[0][0] <= now:
+            deadline, id = heapq.heappop(queue)
+            if self._deadlines.get(id) == deadline:
+                del self._deadlines[id]
+                due.append(self._monitored_peers[id])
+        for mp in due:
+            if (now - mp.get_ts_last_message()) >= PEER_REMOVAL_TIME:
+                self.unregister_monitored_peer(mp)
+                continue
+            if mp.get_ts_last_request() and (now - mp.get_ts_last_request() > 10):
+                mp.set_state(DefaultState(mp))
+            else:
+                mp.get_state().transition()
+            self._schedule_peer(mp, now)
             
     def _mark_dead_supporters(self):
         '''Tries to contact every registered supporters and marks those that do not respond
@@ -924,6 +1113,23 @@ class SupporterMonitor(object):
             NoneType
         '''
         self._dispatcher.query_all_supporters()
+        
+    def mark_supporter_dead(self, monitored_supporter):
+        '''Marks a supporter that did not respond for removal during the next update.
+        
+        @param monitored_supporter:
+            Instance of MonitoredSupporter that did not respond
+            
+        @return:
+            NoneType
+        '''
+        self._lock.acquire()
+        try:
+            if monitored_supporter in self._monitored_supporters and \
+                    monitored_supporter not in self._dead_supporters:
+                self._dead_supporters.append(monitored_supporter)
+        finally:
+            self._lock.release()
             
     def _remove_dead_supporters(self):
         '''Removes supporters that were marked as being dead.
@@ -931,40 +1137,40 @@ class SupporterMonitor(object):
         @return:
             NoneType
         '''
-        for supporter in self._dead_supporters:
+        dead_supporters = self._dead_supporters
+        self._dead_supporters = []
+        for supporter in dead_supporters:
             self.unregister_monitored_supporter(supporter)
         
-    def _enforce_update_of_monitored_peers(self):
-        '''Triggers an update on all registered monitored peers. This has to be done since
-        peer status transitions might happen asynchronously (after a timer runs out).
-        
-        @return:
-            NoneType
-        '''
-        for mp in self.get_monitored_peers():
-            # TODO (mgu): Is the first condition needed any longer? The former code
-            # here did not work (removal of the peer) because we have a side-effect if we try
-            # to remove an item from a list that is being iterated over.
-            if mp.get_ts_last_request() and (time.time() - mp.get_ts_last_request() > 10):
-                mp.set_state(DefaultState(mp))
-            else:
-                mp.get_state().transition()
-            
     def _enforce_update_of_monitored_supporters(self):
-        '''Triggers an update on all registered supporters. This includes the potential transition
-        from ACTIVE to INACTIVE for a specific supporter. Updates the active supporter list.
+        '''Removes the peers that left the SUPPORTED state since the last update from the
+        supportee lists of their supporters. This includes the potential transition from
+        ACTIVE to INACTIVE for those supporters.
         
         @return:
             NoneType
         '''
-        # check for all supporters if they have peers in their supported list
-        # that no longer need support (state == DEFAULT)
-        supporters_to_be_inactivated = []
-        for supporter in self._active_supporters:
-            supporter.update_supported_peer_list()
-            if supporter.assigned_slots() == 0:
-                supporters_to_be_inactivated.append(supporter)
-        self._active_supporters = [s for s in self._active_supporters if s not in supporters_to_be_inactivated]
+        released_peers = self._released_peers
+        self._released_peers = {}
+        for id, mp in released_peers.iteritems():
+            if isinstance(mp.get_state(), SupportedState):
+                continue
+            supporter = self._supporter_of.pop(id, None)
+            if supporter is None:
+                continue
+            supporter.remove_supported_peer(mp)
+            self._supporter_changed(supporter)
+
+    def _next_starving_peer(self):
+        # returns the peer that starves the longest without removing it from the queue
+        starving = self._peers_by_state[StarvingState]
+        queue = self._starving_queue
+        while queue:
+            mp = queue[0]
+            if starving.get(mp.get_id()) is mp:
+                return mp
+            queue.popleft()
+        return None
 
     def _assign_starving_peers_to_active_supporters(self):
         '''Tries to assign starving peers to already active supporters. This method relies on the
@@ -974,25 +1180,15 @@ class SupporterMonitor(object):
         @return:
             NoneType
         '''
-        starving_peers = self.filter_peers_by_state(StarvingState)
-        
-        while len(starving_peers) > 0:
-            peer = starving_peers[0]
+        while self._peers_by_state[StarvingState]:
             # 2. do we have active servers with free slots? it suffices to look
-            # at the first supporter of the active list, since we keep this list
-            # ordered
-            active_supporters = self.get_active_supporters()
-            
+            # at the top of the capacity heap
             if self.remaining_active_supporters_with_capacity():
-                # assign peer to supporter and re-order the active list 
-                self.assign_peer_to_supporter(peer, active_supporters[0])
-                starving_peers.remove(peer)
-                self.order_active_supporters()
+                self.assign_peer_to_supporter(self._next_starving_peer(), self._top_active_supporter())
             else:
-                
                 # this is the case if we have no longer any active supporters that
-                # can provide slots to suffering peers. we break in this case and
-                # handle the set of remaining peers (starving_peers) next
+                # can provide slots to suffering peers. the remaining starving peers
+                # are handled next
                 break
     
     def _check_for_activation_of_new_supporters(self):
@@ -1002,56 +1198,43 @@ class SupporterMonitor(object):
         @return:
             NoneType
         '''
-        def sorted_list_of_inactive_supporters():
-            # create a list with supporters that are inactive and sort this list
-            # in ascending order of min_peers, since we want to help suffering
-            # peers as fast as possible (but please consider the fact this will
-            # not result in an optimal distribution of starving peers in combination
-            # with the used assignment algorithm underneath
-            inactive_supporters = [(s,s.get_min_peer()) for s in self._monitored_supporters if s not in self._active_supporters]
-            if len(inactive_supporters) == 0:
-                return []
-            inactive_supporters.sort(lambda x,y: cmp(x[1],y[1]))
-            return inactive_supporters
-        
-        def retrieve_activation_index(starving_peers, inactive_supporters):
-            # checks how many supporters (up to some index i) should be activated in order
-            # to supply data to starving peers. this algorithm is quite simple. actually, we have a 
-            # bin packing problem here at hand which we dont solve optimally using this algorithm.
-            # the method used here is a very simple greedy approach, which might not assign peers 
-            # optimally, meaning that some peers might remain in the STARVING state, although we 
-            # could obtain a better result if our algorithm was better.
-            starving_number = len(starving_peers)
-            activate_up_to_index = -1
-            for i in xrange(len(inactive_supporters)):
-                if starving_number >= inactive_supporters[i][1]:
-                    starving_number -= inactive_supporters[i][0].available_slots()
-                    activate_up_to_index = i
-                else:
+        starving_number = len(self._peers_by_state[StarvingState])
+        if starving_number == 0:
+            return
+        
+        # create a list with supporters that are inactive and sort this list
+        # in ascending order of min_peers, since we want to help suffering
+        # peers as fast as possible (but please consider the fact this will
+        # not result in an optimal distribution of starving peers in combination
+        # with the used assignment algorithm underneath
+        inactive_supporters = [(s.get_min_peer(), i, s) for i, s in enumerate(self._monitored_supporters)
+                               if not self._active_supporters.has_key(s)]
+        inactive_supporters.sort()
+        
+        # checks how many supporters should be activated in order to supply data to
+        # starving peers. this algorithm is quite simple. actually, we have a bin packing
+        # problem here at hand which we dont solve optimally using this algorithm.
+        # the method used here is a very simple greedy approach, which might not assign peers 
+        # optimally, meaning that some peers might remain in the STARVING state, although we 
+        # could obtain a better result if our algorithm was better.
+        to_be_activated = []
+        for min_peer, i, s in inactive_supporters:
+            if starving_number >= min_peer:
+                starving_number -= s.available_slots()
+                to_be_activated.append(s)
+            else:
+                break
+        
+        # activates the selected supporters and assigns starving peers on-the-fly
+        # to freshly activated supporters.
+        for s in to_be_activated:
+            self.activate_supporter(s)
+            while s.available_slots() > 0:
+                mp = self._next_starving_peer()
+                if mp is None:
                     break
-            return activate_up_to_index
-        
-        def activate_supporters_and_assign_peers(index, starving_peers):
-            # activates new supporters from the sorted inactivate supporters list starting from
-            # index 0 up to the given max. index. the method assigns starving peers on-the-fly
-            # to freshly activated supporters.
-            if activate_up_to_index >= 0:
-                for i in xrange(0,activate_up_to_index+1): # bound for xrange has to be +1
-                    self.activate_supporter(inactive_supporters[i][0])
-                    assigned_peers = []
-                    for peer in starving_peers:
-                        self.assign_peer_to_supporter(peer, inactive_supporters[0][0])
-                        assigned_peers.append(peer)
-                        if inactive_supporters[0][0].available_slots() == 0:
-                            break
-                    starving_peers = [p for p in starving_peers if p not in assigned_peers]
-                # we activated some new supporters and have to maintain their sorting order now
-                self.order_active_supporters()
-        
-        starving_peers = self.filter_peers_by_state(StarvingState)
-        inactive_supporters = sorted_list_of_inactive_supporters()
-        activate_up_to_index = retrieve_activation_index(starving_peers, inactive_supporters)
-        activate_supporters_and_assign_peers(activate_up_to_index, starving_peers)
+                self.assign_peer_to_supporter(mp, s)
+            self._supporter_changed(s)
 
     def activate_supporter(self, monitored_supporter):
         '''Activates the given MonitoredSupporter.
@@ -1070,7 +1253,7 @@ class SupporterMonitor(object):
             # already activated
             return
         
-        self._active_supporters.append(monitored_supporter)
+        self._push_supporter(monitored_supporter)
         
     def inactivate_supporter(self, monitored_supporter):
         '''Inactivates the given MonitoredSupporter if no peer is currently assigned to it.
@@ -1086,7 +1269,7 @@ class SupporterMonitor(object):
         assert isinstance(monitored_supporter, MonitoredSupporter)
         
         if monitored_supporter.assigned_slots() == 0:
-            self._active_supporters.remove(monitored_supporter)
+            self._active_supporters.pop(monitored_supporter, None)
             
     def assign_peer_to_supporter(self, monitored_peer, monitored_supporter):
         '''Assigns a peer to an active supporter and triggers the update of the peer's state.
@@ -1104,12 +1287,15 @@ class SupporterMonitor(object):
         assert monitored_peer is not None
         assert monitored_supporter is not None
         
-        if monitored_supporter not in self._active_supporters:
+        if not self._active_supporters.has_key(monitored_supporter):
             return
         
         monitored_supporter.add_supported_peer(monitored_peer)
-        self.order_active_supporters()
+        self._push_supporter(monitored_supporter)
+        self._supporter_of[monitored_peer.get_id()] = monitored_supporter
+        self._released_peers.pop(monitored_peer.get_id(), None)
         monitored_peer.receive_msg(MSG_PEER_SUPPORTED)
+        self._schedule_peer(monitored_peer)
         
     def received_peer_message(self, msg_type, peer_id):
         '''Handler method for incoming peer messages. Dispatches the message to the resp.
@@ -1124,33 +1310,56 @@ class SupporterMonitor(object):
             NoneType
         '''
         self._lock.acquire()
-        found = False
         try:
-            for peer in self.get_monitored_peers():
-                if peer_id == peer.get_id():
-                    self._logger.debug("Dispatching %s message to %s" % (msg_type, peer_id))
-                    peer.receive_msg(msg_type)
-                    found = True
-                    break
-            if not found:
+            peer = self._monitored_peers.get(peer_id)
+            if peer is not None:
+                self._logger.debug("Dispatching %s message to %s" % (msg_type, peer_id))
+                peer.receive_msg(msg_type)
+                self._schedule_peer(peer)
+            else:
                 self._logger.warning("Got an unregistered peer ID: %s" % peer_id)
         finally:
             self._lock.release()
             
 #___________________________________________________________________________________________________
 
+class TimeoutTransport(xmlrpclib.Transport):
+    '''XML-RPC transport whose connections give up after a given number of seconds.'''
+    def __init__(self, timeout):
+        xmlrpclib.Transport.__init__(self)
+        self._timeout = timeout
+        
+    def make_connection(self, host):
+        conn = xmlrpclib.Transport.make_connection(self, host)
+        conn.timeout = self._timeout
+        return conn
+
 class SupporteeListDispatcher(object):
     '''This class implements a strategy to dispatch supportee lists to specific supporter
     servers. The communication runs over XML-RPC. The implementation requires the establishment
     of a proxy for every registered supporter.
+    
+    All calls are made by a pool of DISPATCH_THREADS threads and time out after
+    SUPPORTER_CALL_TIMEOUT seconds, so a supporter that hangs does not delay the others.
+    There is at most one call in progress per supporter. A supporter gets the full supportee
+    list once, afterwards only the peers that were added or removed since the last list it
+    received.
     '''
-    def __init__(self, monitor):
+    def __init__(self, monitor, threads=DISPATCH_THREADS, timeout=SUPPORTER_CALL_TIMEOUT):
         assert isinstance(monitor, SupporterMonitor)
         
         self._monitor = monitor
         self._logger = logging.getLogger("Tracker.SupporterMonitor.XMLRPC")
+        self._threads = threads
+        self._timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
         # mapping: hash(MonitoredSupporter) => XML/RPC proxy for that supporter
         self._proxies = {}
+        # mapping: MonitoredSupporter => supportee list the supporter received last
+        self._sent_lists = {}
+        # supporters with a call in progress
+        self._pending = {}
         
     def register_proxy(self, supporter):
         '''Creates a proxy for the given supporter.
@@ -1163,7 +1372,7 @@ class SupporteeListDispatcher(object):
         '''
         assert isinstance(supporter, MonitoredSupporter)
         proxy_uri = "http://%s:%i" % (supporter.get_addr()[0], supporter.get_addr()[1]+1)
-        self._proxies[supporter] = xmlrpclib.ServerProxy(proxy_uri)
+        self._proxies[supporter] = xmlrpclib.ServerProxy(proxy_uri, TimeoutTransport(self._timeout))
         
     def unregister_proxy(self, supporter):
         '''Dereferences the proxy for the given supporter (if the proxy was created prior
@@ -1180,49 +1389,120 @@ class SupporteeListDispatcher(object):
         if self._proxies.has_key(supporter):
             self._proxies[supporter] = None
             del self._proxies[supporter]
+        self._sent_lists.pop(supporter, None)
+        
+    def shutdown(self):
+        '''Stops the threads that contact the supporters, calls in progress are finished.
+        
+        @return:
+            NoneType
+        '''
+        self._lock.acquire()
+        pool = self._pool
+        self._pool = None
+        self._lock.release()
+        if pool is not None:
+            pool.joinAll(waitForTasks=False, waitForThreads=False)
+            
+    def _submit(self, supporter, call, *args):
+        # runs call(supporter, proxy, *args) in the thread pool, unless a call to the
+        # supporter is already in progress. returns whether the call was submitted.
+        self._lock.acquire()
+        try:
+            proxy = self._proxies.get(supporter)
+            if proxy is None or self._pending.has_key(supporter):
+                return False
+            if self._pool is None:
+                self._pool = ThreadPool(self._threads)
+            self._pending[supporter] = True
+            self._pool.queueTask(self._run_call, (call, supporter, proxy) + args)
+            return True
+        finally:
+            self._lock.release()
+            
+    def _run_call(self, call, supporter, proxy, *args):
+        try:
+            try:
+                call(supporter, proxy, *args)
+            except:
+                self._logger.exception("Call to supporter at %s:%s failed" % supporter.get_addr())
+        finally:
+            self._lock.acquire()
+            self._pending.pop(supporter, None)
+            self._lock.release()
             
     def query_all_supporters(self):
         '''Queries all registered supporters in order to check if they are still alive. If a
         supporter is considered as being dead, it will be marked for removal from the
-        supporter monitor.
+        supporter monitor. Supporters that are still busy with an earlier call are skipped.
         
         @return:
             NoneType
         '''
-        for supporter in self._monitor.get_monitored_supporters():
-            proxy = self._proxies[supporter]
-            try:
-                proxy.is_alive()
-            except:
-                self._logger.info("Supporter at %s:%s is not responding. Marking it for unregistering.")
-                self._monitor._dead_supporters.append(supporter)
+        for supporter in list(self._monitor.get_monitored_supporters()):
+            self._submit(supporter, self._check_alive)
+            
+    def _check_alive(self, supporter, proxy):
+        try:
+            proxy.is_alive()
+        except:
+            self._logger.info("Supporter at %s:%s is not responding. Marking it for unregistering." %
+                              supporter.get_addr())
+            self._monitor.mark_supporter_dead(supporter)
     
     def dispatch_peer_lists(self):
-        '''Collects supportee data for every monitored supporter and dispatches the resulting
-        supportee lists via the XML-RPC proxy interface to the resp. supporter.
+        '''Collects supportee data for every monitored supporter whose supportees changed and
+        dispatches the resulting supportee lists via the XML-RPC proxy interface to the resp.
+        supporter. Synchronizes against the monitor while collecting the lists only.
         
         @return:
             NoneType
         '''
-        for supporter in self._monitor.get_monitored_supporters():
-            # TODO (mgu): The method name suggests that it only resets some values, not returns
-            # a truth value. This should be changed! (avoid side-effects or misleading method
-            # names)
-            if not supporter.reset_update_counter():
-                continue # NO CHANGES!
-            # gather peers
-            peers_to_be_unchoked = []
-            for peer in supporter.get_supported_peers():
-                peers_to_be_unchoked.append((peer.get_id(), peer.get_ip(), peer.get_port()))
+        jobs = []
+        self._monitor._lock.acquire()
+        try:
+            for supporter in self._monitor.get_monitored_supporters():
+                if self._pending.has_key(supporter):
+                    continue # keeps the changes for the next round
+                # TODO (mgu): The method name suggests that it only resets some values, not returns
+                # a truth value. This should be changed! (avoid side-effects or misleading method
+                # names)
+                if not supporter.reset_update_counter():
+                    continue # NO CHANGES!
+                # gather peers
+                peers_to_be_unchoked = [(peer.get_id(), peer.get_ip(), peer.get_port())
+                                        for peer in supporter.get_supported_peers()]
+                jobs.append((supporter, peers_to_be_unchoked))
+        finally:
+            self._monitor._lock.release()
+            
+        for supporter, peers in jobs:
+            if not self._submit(supporter, self._send_peer_list, peers):
+                supporter.set_updated()
                 
-            if supporter in self._proxies.keys():
-                proxy = self._proxies[supporter]
-                # send peer list to resp. supporter
-                try:
-                    proxy.receive_peer_list(peers_to_be_unchoked)
-                    sys.stderr.write("Let supporter %s support peers %s\n" % (supporter.get_addr(), peers_to_be_unchoked))
-                except:
-                    sys.stderr.write("Failed to connect to supporter %s:%i\n" % (supporter.get_addr()[0], supporter.get_addr()[1]))
+    def _send_peer_list(self, supporter, proxy, peers):
+        # sends the changes since the last list the supporter received, or the whole list if
+        # the supporter does not know the previous list or does not understand deltas
+        sent = self._sent_lists.pop(supporter, None)
+        try:
+            if sent is None:
+                proxy.receive_peer_list(peers)
+            else:
+                current = dict.fromkeys(peers)
+                added = [p for p in peers if not sent.has_key(p)]
+                removed = [p for p in sent.iterkeys() if not current.has_key(p)]
+                if added or removed:
+                    try:
+                        proxy.receive_peer_list_delta(added, removed)
+                    except xmlrpclib.Fault:
+                        proxy.receive_peer_list(peers)
+            self._logger.debug("Let supporter %s support peers %s" % (supporter.get_addr(), peers))
+        except:
+            self._logger.warning("Failed to send supportee list to supporter %s:%i" % supporter.get_addr())
+            supporter.set_updated()
+            return
+        if self._proxies.get(supporter) is proxy:
+            self._sent_lists[supporter] = dict.fromkeys(peers)
             
 #___________________________________________________________________________________________________
             
@@ -1,5 +1,7 @@
+import socket
 import unittest
 import time
+import xmlrpclib
 
 import SisClient.TrackerExt.SupporterMonitor as SupporterMonitor
 
@@ -476,6 +478,46 @@ class TestSupporterMonitor(unittest.TestCase):
         self.assertEquals(monitor.get_active_supporters()[0], s2)
         self.assertEquals(monitor.get_active_supporters()[1], s1)
         
+    def testTimedOutPeersAreRemoved(self):
+        '''Peers are removed once their removal deadline has passed, other peers remain.'''
+        removal_time = SupporterMonitor.PEER_REMOVAL_TIME
+        SupporterMonitor.PEER_REMOVAL_TIME = 1
+        try:
+            monitor = SupporterMonitor.SupporterMonitor()
+            monitor._dispatcher = MockSupporteeListDispatcher(monitor)
+            monitor.register_monitored_peer('XXX---34920F', '192.168.2.50', 10000, SupporterMonitor.PEER_TYPE_LEECHER)
+            time.sleep(0.6)
+            monitor.register_monitored_peer('XXX---34920G', '192.168.2.51', 10001, SupporterMonitor.PEER_TYPE_LEECHER)
+            time.sleep(0.6)
+            monitor.update_states()
+            self.assertEquals(['XXX---34920G'], [mp.get_id() for mp in monitor.get_monitored_peers()])
+            self.assertEquals(1, len(monitor.filter_peers_by_state(SupporterMonitor.DefaultState)))
+        finally:
+            SupporterMonitor.PEER_REMOVAL_TIME = removal_time
+        
+    def testPeersOfUnregisteredSupporterAreReassigned(self):
+        '''Peers of a supporter that is unregistered starve again and get another supporter.'''
+        monitor = SupporterMonitor.SupporterMonitor()
+        monitor._dispatcher = MockSupporteeListDispatcher(monitor)
+        s1 = monitor.register_monitored_supporter(1, ('192.168.2.10', 5000), 1, 2)
+        monitor.register_monitored_peer('XXX---34920F', '192.168.2.50', 10000, SupporterMonitor.PEER_TYPE_LEECHER)
+        monitor.register_monitored_peer('XXX---34920G', '192.168.2.51', 10001, SupporterMonitor.PEER_TYPE_LEECHER)
+        for _ in xrange(SupporterMonitor.PEER_REQUIRED_MSGS):
+            monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_REQUIRED, 'XXX---34920F')
+            monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_REQUIRED, 'XXX---34920G')
+        monitor.update_states()
+        self.assertEquals([s1], monitor.get_active_supporters())
+        self.assertEquals(2, len(monitor.filter_peers_by_state(SupporterMonitor.SupportedState)))
+        
+        s2 = monitor.register_monitored_supporter(2, ('192.168.2.11', 5001), 1, 2)
+        monitor.unregister_monitored_supporter(s1)
+        self.assertEquals([], monitor.get_active_supporters())
+        self.assertEquals(2, len(monitor.filter_peers_by_state(SupporterMonitor.StarvingState)))
+        monitor.update_states()
+        self.assertEquals([s2], monitor.get_active_supporters())
+        self.assertEquals(2, s2.assigned_slots())
+        self.assertEquals(2, len(monitor.filter_peers_by_state(SupporterMonitor.SupportedState)))
+        
     def testUpdateCallWithoutHavingPeersOrSupportersSucceeds(self):
         '''Tests if the update call succeeds if no peers/supporters are registered.
         
@@ -487,9 +529,129 @@ class TestSupporterMonitor(unittest.TestCase):
         monitor._dispatcher = MockSupporteeListDispatcher(monitor)
         monitor.update_states()
         
+class TestSupporteeListDispatcher(unittest.TestCase):
+    def setUp(self):
+        SupporterMonitor.IS_ALIVE_TIMEOUT_BOUND = 2
+        SupporterMonitor.PEER_TIMEOUT_BOUND = 1
+        self.monitor = SupporterMonitor.SupporterMonitor()
+        # the test triggers the updates itself
+        self.monitor.shutdown()
+        self.dispatcher = self.monitor._dispatcher
+        
+    def tearDown(self):
+        self.dispatcher.shutdown()
+        
+    def register_supporter(self, proxy, min_peer=1, max_peer=5):
+        supporter = self.monitor.register_monitored_supporter(1, ('192.168.2.10', 5000), min_peer, max_peer)
+        self.dispatcher._proxies[supporter] = proxy
+        return supporter
+    
+    def starve(self, *ids):
+        for id in ids:
+            self.monitor.register_monitored_peer(id, '192.168.2.50', 10000, SupporterMonitor.PEER_TYPE_LEECHER)
+        for _ in xrange(SupporterMonitor.PEER_REQUIRED_MSGS):
+            for id in ids:
+                self.monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_REQUIRED, id)
+                
+    def wait_for_calls(self):
+        deadline = time.time() + 5
+        while self.dispatcher._pending and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(self.dispatcher._pending)
+        
+    def update(self):
+        self.monitor.update_states()
+        self.wait_for_calls()
+        
+    def testOnlyChangesAreDispatched(self):
+        '''Supporters get the full list once, then only added and removed peers.'''
+        proxy = FakeSupporterProxy()
+        self.register_supporter(proxy)
+        self.starve('XXX---34920F', 'XXX---34920G')
+        self.update()
+        p1 = ('XXX---34920F', '192.168.2.50', 10000)
+        p2 = ('XXX---34920G', '192.168.2.50', 10000)
+        p3 = ('XXX---34920H', '192.168.2.50', 10000)
+        self.assertEquals([('list', [p1, p2])], proxy.lists)
+        
+        self.starve('XXX---34920H')
+        self.update()
+        self.update()
+        self.assertEquals([('list', [p1, p2]), ('delta', [p3], [])], proxy.lists)
+        
+        self.monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_NOT_NEEDED, 'XXX---34920F')
+        time.sleep(SupporterMonitor.PEER_TIMEOUT_BOUND)
+        self.update()
+        self.assertEquals(('delta', [], [p1]), proxy.lists[-1])
+        self.assertEquals(3, len(proxy.lists))
+        
+    def testFullListForSupportersWithoutDeltas(self):
+        '''Supporters that do not understand deltas get the full list instead.'''
+        proxy = FakeSupporterProxy(deltas=False)
+        self.register_supporter(proxy)
+        self.starve('XXX---34920F')
+        self.update()
+        self.starve('XXX---34920G')
+        self.update()
+        self.assertEquals(['list', 'list'], [call[0] for call in proxy.lists])
+        self.assertEquals(2, len(proxy.lists[-1][1]))
+        
+    def testHangingSupporterDoesNotBlockTheMonitor(self):
+        '''A supporter that does not answer delays neither updates nor peer messages.'''
+        proxy = FakeSupporterProxy(delay=1.5)
+        self.register_supporter(proxy)
+        self.starve('XXX---34920F')
+        started = time.time()
+        self.monitor.update_states()
+        self.monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_REQUIRED, 'XXX---34920F')
+        self.monitor.update_states()
+        self.assertTrue(time.time() - started < 0.5)
+        self.wait_for_calls()
+        # one call at a time per supporter
+        self.assertEquals(1, proxy.alive_checks + len(proxy.lists))
+        
+    def testDeadSupporterIsUnregistered(self):
+        '''Supporters that do not respond are removed and their peers starve again.'''
+        proxy = FakeSupporterProxy()
+        self.register_supporter(proxy)
+        self.starve('XXX---34920F')
+        self.update()
+        self.assertEquals(1, len(self.monitor.filter_peers_by_state(SupporterMonitor.SupportedState)))
+        proxy.alive = False
+        self.update()
+        self.update()
+        self.assertEquals([], self.monitor.get_monitored_supporters())
+        self.assertEquals(1, len(self.monitor.filter_peers_by_state(SupporterMonitor.StarvingState)))
+        
 #___________________________________________________________________________________________________
 #
 
+class FakeSupporterProxy(object):
+    def __init__(self, delay=0, deltas=True):
+        self.delay = delay
+        self.deltas = deltas
+        self.alive = True
+        self.alive_checks = 0
+        self.lists = []
+        
+    def is_alive(self):
+        self.alive_checks += 1
+        time.sleep(self.delay)
+        if not self.alive:
+            raise socket.error("connection refused")
+        return True
+    
+    def receive_peer_list(self, peers):
+        time.sleep(self.delay)
+        self.lists.append(('list', peers))
+        return True
+    
+    def receive_peer_list_delta(self, added, removed):
+        if not self.deltas:
+            raise xmlrpclib.Fault(1, "method receive_peer_list_delta is not supported")
+        self.lists.append(('delta', added, removed))
+        return True
+
 class MockSupporteeListDispatcher():
     def __init__(self, monitor):
         assert isinstance(monitor, SupporterMonitor.SupporterMonitor)
@@ -508,6 +670,9 @@ class MockSupporteeListDispatcher():
     
     def query_all_supporters(self):
         pass
+    
+    def shutdown(self):
+        pass
         
 #___________________________________________________________________________________________________
 # MAIN
@@ -516,5 +681,6 @@ if __name__ == "__main__":
     suite_peer = unittest.TestLoader().loadTestsFromTestCase(TestMonitoredPeer)
     suite_supporter = unittest.TestLoader().loadTestsFromTestCase(TestMonitoredSupporter)
     suite_monitor = unittest.TestLoader().loadTestsFromTestCase(TestSupporterMonitor)
-    suite = unittest.TestSuite([suite_peer, suite_supporter, suite_monitor])
+    suite_dispatcher = unittest.TestLoader().loadTestsFromTestCase(TestSupporteeListDispatcher)
+    suite = unittest.TestSuite([suite_peer, suite_supporter, suite_monitor, suite_dispatcher])
     unittest.TextTestRunner(verbosity=2).run(suite)
\ No newline at end of file
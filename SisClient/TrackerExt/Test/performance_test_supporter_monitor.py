@@ -0,0 +1,106 @@
+import optparse
+import random
+import sys
+import time
+
+import SisClient.TrackerExt.SupporterMonitor as SupporterMonitor
+
+class NullDispatcher(object):
+    ''' Dispatcher that does not contact any supporter. '''
+    def __init__(self, monitor):
+        pass
+
+    def register_proxy(self, supporter):
+        pass
+
+    def unregister_proxy(self, supporter):
+        pass
+
+    def query_all_supporters(self):
+        pass
+
+    def dispatch_peer_lists(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+def peer_id(n):
+    return 'PEER%016d' % n
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+def starve(monitor, ids):
+    for _ in xrange(SupporterMonitor.PEER_REQUIRED_MSGS):
+        for id in ids:
+            monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_REQUIRED, id)
+
+def run(options):
+    # supported peers that no longer need support return to DEFAULT on the next update
+    SupporterMonitor.PEER_TIMEOUT_BOUND = 0
+    monitor = SupporterMonitor.SupporterMonitor()
+    # the benchmark calls update_states itself
+    monitor.shutdown()
+    monitor._dispatcher = NullDispatcher(monitor)
+
+    start = time.time()
+    for i in xrange(options.supporters):
+        monitor.register_monitored_supporter(i, ('10.0.%d.%d' % (i / 250, i % 250 + 1), 5000 + i),
+                                             options.min_peer, options.max_peer)
+    for n in xrange(options.peers):
+        monitor.register_monitored_peer(peer_id(n), '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255),
+                                        10000 + n % 50000, SupporterMonitor.PEER_TYPE_LEECHER)
+    print >>sys.stdout, "registration of %d peers and %d supporters: %.2f s" % \
+        (options.peers, options.supporters, time.time() - start)
+
+    ids = [peer_id(n) for n in xrange(options.peers)]
+    starving = random.sample(ids, options.starving)
+    start = time.time()
+    starve(monitor, starving)
+    elapsed = time.time() - start
+    print >>sys.stdout, "%d peer messages: %.2f s (%.1f us per message)" % \
+        (len(starving) * SupporterMonitor.PEER_REQUIRED_MSGS, elapsed,
+         1e6 * elapsed / (len(starving) * SupporterMonitor.PEER_REQUIRED_MSGS))
+
+    print >>sys.stdout, "update assigning %d starving peers: %.1f ms, %d supporters active" % \
+        (len(starving), 1000 * timed(monitor.update_states), len(monitor.get_active_supporters()))
+
+    ticks = [timed(monitor.update_states) for _ in xrange(options.ticks)]
+    print >>sys.stdout, "update without state changes: %.3f ms average over %d updates" % \
+        (1000 * sum(ticks) / len(ticks), len(ticks))
+
+    supported = [mp.get_id() for mp in monitor.filter_peers_by_state(SupporterMonitor.SupportedState)]
+    for changes in (10, 100, 1000):
+        done = random.sample(supported, min(changes, len(supported)))
+        for id in done:
+            monitor.received_peer_message(SupporterMonitor.MSG_SUPPORT_NOT_NEEDED, id)
+        starve(monitor, random.sample(ids, changes))
+        print >>sys.stdout, "update with %4d peers released and %4d starving: %.1f ms" % \
+            (len(done), changes, 1000 * timed(monitor.update_states))
+        supported = [mp.get_id() for mp in monitor.filter_peers_by_state(SupporterMonitor.SupportedState)]
+
+def parse_options():
+    parser = optparse.OptionParser(usage="Usage: " + sys.argv[0] + " [options]",
+                                   description="Measures the state update of a SupporterMonitor " + \
+                                   "with many monitored peers and supporters.")
+    parser.add_option("-p", "--peers", action="store", dest="peers", default=50000, type="int",
+                      help="Number of monitored peers. Defaults to 50000.")
+    parser.add_option("-s", "--supporters", action="store", dest="supporters", default=500, type="int",
+                      help="Number of monitored supporters. Defaults to 500.")
+    parser.add_option("-n", "--starving", action="store", dest="starving", default=5000, type="int",
+                      help="Number of peers that start to starve at once. Defaults to 5000.")
+    parser.add_option("--min-peer", action="store", dest="min_peer", default=1, type="int",
+                      help="Minimum number of supportees per supporter. Defaults to 1.")
+    parser.add_option("--max-peer", action="store", dest="max_peer", default=20, type="int",
+                      help="Maximum number of supportees per supporter. Defaults to 20.")
+    parser.add_option("-t", "--ticks", action="store", dest="ticks", default=20, type="int",
+                      help="Number of updates without state changes to measure. Defaults to 20.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    options, args = parse_options()
+    random.seed(42)
+    run(options)
@@ -0,0 +1,126 @@
+import optparse
+import random
+import sys
+import time
+
+from SisClient.Utils import report_delta
+from SisClient.Utils import serialize
+
+def peer_entry(n):
+    id = "%020d" % n
+    return { "g2g"        : random.choice(["bt", "g2g"]),
+             "addr"       : "10.%d.%d.%d:%d:%s" % (n >> 16 & 255, n >> 8 & 255, n & 255, 6881 + n % 1000,
+                                                   random.choice("LR")),
+             "id"         : id,
+             "g2g_score"  : "%d,%d" % (random.randint(0, 100), random.randint(0, 100)),
+             "down_str"   : random.choice(["ci", "cI", "Ci", "CI"]),
+             "down_total" : random.random() * 100000,
+             "down_rate"  : random.random() * 200,
+             "up_str"     : random.choice(["cio", "cIO", "Cio", "CIo"]),
+             "up_total"   : random.random() * 100000,
+             "up_rate"    : random.random() * 200 }
+
+def make_report(options):
+    ''' A report as PeerHTTPReporter.state_callback builds it for a download
+    with many neighbours. '''
+    pieces = {}
+    for i in xrange(options.pieces):
+        pieces[i] = { "t_received" : 1288000000.0 + i * 0.5, "t_played" : 1288000010.0 + i * 0.5 }
+    return { "timestamp"  : int(time.time() * 1000),
+             "id"         : 1,
+             "iop_flag"   : 0,
+             "status"     : "3",
+             "listenport" : 6881,
+             "infohash"   : "%040x" % random.getrandbits(160),
+             "filename"   : "movie.avi",
+             "peerid"     : "%020d" % 0,
+             "live"       : False,
+             "progress"   : 57.3,
+             "down_total" : 123456.0,
+             "down_rate"  : 180.5,
+             "up_total"   : 65432.0,
+             "up_rate"    : 95.25,
+             "p_played"   : options.pieces,
+             "t_stall"    : 2,
+             "p_late"     : 3,
+             "p_dropped"  : 0,
+             "t_prebuf"   : 4,
+             "peers"      : [peer_entry(n) for n in xrange(options.peers)],
+             "pieces"     : pieces,
+             "validrange" : "",
+             "blockstats" : [(i / 16, i % 16 * 16384, 16384, random.random()) for i in xrange(options.blocks)] }
+
+def run(options):
+    report = make_report(options)
+    print >>sys.stdout, "report with %d peers, %d pieces and %d blocks" % \
+        (options.peers, options.pieces, options.blocks)
+    print >>sys.stdout, "%-8s %5s %10s %10s %10s" % ("method", "level", "bytes", "encode ms", "decode ms")
+    for method in ("xml", "pickle", "binary"):
+        for level in (0, 1, 6, 9):
+            if method == "pickle" and level:
+                continue
+            codec = serialize.get_codec(method, level)
+            start = time.time()
+            for _ in xrange(options.rounds):
+                data = codec.encode(report)
+            encode = (time.time() - start) / options.rounds
+            decode = "-"
+            if method != "xml":
+                start = time.time()
+                for _ in xrange(options.rounds):
+                    assert codec.decode(data) == report
+                decode = "%10.1f" % (1000 * (time.time() - start) / options.rounds)
+            print >>sys.stdout, "%-8s %5d %10d %10.1f %10s" % (method, level, len(data), 1000 * encode, decode)
+    run_delta(options, report)
+
+def next_report(options, report):
+    ''' The report of the next interval: some peers changed their rates and
+    totals, new pieces and blocks arrived. '''
+    report = dict(report)
+    report["timestamp"] += 5000
+    report["down_total"] += 500.0
+    report["down_rate"] = random.random() * 200
+    peers = [dict(peer) for peer in report["peers"]]
+    for peer in random.sample(peers, int(len(peers) * options.changed)):
+        peer["down_rate"] = random.random() * 200
+        peer["down_total"] += peer["down_rate"] * 5
+    report["peers"] = peers
+    first = max(report["pieces"].keys() or [0]) + 1
+    report["pieces"] = dict([(i, { "t_received" : 1288000000.0 + i * 0.5 }) for i in xrange(first, first + 10)])
+    report["blockstats"] = [(first + i / 16, i % 16 * 16384, 16384, random.random()) for i in xrange(160)]
+    return report
+
+def run_delta(options, report):
+    encoder = report_delta.ReportDeltaEncoder(keyframe_interval=1000)
+    encoder.encode(report)
+    report = next_report(options, report)
+    start = time.time()
+    delta = encoder.encode(report)
+    elapsed = time.time() - start
+    print >>sys.stdout, "delta with %d%% of the peers changed: encoded in %.1f ms" % \
+        (100 * options.changed, 1000 * elapsed)
+    for method, level in (("pickle", 0), ("binary", 0), ("binary", 6)):
+        codec = serialize.get_codec(method, level)
+        print >>sys.stdout, "%-8s %5d %10d bytes, full report %d bytes" % \
+            (method, level, len(codec.encode(delta)), len(codec.encode(report)))
+
+def parse_options():
+    parser = optparse.OptionParser(usage="Usage: " + sys.argv[0] + " [options]",
+                                   description="Compares size and encoding time of the report " + \
+                                   "serialization methods for a large report.")
+    parser.add_option("-p", "--peers", action="store", dest="peers", default=500, type="int",
+                      help="Number of peers in the report. Defaults to 500.")
+    parser.add_option("-n", "--pieces", action="store", dest="pieces", default=1000, type="int",
+                      help="Number of piece statistics in the report. Defaults to 1000.")
+    parser.add_option("-b", "--blocks", action="store", dest="blocks", default=2000, type="int",
+                      help="Number of block statistics in the report. Defaults to 2000.")
+    parser.add_option("-c", "--changed", action="store", dest="changed", default=0.1, type="float",
+                      help="Fraction of the peers that change between two reports. Defaults to 0.1.")
+    parser.add_option("-r", "--rounds", action="store", dest="rounds", default=10, type="int",
+                      help="Number of encodings to average over. Defaults to 10.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    options, args = parse_options()
+    random.seed(42)
+    run(options)
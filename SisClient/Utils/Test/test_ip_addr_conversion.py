@@ -35,5 +35,32 @@ class IPAddressUtilsTest(unittest.TestCase):
         self.assertTrue(ipaddr_utils.matches_ip_prefix("130.83.145.1", prefix_ip4))
         self.assertFalse(ipaddr_utils.matches_ip_prefix(test_ip8, prefix_ip4))
         
+    def test_prefix_weight(self):
+        self.assertEquals(100, ipaddr_utils.extract_prefix_weight("130.83.0.0/16"))
+        self.assertEquals(250, ipaddr_utils.extract_prefix_weight("130.83.0.0/16=250"))
+        self.assertTrue(ipaddr_utils.matches_ip_prefix("130.83.1.1", "130.83.0.0/16=250"))
+        
+    def test_prefix_trie_longest_match(self):
+        trie = ipaddr_utils.IPPrefixTrie(["130.83.0.0/16=100", "130.83.145.0/24=500",
+                                          "130.83.145.1/32=1000", "69.32.11.4/8=50"])
+        self.assertEquals(4, len(trie))
+        self.assertEquals(1000, trie.lookup("130.83.145.1"))
+        self.assertEquals(500, trie.lookup("130.83.145.2"))
+        self.assertEquals(100, trie.lookup("130.83.55.1"))
+        self.assertEquals(50, trie.lookup("69.64.11.4"))
+        self.assertEquals(0, trie.lookup("192.168.1.1"))
+        
+    def test_prefix_trie_agrees_with_linear_scan(self):
+        prefixes = ["130.83.147.23/8", "130.83.54.1/16", "69.32.11.4/24", "130.83.145.1/32",
+                    "0.0.0.0/1", "128.0.0.0/2", "130.83.54.128/25"]
+        trie = ipaddr_utils.IPPrefixTrie(prefixes)
+        ips = ["130.82.147.24", "192.168.1.1", "130.83.55.1", "69.32.11.5", "69.64.11.4",
+               "130.83.145.1", "130.83.145.2", "1.2.3.4", "255.255.255.255", "130.83.54.200"]
+        ranked = trie.rank_many(ips)
+        for ip in ips:
+            matches = [p for p in prefixes if ipaddr_utils.matches_ip_prefix(ip, p)]
+            self.assertEquals(len(matches) > 0 and 100 or 0, ranked[ip])
+            self.assertEquals(ranked[ip], trie.lookup(ip))
+        
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import random
+import unittest
+
+from SisClient.Utils import serialize
+from SisClient.Utils.report_delta import ReportDeltaEncoder, ReportDeltaDecoder, merge_events, is_delta
+
+def peer(n, down_total=0.0):
+    return { "id" : "peer%d" % n, "addr" : "10.0.0.%d:6881:L" % n, "down_str" : "ci",
+             "down_total" : down_total, "down_rate" : 0.0 }
+
+def report(timestamp, peers, pieces=None, blockstats=None, filename="movie.avi", p_played=0):
+    return { "id" : 1, "filename" : filename, "timestamp" : timestamp, "status" : "3",
+             "progress" : 10.0, "down_total" : timestamp * 16.0, "p_played" : p_played,
+             "peers" : peers, "pieces" : pieces or {}, "blockstats" : blockstats or [] }
+
+def normalized(report):
+    report = dict(report)
+    report.pop("seq", None)
+    report["peers"] = sorted(report["peers"], key=lambda peer: peer["id"])
+    return report
+
+class TestReportDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.encoder = ReportDeltaEncoder(keyframe_interval=5)
+        self.decoder = ReportDeltaDecoder()
+
+    def testUnchangedPeersAreNotSent(self):
+        peers = [peer(i) for i in xrange(50)]
+        self.encoder.encode(report(1, peers))
+        peers = [dict(p) for p in peers]
+        peers[3]["down_str"] = "CI"
+        peers[7]["down_total"] = 1.5
+        delta = self.encoder.encode(report(2, peers, pieces={ 12 : { "complete" : 2.0 } }, p_played=1))
+        self.assertTrue(is_delta(delta))
+        self.assertEquals(0, delta["base"])
+        self.assertEquals([{ "id" : "peer3", "down_str" : "CI" }, { "id" : "peer7", "down_total" : 1.5 }],
+                          sorted(delta["peers_changed"], key=lambda peer: peer["id"]))
+        self.assertFalse(delta.has_key("peers_added"))
+        self.assertEquals({ "timestamp" : 2 }, delta["changed"])
+        self.assertEquals({ "down_total" : 16.0, "p_played" : 1 }, delta["counters"])
+        self.assertEquals({ 12 : { "complete" : 2.0 } }, delta["pieces"])
+
+    def testKeyframes(self):
+        frames = [self.encoder.encode(report(i, [peer(1)])) for i in xrange(11)]
+        self.assertEquals([0, 5, 10], [f["seq"] for f in frames if not is_delta(f)])
+        # every download has its own frames
+        self.assertFalse(is_delta(self.encoder.encode(report(11, [], filename="other.avi"))))
+        self.encoder.reset()
+        self.assertFalse(is_delta(self.encoder.encode(report(12, [peer(1)]))))
+
+    def testReassemble(self):
+        random.seed(5)
+        peers = {}
+        for step in xrange(40):
+            for n in random.sample(xrange(30), 5):
+                if peers.has_key(n) and random.random() < 0.3:
+                    del peers[n]
+                else:
+                    peers[n] = peer(n, peers.has_key(n) and peers[n]["down_total"] + 0.5 or 0.0)
+            blocks = [(step, 0, 16384, step * 0.25)]
+            original = report(step, [dict(p) for p in peers.values()], blockstats=blocks, p_played=step)
+            encoded = serialize.decode_report(serialize.get_codec("binary").encode(self.encoder.encode(original)))
+            self.assertEquals(normalized(original), normalized(self.decoder.decode(encoded)))
+
+    def testLostDelta(self):
+        self.decoder.decode(self.encoder.encode(report(0, [peer(1)])))
+        self.encoder.encode(report(1, [peer(1)]))
+        self.assertEquals(None, self.decoder.decode(self.encoder.encode(report(2, [peer(2)]))))
+        for i in xrange(3, 5):
+            self.assertEquals(None, self.decoder.decode(self.encoder.encode(report(i, [peer(2)]))))
+        full = self.decoder.decode(self.encoder.encode(report(5, [peer(2)])))
+        self.assertEquals(normalized(report(5, [peer(2)])), normalized(full))
+        # full reports without a sequence number are passed through
+        self.assertEquals(report(6, []), self.decoder.decode(report(6, [])))
+
+    def testPeersBecomeIndexable(self):
+        self.decoder.decode(self.encoder.encode({ "id" : 1, "filename" : "f", "peers" : None }))
+        full = self.decoder.decode(self.encoder.encode({ "id" : 1, "filename" : "f", "peers" : [{ "id" : "a" }] }))
+        self.assertEquals([{ "id" : "a" }], full["peers"])
+        full = self.decoder.decode(self.encoder.encode({ "id" : 1, "filename" : "f" }))
+        self.assertFalse(full.has_key("peers"))
+
+    def testMergeEvents(self):
+        older = report(1, [], pieces={ 1 : { "known" : 1.0 }, 2 : { "known" : 1.0 } }, blockstats=[(1, 0, 10, 1.0)])
+        newer = report(2, [peer(1)], pieces={ 2 : { "complete" : 2.0 } }, blockstats=[(2, 0, 10, 2.0)])
+        merged = merge_events(older, newer)
+        self.assertEquals({ 1 : { "known" : 1.0 }, 2 : { "known" : 1.0, "complete" : 2.0 } }, merged["pieces"])
+        self.assertEquals([(1, 0, 10, 1.0), (2, 0, 10, 2.0)], merged["blockstats"])
+        self.assertEquals(2, merged["timestamp"])
+        self.assertEquals({ 2 : { "complete" : 2.0 } }, newer["pieces"])
+
+if __name__ == "__main__":
+    unittest.main()
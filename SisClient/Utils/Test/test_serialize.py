@@ -1,7 +1,24 @@
 import unittest
 import logging
+import pickle
+import struct
+import zlib
 
-from SisClient.Utils.serialize import serialize
+from SisClient.Utils import serialize as serialize_module
+from SisClient.Utils.serialize import serialize, get_codec, decode_report, SerializationException
+
+def sample_report():
+    return { "timestamp"  : 1288000000000L,
+             "id"         : 7,
+             "live"       : False,
+             "progress"   : 42.5,
+             "status"     : "3",
+             "peers"      : [{ "id" : "peer%d" % i, "down_rate" : i / 3.0, "addr" : "10.0.0.%d:6881:L" % i }
+                             for i in xrange(20)],
+             "pieces"     : { 0 : { "t_received" : 1.25 }, 17 : { "t_received" : 3.5, "t_played" : None } },
+             "blockstats" : [(i, 0, 16384, 0.25 * i) for i in xrange(50)],
+             "filename"   : u"m\xfcnchen.avi",
+             "big"        : -2**70 }
 
 class SerializationTest(unittest.TestCase):
     def setUp(self):
@@ -49,6 +66,48 @@ class SerializationTest(unittest.TestCase):
         xml_string = serialize(test_list)
         self.assertEquals(test_against, xml_string, "xml string was: "+xml_string)
         
+class ReportCodecTest(unittest.TestCase):
+    
+    def testBinaryRoundTrip(self):
+        report = sample_report()
+        for level in (0, 1, 9):
+            data = get_codec('binary', level).encode(report)
+            self.assertEquals(report, decode_report(data))
+            
+    def testBinaryCompression(self):
+        report = sample_report()
+        plain = get_codec('binary').encode(report)
+        compressed = get_codec('binary', 9).encode(report)
+        self.assertTrue(len(compressed) < len(plain))
+        self.assertTrue(len(plain) < len(pickle.dumps(report)))
+        
+    def testPickleReportsAreDecoded(self):
+        report = sample_report()
+        self.assertEquals(report, decode_report(get_codec('pickle', 9).encode(report)))
+        
+    def testXMLCodecMatchesSerialize(self):
+        report = sample_report()
+        self.assertEquals(serialize(report, encodeBase64=True), get_codec('xml').encode(report))
+        data = get_codec('xml', 6).encode(report)
+        self.assertEquals(serialize(report), zlib.decompress(data.decode("base64")))
+        self.assertRaises(SerializationException, get_codec('xml').decode, data)
+        
+    def testErrors(self):
+        self.assertRaises(SerializationException, get_codec, 'json')
+        self.assertRaises(SerializationException, get_codec('binary').encode, { "x" : object() })
+        data = get_codec('binary').encode(sample_report())
+        self.assertRaises(SerializationException, decode_report, data[:-3])
+        self.assertRaises(SerializationException, decode_report, data + "x")
+        self.assertEquals(serialize_module.BinaryCodec.MAGIC, data[:4])
+        compressed = get_codec('binary', 6).encode(sample_report())
+        self.assertRaises(SerializationException, decode_report, compressed[:-3])
+        # a dict with a list as key
+        codec = get_codec('binary')
+        header = serialize_module.BinaryCodec.MAGIC + chr(0)
+        data = header + codec.encode({})[5] + struct.pack('!I', 1) + codec.encode([])[5:] + codec.encode(1)[5:]
+        self.assertRaises(SerializationException, decode_report, data)
+        self.assertRaises(SerializationException, decode_report, "not a pickle")
+        
 if __name__ == "__main__":
     logging.disable(logging.DEBUG)
     logging.disable(logging.INFO)
@@ -1,6 +1,9 @@
 import socket
 import struct
 
+# ranking of IPs matching a reference prefix without an explicit weight
+DEFAULT_PREFIX_WEIGHT = 100
+
 def ip_addr_to_long_number(ip_addr):
     '''Converts a given IP address in dotted string format to a long-valued number.
     The conversion uses the network byte-order (big endian).
@@ -42,7 +45,23 @@ def is_reference_ip_addr_admissible(reference_ip_addr):
 
 def _extract_addr_and_bitrange(reference_ip_addr):
     ref_ip_addr, ref_ip_bitrange = reference_ip_addr.split('/')
-    return ref_ip_addr, int(ref_ip_bitrange)
+    return ref_ip_addr, int(ref_ip_bitrange.split('=')[0])
+
+def extract_prefix_weight(reference_ip_addr, default=DEFAULT_PREFIX_WEIGHT):
+    '''Returns the ranking weight of a reference IP address. The weight is given
+    as an optional suffix of the format: <IP>/<BITRANGE>=<WEIGHT>
+    
+    Arguments:
+        reference_ip_addr -- Reference IP address, see matches_ip_prefix
+        default           -- Weight to use if the reference IP has no weight suffix
+    
+    Returns:
+        The weight as an integer.
+    '''
+    parts = reference_ip_addr.split('=')
+    if len(parts) == 2:
+        return int(parts[1])
+    return default
     
 def _cut_off_irrelevant_bits(ip_addr_as_long_number, bitrange):
     return ip_addr_as_long_number >> (32 - bitrange)
@@ -55,3 +74,119 @@ def validIP(address):
         if not 0 <= int(item) <= 255:
             return False
     return True
+
+def _bitmask(bitrange):
+    return (0xFFFFFFFFL >> (32 - bitrange)) << (32 - bitrange) if bitrange > 0 else 0L
+
+class _PrefixNode(object):
+    __slots__ = ('prefix', 'bitrange', 'mask', 'weight', 'children')
+    
+    def __init__(self, prefix, bitrange, weight=None):
+        self.mask = _bitmask(bitrange)
+        self.prefix = prefix & self.mask
+        self.bitrange = bitrange
+        self.weight = weight
+        self.children = [None, None]
+
+class IPPrefixTrie(object):
+    '''Longest-prefix-match structure over IPv4 prefixes (a path-compressed binary
+    radix trie over addresses as long numbers). Each prefix carries a ranking weight,
+    looking up an address returns the weight of the longest matching prefix.
+    
+    The trie is built once, lookups only convert the looked up address and visit
+    at most one node per branching bit, independent of the number of prefixes.
+    '''
+    
+    def __init__(self, reference_ip_addrs=[], default=0):
+        '''Arguments:
+            reference_ip_addrs -- Reference IP addresses in the format <IP>/<BITRANGE>
+                                  or <IP>/<BITRANGE>=<WEIGHT>, see extract_prefix_weight
+            default            -- Ranking of addresses that match no prefix
+        '''
+        self._root = None
+        self._size = 0
+        self.default = default
+        for reference_ip_addr in reference_ip_addrs:
+            self.add(reference_ip_addr)
+    
+    def __len__(self):
+        return self._size
+    
+    def add(self, reference_ip_addr, weight=None):
+        '''Adds a reference IP address. An explicit weight overrides the weight
+        given in the reference IP address.
+        '''
+        ref_ip_addr, bitrange = _extract_addr_and_bitrange(reference_ip_addr)
+        assert validIP(ref_ip_addr) and 0 <= bitrange <= 32, "Invalid ip range " + reference_ip_addr
+        if weight is None:
+            weight = extract_prefix_weight(reference_ip_addr)
+        self._insert(ip_addr_to_long_number(ref_ip_addr), bitrange, weight)
+    
+    def _insert(self, addr, bitrange, weight):
+        new = _PrefixNode(addr, bitrange, weight)
+        addr = new.prefix
+        parent, side, node = None, 0, self._root
+        while node is not None:
+            common = min(_common_bits(addr, node.prefix), bitrange, node.bitrange)
+            if common < node.bitrange:
+                # split the edge leading to node
+                split = _PrefixNode(addr, common)
+                split.children[_bit(node.prefix, common)] = node
+                if common == bitrange:
+                    split.weight = weight
+                else:
+                    split.children[_bit(addr, common)] = new
+                new = split
+                break
+            if node.bitrange == bitrange:
+                if node.weight is None:
+                    self._size += 1
+                node.weight = weight
+                return
+            parent, side, node = node, _bit(addr, node.bitrange), node.children[_bit(addr, node.bitrange)]
+        if parent is None:
+            self._root = new
+        else:
+            parent.children[side] = new
+        self._size += 1
+    
+    def lookup(self, ip_addr):
+        '''Returns the weight of the longest prefix matching the IP address given
+        in dotted decimal format, or the default if no prefix matches.
+        '''
+        return self._lookup(ip_addr_to_long_number(ip_addr))
+    
+    def _lookup(self, addr):
+        best = self.default
+        node = self._root
+        while node is not None and (addr & node.mask) == node.prefix:
+            if node.weight is not None:
+                best = node.weight
+            if node.bitrange == 32:
+                break
+            node = node.children[(addr >> (31 - node.bitrange)) & 1]
+        return best
+    
+    def rank_many(self, iplist):
+        '''Ranks a list of IP addresses in dotted decimal format in one pass.
+        
+        Returns:
+            Dictionary with the IP addresses as keys and their weights as values.
+        '''
+        result = {}
+        lookup = self._lookup
+        unpack = struct.unpack
+        inet_aton = socket.inet_aton
+        for ip in iplist:
+            if ip not in result:
+                result[ip] = lookup(unpack('!L', inet_aton(ip))[0])
+        return result
+
+def _bit(addr, position):
+    return int((addr >> (31 - position)) & 1)
+
+def _common_bits(addr1, addr2):
+    diff = addr1 ^ addr2
+    if diff == 0:
+        return 32
+    return 32 - diff.bit_length()
@@ -0,0 +1,252 @@
+'''
+Delta encoding of the status reports of a download. The encoder keeps the
+last report it encoded for every download (identified by the fields "id"
+and "filename") and replaces most reports by a delta against it. Every
+keyframe_interval-th report is sent in full, as is the first report of a
+download. The decoder reassembles the full reports from a keyframe and the
+deltas that follow it.
+
+A keyframe is the report itself with the sequence number "seq" added. A
+delta carries "id", "filename", "seq", "delta" (True) and "base", the
+sequence number of the report it is relative to, and only what changed:
+
+<code>
+"changed"       : fields with a new value
+"counters"      : increase of the counters (COUNTERS)
+"removed"       : fields that are no longer reported
+"peers_added"   : peers that are new, as they are
+"peers_changed" : the changed fields and the "id" of the other peers, the
+                  counters of a peer (PEER_COUNTERS) as their increase
+"peers_removed" : ids of the peers that are gone
+</code>
+
+The EVENTS fields of a report only contain what happened since the
+previous report. Deltas and keyframes carry them as they are.
+'''
+
+KEYFRAME_INTERVAL = 10
+
+# fields that identify the download of a report
+KEY_FIELDS = ("id", "filename")
+# fields that only grow
+COUNTERS = ("down_total", "up_total", "p_played", "t_stall", "p_late", "p_dropped")
+PEER_COUNTERS = ("down_total", "up_total")
+# fields that contain the events since the previous report
+EVENTS = ("pieces", "blockstats")
+
+DELTA_FIELDS = ("seq", "delta", "base", "changed", "counters", "removed",
+                "peers_added", "peers_changed", "peers_removed")
+
+_MISSING = object()
+
+def merge_events(older, newer):
+    '''Returns a copy of report newer that also contains the events of the
+    report older, for a report that replaces an unsent one.'''
+    merged = dict(newer)
+    if older.get("pieces"):
+        pieces = {}
+        for piece, stats in older["pieces"].iteritems():
+            pieces[piece] = dict(stats)
+        for piece, stats in (newer.get("pieces") or {}).iteritems():
+            pieces.setdefault(piece, {}).update(stats)
+        merged["pieces"] = pieces
+    if older.get("blockstats"):
+        merged["blockstats"] = list(older["blockstats"]) + list(newer.get("blockstats") or [])
+    return merged
+
+def is_delta(report):
+    return bool(report.get("delta"))
+
+class ReportDeltaEncoder(object):
+    '''
+    Encodes the reports of several downloads. The caller resets the encoder
+    if an encoded report may not have arrived, the next report of every
+    download is a keyframe then.
+    '''
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        assert keyframe_interval > 0
+        self.keyframe_interval = keyframe_interval
+        # (id, filename): [seq, seq of the last keyframe, snapshot]
+        self._sent = {}
+
+    def reset(self):
+        self._sent = {}
+
+    def encode(self, report):
+        key = (report["id"], report["filename"])
+        state = self._sent.get(key)
+        if state is None:
+            seq = 0
+        else:
+            seq = state[0] + 1
+        snapshot = _Snapshot(report)
+        if state is None or seq - state[1] >= self.keyframe_interval:
+            self._sent[key] = [seq, seq, snapshot]
+            keyframe = dict(report)
+            keyframe["seq"] = seq
+            return keyframe
+
+        base = state[2]
+        delta = { "id"       : report["id"],
+                  "filename" : report["filename"],
+                  "seq"      : seq,
+                  "delta"    : True,
+                  "base"     : state[0] }
+        changed, counters = _diff(base.fields, snapshot.fields, COUNTERS)
+        removed = [field for field in base.fields.iterkeys() if not snapshot.fields.has_key(field)]
+        if base.peers is not None and snapshot.peers is not None:
+            added, peers_changed, peers_removed = _diff_peers(base.peers, snapshot.peers, snapshot.order)
+            if added:
+                delta["peers_added"] = added
+            if peers_changed:
+                delta["peers_changed"] = peers_changed
+            if peers_removed:
+                delta["peers_removed"] = peers_removed
+        elif snapshot.peers is not None:
+            # the peers of the base are a field, they are replaced
+            changed["peers"] = report["peers"]
+            if "peers" in removed:
+                removed.remove("peers")
+        elif base.peers is not None and not report.has_key("peers"):
+            removed.append("peers")
+        if changed:
+            delta["changed"] = changed
+        if counters:
+            delta["counters"] = counters
+        if removed:
+            delta["removed"] = removed
+        for field in EVENTS:
+            if report.has_key(field):
+                delta[field] = report[field]
+        state[0] = seq
+        state[2] = snapshot
+        return delta
+
+class ReportDeltaDecoder(object):
+    '''
+    Reassembles the reports of several downloads. Reports without a
+    sequence number are passed through unchanged.
+    '''
+    def __init__(self):
+        # (id, filename): [seq, snapshot]
+        self._received = {}
+
+    def decode(self, report):
+        '''Returns the full report for report. Returns None for a delta whose
+        base report is unknown, e.g. because it was lost; the reports of the
+        download are reassembled again from its next keyframe on.'''
+        key = (report.get("id"), report.get("filename"))
+        if not is_delta(report):
+            if report.has_key("seq"):
+                self._received[key] = [report["seq"], _Snapshot(report)]
+            else:
+                self._received.pop(key, None)
+            return report
+
+        state = self._received.get(key)
+        if state is None or state[0] != report["base"]:
+            self._received.pop(key, None)
+            return None
+        base = state[1]
+
+        full = dict(base.fields)
+        full.update(report.get("changed", {}))
+        for field, increase in report.get("counters", {}).iteritems():
+            full[field] = full[field] + increase
+        removed = report.get("removed", [])
+        for field in removed:
+            full.pop(field, None)
+        if (base.peers is not None and not report.get("changed", {}).has_key("peers")
+            and "peers" not in removed):
+            full["peers"] = _patch_peers(base, report)
+        for field in EVENTS:
+            if report.has_key(field):
+                full[field] = report[field]
+        full["id"] = report["id"]
+        full["filename"] = report["filename"]
+        full["seq"] = report["seq"]
+
+        state[0] = report["seq"]
+        state[1] = _Snapshot(full)
+        return full
+
+#___________________________________________________________________________________________________
+# PRIVATE SECTION
+
+class _Snapshot(object):
+    '''The fields of a report without its events, the peers by id if they
+    can be indexed.'''
+    def __init__(self, report):
+        self.fields = {}
+        for field, value in report.iteritems():
+            if field not in EVENTS and field not in DELTA_FIELDS:
+                self.fields[field] = value
+        self.peers = None
+        self.order = None
+        peers = report.get("peers")
+        if isinstance(peers, list):
+            try:
+                self.order = [peer["id"] for peer in peers]
+                self.peers = dict(zip(self.order, [dict(peer) for peer in peers]))
+            except (TypeError, KeyError):
+                self.order = None
+            if self.peers is not None:
+                del self.fields["peers"]
+
+def _is_number(value):
+    return isinstance(value, (int, long, float)) and not isinstance(value, bool)
+
+def _diff(old, new, counters):
+    changed = {}
+    increases = {}
+    for field, value in new.iteritems():
+        previous = old.get(field, _MISSING)
+        if previous is _MISSING or value != previous or type(value) != type(previous):
+            if field in counters and _is_number(value) and _is_number(previous):
+                increases[field] = value - previous
+            else:
+                changed[field] = value
+    return changed, increases
+
+def _diff_peers(old, new, order):
+    added = []
+    changed = []
+    for id in order:
+        peer = new[id]
+        previous = old.get(id)
+        if previous is None or len(previous) != len(peer) or \
+                [field for field in previous.iterkeys() if not peer.has_key(field)]:
+            added.append(peer)
+            continue
+        fields, increases = _diff(previous, peer, PEER_COUNTERS)
+        if fields or increases:
+            fields.update(increases)
+            fields["id"] = id
+            changed.append(fields)
+    removed = [id for id in old.iterkeys() if not new.has_key(id)]
+    return added, changed, removed
+
+def _patch_peers(base, report):
+    peers = base.peers
+    removed = dict.fromkeys(report.get("peers_removed", []))
+    changed = {}
+    for fields in report.get("peers_changed", []):
+        changed[fields["id"]] = fields
+    added = {}
+    for peer in report.get("peers_added", []):
+        added[peer["id"]] = peer
+    result = []
+    for id in base.order:
+        if removed.has_key(id) or added.has_key(id):
+            continue
+        peer = peers[id]
+        if changed.has_key(id):
+            peer = dict(peer)
+            for field, value in changed[id].iteritems():
+                if field in PEER_COUNTERS and _is_number(value) and _is_number(peer.get(field)):
+                    peer[field] = peer[field] + value
+                else:
+                    peer[field] = value
+        result.append(peer)
+    result.extend(report.get("peers_added", []))
+    return result
@@ -1,5 +1,7 @@
 import sys
 import zlib
+import pickle
+import struct
 import urllib
 import xml.sax.saxutils
 
@@ -77,6 +79,21 @@ will write the following to the standard output:
     </key>
 </map>
 </code>
+
+Besides the XML serialization, the module provides report codecs that
+encode and decode status reports in one of several formats. A codec is
+obtained by the name of its serialization method:
+
+<code>
+codec = serialize.get_codec('binary', compress_level=6)
+data = codec.encode(report)
+report = serialize.decode_report(data)
+</code>
+
+'xml' produces the Base64 encoded XML that the monitoring server expects,
+'pickle' is understood by the testbed webserver, and 'binary' is a compact,
+length-prefixed encoding of the types that occur in reports, including
+floats and non-string dictionary keys.
 '''
 
 #_______________________________________________________________________________
@@ -89,33 +106,127 @@ class SerializationException(Exception):
     def __str__(self):
         return repr(self.value)
     
-def serialize(ds, compress=False, encodeBase64=False):
+def serialize(ds, compress=False, encodeBase64=False, compress_level=9):
     '''Serializes a given data structure <code>ds</code> into an XML formatted
     string. Returns this string. The optional parameter compress determines if 
     the string shall be compressed before it is dispatched to the caller. This
-    parameter is False by default. The second optional parameter encodeBase64
-    determines if the string shall be encoded in Base64 format. This parameter
-    is by default also set to False.
+    parameter is False by default, compress_level is the zlib level used for
+    it. The optional parameter encodeBase64 determines if the string shall be
+    encoded in Base64 format. This parameter is by default also set to False.
     '''
-    dispatch = ""
+    # the XML is written into a list of fragments which are joined once
+    out = []
     if isinstance(ds, dict):
-        dispatch += _serialize_dict(ds)
+        _serialize_dict(out, ds)
     elif isinstance(ds, list):
-        dispatch += _serialize_list(ds)
+        _serialize_list(out, ds)
     elif isinstance(ds, tuple):
-        dispatch += _serialize_tuple(ds)
+        _serialize_tuple(out, ds)
     else:
         # the data structure is neither a list nor dictionary, so we cannot
         # perform the serialization.
         raise SerializationException("The given data structure is neither a list " + \
                                      "nor a dictionary. It cannot be serialized.")
+    dispatch = "".join(out)
     if compress:
-        dispatch = zlib.compress(dispatch,9)
+        dispatch = zlib.compress(dispatch, compress_level)
     if encodeBase64:
         dispatch = dispatch.encode("base64")
         
     return dispatch
 
+class ReportCodec(object):
+    '''Base class of the report codecs. A codec encodes a report (a dict of
+    primitive values, lists, tuples and dicts) into a string that can be
+    posted to a monitoring server, and decodes such a string again if the
+    format allows it. compress_level is the zlib level, 0 disables
+    compression.
+    '''
+    name = None
+    
+    def __init__(self, compress_level=0):
+        assert 0 <= compress_level <= 9
+        self.compress_level = compress_level
+        
+    def encode(self, report):
+        raise NotImplementedError()
+    
+    def decode(self, data):
+        raise SerializationException("Reports in %s format cannot be decoded" % self.name)
+    
+class XMLCodec(ReportCodec):
+    '''The Base64 encoded XML format of the monitoring server.'''
+    name = 'xml'
+    
+    def encode(self, report):
+        return serialize(report, compress=self.compress_level > 0, encodeBase64=True,
+                         compress_level=self.compress_level)
+    
+class PickleCodec(ReportCodec):
+    '''Pickled reports as read by the testbed webserver. Pickles are never
+    compressed, older webservers would not understand them otherwise.'''
+    name = 'pickle'
+    
+    def encode(self, report):
+        return pickle.dumps(report)
+    
+    def decode(self, data):
+        return pickle.loads(data)
+    
+class BinaryCodec(ReportCodec):
+    '''A compact encoding of reports. The encoding starts with MAGIC and a
+    flags byte, bit 0 tells whether the rest is zlib compressed. Every value
+    is a type tag followed by its data, strings, lists and dicts are prefixed
+    with their length.'''
+    name = 'binary'
+    MAGIC = 'SRB1'
+    
+    def encode(self, report):
+        out = []
+        _encode_value(out, report)
+        data = "".join(out)
+        if self.compress_level:
+            return self.MAGIC + chr(1) + zlib.compress(data, self.compress_level)
+        return self.MAGIC + chr(0) + data
+    
+    def decode(self, data):
+        if not data.startswith(self.MAGIC) or len(data) <= len(self.MAGIC):
+            raise SerializationException("Not a binary report")
+        flags = ord(data[len(self.MAGIC)])
+        data = data[len(self.MAGIC)+1:]
+        try:
+            if flags & 1:
+                data = zlib.decompress(data)
+            value, pos = _decode_value(data, 0)
+        except (zlib.error, struct.error, IndexError, KeyError, ValueError, TypeError):
+            # TypeError: a list was decoded as key of a dict
+            raise SerializationException("Corrupt binary report")
+        if pos != len(data):
+            raise SerializationException("Trailing data after binary report")
+        return value
+
+CODECS = { XMLCodec.name    : XMLCodec,
+           PickleCodec.name : PickleCodec,
+           BinaryCodec.name : BinaryCodec }
+
+def get_codec(method, compress_level=0):
+    '''Returns a codec for the serialization method of the given name (one of
+    the keys of CODECS), using the given zlib compression level.
+    '''
+    if not CODECS.has_key(method):
+        raise SerializationException("Unknown serialization method %s" % method)
+    return CODECS[method](compress_level)
+
+def decode_report(data):
+    '''Decodes a report that was encoded by the binary or the pickle codec.'''
+    if data.startswith(BinaryCodec.MAGIC):
+        return BinaryCodec().decode(data)
+    try:
+        return pickle.loads(data)
+    except Exception:
+        # unpickling fails with all kinds of exceptions
+        raise SerializationException("Corrupt pickled report")
+
 #_______________________________________________________________________________
 # PRIVATE SECTION
     
@@ -136,78 +247,79 @@ def _get_primitive_type_as_string(value):
         raise SerializationException("Unknown type of object %s with type %s" %
                                      (value, value.__class__))
         
-def _serialize_tuple(dt, name=None, indent=0):
+def _serialize_tuple(out, dt, name=None, indent=0):
     if name is None:
         name = "parent"
-    serialized_tuple = _add_tuple_begin_tag(indent)
-    values = "\n"
+    out.append(_add_tuple_begin_tag(indent))
+    out.append("\n")
     for i in xrange(len(dt)):
         if isinstance(dt[i], dict): 
-            values += INDENT_CHAR*(indent+1)+'<value at="%i">\n%s</value>\n' % (i, _serialize_dict(dt[i], str(i), indent+2))
+            out.append(INDENT_CHAR*(indent+1)+'<value at="%i">\n' % i)
+            _serialize_dict(out, dt[i], str(i), indent+2)
+            out.append('</value>\n')
         elif isinstance(dt[i], list):
-            values += INDENT_CHAR*(indent+1)+'<value at="%i">\n%s</value>\n' % (i, _serialize_list(dt[i], str(i), indent+2))
-            values += INDENT_CHAR*(indent+1)+"</value>\n"
+            out.append(INDENT_CHAR*(indent+1)+'<value at="%i">\n' % i)
+            _serialize_list(out, dt[i], str(i), indent+2)
+            out.append('</value>\n')
+            out.append(INDENT_CHAR*(indent+1)+"</value>\n")
         elif isinstance(dt[i], tuple):
-            values += INDENT_CHAR*(indent+1)+'<value at="%i">\n%s</value>\n' % (i, _serialize_tuple(dt[i], str(i), indent+2))
-            values += INDENT_CHAR*(indent+1)+"</value>\n"
+            out.append(INDENT_CHAR*(indent+1)+'<value at="%i">\n' % i)
+            _serialize_tuple(out, dt[i], str(i), indent+2)
+            out.append('</value>\n')
+            out.append(INDENT_CHAR*(indent+1)+"</value>\n")
         else:
-            values += INDENT_CHAR*(indent+1)+'<value at="%i">%s</value>\n' % (i, xml.sax.saxutils.escape(str(dt[i])))
-    serialized_tuple += values
-    serialized_tuple += _add_tuple_close_tag(indent)
-    return serialized_tuple
+            out.append(INDENT_CHAR*(indent+1)+'<value at="%i">%s</value>\n' % (i, xml.sax.saxutils.escape(str(dt[i]))))
+    out.append(_add_tuple_close_tag(indent))
 
-def _serialize_list(dt, name=None, indent=0):
+def _serialize_list(out, dt, name=None, indent=0):
     if name is None:
         name = "parent"
-    ll = _add_list_begin_tag(name, indent)
-    items = ""
+    out.append(_add_list_begin_tag(name, indent))
     i = 0
     for item in dt:
         if isinstance(item, dict):
-            items += INDENT_CHAR*(indent+1)+"<item>\n%s</item>\n" % _serialize_dict(item, str(i), indent+2)
+            out.append(INDENT_CHAR*(indent+1)+"<item>\n")
+            _serialize_dict(out, item, str(i), indent+2)
+            out.append("</item>\n")
             i += 1
         elif isinstance(item, list):
-            items += INDENT_CHAR*(indent+1)+"<item>\n%s" % _serialize_list(item, str(i), indent+2)
-            items += INDENT_CHAR*(indent+1)+"</item>\n"
+            out.append(INDENT_CHAR*(indent+1)+"<item>\n")
+            _serialize_list(out, item, str(i), indent+2)
+            out.append(INDENT_CHAR*(indent+1)+"</item>\n")
             i += 1
         elif isinstance(item, tuple):
-            items += INDENT_CHAR*(indent+1)+"<item>\n%s" % _serialize_tuple(item, str(i), indent+2)
-            items += INDENT_CHAR*(indent+1)+"</item>\n"
+            out.append(INDENT_CHAR*(indent+1)+"<item>\n")
+            _serialize_tuple(out, item, str(i), indent+2)
+            out.append(INDENT_CHAR*(indent+1)+"</item>\n")
             i += 1
         else:
             type_as_string = _get_primitive_type_as_string(item)
-            items += INDENT_CHAR*(indent+1)+"<item>%s</item>\n" % xml.sax.saxutils.escape(str(item))
-    ll += items
-    ll += _add_list_close_tag(indent)
-    return ll
+            out.append(INDENT_CHAR*(indent+1)+"<item>%s</item>\n" % xml.sax.saxutils.escape(str(item)))
+    out.append(_add_list_close_tag(indent))
     
-def _serialize_dict(dt, name=None, indent=0):
+def _serialize_dict(out, dt, name=None, indent=0):
     '''Serializes a given dict which contains only primitives or other dicts
        into an XML format.
     '''
     if name is None:
         name = "parent"    
-    map = _add_map_begin_tag(name, indent)
+    out.append(_add_map_begin_tag(name, indent))
     for key in dt.keys():
         value = dt[key]
         if isinstance(value, dict):
-            #map += _serialize_dict(value, key, indent+1)
-            map += _add_key_value_pair(key, _serialize_dict(value, key, indent+2), "dict", indent)
+            _add_complex_entry(out, key, _serialize_dict, value, indent)
         elif isinstance(value, list):
-            #map += _serialize_list(value, key, indent+1)
-            map += _add_key_value_pair(key, _serialize_list(value, key, indent+2), "list", indent)
+            _add_complex_entry(out, key, _serialize_list, value, indent)
         elif isinstance(value, tuple):
-            map += _add_key_value_pair(key, _serialize_tuple(value, key, indent+2), "tuple", indent)
+            _add_complex_entry(out, key, _serialize_tuple, value, indent)
         else:
             try:
                 type_as_string = _get_primitive_type_as_string(value)
-                map += _add_key_value_pair(key, xml.sax.saxutils.escape(str(value)), type_as_string, indent)
+                out.append(_xml_entry(key, xml.sax.saxutils.escape(str(value)), indent))
             except:
                 pass
             
-    map += _add_map_close_tag(indent)
-    
-    return map
+    out.append(_add_map_close_tag(indent))
 
 def _add_tuple_begin_tag(indent):
     return INDENT_CHAR * indent + "%s" % "<tuple>"
@@ -237,20 +349,134 @@ def _add_map_close_tag(indent):
     else:
         return dispatch + "\n"
     
-def _add_key_value_pair(key, value, type, indent):
-    dispatch = ""
-    if type is "list" or type is "dict" or type is "tuple":
-        dispatch = _xml_entry_complex(key, value, indent)
-    else:
-        dispatch = _xml_entry(key, value, indent)
-        
-    return dispatch
+def _add_complex_entry(out, key, serialize_func, value, indent):
+    # the serialized value has the correct indentation
+    out.append(INDENT_CHAR*(indent+1) + "<key name=\"%s\">\n" % key)
+    out.append(INDENT_CHAR*(indent))
+    serialize_func(out, value, key, indent+2)
+    out.append(INDENT_CHAR*(indent+1) + "</key>\n")
             
 def _xml_entry(key, value, indent):
     return INDENT_CHAR*(indent+1)+"<key name=\"%s\">%s</key>\n" % (key, str(value))
 
-def _xml_entry_complex(key, value, indent):
-    dispatch = INDENT_CHAR*(indent+1) + "<key name=\"%s\">\n" % key
-    dispatch += INDENT_CHAR*(indent) + "%s" % value # value has the corrent indentation
-    dispatch += INDENT_CHAR*(indent+1) + "</key>\n"
-    return dispatch
+#_______________________________________________________________________________
+# BINARY FORMAT
+
+def _encode_int(out, x):
+    if -0x80 <= x < 0x80:
+        out.append('b' + struct.pack('!b', x))
+    elif -0x80000000 <= x < 0x80000000:
+        out.append('i' + struct.pack('!i', x))
+    elif -0x8000000000000000 <= x < 0x8000000000000000:
+        out.append('q' + struct.pack('!q', x))
+    else:
+        x = str(x)
+        out.append('l' + struct.pack('!I', len(x)))
+        out.append(x)
+
+def _encode_bool(out, x):
+    out.append(x and 'T' or 'F')
+    
+def _encode_none(out, x):
+    out.append('N')
+    
+def _encode_float(out, x):
+    out.append('f' + struct.pack('!d', x))
+    
+def _encode_string(out, x):
+    out.append('s' + struct.pack('!I', len(x)))
+    out.append(x)
+    
+def _encode_unicode(out, x):
+    x = x.encode('utf-8')
+    out.append('u' + struct.pack('!I', len(x)))
+    out.append(x)
+    
+def _encode_list(out, x):
+    out.append('L' + struct.pack('!I', len(x)))
+    for item in x:
+        _encode_value(out, item)
+        
+def _encode_tuple(out, x):
+    out.append('t' + struct.pack('!I', len(x)))
+    for item in x:
+        _encode_value(out, item)
+        
+def _encode_dict(out, x):
+    out.append('D' + struct.pack('!I', len(x)))
+    for key, value in x.iteritems():
+        _encode_value(out, key)
+        _encode_value(out, value)
+        
+_encode_func = { int        : _encode_int,
+                 long       : _encode_int,
+                 bool       : _encode_bool,
+                 type(None) : _encode_none,
+                 float      : _encode_float,
+                 str        : _encode_string,
+                 unicode    : _encode_unicode,
+                 list       : _encode_list,
+                 tuple      : _encode_tuple,
+                 dict       : _encode_dict }
+
+def _encode_value(out, x):
+    try:
+        func = _encode_func[type(x)]
+    except KeyError:
+        raise SerializationException("Unknown type of object %s with type %s" %
+                                     (x, x.__class__))
+    func(out, x)
+    
+def _decode_length(data, pos):
+    return struct.unpack('!I', data[pos:pos+4])[0], pos + 4
+
+def _decode_bytes(data, pos):
+    n, pos = _decode_length(data, pos)
+    if pos + n > len(data):
+        raise ValueError("string exceeds the report")
+    return data[pos:pos+n], pos + n
+
+def _decode_items(data, pos):
+    n, pos = _decode_length(data, pos)
+    items = []
+    for i in xrange(n):
+        item, pos = _decode_value(data, pos)
+        items.append(item)
+    return items, pos
+
+def _decode_dict(data, pos):
+    n, pos = _decode_length(data, pos)
+    d = {}
+    for i in xrange(n):
+        key, pos = _decode_value(data, pos)
+        d[key], pos = _decode_value(data, pos)
+    return d, pos
+
+def _decode_long(data, pos):
+    x, pos = _decode_bytes(data, pos)
+    return long(x), pos
+
+def _decode_unicode(data, pos):
+    x, pos = _decode_bytes(data, pos)
+    return x.decode('utf-8'), pos
+
+def _decode_tuple(data, pos):
+    items, pos = _decode_items(data, pos)
+    return tuple(items), pos
+
+_decode_func = { 'b' : lambda data, pos: (struct.unpack('!b', data[pos:pos+1])[0], pos + 1),
+                 'i' : lambda data, pos: (struct.unpack('!i', data[pos:pos+4])[0], pos + 4),
+                 'q' : lambda data, pos: (struct.unpack('!q', data[pos:pos+8])[0], pos + 8),
+                 'l' : _decode_long,
+                 'T' : lambda data, pos: (True, pos),
+                 'F' : lambda data, pos: (False, pos),
+                 'N' : lambda data, pos: (None, pos),
+                 'f' : lambda data, pos: (struct.unpack('!d', data[pos:pos+8])[0], pos + 8),
+                 's' : _decode_bytes,
+                 'u' : _decode_unicode,
+                 'L' : _decode_items,
+                 't' : _decode_tuple,
+                 'D' : _decode_dict }
+
+def _decode_value(data, pos):
+    return _decode_func[data[pos]](data, pos + 1)